@@ -1,26 +1,159 @@
 import os
+import sys
+import json
+import time
 import boto3
-from flask import Flask, render_template, request, jsonify, flash, redirect, url_for
+from flask import Flask, Response, render_template, request, jsonify, flash, redirect, url_for, stream_with_context
 from werkzeug.utils import secure_filename
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+from retrieval import SegmentedIndex, ShardedSearchClient, QueryBatcher
+from retrieval.filters import parse_filters
+from retrieval.generation import BedrockStreamingModel, FakeStreamingModel, stream_answer, format_sse
+
+# Helpers shared with the pipeline Lambdas live in lambdas/
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+from profiling import profile_flask_app
+from pdf_prescan import prescan_pdf, file_range_reader, route_for, estimate_processing_seconds
+from pipeline_status import status_store, StatusCache
+from chunk_text import ChunkTextStore, S3ChunkTextSource, LocalChunkTextSource
+from embedding_router import create_embedding_client
+
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
 
-# AWS Configuration
-s3_client = boto3.client(
-    's3',
-    region_name='sa-east-1'
-)
+# Opt-in route profiling (PROFILING=event|sampled); reports go to PROFILE_DIR
+profile_flask_app(app)
+
+# WEB_BACKEND=local serves from local stand-ins (S3 in a directory under
+# WEB_LOCAL_STORAGE, simulated Bedrock and answers) instead of AWS, for
+# development and load_test.py
+WEB_BACKEND = os.environ.get('WEB_BACKEND', 'aws')
+WEB_LOCAL_STORAGE = os.environ.get('WEB_LOCAL_STORAGE', '/tmp/qa-local-s3')
+WEB_LOCAL_S3_LATENCY_MS = float(os.environ.get('WEB_LOCAL_S3_LATENCY_MS', '20'))
+WEB_LOCAL_BEDROCK_LATENCY_MS = float(os.environ.get('WEB_LOCAL_BEDROCK_LATENCY_MS', '50'))
+
+if WEB_BACKEND == 'local':
+    from local_pipeline import LocalS3, LocalBedrockRuntime
+    s3_client = LocalS3(WEB_LOCAL_STORAGE, latency_ms=WEB_LOCAL_S3_LATENCY_MS)
+    bedrock_runtime = LocalBedrockRuntime(latency_ms=WEB_LOCAL_BEDROCK_LATENCY_MS)
+    embedding_runtime = bedrock_runtime
+else:
+    # AWS Configuration
+    s3_client = boto3.client(
+        's3',
+        region_name='sa-east-1'
+    )
+
+    bedrock_runtime = boto3.client(
+        'bedrock-runtime',
+        region_name='us-east-1'
+    )
+
+    # Query embeddings go through the endpoint router (EMBEDDING_ENDPOINTS)
+    embedding_runtime = create_embedding_client()
 
 BUCKET_NAME = 'source-pdf-qa-aws'
 UPLOAD_FOLDER = '/tmp'
 ALLOWED_EXTENSIONS = {'pdf'}
+EMBEDDING_MODEL_ID = 'amazon.titan-embed-text-v1'
+
+# Uploads are pre-scanned to show the estimated processing time; PDFs the
+# pipeline cannot extract text from are refused before reaching S3
+FAST_PATH_MAX_PAGES = int(os.environ.get('FAST_PATH_MAX_PAGES', '5'))
+PRESCAN_REJECT_MESSAGES = {
+    'not_a_pdf': 'o arquivo não é um PDF válido',
+    'no_pages': 'o PDF não tem páginas',
+    'image_only': 'o PDF só tem imagens (digitalizado) e não há OCR no pipeline',
+    'blank': 'as páginas do PDF não têm texto'
+}
+
+# Pipeline progress published by the stages (STATUS_BACKEND) is polled once
+# per STATUS_POLL_SECONDS for all clients and /status is served from memory
+STATUS_POLL_SECONDS = float(os.environ.get('STATUS_POLL_SECONDS', '1'))
+STATUS_MAX_WAIT_SECONDS = 30.0
+STATUS_KEEPALIVE_SECONDS = 15.0
+status_cache = StatusCache(status_store, STATUS_POLL_SECONDS) if status_store else None
+
+# Segmented vector index; segments are memory-mapped and shared by every
+# worker process through the page cache. Kept up to date by sync_vector_index.py
+VECTOR_INDEX_DIR = os.environ.get('VECTOR_INDEX_DIR', '/tmp/qa-vector-index')
+
+# VECTOR_SHARDS=host:port,... searches a sharded index through its shard
+# servers (serve_shards.py) instead; shards slower than SHARD_TIMEOUT_MS are
+# left out of the results, which are then flagged as partial
+VECTOR_SHARDS = [address for address in os.environ.get('VECTOR_SHARDS', '').split(',') if address]
+SHARD_TIMEOUT_MS = float(os.environ.get('SHARD_TIMEOUT_MS', '200'))
+SHARD_AUTHKEY = os.environ.get('SHARD_AUTHKEY', '').encode()
+if VECTOR_SHARDS:
+    if not SHARD_AUTHKEY:
+        raise ValueError('VECTOR_SHARDS requires SHARD_AUTHKEY, the key the shard servers were started with')
+    vector_index = ShardedSearchClient(VECTOR_SHARDS, SHARD_AUTHKEY, timeout_ms=SHARD_TIMEOUT_MS)
+else:
+    vector_index = SegmentedIndex(VECTOR_INDEX_DIR)
+
+# Results indexed without their text (sync_vector_index.py --no-text) get it
+# from chunk-text/ with range GETs, or from a local mirror (CHUNK_TEXT_DIR)
+# read through mmap; hot chunks stay in an LRU of CHUNK_TEXT_CACHE_MB
+CHUNK_TEXT_DIR = os.environ.get('CHUNK_TEXT_DIR')
+if CHUNK_TEXT_DIR:
+    chunk_text_store = ChunkTextStore(LocalChunkTextSource(CHUNK_TEXT_DIR))
+else:
+    chunk_text_store = ChunkTextStore(S3ChunkTextSource(s3_client, BUCKET_NAME))
+
+# Concurrent /search requests are grouped over a short window and scored
+# together; SEARCH_BATCH_WINDOW_MS=0 disables batching
+SEARCH_BATCH_WINDOW_MS = float(os.environ.get('SEARCH_BATCH_WINDOW_MS', '2'))
+SEARCH_BATCH_MAX = int(os.environ.get('SEARCH_BATCH_MAX', '32'))
+embedding_pool = ThreadPoolExecutor(max_workers=SEARCH_BATCH_MAX)
+
+# ANSWER_MODEL=fake streams a canned answer locally instead of calling Bedrock
+if os.environ.get('ANSWER_MODEL', 'bedrock') == 'fake' or WEB_BACKEND == 'local':
+    answer_model = FakeStreamingModel()
+else:
+    answer_model = BedrockStreamingModel(
+        bedrock_runtime,
+        model_id=os.environ.get('ANSWER_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+    )
+
+def format_duration(seconds):
+    if seconds < 60:
+        return f'{seconds:.0f} s'
+    return f'{seconds / 60:.1f} min'
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def embed_query(text):
+    response = embedding_runtime.invoke_model(
+        body=json.dumps({'inputText': text}),
+        modelId=EMBEDDING_MODEL_ID,
+        accept='application/json',
+        contentType='application/json'
+    )
+    return json.loads(response['body'].read())['embedding']
+
+def embed_queries(texts):
+    # Titan text embeddings take one input per request, so a batch is
+    # embedded with concurrent requests instead of a single call
+    return list(embedding_pool.map(embed_query, texts))
+
+query_batcher = QueryBatcher(
+    vector_index,
+    embed_queries,
+    window_ms=SEARCH_BATCH_WINDOW_MS,
+    max_batch=SEARCH_BATCH_MAX
+)
+
+def search_index(query, k, filters=None):
+    if SEARCH_BATCH_WINDOW_MS > 0:
+        results = query_batcher.search(query, k, filters)
+    else:
+        results = vector_index.search(embed_query(query), k, filters=filters)
+    return chunk_text_store.hydrate(results)
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -40,6 +173,14 @@ def upload_file():
         
         if file and allowed_file(file.filename):
             try:
+                # Ranged reads over the received file: pages, text, route
+                scan = prescan_pdf(file_range_reader(file.stream))
+                file.stream.seek(0)
+                decision = route_for(scan, FAST_PATH_MAX_PAGES)
+                if decision['route'] == 'reject':
+                    flash(f"❌ Arquivo recusado: {PRESCAN_REJECT_MESSAGES.get(decision['reason'], decision['reason'])}")
+                    return redirect(request.url)
+                
                 # Generate unique filename
                 timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
                 unique_id = str(uuid.uuid4())[:8]
@@ -59,6 +200,8 @@ def upload_file():
                 
                 flash(f'✅ Arquivo {file.filename} enviado com sucesso!')
                 flash(f'📁 Salvo como: {s3_key}')
+                flash(f"📄 {scan['pages']} páginas, ~{scan['estimated_chunks']} trechos | "
+                      f"⏱️ tempo estimado de processamento: {format_duration(estimate_processing_seconds(scan, decision['route']))}")
                 
                 return redirect(url_for('upload_file'))
                 
@@ -93,12 +236,165 @@ def list_files():
         # Sort by modification date (newest first)
         files.sort(key=lambda x: x['modified'], reverse=True)
         
-        return render_template('files.html', files=files)
+        # Processing status from the in-memory cache; the page then follows
+        # changes through the /status SSE stream
+        statuses, status_version = {}, 0
+        if status_cache is not None:
+            status_cache.start()
+            status_cache.backfill([file['key'] for file in files])
+            status_version, records = status_cache.query(0, [file['key'] for file in files])
+            statuses = {record['document_id']: record for record in records}
+        
+        return render_template(
+            'files.html', files=files, statuses=statuses, status_version=status_version,
+            status_enabled=status_cache is not None
+        )
         
     except Exception as e:
         flash(f'❌ Erro ao listar arquivos: {str(e)}')
         return render_template('files.html', files=[])
 
+def status_response(document_ids=None, prefix=None, single=False):
+    """
+    Status records changed after the client's version (?since=, 0 for all).
+    ?wait=N long-polls up to N seconds for a change; ?stream=1 or an
+    Accept: text/event-stream header streams every change as SSE.
+    """
+    
+    if status_cache is None:
+        return jsonify({'error': 'Status store disabled (STATUS_BACKEND=none)'}), 503
+    
+    try:
+        since = int(request.args.get('since', 0))
+        wait = max(0.0, min(float(request.args.get('wait', 0)), STATUS_MAX_WAIT_SECONDS))
+    except ValueError:
+        return jsonify({'error': 'Invalid since or wait'}), 400
+    
+    status_cache.start()
+    if document_ids:
+        # Documents last updated before the cache's initial window
+        status_cache.backfill(document_ids)
+    
+    wants_stream = (
+        request.args.get('stream') == '1'
+        or 'text/event-stream' in request.headers.get('Accept', '')
+    )
+    if wants_stream:
+        def generate():
+            version = since
+            while True:
+                current, records = status_cache.query(version, document_ids, prefix)
+                if records:
+                    yield format_sse({'event': 'status', 'data': {'version': current, 'documents': records}})
+                version = current
+                if not status_cache.wait(version, STATUS_KEEPALIVE_SECONDS):
+                    yield ': keep-alive\n\n'
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    version, records = status_cache.query(since, document_ids, prefix)
+    deadline = time.monotonic() + wait
+    while not records and time.monotonic() < deadline:
+        status_cache.wait(version, deadline - time.monotonic())
+        version, records = status_cache.query(since, document_ids, prefix)
+    
+    if single:
+        if not records and since == 0:
+            return jsonify({'error': f'No status for {document_ids[0]}'}), 404
+        return jsonify({'version': version, 'document': records[0] if records else None})
+    return jsonify({'version': version, 'documents': records})
+
+@app.route('/status', methods=['GET', 'POST'])
+def bulk_status():
+    # Document ids as ?ids=a,b or a JSON body {"ids": [...]} for long lists
+    body = request.get_json(silent=True) or {}
+    document_ids = body.get('ids') or [item for item in request.args.get('ids', '').split(',') if item] or None
+    return status_response(document_ids, request.args.get('prefix') or None)
+
+@app.route('/status/<path:document_id>')
+def document_status(document_id):
+    return status_response([document_id], single=True)
+
+@app.route('/search')
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Missing query parameter q'}), 400
+    
+    try:
+        k = max(1, min(int(request.args.get('k', 5)), 50))
+        filters = parse_filters(request.args)
+    except ValueError:
+        return jsonify({'error': 'Invalid k or filter'}), 400
+    
+    try:
+        results = search_index(query, k, filters)
+        return jsonify({
+            'query': query,
+            'filters': filters,
+            'generation': vector_index.generation,
+            'partial': bool(getattr(results, 'missing_shards', None)),
+            'results': results
+        })
+    except Exception as e:
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+
+@app.route('/ask', methods=['GET', 'POST'])
+def ask():
+    question = (request.values.get('q') or '').strip()
+    if not question:
+        if request.method == 'GET':
+            return render_template('ask.html')
+        return jsonify({'error': 'Missing question q'}), 400
+    
+    try:
+        k = max(1, min(int(request.values.get('k', 5)), 20))
+        filters = parse_filters(request.values)
+    except ValueError:
+        return jsonify({'error': 'Invalid k or filter'}), 400
+    
+    started_at = time.perf_counter()
+    try:
+        sources = search_index(question, k, filters)
+    except Exception as e:
+        return jsonify({'error': f'Search failed: {str(e)}'}), 500
+    
+    events = stream_answer(question, sources, answer_model, started_at)
+    
+    wants_stream = (
+        request.values.get('stream') == '1'
+        or 'text/event-stream' in request.headers.get('Accept', '')
+    )
+    if wants_stream:
+        def generate():
+            try:
+                for event in events:
+                    yield format_sse(event)
+            except Exception as e:
+                yield format_sse({'event': 'error', 'data': {'error': f'Generation failed: {str(e)}'}})
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    try:
+        done = [event for event in events if event['event'] == 'done'][0]['data']
+    except Exception as e:
+        return jsonify({'error': f'Generation failed: {str(e)}'}), 500
+    
+    return jsonify({
+        'question': question,
+        'answer': done['answer'],
+        'sources': sources,
+        'timings': done['timings']
+    })
+
 @app.route('/health')
 def health_check():
     return jsonify({'status': 'healthy', 'service': 'QA on AWS Flask App'})
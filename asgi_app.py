@@ -0,0 +1,554 @@
+#!/usr/bin/env python3
+"""
+Modo de servidor assíncrono (ASGI) das mesmas rotas do app.py
+S3 e Bedrock são chamados por clientes assíncronos (aiobotocore), o corpo
+dos uploads é lido em streaming e cada dependência tem um limite de
+concorrência; um único processo atende centenas de uploads e buscas lentos
+Executa: python asgi_app.py [--port 8000] [--workers N]
+   ou:   uvicorn asgi_app:app --port 8000
+Local:   WEB_BACKEND=local WEB_LOCAL_STORAGE=/tmp/qa-local-s3 python asgi_app.py
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import argparse
+from contextlib import AsyncExitStack, asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from functools import partial
+from urllib.parse import parse_qsl
+
+import jinja2
+from starlette.applications import Starlette
+from starlette.datastructures import ImmutableMultiDict
+from starlette.middleware import Middleware
+from starlette.middleware.sessions import SessionMiddleware
+from starlette.responses import JSONResponse, RedirectResponse, StreamingResponse
+from starlette.routing import Route
+from starlette.templating import Jinja2Templates
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+
+# Configuration, the vector index and the status cache are shared with the Flask app
+from app import (
+    app as flask_app, WEB_BACKEND, WEB_LOCAL_STORAGE, WEB_LOCAL_S3_LATENCY_MS, WEB_LOCAL_BEDROCK_LATENCY_MS,
+    BUCKET_NAME, UPLOAD_FOLDER, EMBEDDING_MODEL_ID, FAST_PATH_MAX_PAGES,
+    PRESCAN_REJECT_MESSAGES, STATUS_MAX_WAIT_SECONDS, STATUS_KEEPALIVE_SECONDS,
+    SEARCH_BATCH_WINDOW_MS, SEARCH_BATCH_MAX, CHUNK_TEXT_DIR, status_cache, vector_index, chunk_text_store,
+    format_duration, allowed_file
+)
+from retrieval import QueryBatcher
+from retrieval.filters import parse_filters
+from retrieval.generation import AsyncBedrockStreamingModel, FakeStreamingModel, astream_answer, format_sse
+from serving import Overloaded, MultipartError, StreamingUpload, limits_from_env, parse_boundary, iter_parts
+from pdf_prescan import prescan_pdf, file_range_reader, route_for, estimate_processing_seconds
+from chunk_text import ChunkTextStore, AsyncS3ChunkTextSource
+
+RETRY_AFTER_SECONDS = 1
+
+templates = Jinja2Templates(
+    directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates')
+)
+
+
+@jinja2.pass_context
+def url_for(context, name, **params):
+    # Paths, like Flask's url_for (Starlette's builds absolute URLs)
+    return context['request'].app.url_path_for(name, **params)
+
+
+@jinja2.pass_context
+def get_flashed_messages(context):
+    return context['request'].session.pop('_flashes', [])
+
+
+templates.env.globals['url_for'] = url_for
+templates.env.globals['get_flashed_messages'] = get_flashed_messages
+
+
+def flash(request, message):
+    request.session.setdefault('_flashes', []).append(message)
+
+
+def redirect(url):
+    return RedirectResponse(str(url), status_code=302)
+
+
+def render_template(request, name, **context):
+    return templates.TemplateResponse(request, name, context)
+
+
+class StatusWaiter:
+    """
+    asyncio side of StatusCache.wait(): the cache's polling thread wakes
+    every waiting request through one Event, without a thread per client
+    """
+
+    def __init__(self, cache, loop):
+        self.cache = cache
+        self.loop = loop
+        self._event = asyncio.Event()
+        cache.subscribe(lambda version: loop.call_soon_threadsafe(self._changed))
+
+    def _changed(self):
+        event, self._event = self._event, asyncio.Event()
+        event.set()
+
+    async def wait(self, since_version, timeout):
+        deadline = self.loop.time() + timeout
+        while self.cache.version <= since_version:
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._event.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+async def open_clients(stack):
+    """
+    S3 and Bedrock clients for WEB_BACKEND (async stand-ins when local);
+    connection pools are sized to the concurrency limits
+    """
+
+    limits = limits_from_env()
+    if WEB_BACKEND == 'local':
+        from local_pipeline import AsyncLocalS3, AsyncLocalBedrockRuntime
+        s3_client = AsyncLocalS3(WEB_LOCAL_STORAGE, latency_ms=WEB_LOCAL_S3_LATENCY_MS)
+        bedrock_runtime = AsyncLocalBedrockRuntime(latency_ms=WEB_LOCAL_BEDROCK_LATENCY_MS)
+        return limits, s3_client, bedrock_runtime
+
+    from aiobotocore.config import AioConfig
+    from aiobotocore.session import get_session
+    session = get_session()
+    s3_client = await stack.enter_async_context(session.create_client(
+        's3', region_name='sa-east-1', config=AioConfig(max_pool_connections=limits['s3'].limit)
+    ))
+    bedrock_runtime = await stack.enter_async_context(session.create_client(
+        'bedrock-runtime', region_name='us-east-1',
+        config=AioConfig(max_pool_connections=limits['bedrock'].limit + limits['answer'].limit)
+    ))
+    return limits, s3_client, bedrock_runtime
+
+
+@asynccontextmanager
+async def lifespan(app):
+    loop = asyncio.get_running_loop()
+    async with AsyncExitStack() as stack:
+        state = app.state
+        state.limits, state.s3_client, state.bedrock_runtime = await open_clients(stack)
+
+        # Index searches and the pre-scan are CPU work; they run on a pool
+        # sized to their limits so the event loop only awaits them
+        state.cpu_pool = ThreadPoolExecutor(
+            max_workers=state.limits['index'].limit + state.limits['cpu'].limit, thread_name_prefix='asgi-cpu'
+        )
+        stack.callback(state.cpu_pool.shutdown, wait=False)
+
+        # The batcher's threads embed through the loop's Bedrock client
+        def embed_queries(texts):
+            return asyncio.run_coroutine_threadsafe(embed_many(state, texts), loop).result()
+
+        state.query_batcher = QueryBatcher(
+            vector_index, embed_queries, window_ms=SEARCH_BATCH_WINDOW_MS, max_batch=SEARCH_BATCH_MAX
+        )
+
+        # Range GETs of chunk texts go through the loop's S3 client; a local
+        # mirror is read through mmap like in the Flask app
+        if CHUNK_TEXT_DIR:
+            state.chunk_text_store = chunk_text_store
+        else:
+            state.chunk_text_store = ChunkTextStore(
+                AsyncS3ChunkTextSource(state.s3_client, BUCKET_NAME, state.limits['s3'])
+            )
+
+        if os.environ.get('ANSWER_MODEL', 'bedrock') == 'fake' or WEB_BACKEND == 'local':
+            state.answer_model = FakeStreamingModel()
+        else:
+            state.answer_model = AsyncBedrockStreamingModel(
+                state.bedrock_runtime,
+                model_id=os.environ.get('ANSWER_MODEL_ID', 'anthropic.claude-3-haiku-20240307-v1:0')
+            )
+
+        state.status_waiter = None
+        if status_cache is not None:
+            # start() loads the records with a blocking call
+            await loop.run_in_executor(state.cpu_pool, status_cache.start)
+            state.status_waiter = StatusWaiter(status_cache, loop)
+
+        print(f"ASGI app ready (backend={WEB_BACKEND}, limits="
+              f"{ {name: limiter.limit for name, limiter in state.limits.items()} })")
+        yield
+
+
+async def run_limited(state, downstream, function, *args, **kwargs):
+    async with state.limits[downstream]:
+        return await asyncio.get_running_loop().run_in_executor(state.cpu_pool, partial(function, *args, **kwargs))
+
+
+async def embed_query(state, text):
+    async with state.limits['bedrock']:
+        response = await state.bedrock_runtime.invoke_model(
+            body=json.dumps({'inputText': text}),
+            modelId=EMBEDDING_MODEL_ID,
+            accept='application/json',
+            contentType='application/json'
+        )
+        body = await response['body'].read()
+    return json.loads(body)['embedding']
+
+
+async def embed_many(state, texts):
+    # Titan text embeddings take one input per request
+    return list(await asyncio.gather(*(embed_query(state, text) for text in texts)))
+
+
+async def search_index(state, query, k, filters=None):
+    if SEARCH_BATCH_WINDOW_MS > 0:
+        results = await asyncio.wrap_future(state.query_batcher.submit(query, k, filters))
+    else:
+        vector = await embed_query(state, query)
+        results = await run_limited(state, 'index', vector_index.search, vector, k, filters=filters)
+    return await state.chunk_text_store.ahydrate(results)
+
+
+async def request_values(request):
+    """
+    Query string plus an urlencoded form body, like Flask's request.values
+    """
+
+    items = list(request.query_params.multi_items())
+    if request.method == 'POST' and request.headers.get('content-type', '').startswith(
+            'application/x-www-form-urlencoded'):
+        items += parse_qsl((await request.body()).decode('utf-8'), keep_blank_values=True)
+    return ImmutableMultiDict(items)
+
+
+async def index(request):
+    return render_template(request, 'index.html')
+
+
+async def upload_file(request):
+    if request.method != 'POST':
+        return render_template(request, 'upload.html')
+
+    try:
+        boundary = parse_boundary(request.headers.get('content-type', ''))
+    except MultipartError:
+        flash(request, 'Nenhum arquivo selecionado')
+        return redirect(request.url)
+
+    state = request.app.state
+    upload, filename, received = None, '', False
+    try:
+        # The body is streamed: each piece of the file goes to the spool
+        # file and, once a part is full, to S3
+        async for kind, headers, data in iter_parts(request.stream(), boundary):
+            if kind == 'part' and headers['name'] == 'file' and upload is None and not received:
+                filename = headers['filename'] or ''
+                if filename == '':
+                    continue
+                if not allowed_file(filename):
+                    flash(request, '❌ Apenas arquivos PDF são permitidos')
+                    return redirect(request.url)
+
+                # Generate unique filename
+                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+                unique_id = str(uuid.uuid4())[:8]
+                file_extension = filename.rsplit('.', 1)[1].lower()
+                s3_key = f"uploads/{timestamp}_{unique_id}.{file_extension}"
+                upload = StreamingUpload(
+                    state.s3_client, BUCKET_NAME, s3_key, state.limits['s3'],
+                    extra_args={'ContentType': 'application/pdf', 'ServerSideEncryption': 'AES256'},
+                    spool_dir=UPLOAD_FOLDER
+                )
+            elif kind == 'data' and upload is not None and not received:
+                await upload.write(data)
+            elif kind == 'end' and upload is not None:
+                received = True
+
+        if upload is None or upload.size == 0:
+            flash(request, 'Nenhum arquivo selecionado')
+            return redirect(request.url)
+
+        # Ranged reads over the received file: pages, text, route
+        scan = await run_limited(state, 'cpu', prescan_pdf, file_range_reader(upload.file))
+        decision = route_for(scan, FAST_PATH_MAX_PAGES)
+        if decision['route'] == 'reject':
+            await upload.abort()
+            flash(request, f"❌ Arquivo recusado: {PRESCAN_REJECT_MESSAGES.get(decision['reason'], decision['reason'])}")
+            return redirect(request.url)
+
+        await upload.finish()
+
+        flash(request, f'✅ Arquivo {filename} enviado com sucesso!')
+        flash(request, f'📁 Salvo como: {upload.key}')
+        flash(request, f"📄 {scan['pages']} páginas, ~{scan['estimated_chunks']} trechos | "
+                       f"⏱️ tempo estimado de processamento: {format_duration(estimate_processing_seconds(scan, decision['route']))}")
+        return redirect(request.url_for('upload_file').path)
+
+    except Overloaded as e:
+        if upload is not None:
+            await upload.abort()
+        flash(request, f'⏳ Servidor ocupado ({e.downstream}), tente de novo em instantes')
+        return redirect(request.url)
+    except Exception as e:
+        if upload is not None:
+            await upload.abort()
+        flash(request, f'❌ Erro no upload: {str(e)}')
+        return redirect(request.url)
+    finally:
+        if upload is not None:
+            upload.close()
+
+
+async def list_files(request):
+    state = request.app.state
+    try:
+        async with state.limits['s3']:
+            response = await state.s3_client.list_objects_v2(
+                Bucket=BUCKET_NAME,
+                Prefix='uploads/',
+                MaxKeys=20
+            )
+
+        files = []
+        for obj in response.get('Contents', []):
+            files.append({
+                'name': obj['Key'].split('/')[-1],
+                'key': obj['Key'],
+                'size': obj['Size'],
+                'modified': obj['LastModified'].strftime('%Y-%m-%d %H:%M:%S')
+            })
+
+        # Sort by modification date (newest first)
+        files.sort(key=lambda x: x['modified'], reverse=True)
+
+        statuses, status_version = {}, 0
+        if status_cache is not None:
+            keys = [file['key'] for file in files]
+            await asyncio.get_running_loop().run_in_executor(state.cpu_pool, status_cache.backfill, keys)
+            status_version, records = status_cache.query(0, keys)
+            statuses = {record['document_id']: record for record in records}
+
+        return render_template(
+            request, 'files.html', files=files, statuses=statuses, status_version=status_version,
+            status_enabled=status_cache is not None
+        )
+
+    except Exception as e:
+        flash(request, f'❌ Erro ao listar arquivos: {str(e)}')
+        return render_template(request, 'files.html', files=[])
+
+
+async def status_response(request, document_ids=None, prefix=None, single=False):
+    """
+    Same contract as app.status_response (?since=, ?wait=, ?stream=1); a
+    waiting client holds no thread
+    """
+
+    if status_cache is None:
+        return JSONResponse({'error': 'Status store disabled (STATUS_BACKEND=none)'}, 503)
+
+    try:
+        since = int(request.query_params.get('since', 0))
+        wait = max(0.0, min(float(request.query_params.get('wait', 0)), STATUS_MAX_WAIT_SECONDS))
+    except ValueError:
+        return JSONResponse({'error': 'Invalid since or wait'}, 400)
+
+    if document_ids:
+        # Documents last updated before the cache's initial window
+        await asyncio.get_running_loop().run_in_executor(
+            request.app.state.cpu_pool, status_cache.backfill, document_ids
+        )
+    waiter = request.app.state.status_waiter
+    wants_stream = (
+        request.query_params.get('stream') == '1'
+        or 'text/event-stream' in request.headers.get('accept', '')
+    )
+    if wants_stream:
+        async def generate():
+            version = since
+            while True:
+                current, records = status_cache.query(version, document_ids, prefix)
+                if records:
+                    yield format_sse({'event': 'status', 'data': {'version': current, 'documents': records}})
+                version = current
+                if not await waiter.wait(version, STATUS_KEEPALIVE_SECONDS):
+                    yield ': keep-alive\n\n'
+
+        return StreamingResponse(
+            generate(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    version, records = status_cache.query(since, document_ids, prefix)
+    deadline = time.monotonic() + wait
+    while not records and time.monotonic() < deadline:
+        await waiter.wait(version, deadline - time.monotonic())
+        version, records = status_cache.query(since, document_ids, prefix)
+
+    if single:
+        if not records and since == 0:
+            return JSONResponse({'error': f'No status for {document_ids[0]}'}, 404)
+        return JSONResponse({'version': version, 'document': records[0] if records else None})
+    return JSONResponse({'version': version, 'documents': records})
+
+
+async def bulk_status(request):
+    body = {}
+    if request.headers.get('content-type', '').startswith('application/json'):
+        try:
+            body = await request.json() or {}
+        except ValueError:
+            body = {}
+    ids = request.query_params.get('ids', '')
+    document_ids = body.get('ids') or [item for item in ids.split(',') if item] or None
+    return await status_response(request, document_ids, request.query_params.get('prefix') or None)
+
+
+async def document_status(request):
+    return await status_response(request, [request.path_params['document_id']], single=True)
+
+
+async def search(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return JSONResponse({'error': 'Missing query parameter q'}, 400)
+
+    try:
+        k = max(1, min(int(request.query_params.get('k', 5)), 50))
+        filters = parse_filters(request.query_params)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid k or filter'}, 400)
+
+    try:
+        results = await search_index(request.app.state, query, k, filters)
+        return JSONResponse({
+            'query': query,
+            'filters': filters,
+            'generation': vector_index.generation,
+            'partial': bool(getattr(results, 'missing_shards', None)),
+            'results': results
+        })
+    except Overloaded:
+        raise
+    except Exception as e:
+        return JSONResponse({'error': f'Search failed: {str(e)}'}, 500)
+
+
+async def ask(request):
+    values = await request_values(request)
+    question = (values.get('q') or '').strip()
+    if not question:
+        if request.method == 'GET':
+            return render_template(request, 'ask.html')
+        return JSONResponse({'error': 'Missing question q'}, 400)
+
+    try:
+        k = max(1, min(int(values.get('k', 5)), 20))
+        filters = parse_filters(values)
+    except ValueError:
+        return JSONResponse({'error': 'Invalid k or filter'}, 400)
+
+    state = request.app.state
+    started_at = time.perf_counter()
+    try:
+        sources = await search_index(state, question, k, filters)
+    except Overloaded:
+        raise
+    except Exception as e:
+        return JSONResponse({'error': f'Search failed: {str(e)}'}, 500)
+
+    wants_stream = (
+        values.get('stream') == '1'
+        or 'text/event-stream' in request.headers.get('accept', '')
+    )
+    if wants_stream:
+        async def generate():
+            try:
+                # The generation slot is held for the whole stream
+                async with state.limits['answer']:
+                    async for event in astream_answer(question, sources, state.answer_model, started_at):
+                        yield format_sse(event)
+            except Exception as e:
+                yield format_sse({'event': 'error', 'data': {'error': f'Generation failed: {str(e)}'}})
+
+        return StreamingResponse(
+            generate(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    try:
+        async with state.limits['answer']:
+            events = [event async for event in astream_answer(question, sources, state.answer_model, started_at)]
+        done = [event for event in events if event['event'] == 'done'][0]['data']
+    except Overloaded:
+        raise
+    except Exception as e:
+        return JSONResponse({'error': f'Generation failed: {str(e)}'}, 500)
+
+    return JSONResponse({
+        'question': question,
+        'answer': done['answer'],
+        'sources': sources,
+        'timings': done['timings']
+    })
+
+
+async def health_check(request):
+    return JSONResponse({
+        'status': 'healthy',
+        'service': 'QA on AWS ASGI App',
+        'backend': WEB_BACKEND,
+        'downstreams': {name: limiter.stats() for name, limiter in request.app.state.limits.items()},
+        'chunk_text': request.app.state.chunk_text_store.stats()
+    })
+
+
+async def overloaded(request, exc):
+    return JSONResponse({'error': str(exc)}, 503, headers={'Retry-After': str(RETRY_AFTER_SECONDS)})
+
+
+app = Starlette(
+    routes=[
+        Route('/', index, name='index'),
+        Route('/upload', upload_file, methods=['GET', 'POST'], name='upload_file'),
+        Route('/files', list_files, name='list_files'),
+        Route('/status', bulk_status, methods=['GET', 'POST'], name='bulk_status'),
+        Route('/status/{document_id:path}', document_status, name='document_status'),
+        Route('/search', search, name='search'),
+        Route('/ask', ask, methods=['GET', 'POST'], name='ask'),
+        Route('/health', health_check, name='health_check'),
+    ],
+    middleware=[Middleware(SessionMiddleware, secret_key=flask_app.secret_key)],
+    exception_handlers={Overloaded: overloaded},
+    lifespan=lifespan
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description='Servidor ASGI (uvicorn) do app de QA')
+    parser.add_argument('--host', default='0.0.0.0')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=1, help='Processos; cada um com seu event loop')
+    args = parser.parse_args()
+
+    try:
+        print(f"🚀 Servindo o app ASGI em http://{args.host}:{args.port} (backend {WEB_BACKEND})")
+        uvicorn.run('asgi_app:app', host=args.host, port=args.port, workers=args.workers,
+                    proxy_headers=True, log_level='warning')
+    except KeyboardInterrupt:
+        print("\n⏹️  Servidor interrompido")
+    except Exception as e:
+        print(f"❌ Erro ao iniciar o servidor: {str(e)}")
+        sys.exit(1)
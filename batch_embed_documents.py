@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""
+Script para gerar de novo os embeddings do corpus em lote (Bedrock batch inference)
+Os chunks pendentes (embeddings/ ausente ou mais antigo que extracted/) viram
+arquivos JSONL de entrada, um job por arquivo; a saída dos jobs é lida de volta
+para embeddings/ e indexed/, com as falhas registradas por chunk no manifesto
+Executa: python batch_embed_documents.py --role-arn arn:aws:iam::...:role/... [--force]
+         python batch_embed_documents.py --run-id 20261019-120000 (retoma uma execução)
+         python batch_embed_documents.py --local /tmp/pipeline (S3 e Bedrock locais)
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Gera os embeddings pendentes com jobs de batch inference do Bedrock')
+    parser.add_argument('--force', action='store_true', help='Todos os documentos extraídos, não só os pendentes')
+    parser.add_argument('--run-id', help='Retoma a execução com este id (manifesto em batch-embeddings/)')
+    parser.add_argument('--role-arn', default=os.environ.get('BATCH_ROLE_ARN'),
+                        help='Role que o Bedrock assume para ler e gravar no S3 (padrão: BATCH_ROLE_ARN)')
+    parser.add_argument('--max-records-per-job', type=int, default=None, help='Padrão: BATCH_MAX_RECORDS_PER_JOB (50000)')
+    parser.add_argument('--max-concurrent-jobs', type=int, default=None, help='Padrão: BATCH_MAX_CONCURRENT_JOBS (10)')
+    parser.add_argument('--poll-seconds', type=float, default=None, help='Padrão: BATCH_POLL_SECONDS (60)')
+    parser.add_argument('--online-fallback', action='store_true',
+                        help='Chunks que falharem no lote são gerados com invoke_model')
+    parser.add_argument('--local', metavar='DIR', help='S3 local (run_local_pipeline.py --storage) e jobs simulados')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Com --local: fração de registros com erro')
+    args = parser.parse_args()
+
+    # Configurações
+    bucket_name = 'source-pdf-qa-aws'
+
+    try:
+        if args.local:
+            from local_pipeline import LocalPipeline, LocalBedrockBatch
+            pipeline = LocalPipeline(args.local)
+            batch = pipeline.module('batch_embeddings')
+            batch.bedrock_client = LocalBedrockBatch(pipeline.s3, failure_rate=args.failure_rate)
+            role_arn = args.role_arn or 'arn:aws:iam::000000000000:role/local-batch'
+            poll_seconds = args.poll_seconds if args.poll_seconds is not None else 0.5
+        else:
+            import batch_embeddings as batch
+            role_arn = args.role_arn
+            poll_seconds = args.poll_seconds if args.poll_seconds is not None else batch.BATCH_POLL_SECONDS
+            if not role_arn:
+                raise ValueError('informe --role-arn ou BATCH_ROLE_ARN (saída BedrockBatchRoleArn do stack)')
+
+        started = time.perf_counter()
+        if args.run_id:
+            manifest = batch.load_manifest(bucket_name, args.run_id)
+            print(f"🔁 Retomando a execução {args.run_id} ({len(manifest['shards'])} jobs)...")
+        else:
+            document_ids = batch.find_pending_documents(bucket_name, args.force)
+            if not document_ids:
+                print("✅ Nenhum documento pendente")
+                sys.exit(0)
+            print(f"🧮 Planejando {len(document_ids)} documentos...")
+            manifest = batch.create_run(
+                bucket_name, document_ids,
+                max_records=args.max_records_per_job or batch.BATCH_MAX_RECORDS_PER_JOB
+            )
+            records = sum(shard['records'] for shard in manifest['shards'])
+            print(f"📦 Execução {manifest['run_id']}: {records} chunks em {len(manifest['shards'])} jobs")
+            for document_id, entry in manifest['documents'].items():
+                if entry['status'] == 'too_large':
+                    print(f"   ⚠️  {document_id}: {entry['records']} chunks, acima do limite por job (use o pipeline)")
+
+        summary = batch.run_jobs(
+            bucket_name, manifest, role_arn,
+            max_concurrent=args.max_concurrent_jobs or batch.BATCH_MAX_CONCURRENT_JOBS,
+            poll_seconds=poll_seconds, online_fallback=args.online_fallback
+        )
+        elapsed = time.perf_counter() - started
+
+        for document_id, entry in manifest['documents'].items():
+            if entry['status'] == 'failed':
+                reason = entry.get('error') or f"{len(entry['failed_records'])} chunks com erro"
+                print(f"   ❌ {document_id}: {reason}")
+
+        documents = summary['documents']
+        failed = documents.get('failed', 0)
+        print(f"\n🎯 {documents.get('embedded', 0)} documentos com embeddings novos em {elapsed:.1f}s "
+              f"({summary['records']} chunks em {summary['jobs']} jobs, {summary['online_records']} pelo fallback online, "
+              f"{summary['failed_records']} chunks com falha em {failed} documentos)")
+        if failed:
+            print(f"⚠️  Falhas por chunk em s3://{bucket_name}/{batch.manifest_key(manifest['run_id'])}; "
+                  f"rode de novo para reprocessar só os documentos pendentes")
+        if documents.get('embedded'):
+            print("🔄 Atualize o índice vetorial: python sync_vector_index.py")
+
+        sys.exit(0 if failed == 0 else 1)
+
+    except Exception as e:
+        print(f"❌ Erro ao gerar embeddings em lote: {str(e)}")
+        sys.exit(1)
@@ -23,6 +23,8 @@ def create_s3_folder_structure():
         'embeddings/',       # Embeddings gerados em JSON
         'indexed/',          # Resultados da indexação em JSON
         'summaries/',        # Resumos finais do processamento
+        'chunk-text/',       # Texto dos chunks com índice de offsets (leitura por range)
+        'batch-embeddings/', # Entradas, saídas e manifestos dos embeddings em lote
     ]
     
     try:
@@ -49,10 +51,12 @@ def create_s3_folder_structure():
                 "description": "S3 folder structure for RAG pipeline data lineage",
                 "folders": {
                     "uploads/": "Original PDF files uploaded by users",
-                    "extracted/": "Extracted text data in JSON format from PyMuPDF",
-                    "embeddings/": "Generated embeddings in JSON format from Amazon Bedrock",
+                    "extracted/": "Extracted text data (compressed line-delimited JSON) from PyMuPDF",
+                    "embeddings/": "Generated embeddings (compressed line-delimited JSON) from Amazon Bedrock",
                     "indexed/": "OpenSearch indexing results and metadata in JSON",
-                    "summaries/": "Final processing summaries and pipeline status"
+                    "summaries/": "Final processing summaries and pipeline status",
+                    "chunk-text/": "Packed chunk texts per document with a chunk_id -> byte range index",
+                    "batch-embeddings/": "Bedrock batch inference runs: JSONL inputs, outputs and per-record manifests"
                 },
                 "benefits": [
                     "Complete audit trail of document processing",
@@ -0,0 +1,448 @@
+import os
+import json
+import math
+import time
+import array
+import bisect
+import tempfile
+import boto3
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+from artifacts import put_artifact, read_artifact
+from generate_embeddings import (
+    suppress_duplicates, finish_dedup, build_embeddings_json, embedding_entry, embed_chunk
+)
+from index_opensearch import index_documents_to_opensearch, build_indexed_json
+from chunk_text import put_chunk_texts
+from pipeline_status import publish
+
+bedrock_client = boto3.client('bedrock', region_name='us-east-1')
+s3_client = boto3.client('s3', region_name='sa-east-1')
+
+# Bulk (re-)embedding through Bedrock batch inference, for backfills where
+# one invoke_model per chunk is too slow and too quota-bound. A run has
+# three passes over the corpus and keeps its state in a manifest, so it
+# can be resumed by run id after the process stops:
+#   1. plan: every pending document is read once from extracted/, its
+#      near-duplicates suppressed, and the canonical chunks saved as a plan
+#      artifact (batch-embeddings/{run}/documents/);
+#   2. shard: documents are packed, never split, into balanced job input
+#      files of at most BATCH_MAX_RECORDS_PER_JOB records; each line is
+#      {"recordId", "modelInput"} and recordId is the line number in the
+#      file, which together with the shard's ordered document list and
+#      record counts maps a result back to its chunk;
+#   3. collect: a job per input file is submitted (at most
+#      BATCH_MAX_CONCURRENT_JOBS at a time) and polled; output files are
+#      streamed line by line and a document is written to embeddings/ and
+#      re-indexed as soon as all of its records are back. Records that come
+#      back with an error, or not at all, are kept per chunk in the
+#      manifest and the document is left as it was (or embedded online
+#      with online_fallback).
+BATCH_PREFIX = 'batch-embeddings/'
+BATCH_MODEL_ID = os.environ.get('BATCH_EMBEDDING_MODEL_ID', 'amazon.titan-embed-text-v1')
+BATCH_MAX_RECORDS_PER_JOB = int(os.environ.get('BATCH_MAX_RECORDS_PER_JOB', '50000'))
+# Bedrock rejects jobs with fewer records than this
+BATCH_MIN_RECORDS_PER_JOB = int(os.environ.get('BATCH_MIN_RECORDS_PER_JOB', '100'))
+BATCH_MAX_CONCURRENT_JOBS = int(os.environ.get('BATCH_MAX_CONCURRENT_JOBS', '10'))
+BATCH_POLL_SECONDS = float(os.environ.get('BATCH_POLL_SECONDS', '60'))
+
+JOB_RUNNING = ('Submitted', 'Validating', 'Scheduled', 'InProgress', 'Stopping')
+JOB_SUCCEEDED = ('Completed', 'PartiallyCompleted')
+JOB_FAILED = ('Failed', 'Stopped', 'Expired')
+
+READ_BUFFER_BYTES = 64 * 1024
+
+
+def manifest_key(run_id: str) -> str:
+    return f"{BATCH_PREFIX}{run_id}/manifest.json"
+
+
+def new_run_id() -> str:
+    return datetime.now(timezone.utc).strftime('%Y%m%d-%H%M%S')
+
+
+def load_manifest(bucket: str, run_id: str) -> Dict:
+    response = s3_client.get_object(Bucket=bucket, Key=manifest_key(run_id))
+    return json.loads(response['Body'].read().decode('utf-8'))
+
+
+def save_manifest(bucket: str, manifest: Dict):
+    manifest['updated_at'] = datetime.now(timezone.utc).isoformat()
+    s3_client.put_object(
+        Bucket=bucket,
+        Key=manifest_key(manifest['run_id']),
+        Body=json.dumps(manifest).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+
+def _list_objects(bucket: str, prefix: str) -> Iterator[Dict]:
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        yield from page.get('Contents', [])
+
+
+def find_pending_documents(bucket: str, force: bool = False) -> List[str]:
+    """
+    Documents whose embeddings/ artifact is missing or older than their
+    extracted/ artifact (all extracted documents with force)
+    """
+
+    embedded = {
+        obj['Key'][len('embeddings/'):-len('.json')]: obj['LastModified']
+        for obj in _list_objects(bucket, 'embeddings/') if obj['Key'].endswith('.json')
+    }
+    pending = []
+    for obj in _list_objects(bucket, 'extracted/'):
+        if not obj['Key'].endswith('.json'):
+            continue
+        document_id = obj['Key'][len('extracted/'):-len('.json')]
+        if force or document_id not in embedded or embedded[document_id] < obj['LastModified']:
+            pending.append(document_id)
+    return pending
+
+
+def plan_document(bucket: str, run_id: str, document_id: str) -> Dict:
+    """
+    Pass 1 for one document: canonical chunks saved as the plan artifact.
+    Chunks reusing a corpus duplicate's vector are kept as ready entries
+    and never sent to the batch job.
+    """
+
+    extracted_file_key = f"extracted/{document_id}.json"
+    extracted = read_artifact(s3_client, bucket, extracted_file_key, records_field='chunks')
+    canonical, duplicate_chunks, dedup_stats, _ = suppress_duplicates(extracted['chunks'], document_id, bucket)
+    chunks = [chunk for chunk in canonical if 'reuse_embedding' not in chunk]
+    reused = [
+        embedding_entry(chunk, chunk['reuse_embedding']) for chunk in canonical if 'reuse_embedding' in chunk
+    ]
+
+    plan_key = f"{BATCH_PREFIX}{run_id}/documents/{document_id}.json"
+    put_artifact(s3_client, bucket, plan_key, {
+        'document_id': document_id,
+        'source_bucket': extracted.get('source_bucket', bucket),
+        'source_key': extracted.get('source_key'),
+        'extracted_file_key': extracted_file_key,
+        'total_pages': extracted.get('total_pages'),
+        'metadata': extracted.get('metadata') or {},
+        'duplicate_chunks': duplicate_chunks,
+        'dedup_stats': dedup_stats,
+        'reused_entries': reused,
+        'chunks': chunks
+    }, records_field='chunks')
+    return {'plan_key': plan_key, 'records': len(chunks), 'reused': len(reused)}
+
+
+def assign_shards(records_by_document: Dict[str, int], max_records: int) -> List[List[str]]:
+    """
+    Pass 2: documents in balanced groups of at most max_records records,
+    each document whole. The caller leaves out documents above max_records.
+    """
+
+    total = sum(records_by_document.values())
+    if not total:
+        return []
+    target = math.ceil(total / math.ceil(total / max_records))
+    shards, current, size = [], [], 0
+    for document_id, records in records_by_document.items():
+        if current and (size >= target or size + records > max_records):
+            shards.append(current)
+            current, size = [], 0
+        current.append(document_id)
+        size += records
+    shards.append(current)
+    return shards
+
+
+def write_shard_input(bucket: str, manifest: Dict, shard: Dict):
+    """
+    Pass 3 for one shard: the JSONL input file, streamed from the plan
+    artifacts through a temporary file
+    """
+
+    line = 0
+    with tempfile.TemporaryFile() as f:
+        for document_id in shard['documents']:
+            plan = read_artifact(s3_client, bucket, manifest['documents'][document_id]['plan_key'], records_field='chunks')
+            for chunk in plan['chunks']:
+                record = {'recordId': f"{line:011d}", 'modelInput': {'inputText': chunk['text']}}
+                f.write(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                f.write(b'\n')
+                line += 1
+        f.seek(0)
+        s3_client.put_object(Bucket=bucket, Key=shard['input_key'], Body=f, ContentType='application/jsonl')
+    shard['records'] = line
+
+
+def create_run(bucket: str, document_ids: List[str], run_id: Optional[str] = None,
+               max_records: int = BATCH_MAX_RECORDS_PER_JOB) -> Dict:
+    """
+    Plan, shard and write the job inputs of a new run; returns its manifest
+    """
+
+    run_id = run_id or new_run_id()
+    manifest = {
+        'run_id': run_id,
+        'model_id': BATCH_MODEL_ID,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'documents': {},
+        'shards': []
+    }
+
+    for document_id in document_ids:
+        try:
+            planned = plan_document(bucket, run_id, document_id)
+        except Exception as e:
+            print(f"Error planning {document_id}: {str(e)}")
+            manifest['documents'][document_id] = {'status': 'failed', 'error': str(e)[:500]}
+            continue
+        entry = dict(planned, shard=None, status='planned', failed_records={})
+        if not planned['records']:
+            entry['status'] = 'empty'
+        elif planned['records'] > max_records:
+            entry['status'] = 'too_large'
+        manifest['documents'][document_id] = entry
+        if not planned['records'] and planned['reused']:
+            # Every chunk reuses a corpus vector: nothing to batch, finish it now
+            finish_document(bucket, manifest, document_id, {}, {})
+
+    records_by_document = {
+        document_id: entry['records'] for document_id, entry in manifest['documents'].items()
+        if entry['status'] == 'planned'
+    }
+    for number, documents in enumerate(assign_shards(records_by_document, max_records)):
+        shard = {
+            'shard': number,
+            'input_key': f"{BATCH_PREFIX}{run_id}/input/{number:05d}.jsonl",
+            'output_prefix': f"{BATCH_PREFIX}{run_id}/output/{number:05d}/",
+            'documents': documents,
+            'records': 0,
+            'job_arn': None,
+            'status': 'pending',
+            'message': None,
+            'output_processed': False
+        }
+        write_shard_input(bucket, manifest, shard)
+        for document_id in documents:
+            manifest['documents'][document_id].update(shard=number, status='submitted')
+        if shard['records'] < BATCH_MIN_RECORDS_PER_JOB:
+            print(f"Shard {number} has {shard['records']} records, below the batch minimum of "
+                  f"{BATCH_MIN_RECORDS_PER_JOB}; the job will be rejected")
+        manifest['shards'].append(shard)
+
+    save_manifest(bucket, manifest)
+    return manifest
+
+
+def submit_shard(bucket: str, manifest: Dict, shard: Dict, role_arn: str):
+    job_name = f"qa-embed-{manifest['run_id']}-{shard['shard']:05d}"
+    try:
+        response = bedrock_client.create_model_invocation_job(
+            jobName=job_name,
+            roleArn=role_arn,
+            modelId=manifest['model_id'],
+            inputDataConfig={'s3InputDataConfig': {
+                's3Uri': f"s3://{bucket}/{shard['input_key']}", 's3InputFormat': 'JSONL'
+            }},
+            outputDataConfig={'s3OutputDataConfig': {'s3Uri': f"s3://{bucket}/{shard['output_prefix']}"}}
+        )
+    except Exception as e:
+        print(f"Error submitting batch job {job_name}: {str(e)}")
+        shard.update(status='Failed', message=f"Submission failed: {str(e)}"[:500])
+        return
+    shard.update(job_arn=response['jobArn'], status='Submitted')
+    print(f"Submitted batch job {job_name}: {response['jobArn']}")
+
+
+def _read_lines(body) -> Iterator[bytes]:
+    pending = b''
+    while True:
+        block = body.read(READ_BUFFER_BYTES)
+        if not block:
+            break
+        lines = (pending + block).split(b'\n')
+        pending = lines.pop()
+        yield from lines
+    if pending:
+        yield pending
+
+
+def _output_key(bucket: str, shard: Dict) -> Optional[str]:
+    # Bedrock writes {output prefix}{job id}/{input file name}.out
+    suffix = f"/{shard['input_key'].rsplit('/', 1)[-1]}.out"
+    for obj in _list_objects(bucket, shard['output_prefix']):
+        if obj['Key'].endswith(suffix):
+            return obj['Key']
+    return None
+
+
+def collect_shard(bucket: str, manifest: Dict, shard: Dict, online_fallback: bool = False) -> Dict:
+    """
+    Stream a finished job's output and finish each document of the shard
+    once all of its records are accounted for. Documents are finished in
+    output order, so with in-order output only one is held in memory.
+    """
+
+    documents = [
+        document_id for document_id in shard['documents']
+        if manifest['documents'][document_id]['status'] == 'submitted'
+    ]
+    offsets, position = [], 0
+    for document_id in shard['documents']:
+        offsets.append(position)
+        position += manifest['documents'][document_id]['records']
+
+    vectors: Dict[str, Dict[int, array.array]] = {}
+    errors: Dict[str, Dict[int, str]] = {}
+    counts = {'records': 0, 'errors': 0}
+    output_key = _output_key(bucket, shard) if shard['status'] in JOB_SUCCEEDED else None
+
+    if output_key:
+        response = s3_client.get_object(Bucket=bucket, Key=output_key)
+        for line in _read_lines(response['Body']):
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            record = int(result['recordId'])
+            slot = bisect.bisect_right(offsets, record) - 1
+            document_id = shard['documents'][slot]
+            if manifest['documents'][document_id]['status'] != 'submitted':
+                continue
+            index = record - offsets[slot]
+            embedding = (result.get('modelOutput') or {}).get('embedding')
+            counts['records'] += 1
+            if embedding and 'error' not in result:
+                vectors.setdefault(document_id, {})[index] = array.array('f', embedding)
+            else:
+                counts['errors'] += 1
+                error = result.get('error') or 'Empty embedding in batch output'
+                errors.setdefault(document_id, {})[index] = (
+                    error.get('errorMessage', json.dumps(error)) if isinstance(error, dict) else str(error)
+                )
+            seen = len(vectors.get(document_id, {})) + len(errors.get(document_id, {}))
+            if seen == manifest['documents'][document_id]['records']:
+                finish_document(bucket, manifest, document_id, vectors.pop(document_id, {}),
+                                errors.pop(document_id, {}), online_fallback)
+
+    # Whatever is still open is missing records (or the whole job failed)
+    missing = 'Missing from batch output' if output_key else f"Batch job {shard['status']}: {shard['message']}"
+    for document_id in documents:
+        if manifest['documents'][document_id]['status'] == 'submitted':
+            finish_document(bucket, manifest, document_id, vectors.pop(document_id, {}),
+                            errors.pop(document_id, {}), online_fallback, missing)
+
+    shard['output_processed'] = True
+    return counts
+
+
+def finish_document(bucket: str, manifest: Dict, document_id: str, vectors: Dict[int, array.array],
+                    errors: Dict[int, str], online_fallback: bool = False, missing_error: Optional[str] = None):
+    """
+    Write embeddings/ and indexed/ for a document whose batch records are
+    all back; with failed records, record them per chunk instead (after
+    trying them online with online_fallback)
+    """
+
+    entry = manifest['documents'][document_id]
+    plan = read_artifact(s3_client, bucket, entry['plan_key'], records_field='chunks')
+    embeddings_data, failed_records, online = list(plan.get('reused_entries', [])), {}, 0
+
+    for index, chunk in enumerate(plan['chunks']):
+        vector = vectors.get(index)
+        if vector is not None:
+            embeddings_data.append(embedding_entry(chunk, vector.tolist()))
+            continue
+        error = errors.get(index, missing_error or 'Missing from batch output')
+        if online_fallback:
+            result = embed_chunk(chunk, document_id)
+            if result['entry'] is not None:
+                embeddings_data.append(result['entry'])
+                online += 1
+                continue
+            error = f"{error}; online: {result['error']}"
+        failed_records[chunk['chunk_id']] = error[:500]
+
+    if failed_records:
+        print(f"{len(failed_records)} of {len(plan['chunks'])} records failed for {document_id}; "
+              f"embeddings/ left unchanged")
+        entry.update(status='failed', failed_records=failed_records)
+        return
+
+    try:
+        finish_dedup(bucket, embeddings_data, plan['dedup_stats'], None)
+        embeddings_file_key = f"embeddings/{document_id}.json"
+        embeddings_json = build_embeddings_json(
+            document_id, plan['source_bucket'], plan['source_key'], plan['extracted_file_key'],
+            plan['total_pages'], plan['metadata'], embeddings_data, plan['duplicate_chunks'], plan['dedup_stats']
+        )
+        embeddings_json.update(embedding_model=manifest['model_id'], batch_run_id=manifest['run_id'])
+        put_artifact(s3_client, bucket, embeddings_file_key, embeddings_json, records_field='embeddings_data')
+
+        # Re-index like the index stage, so sync_vector_index.py picks the document up
+        indexing_result = index_documents_to_opensearch(
+            document_id, embeddings_data, plan['metadata'], plan['total_pages'] or 0
+        )
+        chunk_text_key = put_chunk_texts(s3_client, bucket, document_id, embeddings_data)
+        put_artifact(s3_client, bucket, f"indexed/{document_id}.json", build_indexed_json(
+            document_id, plan['source_bucket'], plan['source_key'], embeddings_file_key, indexing_result,
+            plan['dedup_stats'], chunk_text_key
+        ))
+    except Exception as e:
+        print(f"Error writing batch embeddings for {document_id}: {str(e)}")
+        entry.update(status='failed', error=str(e)[:500])
+        return
+
+    entry.update(status='embedded', failed_records={}, online_records=online)
+    publish(document_id, 'embed', 'completed', counts={
+        'embeddings': len(embeddings_data), 'duplicates': len(plan['duplicate_chunks']), 'online': online
+    })
+
+
+def run_jobs(bucket: str, manifest: Dict, role_arn: str, max_concurrent: int = BATCH_MAX_CONCURRENT_JOBS,
+             poll_seconds: float = BATCH_POLL_SECONDS, online_fallback: bool = False) -> Dict:
+    """
+    Submit, poll and collect every shard of a run until all are processed.
+    The manifest is saved after every change, so a stopped run resumes
+    where it was (running jobs are polled again, not resubmitted).
+    """
+
+    while True:
+        running = [shard for shard in manifest['shards'] if shard['status'] in JOB_RUNNING]
+        for shard in manifest['shards']:
+            if len(running) >= max_concurrent:
+                break
+            if shard['status'] == 'pending':
+                submit_shard(bucket, manifest, shard, role_arn)
+                if shard['status'] in JOB_RUNNING:
+                    running.append(shard)
+
+        for shard in running:
+            job = bedrock_client.get_model_invocation_job(jobIdentifier=shard['job_arn'])
+            if job['status'] != shard['status']:
+                print(f"Batch job {shard['job_arn']}: {job['status']}")
+            shard.update(status=job['status'], message=job.get('message'))
+
+        for shard in manifest['shards']:
+            if not shard['output_processed'] and shard['status'] in JOB_SUCCEEDED + JOB_FAILED:
+                counts = collect_shard(bucket, manifest, shard, online_fallback)
+                print(f"Collected shard {shard['shard']}: {counts['records']} records, {counts['errors']} errors")
+        save_manifest(bucket, manifest)
+
+        if all(shard['output_processed'] for shard in manifest['shards']):
+            return summarize_run(manifest)
+        time.sleep(poll_seconds)
+
+
+def summarize_run(manifest: Dict) -> Dict:
+    statuses: Dict[str, int] = {}
+    for entry in manifest['documents'].values():
+        statuses[entry['status']] = statuses.get(entry['status'], 0) + 1
+    return {
+        'run_id': manifest['run_id'],
+        'documents': statuses,
+        'jobs': len(manifest['shards']),
+        'records': sum(shard['records'] for shard in manifest['shards']),
+        'failed_records': sum(len(entry.get('failed_records') or {}) for entry in manifest['documents'].values()),
+        'online_records': sum(entry.get('online_records', 0) for entry in manifest['documents'].values())
+    }
@@ -0,0 +1,155 @@
+import json
+import hashlib
+from typing import List, Dict, Tuple
+from datetime import datetime, timezone
+
+from artifacts import put_artifact, open_artifact
+
+CHECKPOINT_PREFIX = 'checkpoints/embeddings'
+
+
+class EmbeddingCheckpoint:
+    """
+    Progress checkpoint for one document's embedding run, stored in S3.
+
+    Finished embeddings are written as immutable shard objects; a small
+    manifest records the shard keys, the completed chunk index ranges and
+    every chunk that failed together with its attempt count. A retried or
+    handed-off invocation loads the manifest and only embeds what is left.
+    The manifest is bound to the exact chunk list through a fingerprint, so
+    a re-extracted document never resumes from a stale checkpoint.
+    """
+
+    def __init__(self, s3_client, bucket: str, document_id: str, chunk_ids: List[str]):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.document_id = document_id
+        self.prefix = f"{CHECKPOINT_PREFIX}/{document_id}"
+        self.manifest_key = f"{self.prefix}/manifest.json"
+        self.fingerprint = hashlib.sha256('\n'.join(chunk_ids).encode('utf-8')).hexdigest()
+        self.total_chunks = len(chunk_ids)
+        self.completed: List[List[int]] = []
+        self.shards: List[str] = []
+        self.failed: Dict[str, Dict] = {}
+        self.invocations = 0
+
+    def load(self) -> bool:
+        """
+        Load an existing checkpoint; returns True when resuming
+        """
+
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=self.manifest_key)
+            manifest = json.loads(response['Body'].read().decode('utf-8'))
+        except self.s3_client.exceptions.NoSuchKey:
+            return False
+
+        if manifest.get('fingerprint') != self.fingerprint:
+            print(f"Discarding stale checkpoint {self.manifest_key} (chunk list changed)")
+            # Delete the stale shards too, not only the manifest
+            self.shards = manifest.get('shards', [])
+            self.clear()
+            return False
+
+        self.completed = manifest['completed']
+        self.shards = manifest['shards']
+        self.failed = manifest['failed']
+        self.invocations = manifest.get('invocations', 0)
+        return True
+
+    def completed_count(self) -> int:
+        return sum(end - start for start, end in self.completed)
+
+    def pending_indices(self) -> List[int]:
+        done = set()
+        for start, end in self.completed:
+            done.update(range(start, end))
+        return [index for index in range(self.total_chunks) if index not in done]
+
+    def _mark_completed(self, indices: List[int]):
+        ranges = [list(r) for r in self.completed] + [[index, index + 1] for index in indices]
+        ranges.sort()
+        merged: List[List[int]] = []
+        for start, end in ranges:
+            if merged and start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.completed = merged
+
+    def save_shard(self, entries: List[Tuple[int, Dict]]):
+        """
+        Persist a batch of (chunk index, embedding entry) pairs
+        """
+
+        if not entries:
+            return
+
+        shard_key = f"{self.prefix}/shard-{len(self.shards):05d}.json"
+        put_artifact(
+            self.s3_client, self.bucket, shard_key,
+            {'document_id': self.document_id,
+             'entries': [dict(entry, index=index) for index, entry in entries]},
+            records_field='entries'
+        )
+        self.shards.append(shard_key)
+        self._mark_completed([index for index, _ in entries])
+        for _, entry in entries:
+            self.failed.pop(entry['chunk_id'], None)
+        self.save_manifest()
+
+    def record_failures(self, failures: Dict[str, str]):
+        for chunk_id, error in failures.items():
+            previous = self.failed.get(chunk_id, {})
+            self.failed[chunk_id] = {
+                'attempts': previous.get('attempts', 0) + 1,
+                'error': error
+            }
+        self.save_manifest()
+
+    def save_manifest(self):
+        self.s3_client.put_object(
+            Bucket=self.bucket,
+            Key=self.manifest_key,
+            Body=json.dumps({
+                'fingerprint': self.fingerprint,
+                'total_chunks': self.total_chunks,
+                'completed': self.completed,
+                'shards': self.shards,
+                'failed': self.failed,
+                'invocations': self.invocations,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }),
+            ContentType='application/json'
+        )
+
+    def load_embeddings(self) -> List[Dict]:
+        """
+        All checkpointed embedding entries in chunk order
+        """
+
+        by_index = {}
+        for shard_key in self.shards:
+            _, records = open_artifact(self.s3_client, self.bucket, shard_key, records_field='entries')
+            for record in records:
+                # Shards written before the line-delimited format hold [index, entry] pairs
+                index, entry = record if isinstance(record, list) else (record.pop('index'), record)
+                by_index[index] = entry
+        return [by_index[index] for index in sorted(by_index)]
+
+    def clear(self):
+        """
+        Remove the checkpoint once the embeddings artifact is written
+        """
+
+        keys = self.shards + [self.manifest_key]
+        try:
+            for start in range(0, len(keys), 1000):
+                self.s3_client.delete_objects(
+                    Bucket=self.bucket,
+                    Delete={'Objects': [{'Key': key} for key in keys[start:start + 1000]], 'Quiet': True}
+                )
+        except Exception as e:
+            # Leftover checkpoint objects are harmless; the fingerprint guards reuse
+            print(f"Could not delete checkpoint {self.prefix}: {str(e)}")
+        self.completed, self.shards, self.failed = [], [], {}
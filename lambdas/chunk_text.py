@@ -0,0 +1,398 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+import asyncio
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Random-access store of chunk texts, so showing the text of a retrieved
+# chunk does not mean downloading its whole extracted/ or embeddings/
+# artifact. The texts of a document are packed into one uncompressed UTF-8
+# blob, chunk-text/{document_id}.{content hash}.txt, and a small offset
+# index, chunk-text/{document_id}.json, maps every chunk_id to its byte
+# range. Readers fetch the index once (cached) and then only the byte
+# ranges of the chunks they need: S3 range GETs, or slices of a memory-
+# mapped file when the prefix is mirrored to a local directory. Blobs are
+# content-addressed, so a cached text never goes stale; a re-ingested
+# document gets a new blob and the old one is deleted after the index
+# points to the new one.
+CHUNK_TEXT_PREFIX = 'chunk-text/'
+CHUNK_TEXT_FORMAT = 'chunk-text/1'
+CHUNK_TEXT_CACHE_MB = float(os.environ.get('CHUNK_TEXT_CACHE_MB', '64'))
+# Cached offset indexes are re-read after this long (re-ingested documents)
+CHUNK_TEXT_INDEX_TTL_SECONDS = float(os.environ.get('CHUNK_TEXT_INDEX_TTL_SECONDS', '60'))
+CHUNK_TEXT_INDEX_CACHE = 4096
+# Chunks of one document closer than this are fetched with one range read
+RANGE_COALESCE_BYTES = 64 * 1024
+MAX_OPEN_MAPS = 256
+
+
+def chunk_text_index_key(document_id: str) -> str:
+    return f"{CHUNK_TEXT_PREFIX}{document_id}.json"
+
+
+def pack_chunk_texts(document_id: str, chunks: Iterable[Dict]) -> Tuple[bytes, Dict]:
+    """
+    The packed texts of a document's chunks and their offset index
+    """
+
+    parts, offsets, position = [], {}, 0
+    for chunk in chunks:
+        data = (chunk.get('text') or '').encode('utf-8')
+        offsets[chunk['chunk_id']] = [position, len(data)]
+        parts.append(data)
+        position += len(data)
+    blob = b''.join(parts)
+    text_key = f"{CHUNK_TEXT_PREFIX}{document_id}.{hashlib.sha256(blob).hexdigest()[:16]}.txt"
+    index = {
+        'format': CHUNK_TEXT_FORMAT,
+        'document_id': document_id,
+        'text_key': text_key,
+        'bytes': len(blob),
+        'chunks': offsets
+    }
+    return blob, index
+
+
+def put_chunk_texts(s3_client, bucket: str, document_id: str, chunks: Iterable[Dict]) -> str:
+    """
+    Write a document's chunk texts and offset index; returns the index key
+    """
+
+    blob, index = pack_chunk_texts(document_id, chunks)
+    index_key = chunk_text_index_key(document_id)
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=index_key)
+        previous = json.loads(response['Body'].read()).get('text_key')
+    except s3_client.exceptions.NoSuchKey:
+        previous = None
+
+    # Blob first: a reader never sees an index pointing to a missing blob
+    s3_client.put_object(
+        Bucket=bucket, Key=index['text_key'], Body=blob, ContentType='text/plain; charset=utf-8'
+    )
+    s3_client.put_object(
+        Bucket=bucket, Key=index_key, Body=json.dumps(index).encode('utf-8'), ContentType='application/json'
+    )
+    if previous and previous != index['text_key']:
+        s3_client.delete_object(Bucket=bucket, Key=previous)
+    return index_key
+
+
+class S3ChunkTextSource:
+    """
+    Offset indexes and text ranges read from S3
+    """
+
+    def __init__(self, s3_client, bucket: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def read_index(self, document_id: str) -> Optional[Dict]:
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket, Key=chunk_text_index_key(document_id))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return json.loads(response['Body'].read())
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        response = self.s3_client.get_object(Bucket=self.bucket, Key=key, Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+
+class AsyncS3ChunkTextSource:
+    """
+    S3ChunkTextSource for an aiobotocore client; limiter (an async context
+    manager) bounds the S3 calls in flight
+    """
+
+    def __init__(self, s3_client, bucket: str, limiter=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.limiter = limiter
+
+    async def _get(self, **kwargs) -> bytes:
+        if self.limiter is None:
+            response = await self.s3_client.get_object(Bucket=self.bucket, **kwargs)
+            return await response['Body'].read()
+        async with self.limiter:
+            response = await self.s3_client.get_object(Bucket=self.bucket, **kwargs)
+            return await response['Body'].read()
+
+    async def aread_index(self, document_id: str) -> Optional[Dict]:
+        try:
+            return json.loads(await self._get(Key=chunk_text_index_key(document_id)))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    async def aread_range(self, key: str, start: int, end: int) -> bytes:
+        return await self._get(Key=key, Range=f'bytes={start}-{end}')
+
+
+class LocalChunkTextSource:
+    """
+    The chunk-text/ prefix mirrored to a directory (directory/<key>, e.g.
+    with aws s3 sync); blobs are memory-mapped, so reads are page-cache
+    slices shared by every process on the host
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._maps: 'OrderedDict[str, mmap.mmap]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, *key.split('/'))
+
+    def read_index(self, document_id: str) -> Optional[Dict]:
+        try:
+            with open(self._path(chunk_text_index_key(document_id)), 'rb') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _map(self, key: str) -> mmap.mmap:
+        with self._lock:
+            mapped = self._maps.get(key)
+            if mapped is not None:
+                self._maps.move_to_end(key)
+                return mapped
+            with open(self._path(key), 'rb') as f:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+            self._maps[key] = mapped
+            # Evicted maps are unmapped once no reader holds them
+            if len(self._maps) > MAX_OPEN_MAPS:
+                self._maps.popitem(last=False)
+            return mapped
+
+    def read_range(self, key: str, start: int, end: int) -> bytes:
+        return self._map(key)[start:end + 1]
+
+    async def aread_index(self, document_id: str) -> Optional[Dict]:
+        return self.read_index(document_id)
+
+    async def aread_range(self, key: str, start: int, end: int) -> bytes:
+        return self.read_range(key, start, end)
+
+
+class ChunkTextStore:
+    """
+    Texts of (document_id, chunk_id) pairs through a source, behind an LRU
+    of hot chunks (cache_mb of text) and of offset indexes. A lookup costs
+    at most one index read per uncached document and one range read per
+    group of nearby chunks; missing documents or chunks are left out.
+    """
+
+    def __init__(self, source, cache_mb: float = CHUNK_TEXT_CACHE_MB,
+                 index_ttl: float = CHUNK_TEXT_INDEX_TTL_SECONDS, max_workers: int = 8):
+        self.source = source
+        self.cache_bytes = int(cache_mb * 1024 * 1024)
+        self.index_ttl = index_ttl
+        self._texts: 'OrderedDict[Tuple[str, str], str]' = OrderedDict()
+        self._cached_bytes = 0
+        self._indexes: 'OrderedDict[str, Tuple[float, Optional[Dict]]]' = OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='chunk-text')
+        self.hits = 0
+        self.misses = 0
+        self.index_reads = 0
+        self.range_reads = 0
+        self.bytes_read = 0
+
+    def _cached_index(self, document_id: str):
+        # False when not cached (or expired); None for a document without chunk texts
+        with self._lock:
+            entry = self._indexes.get(document_id)
+            if entry is None or time.monotonic() - entry[0] > self.index_ttl:
+                return False
+            self._indexes.move_to_end(document_id)
+            return entry[1]
+
+    def _remember_index(self, document_id: str, index: Optional[Dict]):
+        with self._lock:
+            self.index_reads += 1
+            self._indexes[document_id] = (time.monotonic(), index)
+            self._indexes.move_to_end(document_id)
+            while len(self._indexes) > CHUNK_TEXT_INDEX_CACHE:
+                self._indexes.popitem(last=False)
+
+    def _forget_index(self, document_id: str):
+        with self._lock:
+            self._indexes.pop(document_id, None)
+
+    def _lookup(self, pairs: List[Tuple[str, str]]) -> Tuple[Dict, List[str]]:
+        """
+        Cached texts, and the documents whose offset index must be read
+        """
+
+        found, documents = {}, []
+        with self._lock:
+            for pair in pairs:
+                text = self._texts.get(pair)
+                if text is not None:
+                    self._texts.move_to_end(pair)
+                    found[pair] = text
+        for document_id, chunk_id in pairs:
+            if (document_id, chunk_id) not in found and document_id not in documents \
+                    and self._cached_index(document_id) is False:
+                documents.append(document_id)
+        return found, documents
+
+    def _plan(self, pairs: List[Tuple[str, str]], found: Dict) -> List[Tuple[str, str, int, int, List]]:
+        """
+        Range reads for the uncached chunks: (document_id, text_key, start,
+        end, [(pair, offset, length)]), nearby chunks coalesced
+        """
+
+        wanted: Dict[str, Tuple[str, List]] = {}
+        for pair in pairs:
+            if pair in found:
+                continue
+            index = self._cached_index(pair[0])
+            location = index['chunks'].get(pair[1]) if index else None
+            if location and location[1]:
+                wanted.setdefault(pair[0], (index['text_key'], []))[1].append((pair, location[0], location[1]))
+            elif location:
+                found[pair] = ''
+
+        reads = []
+        for document_id, (text_key, chunks) in wanted.items():
+            chunks.sort(key=lambda chunk: chunk[1])
+            group = [chunks[0]]
+            for chunk in chunks[1:]:
+                end = group[-1][1] + group[-1][2]
+                if chunk[1] - end <= RANGE_COALESCE_BYTES:
+                    group.append(chunk)
+                else:
+                    reads.append(self._read(document_id, text_key, group))
+                    group = [chunk]
+            reads.append(self._read(document_id, text_key, group))
+        return reads
+
+    @staticmethod
+    def _read(document_id: str, text_key: str, group: List) -> Tuple[str, str, int, int, List]:
+        start = group[0][1]
+        end = max(offset + length for _, offset, length in group) - 1
+        return document_id, text_key, start, end, group
+
+    def _store(self, read: Tuple, data: bytes, found: Dict):
+        _, _, start, _, group = read
+        with self._lock:
+            self.range_reads += 1
+            self.bytes_read += len(data)
+            for pair, offset, length in group:
+                text = data[offset - start:offset - start + length].decode('utf-8')
+                found[pair] = text
+                if pair not in self._texts:
+                    self._texts[pair] = text
+                    self._cached_bytes += len(text)
+            while self._cached_bytes > self.cache_bytes and self._texts:
+                _, evicted = self._texts.popitem(last=False)
+                self._cached_bytes -= len(evicted)
+
+    def _count(self, pairs: List, cached: int):
+        with self._lock:
+            self.hits += cached
+            self.misses += len(pairs) - cached
+
+    def get_texts(self, pairs: Iterable[Tuple[str, str]], retry: bool = True) -> Dict[Tuple[str, str], str]:
+        """
+        Text of every (document_id, chunk_id) pair that exists
+        """
+
+        pairs = list(dict.fromkeys(pairs))
+        found, documents = self._lookup(pairs)
+        self._count(pairs, len(found))
+        for document_id, index in zip(documents, self._pool.map(self.source.read_index, documents)):
+            self._remember_index(document_id, index)
+
+        reads = self._plan(pairs, found)
+        futures = [self._pool.submit(self.source.read_range, *read[1:4]) for read in reads]
+        stale = []
+        for read, future in zip(reads, futures):
+            try:
+                self._store(read, future.result(), found)
+            except Exception as e:
+                # The blob of a re-ingested document is replaced; the next
+                # lookup reads its new index
+                print(f"Chunk text read failed for {read[0]}: {str(e)}")
+                stale.append(read[0])
+        for document_id in stale:
+            self._forget_index(document_id)
+        if stale and retry:
+            found.update(self.get_texts([pair for pair in pairs if pair[0] in stale], retry=False))
+        return found
+
+    async def aget_texts(self, pairs: Iterable[Tuple[str, str]], retry: bool = True) -> Dict[Tuple[str, str], str]:
+        """
+        get_texts for an async source
+        """
+
+        pairs = list(dict.fromkeys(pairs))
+        found, documents = self._lookup(pairs)
+        self._count(pairs, len(found))
+        indexes = await asyncio.gather(*(self.source.aread_index(document_id) for document_id in documents))
+        for document_id, index in zip(documents, indexes):
+            self._remember_index(document_id, index)
+
+        reads = self._plan(pairs, found)
+        results = await asyncio.gather(
+            *(self.source.aread_range(*read[1:4]) for read in reads), return_exceptions=True
+        )
+        stale = []
+        for read, data in zip(reads, results):
+            if isinstance(data, Exception):
+                print(f"Chunk text read failed for {read[0]}: {str(data)}")
+                stale.append(read[0])
+            else:
+                self._store(read, data, found)
+        for document_id in stale:
+            self._forget_index(document_id)
+        if stale and retry:
+            found.update(await self.aget_texts([pair for pair in pairs if pair[0] in stale], retry=False))
+        return found
+
+    @staticmethod
+    def _missing(results: List[Dict]) -> List[Tuple[str, str]]:
+        return [
+            (result['metadata']['document_id'], result['metadata']['chunk_id'])
+            for result in results if 'text' not in result['metadata']
+        ]
+
+    @staticmethod
+    def _fill(results: List[Dict], texts: Dict) -> List[Dict]:
+        for result in results:
+            metadata = result['metadata']
+            text = texts.get((metadata['document_id'], metadata['chunk_id']))
+            if 'text' not in metadata and text is not None:
+                metadata['text'] = text
+        return results
+
+    def hydrate(self, results: List[Dict]) -> List[Dict]:
+        """
+        Fill in the text of search results indexed without it (in place)
+        """
+
+        missing = self._missing(results)
+        return self._fill(results, self.get_texts(missing)) if missing else results
+
+    async def ahydrate(self, results: List[Dict]) -> List[Dict]:
+        missing = self._missing(results)
+        return self._fill(results, await self.aget_texts(missing)) if missing else results
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'cached_chunks': len(self._texts),
+                'cached_bytes': self._cached_bytes,
+                'cached_indexes': len(self._indexes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'index_reads': self.index_reads,
+                'range_reads': self.range_reads,
+                'bytes_read': self.bytes_read
+            }
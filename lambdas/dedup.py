@@ -0,0 +1,426 @@
+import re
+import json
+import random
+import struct
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple, Iterable
+
+# MinHash over 5-word shingles, 128 permutations split into 16 LSH bands of
+# 8 rows. With this banding a pair with Jaccard similarity 0.9 becomes a
+# candidate with probability > 0.99, while pairs below 0.5 almost never do.
+# Candidates are always verified against the full signature before merging.
+NUM_PERM = 128
+NUM_BANDS = 16
+SHINGLE_SIZE = 5
+DEFAULT_THRESHOLD = 0.9
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_MAX_HASH = (1 << 32) - 1
+_WORD_RE = re.compile(r'\w+')
+_DIGITS_RE = re.compile(r'\d+')
+
+
+def normalize_text(text: str) -> List[str]:
+    """
+    Lowercase and tokenize text, collapsing digit runs so that repeated
+    headers and footers ("Page 3 of 40") normalize to the same tokens
+    """
+
+    return [_DIGITS_RE.sub('0', token) for token in _WORD_RE.findall(text.lower())]
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> set:
+    """
+    Build the set of word shingles for a chunk of text
+    """
+
+    tokens = normalize_text(text)
+
+    if len(tokens) <= size:
+        return {' '.join(tokens)} if tokens else set()
+
+    return {' '.join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+class MinHasher:
+    """
+    Compute MinHash signatures with universal hashing (a * x + b) mod p
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, seed: int = 1):
+        generator = random.Random(seed)
+        self.num_perm = num_perm
+        self.permutations = [
+            (generator.randint(1, _MERSENNE_PRIME - 1), generator.randint(0, _MERSENNE_PRIME - 1))
+            for _ in range(num_perm)
+        ]
+
+    def signature(self, text: str) -> Tuple[int, ...]:
+        shingle_hashes = [
+            struct.unpack('<I', hashlib.blake2b(s.encode('utf-8'), digest_size=4).digest())[0]
+            for s in shingles(text)
+        ]
+
+        if not shingle_hashes:
+            return tuple([_MAX_HASH] * self.num_perm)
+
+        return tuple(
+            min(((a * h + b) % _MERSENNE_PRIME) & _MAX_HASH for h in shingle_hashes)
+            for a, b in self.permutations
+        )
+
+
+def estimate_similarity(signature_a: Iterable[int], signature_b: Iterable[int]) -> float:
+    """
+    Estimate Jaccard similarity as the fraction of matching MinHash slots
+    """
+
+    signature_a = list(signature_a)
+    signature_b = list(signature_b)
+    matches = sum(1 for a, b in zip(signature_a, signature_b) if a == b)
+    return matches / len(signature_a) if signature_a else 0.0
+
+
+class LSHIndex:
+    """
+    Banded LSH index mapping band hashes to the chunks that produced them.
+    Band hashes are stable across processes so the index can be persisted.
+    """
+
+    def __init__(self, num_perm: int = NUM_PERM, num_bands: int = NUM_BANDS):
+        if num_perm % num_bands:
+            raise ValueError('num_perm must be divisible by num_bands')
+
+        self.num_bands = num_bands
+        self.rows = num_perm // num_bands
+        self.buckets: Dict[str, set] = {}
+        self.signatures: Dict[str, Tuple[int, ...]] = {}
+
+    def _band_keys(self, signature: Tuple[int, ...]) -> List[str]:
+        keys = []
+        for band in range(self.num_bands):
+            rows = signature[band * self.rows:(band + 1) * self.rows]
+            digest = hashlib.blake2b(struct.pack(f'<{len(rows)}I', *rows), digest_size=8).hexdigest()
+            keys.append(f"{band}:{digest}")
+        return keys
+
+    def add(self, key: str, signature: Tuple[int, ...]):
+        self.signatures[key] = tuple(signature)
+        for band_key in self._band_keys(signature):
+            self.buckets.setdefault(band_key, set()).add(key)
+
+    def query(self, signature: Tuple[int, ...], threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        Return the most similar indexed key at or above threshold, if any
+        """
+
+        candidates = set()
+        for band_key in self._band_keys(signature):
+            candidates.update(self.buckets.get(band_key, ()))
+
+        best = None
+        for candidate in candidates:
+            similarity = estimate_similarity(signature, self.signatures[candidate])
+            if similarity >= threshold and (best is None or similarity > best[1]):
+                best = (candidate, similarity)
+
+        return best
+
+    def to_dict(self) -> Dict:
+        return {
+            'num_bands': self.num_bands,
+            'rows': self.rows,
+            'signatures': {key: list(sig) for key, sig in self.signatures.items()}
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> 'LSHIndex':
+        index = cls(num_perm=data['num_bands'] * data['rows'], num_bands=data['num_bands'])
+        for key, signature in data.get('signatures', {}).items():
+            index.add(key, tuple(signature))
+        return index
+
+
+def corpus_key(document_id: str, chunk_id: str) -> str:
+    return json.dumps([document_id, chunk_id])
+
+
+def _error_code(e: Exception) -> str:
+    return getattr(e, 'response', {}).get('Error', {}).get('Code', '')
+
+
+class S3CorpusIndex:
+    """
+    Corpus-wide LSH index of canonical chunks stored in S3 with one object
+    per band bucket and one per chunk, so no object is rewritten per
+    document and its size does not grow with the corpus:
+
+    - {prefix}bands/{band}/{digest}.json: keys of the chunks in the bucket,
+      appended with conditional writes (If-Match on the ETag that was read,
+      If-None-Match for a new bucket) and retried on a conflict, so
+      concurrent documents never drop each other's chunks
+    - {prefix}chunks/{sha1 of key}.json: signature and embedding of one
+      canonical chunk, written once and before its band entries, so every
+      indexed chunk can lend its vector to a duplicate
+
+    add() only buffers; flush() publishes the buffered chunks once their
+    embeddings exist. Read errors degrade to no match.
+    """
+
+    def __init__(self, s3_client, bucket: str, prefix: str, num_perm: int = NUM_PERM,
+                 num_bands: int = NUM_BANDS, max_conflicts: int = 10, workers: int = 16):
+        self.s3 = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.bands = LSHIndex(num_perm, num_bands)
+        self.max_conflicts = max_conflicts
+        self.pending: Dict[str, Tuple[int, ...]] = {}
+        self._buckets: Dict[str, set] = {}
+        self._entries: Dict[str, Optional[Dict]] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='corpus-index')
+
+    def _bucket_key(self, band_key: str) -> str:
+        band, digest = band_key.split(':')
+        return f"{self.prefix}bands/{band}/{digest}.json"
+
+    def _entry_key(self, key: str) -> str:
+        return f"{self.prefix}chunks/{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+    def _get_json(self, object_key: str):
+        """
+        (value, etag), or (None, None) when the object does not exist
+        """
+
+        try:
+            response = self.s3.get_object(Bucket=self.bucket, Key=object_key)
+        except self.s3.exceptions.NoSuchKey:
+            return None, None
+        return json.loads(response['Body'].read().decode('utf-8')), response.get('ETag')
+
+    def _members(self, band_key: str) -> set:
+        with self._lock:
+            if band_key in self._buckets:
+                return self._buckets[band_key]
+        members, _ = self._get_json(self._bucket_key(band_key))
+        members = set(members or [])
+        with self._lock:
+            self._buckets[band_key] = members
+        return members
+
+    def entry(self, key: str) -> Optional[Dict]:
+        """
+        Signature and embedding of an indexed chunk
+        """
+
+        with self._lock:
+            if key in self._entries:
+                return self._entries[key]
+        value, _ = self._get_json(self._entry_key(key))
+        with self._lock:
+            self._entries[key] = value
+        return value
+
+    def query(self, signature: Tuple[int, ...], threshold: float) -> Optional[Tuple[str, float]]:
+        """
+        Return the most similar indexed key at or above threshold, if any
+        """
+
+        try:
+            candidates = set()
+            for members in self._pool.map(self._members, self.bands._band_keys(signature)):
+                candidates.update(members)
+            best = None
+            for candidate, entry in zip(candidates, self._pool.map(self.entry, candidates)):
+                if entry is None:
+                    continue
+                similarity = estimate_similarity(signature, entry['signature'])
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (candidate, similarity)
+            return best
+        except Exception as e:
+            # Corpus-wide suppression is an optimization: no match, embed it
+            print(f"Corpus LSH index lookup failed: {str(e)}")
+            return None
+
+    def add(self, key: str, signature: Tuple[int, ...]):
+        self.pending[key] = tuple(signature)
+
+    def _append(self, band_key: str, keys: List[str]):
+        object_key = self._bucket_key(band_key)
+        for _ in range(self.max_conflicts):
+            members, etag = self._get_json(object_key)
+            merged = sorted(set(members or []) | set(keys))
+            condition = {'IfMatch': etag} if etag else {'IfNoneMatch': '*'}
+            try:
+                self.s3.put_object(
+                    Bucket=self.bucket, Key=object_key, Body=json.dumps(merged),
+                    ContentType='application/json', **condition
+                )
+                return
+            except Exception as e:
+                # Another document wrote the bucket since it was read
+                if _error_code(e) not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                    raise
+        raise Exception(f'Corpus LSH bucket {object_key} is too contended')
+
+    def flush(self, embeddings: Dict[str, List[float]]):
+        """
+        Publish the buffered chunks whose key's chunk_id has an embedding
+        """
+
+        ready = {
+            key: signature for key, signature in self.pending.items()
+            if json.loads(key)[1] in embeddings
+        }
+        if not ready:
+            return
+
+        def put_entry(item):
+            key, signature = item
+            self.s3.put_object(
+                Bucket=self.bucket, Key=self._entry_key(key), ContentType='application/json',
+                Body=json.dumps({
+                    'key': key,
+                    'signature': list(signature),
+                    'embedding': embeddings[json.loads(key)[1]]
+                })
+            )
+
+        list(self._pool.map(put_entry, ready.items()))
+
+        by_bucket: Dict[str, List[str]] = {}
+        for key, signature in ready.items():
+            for band_key in self.bands._band_keys(signature):
+                by_bucket.setdefault(band_key, []).append(key)
+        list(self._pool.map(lambda item: self._append(*item), by_bucket.items()))
+        for key in ready:
+            del self.pending[key]
+
+
+class ChunkDeduplicator:
+    """
+    Incremental near-duplicate suppression for one document: chunks are
+    fed in document order and add() tells whether each one is canonical.
+
+    Chunks are compared within the document and, when corpus_index is given,
+    against canonical chunks already embedded for other documents. Canonical
+    chunks get a 'duplicates' back-reference list; repeats within the
+    document are recorded in duplicate_chunks pointing at their canonical
+    copy. A chunk matching another document's chunk stays a chunk of this
+    document (searchable under its document_id, and independent of that
+    document being deleted or reingested) but reuses its embedding
+    ('reuse_embedding', 'reused_from') instead of calling Bedrock. New
+    canonical chunks are added to corpus_index.
+    """
+
+    def __init__(
+        self,
+        document_id: str,
+        threshold: float = DEFAULT_THRESHOLD,
+        corpus_index: Optional['S3CorpusIndex'] = None,
+        hasher: Optional[MinHasher] = None
+    ):
+        self.document_id = document_id
+        self.threshold = threshold
+        self.corpus_index = corpus_index
+        self.hasher = hasher or MinHasher()
+        self.document_index = LSHIndex()
+        self.canonical_chunks: List[Dict] = []
+        self.canonical_by_id: Dict[str, Dict] = {}
+        self.duplicate_chunks: List[Dict] = []
+        self.chunks_total = 0
+        self.within_document = 0
+        self.across_corpus = 0
+        self.reused_chars = 0
+
+    def add(self, chunk: Dict) -> Optional[Dict]:
+        """
+        Returns the canonical copy of chunk, or None if it is a duplicate
+        """
+
+        self.chunks_total += 1
+        signature = self.hasher.signature(chunk['text'])
+
+        match = self.document_index.query(signature, self.threshold)
+        if match:
+            canonical_id, similarity = match
+            self.canonical_by_id[canonical_id]['duplicates'].append({
+                'chunk_id': chunk['chunk_id'],
+                'page': chunk['page']
+            })
+            self.duplicate_chunks.append({
+                'chunk_id': chunk['chunk_id'],
+                'page': chunk['page'],
+                'char_count': chunk['char_count'],
+                'duplicate_of': {'document_id': self.document_id, 'chunk_id': canonical_id},
+                'similarity': round(similarity, 4)
+            })
+            self.within_document += 1
+            return None
+
+        corpus_match = self.corpus_index.query(signature, self.threshold) if self.corpus_index else None
+        if corpus_match:
+            canonical_document_id, canonical_id = json.loads(corpus_match[0])
+            entry = self.corpus_index.entry(corpus_match[0])
+            if canonical_document_id != self.document_id and entry and entry.get('embedding'):
+                reused = dict(
+                    chunk, duplicates=[], reuse_embedding=entry['embedding'],
+                    reused_from={
+                        'document_id': canonical_document_id,
+                        'chunk_id': canonical_id,
+                        'similarity': round(corpus_match[1], 4)
+                    }
+                )
+                self.canonical_chunks.append(reused)
+                self.canonical_by_id[chunk['chunk_id']] = reused
+                self.document_index.add(chunk['chunk_id'], signature)
+                self.across_corpus += 1
+                self.reused_chars += chunk['char_count']
+                return reused
+
+        canonical = dict(chunk, duplicates=[])
+        self.canonical_chunks.append(canonical)
+        self.canonical_by_id[chunk['chunk_id']] = canonical
+        self.document_index.add(chunk['chunk_id'], signature)
+
+        if self.corpus_index is not None:
+            self.corpus_index.add(corpus_key(self.document_id, chunk['chunk_id']), signature)
+        return canonical
+
+    def stats(self) -> Dict:
+        return {
+            'chunks_total': self.chunks_total,
+            'chunks_embedded': len(self.canonical_chunks),
+            'duplicates_within_document': self.within_document,
+            'duplicates_across_corpus': self.across_corpus,
+            'bedrock_calls_saved': len(self.duplicate_chunks) + self.across_corpus,
+            'bedrock_input_chars_saved': sum(d['char_count'] for d in self.duplicate_chunks) + self.reused_chars,
+            'index_documents_saved': len(self.duplicate_chunks),
+            'threshold': self.threshold
+        }
+
+
+def deduplicate_chunks(
+    chunks: List[Dict],
+    document_id: str,
+    threshold: float = DEFAULT_THRESHOLD,
+    corpus_index: Optional['S3CorpusIndex'] = None,
+    hasher: Optional[MinHasher] = None
+) -> Dict:
+    """
+    Collapse near-duplicate chunks to a single canonical chunk (see
+    ChunkDeduplicator)
+    """
+
+    deduplicator = ChunkDeduplicator(document_id, threshold, corpus_index, hasher)
+    for chunk in chunks:
+        deduplicator.add(chunk)
+
+    return {
+        'canonical_chunks': deduplicator.canonical_chunks,
+        'duplicate_chunks': deduplicator.duplicate_chunks,
+        'stats': deduplicator.stats()
+    }
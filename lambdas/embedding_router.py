@@ -0,0 +1,312 @@
+import io
+import os
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Embedding calls spread over several bedrock-runtime endpoints (regions,
+# or VPC endpoint URLs) serving the same model, so one slow or throttled
+# region neither sets the latency of every call nor stops the pipeline.
+# Every endpoint keeps an EWMA of its latency and of the deviation (as in
+# TCP's RTT estimator, samples capped at 4 deviations above the mean), and
+# of its error and throttle rates, which also fade with a half-life of
+# ERROR_HALF_LIFE_SECONDS so a recovered region wins its traffic back even
+# when it is rarely called. A call goes to the endpoint with the lowest
+# expected cost, latency / (1 - error rate). A throttled endpoint, or one
+# failing EJECT_AFTER_FAILURES calls in a row, is ejected for EJECT_SECONDS
+# (doubling on every further failure) and the call fails over to the next
+# one at once; validation errors would fail anywhere and are raised as
+# they are. A call still unanswered after latency + 4 * deviation of its
+# endpoint is hedged: the same request goes to the next endpoint and the
+# first answer wins. Each hedge is a billed request against the quota, so
+# hedges are limited to HEDGE_BUDGET of the calls and, with hedge_admission,
+# only sent when the shared rate limiter has budget for them right away.
+# With a single endpoint the plain boto3 client is used, as before.
+EMBEDDING_ENDPOINTS = os.environ.get('EMBEDDING_ENDPOINTS', 'us-east-1')
+ROUTER_EWMA_ALPHA = float(os.environ.get('EMBEDDING_ROUTER_EWMA_ALPHA', '0.2'))
+HEDGE_ENABLED = os.environ.get('EMBEDDING_HEDGE_ENABLED', 'true').lower() == 'true'
+HEDGE_MIN_MS = float(os.environ.get('EMBEDDING_HEDGE_MIN_MS', '50'))
+HEDGE_BUDGET = float(os.environ.get('EMBEDDING_HEDGE_BUDGET', '0.1'))
+EJECT_SECONDS = float(os.environ.get('EMBEDDING_ENDPOINT_EJECT_SECONDS', '5'))
+EJECT_MAX_SECONDS = 60.0
+EJECT_AFTER_FAILURES = 2
+ERROR_HALF_LIFE_SECONDS = float(os.environ.get('EMBEDDING_ROUTER_ERROR_HALF_LIFE_SECONDS', '10'))
+# Share of calls sent to a random healthy endpoint other than the best, so
+# the estimates of the others stay current
+EXPLORE_RATE = 0.02
+ROUTER_WORKERS = int(os.environ.get('EMBEDDING_ROUTER_WORKERS', '64'))
+
+THROTTLE_CODES = (
+    'ThrottlingException', 'TooManyRequestsException', 'ServiceQuotaExceededException',
+    'ServiceUnavailableException', 'ModelNotReadyException'
+)
+# Errors caused by the request itself: every endpoint would return them
+REQUEST_ERROR_CODES = ('ValidationException',)
+
+
+def error_code(error: Exception) -> str:
+    code = (getattr(error, 'response', None) or {}).get('Error', {}).get('Code')
+    if code:
+        return code
+    # Clients without botocore's error shape (the local stand-ins) name the code in the message
+    for name in THROTTLE_CODES + REQUEST_ERROR_CODES:
+        if name in str(error):
+            return name
+    return type(error).__name__
+
+
+class Endpoint:
+    """
+    One bedrock-runtime client and its health estimates
+    """
+
+    def __init__(self, name: str, client):
+        self.name = name
+        self.client = client
+        self.latency_ms: Optional[float] = None
+        self.deviation_ms = 0.0
+        self.error_rate = 0.0
+        self.throttle_rate = 0.0
+        self.rates_at = time.monotonic()
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+        self.throttles = 0
+
+    def decay_rates(self, now: float):
+        factor = 0.5 ** ((now - self.rates_at) / ERROR_HALF_LIFE_SECONDS)
+        self.error_rate *= factor
+        self.throttle_rate *= factor
+        self.rates_at = now
+
+    def cost(self) -> float:
+        # An unmeasured endpoint gets one call for a first estimate, then
+        # waits for its answer before getting more
+        if self.latency_ms is None:
+            return 0.0 if self.in_flight == 0 else float('inf')
+        return self.latency_ms / max(0.05, 1.0 - self.error_rate)
+
+    def hedge_after_ms(self) -> Optional[float]:
+        if self.latency_ms is None:
+            return None
+        return max(HEDGE_MIN_MS, self.latency_ms + 4.0 * self.deviation_ms)
+
+
+class EmbeddingRouter:
+    """
+    invoke_model over several endpoints, with the call shape of a
+    bedrock-runtime client. The response body is read by the router (to
+    time the whole call) and returned as a BytesIO. hedge_admission, given
+    the request kwargs, says whether a hedge may be sent now (it should take
+    the budget of the duplicate request when it says yes).
+    """
+
+    def __init__(self, endpoints: Sequence[Endpoint], hedge: bool = HEDGE_ENABLED,
+                 hedge_budget: float = HEDGE_BUDGET, workers: int = ROUTER_WORKERS,
+                 hedge_admission: Optional[Callable[[Dict], bool]] = None):
+        if not endpoints:
+            raise ValueError('EmbeddingRouter needs at least one endpoint')
+        self.endpoints = list(endpoints)
+        self.hedge = hedge
+        self.hedge_budget = hedge_budget
+        self.hedge_admission = hedge_admission
+        self._hedge_tokens = 1.0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='embedding-router')
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedged = 0
+        self.hedges_denied = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+
+    def _ranking(self) -> List[Endpoint]:
+        now = time.monotonic()
+        with self._lock:
+            for endpoint in self.endpoints:
+                endpoint.decay_rates(now)
+            healthy = sorted((e for e in self.endpoints if e.ejected_until <= now), key=Endpoint.cost)
+            ejected = sorted((e for e in self.endpoints if e.ejected_until > now), key=lambda e: e.ejected_until)
+        if len(healthy) > 1 and random.random() < EXPLORE_RATE:
+            healthy.insert(0, healthy.pop(random.randrange(1, len(healthy))))
+        # With every endpoint ejected, try the one that comes back first
+        return healthy + ejected
+
+    def _take_hedge_token(self, kwargs: Dict) -> bool:
+        with self._lock:
+            if self._hedge_tokens < 1.0:
+                return False
+            self._hedge_tokens -= 1.0
+        admitted = self.hedge_admission is None or self.hedge_admission(kwargs)
+        with self._lock:
+            if admitted:
+                self.hedged += 1
+            else:
+                self._hedge_tokens += 1.0
+                self.hedges_denied += 1
+        return admitted
+
+    def _record(self, endpoint: Endpoint, elapsed_ms: Optional[float], code: Optional[str]):
+        alpha = ROUTER_EWMA_ALPHA
+        with self._lock:
+            endpoint.decay_rates(time.monotonic())
+            if code is None:
+                if endpoint.latency_ms is None:
+                    endpoint.latency_ms, endpoint.deviation_ms = elapsed_ms, elapsed_ms / 2.0
+                else:
+                    # A tail sample moves the mean by at most 4 deviations, so
+                    # rare slow calls (which hedging covers) do not push an
+                    # endpoint out of the ranking; the deviation takes the raw
+                    # sample, so a lasting slowdown still shows within a few calls
+                    sample = min(elapsed_ms, endpoint.latency_ms + 4.0 * endpoint.deviation_ms)
+                    endpoint.deviation_ms += alpha * (abs(elapsed_ms - endpoint.latency_ms) - endpoint.deviation_ms)
+                    endpoint.latency_ms += alpha * (sample - endpoint.latency_ms)
+                endpoint.error_rate *= 1.0 - alpha
+                endpoint.throttle_rate *= 1.0 - alpha
+                endpoint.consecutive_failures = 0
+                endpoint.ejected_until = 0.0
+            elif code not in REQUEST_ERROR_CODES:
+                throttled = code in THROTTLE_CODES
+                endpoint.error_rate += alpha * (1.0 - endpoint.error_rate)
+                endpoint.throttle_rate += alpha * ((1.0 if throttled else 0.0) - endpoint.throttle_rate)
+                endpoint.errors += 1
+                endpoint.throttles += throttled
+                endpoint.consecutive_failures += 1
+                if throttled or endpoint.consecutive_failures >= EJECT_AFTER_FAILURES:
+                    backoff = EJECT_SECONDS * 2 ** max(0, endpoint.consecutive_failures - EJECT_AFTER_FAILURES)
+                    endpoint.ejected_until = time.monotonic() + min(EJECT_MAX_SECONDS, backoff)
+
+    def _call(self, endpoint: Endpoint, kwargs: Dict) -> Dict:
+        with self._lock:
+            endpoint.in_flight += 1
+            endpoint.requests += 1
+        started = time.perf_counter()
+        try:
+            response = endpoint.client.invoke_model(**kwargs)
+            body = response['body'].read()
+        except Exception as e:
+            self._record(endpoint, None, error_code(e))
+            raise
+        finally:
+            with self._lock:
+                endpoint.in_flight -= 1
+        self._record(endpoint, (time.perf_counter() - started) * 1000.0, None)
+        return dict(response, body=io.BytesIO(body))
+
+    def invoke_model(self, **kwargs) -> Dict:
+        ranking = iter(self._ranking())
+        attempts: Dict = {}
+        with self._lock:
+            self.calls += 1
+            self._hedge_tokens = min(10.0, self._hedge_tokens + self.hedge_budget)
+
+        def launch() -> bool:
+            endpoint = next(ranking, None)
+            if endpoint is None:
+                return False
+            attempts[self._pool.submit(self._call, endpoint, kwargs)] = endpoint
+            return True
+
+        launch()
+        primary = next(iter(attempts.values()))
+        hedge_after = None
+        if self.hedge and len(self.endpoints) > 1:
+            # A cold endpoint is hedged on the estimate of the others
+            hedge_after = primary.hedge_after_ms() or min(
+                filter(None, (endpoint.hedge_after_ms() for endpoint in self.endpoints)), default=None
+            )
+        hedged, last_error = False, None
+        while attempts:
+            done, _ = wait(attempts, timeout=hedge_after / 1000.0 if hedge_after else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # The endpoint is slower than usual: the first answer of the two wins
+                hedge_after = None
+                if self._take_hedge_token(kwargs):
+                    hedged = launch()
+                continue
+            for future in done:
+                endpoint = attempts.pop(future)
+                try:
+                    response = future.result()
+                except Exception as e:
+                    if error_code(e) in REQUEST_ERROR_CODES:
+                        raise
+                    print(f"Embedding endpoint {endpoint.name} failed: {str(e)}")
+                    last_error = e
+                    continue
+                if hedged and endpoint is not primary:
+                    with self._lock:
+                        self.hedge_wins += 1
+                return response
+            if not attempts:
+                # Fail over to the next endpoint in the ranking
+                hedge_after = None
+                if not launch():
+                    break
+                with self._lock:
+                    self.failovers += 1
+        raise last_error
+
+    def stats(self) -> Dict:
+        now = time.monotonic()
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'hedged': self.hedged,
+                'hedges_denied': self.hedges_denied,
+                'hedge_wins': self.hedge_wins,
+                'failovers': self.failovers,
+                'endpoints': [{
+                    'name': endpoint.name,
+                    'latency_ms': round(endpoint.latency_ms, 1) if endpoint.latency_ms is not None else None,
+                    'deviation_ms': round(endpoint.deviation_ms, 1),
+                    'error_rate': round(endpoint.error_rate, 3),
+                    'throttle_rate': round(endpoint.throttle_rate, 3),
+                    'in_flight': endpoint.in_flight,
+                    'requests': endpoint.requests,
+                    'errors': endpoint.errors,
+                    'throttles': endpoint.throttles,
+                    'ejected': endpoint.ejected_until > now
+                } for endpoint in self.endpoints]
+            }
+
+
+def parse_endpoints(spec: str) -> List[Tuple[str, Optional[str]]]:
+    """
+    'us-east-1,us-west-2=https://vpce-....bedrock-runtime.us-west-2.vpce.amazonaws.com'
+    -> [(region, endpoint_url or None), ...]
+    """
+
+    endpoints = []
+    for item in spec.split(','):
+        region, _, url = item.strip().partition('=')
+        if region:
+            endpoints.append((region, url or None))
+    return endpoints
+
+
+def create_embedding_client(spec: Optional[str] = None, hedge_admission: Optional[Callable[[Dict], bool]] = None):
+    """
+    The bedrock-runtime client for embeddings configured by
+    EMBEDDING_ENDPOINTS: a plain client for one endpoint, an
+    EmbeddingRouter (with hedge_admission) for several
+    """
+
+    import boto3
+    from botocore.config import Config
+
+    endpoints = parse_endpoints(spec or EMBEDDING_ENDPOINTS)
+    if len(endpoints) == 1:
+        region, url = endpoints[0]
+        return boto3.client('bedrock-runtime', region_name=region, endpoint_url=url)
+
+    # No SDK retries: a throttled call fails over to another endpoint instead
+    config = Config(retries={'total_max_attempts': 1, 'mode': 'standard'}, connect_timeout=2, read_timeout=30)
+    return EmbeddingRouter([
+        Endpoint(region, boto3.client('bedrock-runtime', region_name=region, endpoint_url=url, config=config))
+        for region, url in endpoints
+    ], hedge_admission=hedge_admission)
@@ -1,12 +1,25 @@
 import json
 import boto3
-import fitz  # PyMuPDF
 import os
-from typing import List, Dict
+import time
+from typing import Iterable, List, Dict, Optional
 from datetime import datetime, timezone
 
+from profiling import profiled_handler
+from pipeline_status import publish
+from artifacts import put_artifact
+from parsed_pages import open_parsed_pages
+
 s3_client = boto3.client('s3')
 
+# Chunking runs on parsed pages (parsed_pages.py), which are cached by PDF
+# content hash, so changing these only costs string processing; stored
+# documents are re-chunked with rechunk_documents.py
+CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', '1000'))
+CHUNK_OVERLAP = int(os.environ.get('CHUNK_OVERLAP', '100'))
+CHUNKING_STRATEGY = 'sentence-window/1'
+
+@profiled_handler('extract_text')
 def lambda_handler(event, context):
     """
     Lambda 1: Extract text from PDF using PyMuPDF
@@ -14,6 +27,8 @@ def lambda_handler(event, context):
     
     print(f"Extract Text Lambda - Received event: {json.dumps(event)}")
     
+    started = time.perf_counter()
+    key = None
     try:
         # Parse input from Step Function or S3 event
         if 'Records' in event and event['Records']:
@@ -30,35 +45,32 @@ def lambda_handler(event, context):
             raise ValueError('Missing bucket or key in event')
         
         print(f"Extracting text from: s3://{bucket}/{key}")
+        publish(key, 'extract', 'running')
         
         # Download PDF from S3
         response = s3_client.get_object(Bucket=bucket, Key=key)
         pdf_content = response['Body'].read()
         
-        # Extract text using PyMuPDF
-        extracted_data = extract_text_from_pdf(pdf_content, key)
+        # Extract text using PyMuPDF (or the parsed pages cache)
+        extracted_data = extract_text_from_pdf(pdf_content, key, bucket)
+        if not extracted_data['chunks']:
+            # The pre-scan only samples pages; this is the check over all of them
+            raise ValueError('No text in any page (image-only or blank PDF, no OCR in the pipeline)')
+        print(f"Parsed pages {'cache hit' if extracted_data['parsed_cached'] else 'parsed'}: "
+              f"{extracted_data['content_hash']} ({extracted_data['parser_version']})")
         
-        # Save extracted text to S3 as JSON
+        # Save extracted text to S3, one line per chunk
         extracted_file_key = f"extracted/{extracted_data['document_id']}.json"
-        extracted_json = {
-            'document_id': extracted_data['document_id'],
-            'source_bucket': bucket,
-            'source_key': key,
-            'total_pages': extracted_data['total_pages'],
-            'chunks': extracted_data['chunks'],
-            'metadata': extracted_data['metadata'],
-            'extraction_timestamp': datetime.now(timezone.utc).isoformat(),
-            'pipeline_stage': 'text_extraction'
-        }
+        extracted_json = build_extracted_json(extracted_data, bucket, key)
         
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=extracted_file_key,
-            Body=json.dumps(extracted_json, indent=2),
-            ContentType='application/json'
-        )
+        put_artifact(s3_client, bucket, extracted_file_key, extracted_json, records_field='chunks')
         
         print(f"Successfully extracted {len(extracted_data['chunks'])} text chunks")
+        publish(
+            key, 'extract', 'completed',
+            counts={'pages': extracted_data['total_pages'], 'chunks': len(extracted_data['chunks'])},
+            timings={'ms': (time.perf_counter() - started) * 1000.0}
+        )
         print(f"Saved extracted data to: s3://{bucket}/{extracted_file_key}")
         
         return {
@@ -67,7 +79,7 @@ def lambda_handler(event, context):
             'key': key,
             'document_id': extracted_data['document_id'],
             'total_pages': extracted_data['total_pages'],
-            'chunks': extracted_data['chunks'],
+            'chunks_count': len(extracted_data['chunks']),
             'metadata': extracted_data['metadata'],
             'extracted_file_key': extracted_file_key,
             'processing_timestamp': datetime.now(timezone.utc).isoformat()
@@ -75,55 +87,98 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"Error extracting text from PDF: {str(e)}")
+        if key:
+            publish(key, 'extract', 'failed', error=str(e)[:500])
         raise Exception(f'Text extraction failed: {str(e)}')
 
-def extract_text_from_pdf(pdf_content: bytes, document_id: str) -> Dict:
+def build_extracted_json(extracted_data: Dict, bucket: str, key: str) -> Dict:
     """
-    Extract text from PDF using PyMuPDF with chunking for better retrieval
+    The extracted/{document_id}.json artifact
     """
     
-    # Open PDF from memory
-    pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+    return {
+        'document_id': extracted_data['document_id'],
+        'source_bucket': bucket,
+        'source_key': key,
+        'total_pages': extracted_data['total_pages'],
+        'chunks': extracted_data['chunks'],
+        'metadata': extracted_data['metadata'],
+        'content_hash': extracted_data.get('content_hash'),
+        'parser_version': extracted_data.get('parser_version'),
+        'chunking': extracted_data.get('chunking'),
+        'extraction_timestamp': datetime.now(timezone.utc).isoformat(),
+        'pipeline_stage': 'text_extraction'
+    }
+
+def extract_text_from_pdf(pdf_content: bytes, document_id: str, bucket: Optional[str] = None) -> Dict:
+    """
+    Extract text from PDF using PyMuPDF with chunking for better retrieval;
+    with a bucket, parsed pages are read from / written to its cache
+    """
     
-    document_data = {
-        'document_id': document_id,
-        'total_pages': len(pdf_document),
-        'chunks': [],
-        'metadata': {}
+    header, pages = open_parsed_pages(pdf_content, s3_client, bucket)
+    return chunk_document(header, pages, document_id)
+
+def chunking_config(chunk_size: Optional[int] = None, overlap: Optional[int] = None) -> Dict:
+    config = {
+        'strategy': CHUNKING_STRATEGY,
+        'chunk_size': CHUNK_SIZE if chunk_size is None else chunk_size,
+        'overlap': CHUNK_OVERLAP if overlap is None else overlap
     }
+    # chunk_text may end a chunk at half its size; a larger overlap would
+    # never advance
+    if config['chunk_size'] <= 0 or not 0 <= config['overlap'] < config['chunk_size'] // 2:
+        raise ValueError(f"Invalid chunking: size {config['chunk_size']}, overlap {config['overlap']}")
+    return config
+
+def chunk_document(
+    header: Dict,
+    pages: Iterable[Dict],
+    document_id: str,
+    chunk_size: Optional[int] = None,
+    overlap: Optional[int] = None
+) -> Dict:
+    """
+    Chunk a parsed document (header and pages from parsed_pages)
+    """
     
-    # Extract text page by page
-    for page_num in range(len(pdf_document)):
-        page = pdf_document[page_num]
-        text = page.get_text()
-        
-        if text.strip():  # Only process pages with text
-            # Split into smaller chunks for better retrieval
-            chunks = chunk_text(text, chunk_size=1000, overlap=100)
-            
-            for i, chunk in enumerate(chunks):
-                document_data['chunks'].append({
-                    'page': page_num + 1,
-                    'chunk_id': f"page_{page_num + 1}_chunk_{i + 1}",
-                    'text': chunk.strip(),
-                    'char_count': len(chunk)
-                })
+    config = chunking_config(chunk_size, overlap)
+    chunks = []
+    for page in pages:
+        chunks.extend(chunk_page(page, config['chunk_size'], config['overlap']))
     
-    # Extract metadata
-    metadata = pdf_document.metadata
-    document_data['metadata'] = {
-        'title': metadata.get('title', ''),
-        'author': metadata.get('author', ''),
-        'subject': metadata.get('subject', ''),
-        'creator': metadata.get('creator', ''),
-        'producer': metadata.get('producer', ''),
-        'creation_date': metadata.get('creationDate', ''),
-        'modification_date': metadata.get('modDate', '')
+    return {
+        'document_id': document_id,
+        'total_pages': header['total_pages'],
+        'chunks': chunks,
+        'metadata': header['metadata'],
+        'content_hash': header['content_hash'],
+        'parser_version': header['parser_version'],
+        'parsed_cached': header.get('cached', False),
+        'chunking': config
     }
+
+def chunk_page(page: Dict, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[Dict]:
+    """
+    Text chunks of one parsed page
+    """
+    
+    text = page['text']
+    if not text.strip():  # Only process pages with text
+        return []
     
-    pdf_document.close()
+    # Split into smaller chunks for better retrieval
+    chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
     
-    return document_data
+    return [
+        {
+            'page': page['page'],
+            'chunk_id': f"page_{page['page']}_chunk_{i + 1}",
+            'text': chunk.strip(),
+            'char_count': len(chunk)
+        }
+        for i, chunk in enumerate(chunks)
+    ]
 
 def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 100) -> List[str]:
     """
@@ -1,11 +1,52 @@
 import json
+import os
+import time
 import boto3
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime, timezone
 
-bedrock_runtime = boto3.client('bedrock-runtime', region_name='us-east-1')
+from dedup import ChunkDeduplicator, S3CorpusIndex
+from checkpoint import EmbeddingCheckpoint
+from rate_limiter import create_rate_limiter, estimate_tokens
+from profiling import profiled_handler
+from pipeline_status import publish
+from artifacts import put_artifact, read_artifact
+from embedding_router import create_embedding_client
+
 s3_client = boto3.client('s3', region_name='sa-east-1')
 
+# Near-duplicate suppression: 'document' compares chunks within one PDF,
+# 'corpus' also compares against canonical chunks of previously embedded PDFs
+# and reuses their vectors (index objects under DEDUP_CORPUS_PREFIX)
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', 'true').lower() == 'true'
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.9'))
+DEDUP_SCOPE = os.environ.get('DEDUP_SCOPE', 'document')
+DEDUP_CORPUS_PREFIX = 'dedup/corpus/'
+
+# Progress is checkpointed every CHECKPOINT_EVERY chunks; when less than
+# CHECKPOINT_MARGIN_MS of Lambda time is left the run stops cleanly and
+# hands off to the next invocation through the state machine
+CHECKPOINT_EVERY = int(os.environ.get('CHECKPOINT_EVERY', '50'))
+CHECKPOINT_MARGIN_MS = int(os.environ.get('CHECKPOINT_MARGIN_MS', '30000'))
+MAX_CHUNK_ATTEMPTS = int(os.environ.get('MAX_CHUNK_ATTEMPTS', '3'))
+
+# Shared Bedrock budget across all concurrent executions (RATE_LIMIT_BACKEND)
+rate_limiter = create_rate_limiter()
+
+def admit_hedge(request: Dict) -> bool:
+    """
+    Take the shared budget of a hedged duplicate request, if it is there now
+    """
+    
+    if rate_limiter is None:
+        return True
+    return rate_limiter.try_acquire_global(estimate_tokens(json.loads(request['body']).get('inputText', '')))
+
+# One client, or a router over several regions (EMBEDDING_ENDPOINTS) whose
+# hedges also spend the shared budget
+bedrock_runtime = create_embedding_client(hedge_admission=admit_hedge)
+
+@profiled_handler('generate_embeddings')
 def lambda_handler(event, context):
     """
     Lambda 2: Generate embeddings using Amazon Bedrock
@@ -13,6 +54,7 @@ def lambda_handler(event, context):
     
     print(f"Generate Embeddings Lambda - Processing document: {event.get('document_id')}")
     
+    started = time.perf_counter()
     try:
         # Get data from previous step
         document_id = event.get('document_id')
@@ -22,11 +64,10 @@ def lambda_handler(event, context):
         if not document_id:
             raise ValueError('Missing document_id')
         
-        # Read extracted text from S3 JSON file
+        # Read extracted text from S3
         if extracted_file_key:
             print(f"Reading extracted data from: s3://{bucket}/{extracted_file_key}")
-            response = s3_client.get_object(Bucket=bucket, Key=extracted_file_key)
-            extracted_data = json.loads(response['Body'].read().decode('utf-8'))
+            extracted_data = read_artifact(s3_client, bucket, extracted_file_key, records_field='chunks')
             chunks = extracted_data['chunks']
         else:
             # Fallback to chunks passed directly (for backward compatibility)
@@ -37,35 +78,77 @@ def lambda_handler(event, context):
         
         print(f"Processing {len(chunks)} chunks for embeddings")
         
-        # Generate embeddings for all chunks
-        embeddings_data = generate_embeddings_bedrock(chunks)
+        # Collapse repeated headers, footers and boilerplate before calling Bedrock
+        chunks, duplicate_chunks, dedup_stats, corpus_index = suppress_duplicates(chunks, document_id, bucket)
         
-        # Save embeddings to S3 as JSON
-        embeddings_file_key = f"embeddings/{document_id}.json"
-        embeddings_json = {
-            'document_id': document_id,
-            'source_bucket': bucket,
-            'source_key': event.get('key'),
-            'extracted_file_key': extracted_file_key,
-            'embeddings_data': embeddings_data,
-            'embeddings_count': len(embeddings_data),
-            'embedding_model': 'amazon.titan-embed-text-v1',
-            'embeddings_timestamp': datetime.now(timezone.utc).isoformat(),
-            'pipeline_stage': 'embeddings_generation'
-        }
+        # Resume from the last checkpoint left by a timeout, hand-off or retry
+        checkpoint = EmbeddingCheckpoint(
+            s3_client, bucket, document_id, [chunk['chunk_id'] for chunk in chunks]
+        )
+        if checkpoint.load():
+            print(f"Resuming from checkpoint: {checkpoint.completed_count()}/{len(chunks)} chunks done, "
+                  f"{len(checkpoint.failed)} failed")
+        checkpoint.invocations += 1
+        publish(
+            document_id, 'embed', 'running',
+            counts={'done': checkpoint.completed_count(), 'total': len(chunks)}
+        )
+        
+        progress = generate_embeddings_bedrock(chunks, checkpoint, context)
+        
+        if progress['stopped_early']:
+            print(f"Stopping before timeout with {checkpoint.completed_count()}/{len(chunks)} chunks done")
+            return {
+                'statusCode': 202,
+                'embeddings_status': 'IN_PROGRESS',
+                'bucket': bucket,
+                'key': event.get('key'),
+                'document_id': document_id,
+                'total_pages': event.get('total_pages'),
+                'metadata': event.get('metadata'),
+                'extracted_file_key': extracted_file_key,
+                'chunks_completed': checkpoint.completed_count(),
+                'chunks_total': len(chunks),
+                # Counted in the state input; the state machine gives up past its limit
+                'embeddings_handoffs': int(event.get('embeddings_handoffs') or 0) + 1,
+                'processing_timestamp': datetime.now(timezone.utc).isoformat()
+            }
+        
+        if checkpoint.failed:
+            # Failed chunks stay in the checkpoint; the state machine Retry
+            # re-invokes this stage and only those chunks are embedded again
+            raise RuntimeError(
+                f"{len(checkpoint.failed)} chunks failed after {MAX_CHUNK_ATTEMPTS} attempts: "
+                f"{json.dumps(checkpoint.failed)[:1000]}"
+            )
         
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=embeddings_file_key,
-            Body=json.dumps(embeddings_json, indent=2),
-            ContentType='application/json'
+        embeddings_data = checkpoint.load_embeddings()
+        
+        finish_dedup(bucket, embeddings_data, dedup_stats, corpus_index)
+        
+        # Save embeddings to S3, one line per embedded chunk
+        embeddings_file_key = f"embeddings/{document_id}.json"
+        embeddings_json = build_embeddings_json(
+            document_id, bucket, event.get('key'), extracted_file_key, event.get('total_pages'),
+            event.get('metadata'), embeddings_data, duplicate_chunks, dedup_stats
         )
         
+        put_artifact(s3_client, bucket, embeddings_file_key, embeddings_json, records_field='embeddings_data')
+        
+        checkpoint.clear()
+        
         print(f"Successfully generated embeddings for {len(embeddings_data)} chunks")
+        publish(
+            document_id, 'embed', 'completed',
+            counts={'embeddings': len(embeddings_data), 'duplicates': len(duplicate_chunks),
+                    'invocations': checkpoint.invocations},
+            timings={'ms': (time.perf_counter() - started) * 1000.0}
+        )
         print(f"Saved embeddings data to: s3://{bucket}/{embeddings_file_key}")
         
         return {
             'statusCode': 200,
+            'embeddings_status': 'COMPLETE',
             'bucket': bucket,
             'key': event.get('key'),
             'document_id': document_id,
@@ -73,54 +156,247 @@ def lambda_handler(event, context):
             'metadata': event.get('metadata'),
             'extracted_file_key': extracted_file_key,
             'embeddings_file_key': embeddings_file_key,
-            'embeddings_data': embeddings_data,
             'embeddings_count': len(embeddings_data),
+            'dedup_stats': dedup_stats,
             'processing_timestamp': datetime.now(timezone.utc).isoformat()
         }
         
     except Exception as e:
         print(f"Error generating embeddings: {str(e)}")
+        if event.get('document_id'):
+            publish(event['document_id'], 'embed', 'failed', error=str(e)[:500])
         raise Exception(f'Embeddings generation failed: {str(e)}')
 
-def generate_embeddings_bedrock(chunks: List[Dict]) -> List[Dict]:
+def embed_text(text: str) -> List[float]:
     """
-    Generate embeddings using Amazon Bedrock Titan Embeddings
+    Embed one text with Amazon Bedrock Titan Embeddings
     """
     
-    embeddings_data = []
+    response = bedrock_runtime.invoke_model(
+        body=json.dumps({"inputText": text}),
+        modelId="amazon.titan-embed-text-v1",
+        accept="application/json",
+        contentType="application/json"
+    )
     
-    for chunk in chunks:
+    response_body = json.loads(response.get('body').read())
+    return response_body.get('embedding')
+
+def remaining_time_ms(context) -> float:
+    if context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        return context.get_remaining_time_in_millis()
+    return float('inf')
+
+def acquire_bedrock_budget(document_id: str, text: str, context=None) -> bool:
+    """
+    Wait for the shared rate limiter before a Bedrock request. Returns False
+    when the wait would run into the checkpoint margin.
+    """
+    
+    if rate_limiter is None:
+        return True
+    
+    budget_ms = remaining_time_ms(context) - CHECKPOINT_MARGIN_MS
+    timeout = None if budget_ms == float('inf') else max(0.0, budget_ms / 1000.0)
+    return rate_limiter.acquire(document_id, estimate_tokens(text), timeout=timeout)
+
+def embedding_entry(chunk: Dict, embedding: List[float]) -> Dict:
+    """
+    One record of the embeddings/ artifact
+    """
+    
+    return {
+        'chunk_id': chunk['chunk_id'],
+        'text': chunk['text'],
+        'page': chunk['page'],
+        'embedding': embedding,
+        'char_count': chunk['char_count'],
+        'duplicates': chunk.get('duplicates', []),
+        **({'reused_from': chunk['reused_from']} if 'reused_from' in chunk else {})
+    }
+
+def embed_chunk(chunk: Dict, document_id: str, context=None) -> Dict:
+    """
+    Embed one chunk with up to MAX_CHUNK_ATTEMPTS attempts. Returns the
+    embedding entry, or the last error; stopped_early is set when the rate
+    limiter wait or a backoff would run into the checkpoint margin.
+    """
+    
+    if 'reuse_embedding' in chunk:
+        # Near-duplicate of another document's chunk: its vector, no Bedrock call
+        return {
+            'entry': embedding_entry(chunk, chunk['reuse_embedding']),
+            'error': None,
+            'stopped_early': False
+        }
+    
+    error = None
+    for attempt in range(1, MAX_CHUNK_ATTEMPTS + 1):
         try:
-            # Prepare request for Bedrock Titan Embeddings
-            body = json.dumps({
-                "inputText": chunk['text']
-            })
+            # Limiter errors (e.g. a DynamoDB throttle) cost an attempt like Bedrock ones
+            if not acquire_bedrock_budget(document_id, chunk['text'], context):
+                return {'entry': None, 'error': error, 'stopped_early': True}
             
-            # Call Bedrock
-            response = bedrock_runtime.invoke_model(
-                body=body,
-                modelId="amazon.titan-embed-text-v1",
-                accept="application/json",
-                contentType="application/json"
-            )
+            embedding = embed_text(chunk['text'])
+            if not embedding:
+                raise ValueError('Empty embedding in Bedrock response')
+            
+            print(f"Generated embedding for chunk: {chunk['chunk_id']}")
+            return {
+                'entry': embedding_entry(chunk, embedding),
+                'error': None,
+                'stopped_early': False
+            }
+            
+        except Exception as e:
+            print(f"Error generating embedding for chunk {chunk['chunk_id']} "
+                  f"(attempt {attempt}/{MAX_CHUNK_ATTEMPTS}): {str(e)}")
+            error = str(e)
+            backoff = 0.5 * (2 ** (attempt - 1))
+            if attempt == MAX_CHUNK_ATTEMPTS or remaining_time_ms(context) < CHECKPOINT_MARGIN_MS + backoff * 1000:
+                break
+            time.sleep(backoff)
+    
+    return {'entry': None, 'error': error, 'stopped_early': False}
+
+def generate_embeddings_bedrock(chunks: List[Dict], checkpoint: EmbeddingCheckpoint, context=None) -> Dict:
+    """
+    Generate embeddings using Amazon Bedrock Titan Embeddings for every
+    chunk the checkpoint still lists as pending, flushing finished vectors
+    to checkpoint shards as it goes. Chunks that keep failing are recorded
+    in the checkpoint instead of being dropped.
+    """
+    
+    buffer = []
+    failures = {}
+    stopped_early = False
+    
+    try:
+        for index in checkpoint.pending_indices():
+            if remaining_time_ms(context) < CHECKPOINT_MARGIN_MS:
+                stopped_early = True
+                break
             
-            # Parse response
-            response_body = json.loads(response.get('body').read())
-            embedding = response_body.get('embedding')
+            chunk = chunks[index]
+            result = embed_chunk(chunk, checkpoint.document_id, context)
             
-            embeddings_data.append({
-                'chunk_id': chunk['chunk_id'],
-                'text': chunk['text'],
-                'page': chunk['page'],
-                'embedding': embedding,
-                'char_count': chunk['char_count']
-            })
+            if result['stopped_early']:
+                stopped_early = True
+                break
             
-            print(f"Generated embedding for chunk: {chunk['chunk_id']}")
+            if result['entry'] is not None:
+                buffer.append((index, result['entry']))
+                failures.pop(chunk['chunk_id'], None)
+            else:
+                failures[chunk['chunk_id']] = result['error']
             
+            if len(buffer) >= CHECKPOINT_EVERY:
+                checkpoint.save_shard(buffer)
+                buffer = []
+                publish(
+                    checkpoint.document_id, 'embed', 'running',
+                    counts={'done': checkpoint.completed_count(), 'total': len(chunks)}
+                )
+    except Exception:
+        # Keep the vectors already paid for; the retry resumes after them
+        checkpoint.save_shard(buffer)
+        raise
+    
+    checkpoint.save_shard(buffer)
+    if failures:
+        checkpoint.record_failures(failures)
+    else:
+        checkpoint.save_manifest()
+    
+    return {
+        'stopped_early': stopped_early,
+        'failed_chunks': failures
+    }
+
+def create_deduplicator(document_id: str, bucket: str):
+    """
+    Incremental deduplicator configured by DEDUP_*, and the corpus index it
+    adds to (None unless DEDUP_SCOPE is 'corpus'). Returns (None, None) when
+    dedup is disabled.
+    """
+    
+    if not DEDUP_ENABLED:
+        return None, None
+    
+    corpus_index = S3CorpusIndex(s3_client, bucket, DEDUP_CORPUS_PREFIX) if DEDUP_SCOPE == 'corpus' else None
+    return ChunkDeduplicator(document_id, threshold=DEDUP_THRESHOLD, corpus_index=corpus_index), corpus_index
+
+def suppress_duplicates(chunks: List[Dict], document_id: str, bucket: str):
+    """
+    Near-duplicate suppression configured by DEDUP_*. Returns the canonical
+    chunks, the suppressed duplicates, the stats and the corpus index (None
+    unless DEDUP_SCOPE is 'corpus').
+    """
+    
+    deduplicator, corpus_index = create_deduplicator(document_id, bucket)
+    if deduplicator is None:
+        return chunks, [], None, None
+    
+    for chunk in chunks:
+        deduplicator.add(chunk)
+    stats = deduplicator.stats()
+    print(f"Near-duplicate suppression: {json.dumps(stats)}")
+    return deduplicator.canonical_chunks, deduplicator.duplicate_chunks, stats, corpus_index
+
+def finish_dedup(bucket: str, embeddings_data: List[Dict], dedup_stats: Optional[Dict], corpus_index: Optional[S3CorpusIndex]):
+    """
+    Add the index size estimate to the stats and publish this document's
+    new canonical chunks, with their vectors, to the corpus index, recording
+    in the stats whether that publish succeeded
+    """
+    
+    if dedup_stats is None:
+        return
+    
+    dimensions = len(embeddings_data[0]['embedding']) if embeddings_data else 0
+    # Each suppressed chunk saves a float32 vector plus its text in the index
+    dedup_stats['estimated_index_bytes_saved'] = (
+        dedup_stats['index_documents_saved'] * dimensions * 4
+        + dedup_stats['bedrock_input_chars_saved']
+    )
+    if DEDUP_SCOPE == 'corpus' and corpus_index is not None:
+        try:
+            corpus_index.flush({entry['chunk_id']: entry['embedding'] for entry in embeddings_data})
+            dedup_stats['corpus_index_published'] = True
         except Exception as e:
-            print(f"Error generating embedding for chunk {chunk['chunk_id']}: {str(e)}")
-            # Continue with other chunks instead of failing completely
-            continue
+            # Corpus-wide suppression is an optimization: only later matches are
+            # missed, but the summary must show that this document was not indexed
+            print(f"Could not update corpus LSH index: {str(e)}")
+            dedup_stats['corpus_index_published'] = False
+            dedup_stats['corpus_index_error'] = str(e)
+
+def build_embeddings_json(
+    document_id: str,
+    bucket: str,
+    key: str,
+    extracted_file_key: Optional[str],
+    total_pages: int,
+    metadata: Dict,
+    embeddings_data: List[Dict],
+    duplicate_chunks: List[Dict],
+    dedup_stats: Optional[Dict]
+) -> Dict:
+    """
+    The embeddings/{document_id}.json artifact
+    """
     
-    return embeddings_data
\ No newline at end of file
+    return {
+        'document_id': document_id,
+        'source_bucket': bucket,
+        'source_key': key,
+        'extracted_file_key': extracted_file_key,
+        'total_pages': total_pages,
+        'metadata': metadata,
+        'embeddings_data': embeddings_data,
+        'embeddings_count': len(embeddings_data),
+        'duplicate_chunks': duplicate_chunks,
+        'dedup_stats': dedup_stats,
+        'embedding_model': 'amazon.titan-embed-text-v1',
+        'embeddings_timestamp': datetime.now(timezone.utc).isoformat(),
+        'pipeline_stage': 'embeddings_generation'
+    }
@@ -1,13 +1,20 @@
 import json
+import time
 import boto3
-from typing import List, Dict
+from typing import List, Dict, Optional
 from datetime import datetime, timezone
 
+from profiling import profiled_handler
+from pipeline_status import publish
+from artifacts import put_artifact, read_artifact
+from chunk_text import put_chunk_texts
+
 # For now, we'll prepare for OpenSearch but not implement actual indexing
 # until the OpenSearch cluster is created
 opensearch_client = boto3.client('opensearchserverless', region_name='sa-east-1')
 s3_client = boto3.client('s3', region_name='sa-east-1')
 
+@profiled_handler('index_opensearch')
 def lambda_handler(event, context):
     """
     Lambda 3: Index documents with embeddings to OpenSearch
@@ -15,6 +22,7 @@ def lambda_handler(event, context):
     
     print(f"Index OpenSearch Lambda - Processing document: {event.get('document_id')}")
     
+    started = time.perf_counter()
     try:
         # Get data from previous step
         document_id = event.get('document_id')
@@ -24,16 +32,18 @@ def lambda_handler(event, context):
         if not document_id:
             raise ValueError('Missing document_id')
         
-        # Read embeddings data from S3 JSON file
+        # Read embeddings data from S3
         if embeddings_file_key:
             print(f"Reading embeddings data from: s3://{bucket}/{embeddings_file_key}")
-            response = s3_client.get_object(Bucket=bucket, Key=embeddings_file_key)
-            embeddings_json = json.loads(response['Body'].read().decode('utf-8'))
+            embeddings_json = read_artifact(s3_client, bucket, embeddings_file_key, records_field='embeddings_data')
             embeddings_data = embeddings_json['embeddings_data']
+            dedup_stats = embeddings_json.get('dedup_stats')
         else:
             # Fallback to embeddings passed directly (for backward compatibility)
             embeddings_data = event.get('embeddings_data', [])
+            dedup_stats = event.get('dedup_stats')
         
+        # Corpus-wide duplicates carry a reused vector, so every document has entries
         if not embeddings_data:
             raise ValueError('No embeddings data to index')
         
@@ -44,28 +54,24 @@ def lambda_handler(event, context):
             document_id, embeddings_data, event.get('metadata', {}), event.get('total_pages', 0)
         )
         
-        # Save indexing results to S3 as JSON
-        indexed_file_key = f"indexed/{document_id}.json"
-        indexed_json = {
-            'document_id': document_id,
-            'source_bucket': bucket,
-            'source_key': event.get('key'),
-            'embeddings_file_key': embeddings_file_key,
-            'indexed_documents': indexing_result['indexed_documents'],
-            'opensearch_index': indexing_result.get('index_name', 'documents'),
-            'indexing_success': indexing_result['success'],
-            'indexing_timestamp': datetime.now(timezone.utc).isoformat(),
-            'pipeline_stage': 'opensearch_indexing'
-        }
+        # Chunk texts for random access by the app, before indexed/ announces the document
+        chunk_text_key = put_chunk_texts(s3_client, bucket, document_id, embeddings_data)
         
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=indexed_file_key,
-            Body=json.dumps(indexed_json, indent=2),
-            ContentType='application/json'
+        # Save indexing results to S3
+        indexed_file_key = f"indexed/{document_id}.json"
+        indexed_json = build_indexed_json(
+            document_id, bucket, event.get('key'), embeddings_file_key, indexing_result, dedup_stats,
+            chunk_text_key
         )
         
+        put_artifact(s3_client, bucket, indexed_file_key, indexed_json)
+        
         print(f"Successfully indexed {indexing_result['indexed_documents']} documents")
+        publish(
+            document_id, 'index', 'completed',
+            counts={'indexed': indexing_result['indexed_documents']},
+            timings={'ms': (time.perf_counter() - started) * 1000.0}
+        )
         print(f"Saved indexing results to: s3://{bucket}/{indexed_file_key}")
         
         return {
@@ -76,14 +82,44 @@ def lambda_handler(event, context):
             'indexed_documents': indexing_result['indexed_documents'],
             'opensearch_index': indexing_result.get('index_name', 'documents'),
             'indexed_file_key': indexed_file_key,
+            'dedup_stats': dedup_stats,
             'processing_timestamp': datetime.now(timezone.utc).isoformat(),
             'success': indexing_result['success']
         }
         
     except Exception as e:
         print(f"Error indexing to OpenSearch: {str(e)}")
+        if event.get('document_id'):
+            publish(event['document_id'], 'index', 'failed', error=str(e)[:500])
         raise Exception(f'OpenSearch indexing failed: {str(e)}')
 
+def build_indexed_json(
+    document_id: str,
+    bucket: str,
+    key: str,
+    embeddings_file_key: str,
+    indexing_result: Dict,
+    dedup_stats: Optional[Dict],
+    chunk_text_key: Optional[str] = None
+) -> Dict:
+    """
+    The indexed/{document_id}.json artifact
+    """
+    
+    return {
+        'document_id': document_id,
+        'source_bucket': bucket,
+        'source_key': key,
+        'embeddings_file_key': embeddings_file_key,
+        'chunk_text_key': chunk_text_key,
+        'indexed_documents': indexing_result['indexed_documents'],
+        'opensearch_index': indexing_result.get('index_name', 'documents'),
+        'indexing_success': indexing_result['success'],
+        'dedup_stats': dedup_stats,
+        'indexing_timestamp': datetime.now(timezone.utc).isoformat(),
+        'pipeline_stage': 'opensearch_indexing'
+    }
+
 def index_documents_to_opensearch(
     document_id: str, 
     embeddings_data: List[Dict], 
@@ -107,6 +143,8 @@ def index_documents_to_opensearch(
                 'page': embedding_chunk['page'],
                 'char_count': embedding_chunk['char_count'],
                 'embedding_vector': embedding_chunk['embedding'],
+                # Near-duplicate chunks collapsed into this one (back-references)
+                'duplicates': embedding_chunk.get('duplicates', []),
                 'timestamp': datetime.now(timezone.utc).isoformat(),
                 'metadata': {
                     'total_pages': total_pages,
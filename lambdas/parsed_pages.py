@@ -0,0 +1,148 @@
+import os
+import hashlib
+import fitz  # PyMuPDF
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from artifacts import put_artifact, open_artifact
+
+# Parsing a PDF with PyMuPDF is the expensive part of extraction; chunking
+# its text is string processing. Parsed pages (per-page text plus block
+# structure) are cached in S3 under the PDF's content hash and the parser
+# version, so re-chunking, re-uploads and retries skip the parser. Bump
+# PARSE_FORMAT_VERSION whenever parse_page() output changes; a PyMuPDF
+# upgrade changes the version on its own.
+PARSED_PAGES_CACHE = os.environ.get('PARSED_PAGES_CACHE', 'true').lower() == 'true'
+PARSED_PREFIX = 'parsed'
+PARSE_FORMAT_VERSION = 'v1'
+PARSER_VERSION = f"{PARSE_FORMAT_VERSION}-pymupdf-{fitz.VersionBind}"
+
+BLOCK_TYPES = {0: 'text', 1: 'image'}
+
+
+def content_hash(pdf_content: bytes) -> str:
+    return hashlib.sha256(pdf_content).hexdigest()
+
+
+def parsed_key(pdf_hash: str, parser_version: str = PARSER_VERSION) -> str:
+    return f"{PARSED_PREFIX}/{parser_version}/{pdf_hash}.json"
+
+
+def pdf_metadata(pdf_document) -> Dict:
+    metadata = pdf_document.metadata
+    return {
+        'title': metadata.get('title', ''),
+        'author': metadata.get('author', ''),
+        'subject': metadata.get('subject', ''),
+        'creator': metadata.get('creator', ''),
+        'producer': metadata.get('producer', ''),
+        'creation_date': metadata.get('creationDate', ''),
+        'modification_date': metadata.get('modDate', '')
+    }
+
+
+def parse_page(page, page_num: int) -> Dict:
+    """
+    Text of one page (page_num is zero-based) with its blocks in reading
+    order: [start, end, x0, y0, x1, y1, type], where start/end are offsets
+    into text and image blocks are empty ranges at their position
+    """
+
+    textpage = page.get_textpage()
+    text = page.get_text(textpage=textpage)
+    blocks = []
+    cursor = 0
+    for x0, y0, x1, y1, block_text, _, block_type in page.get_text('blocks', textpage=textpage):
+        start = end = cursor
+        if block_type == 0 and block_text:
+            # Page text is the concatenation of its text blocks; search only
+            # if a block does not line up
+            found = cursor if text.startswith(block_text, cursor) else text.find(block_text, cursor)
+            if found >= 0:
+                start, end = found, found + len(block_text)
+                cursor = end
+        blocks.append([
+            start, end, round(x0, 1), round(y0, 1), round(x1, 1), round(y1, 1),
+            BLOCK_TYPES.get(block_type, str(block_type))
+        ])
+    return {'page': page_num + 1, 'text': text, 'blocks': blocks}
+
+
+def _parse_pages(pdf_document, header: Dict, on_complete) -> Iterator[Dict]:
+    pages = []
+    try:
+        for page_num in range(len(pdf_document)):
+            page = parse_page(pdf_document[page_num], page_num)
+            pages.append(page)
+            yield page
+    finally:
+        pdf_document.close()
+    on_complete(dict(header, pages=pages))
+
+
+class ParsedPageCache:
+    """
+    parsed/{parser_version}/{content_hash}.json artifacts, one page per line
+    """
+
+    def __init__(self, s3_client, bucket: str):
+        self.s3_client = s3_client
+        self.bucket = bucket
+
+    def open(self, pdf_hash: str) -> Optional[Tuple[Dict, Iterator[Dict]]]:
+        try:
+            return open_artifact(self.s3_client, self.bucket, parsed_key(pdf_hash), records_field='pages')
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+
+    def put(self, parsed: Dict):
+        try:
+            put_artifact(self.s3_client, self.bucket, parsed_key(parsed['content_hash']), parsed,
+                         records_field='pages')
+        except Exception as e:
+            # The cache only saves work; extraction goes on without it
+            print(f"Could not cache parsed pages {parsed['content_hash']}: {str(e)}")
+
+
+def open_parsed_pages(pdf_content: bytes, s3_client=None, bucket: Optional[str] = None
+                      ) -> Tuple[Dict, Iterator[Dict]]:
+    """
+    Header (content_hash, parser_version, total_pages, metadata, cached)
+    and a page iterator for a PDF. Pages come from the cache when present;
+    otherwise they are parsed one at a time and cached once the iterator is
+    exhausted. Without s3_client/bucket (or with PARSED_PAGES_CACHE=false)
+    the PDF is always parsed.
+    """
+
+    pdf_hash = content_hash(pdf_content)
+    cache = ParsedPageCache(s3_client, bucket) if PARSED_PAGES_CACHE and s3_client and bucket else None
+
+    if cache is not None:
+        try:
+            cached = cache.open(pdf_hash)
+        except Exception as e:
+            print(f"Could not read parsed pages cache for {pdf_hash}: {str(e)}")
+            cached = None
+        if cached is not None:
+            header, pages = cached
+            header['cached'] = True
+            return header, pages
+
+    pdf_document = fitz.open(stream=pdf_content, filetype="pdf")
+    header = {
+        'content_hash': pdf_hash,
+        'parser_version': PARSER_VERSION,
+        'total_pages': len(pdf_document),
+        'metadata': pdf_metadata(pdf_document)
+    }
+    on_complete = cache.put if cache is not None else (lambda parsed: None)
+    pages = _parse_pages(pdf_document, header, on_complete)
+    return dict(header, cached=False), pages
+
+
+def load_parsed_pages(pdf_content: bytes, s3_client=None, bucket: Optional[str] = None) -> Dict:
+    """
+    The parsed document with all its pages (see open_parsed_pages)
+    """
+
+    header, pages = open_parsed_pages(pdf_content, s3_client, bucket)
+    return dict(header, pages=list(pages))
@@ -0,0 +1,623 @@
+import os
+import re
+import zlib
+from typing import Callable, Dict, Optional
+
+# Cheap structural pre-scan of a PDF through ranged reads. The trailer and
+# cross-reference section at the end of the file locate the catalog and the
+# page tree, so the page count, the encryption dictionary and a sample of
+# pages (resources and content streams) are read without downloading or
+# parsing the whole document. Anything unexpected falls back to scanning
+# the first and last blocks for /Count and /Encrypt.
+PRESCAN_BLOCK_BYTES = 16384
+PRESCAN_SAMPLE_PAGES = int(os.environ.get('PRESCAN_SAMPLE_PAGES', '3'))
+PRESCAN_MAX_READS = int(os.environ.get('PRESCAN_MAX_READS', '32'))
+PRESCAN_FORM_DEPTH = 3
+# extract_text chunks advance CHUNK_SIZE - CHUNK_OVERLAP chars (900 by default)
+CHUNK_STRIDE = int(os.environ.get('CHUNK_SIZE', '1000')) - int(os.environ.get('CHUNK_OVERLAP', '100'))
+DEFAULT_CHARS_PER_PAGE = 2000
+# Processing time model for estimate_processing_seconds
+PRESCAN_SECONDS_PER_CHUNK = float(os.environ.get('PRESCAN_SECONDS_PER_CHUNK', '0.12'))
+ROUTE_OVERHEAD_SECONDS = {'fast_path': 2.0, 'state_machine': 8.0}
+
+_WHITESPACE = b' \t\r\n\f\x00'
+_DELIMITERS = b'()<>[]{}/%'
+_OBJECT_HEADER = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+_STRING_OPERAND = re.compile(rb'\((?:\\.|[^\\()])*\)|<[0-9A-Fa-f\s]*>')
+_TEXT_OPERATOR = re.compile(rb'(\((?:\\.|[^\\()])*\)|<[0-9A-Fa-f\s]*>|\[[^\]]*\])\s*(?:Tj|TJ|\'|")')
+
+
+class PrescanError(Exception):
+    pass
+
+
+class Ref:
+    def __init__(self, number: int, generation: int = 0):
+        self.number = number
+        self.generation = generation
+
+    def __repr__(self):
+        return f"{self.number} {self.generation} R"
+
+
+class Name(str):
+    pass
+
+
+class RangeReader:
+    """
+    Random access over read(start, end) (inclusive byte range) in aligned
+    blocks, cached so nearby objects cost one request
+    """
+
+    def __init__(self, read: Callable[[int, int], bytes], size: int, block_bytes: int = PRESCAN_BLOCK_BYTES):
+        self._read = read
+        self.size = size
+        self.block_bytes = block_bytes
+        self.blocks: Dict[int, bytes] = {}
+        self.reads = 0
+        self.bytes_read = 0
+
+    def read(self, start: int, length: int) -> bytes:
+        start = max(0, start)
+        end = min(self.size, start + length)
+        first, last = start // self.block_bytes, (end - 1) // self.block_bytes
+        missing = [index for index in range(first, last + 1) if index not in self.blocks]
+        if missing:
+            if self.reads >= PRESCAN_MAX_READS:
+                raise PrescanError(f'More than {PRESCAN_MAX_READS} range reads')
+            lo = missing[0] * self.block_bytes
+            hi = min(self.size, (missing[-1] + 1) * self.block_bytes) - 1
+            data = self._read(lo, hi)
+            self.reads += 1
+            self.bytes_read += len(data)
+            for index in range(missing[0], missing[-1] + 1):
+                offset = (index - missing[0]) * self.block_bytes
+                self.blocks[index] = data[offset:offset + self.block_bytes]
+        data = b''.join(self.blocks[index] for index in range(first, last + 1))
+        return data[start - first * self.block_bytes:end - first * self.block_bytes]
+
+    def tail(self, length: int) -> bytes:
+        return self.read(max(0, self.size - length), length)
+
+
+def s3_range_reader(s3_client, bucket: str, key: str, size: Optional[int] = None) -> RangeReader:
+    if size is None:
+        size = s3_client.head_object(Bucket=bucket, Key=key)['ContentLength']
+
+    def read(start, end):
+        response = s3_client.get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{end}')
+        return response['Body'].read()
+
+    return RangeReader(read, size)
+
+
+def bytes_range_reader(data: bytes) -> RangeReader:
+    return RangeReader(lambda start, end: data[start:end + 1], len(data))
+
+
+def file_range_reader(fileobj) -> RangeReader:
+    """
+    Seekable file object (e.g. an upload being received); the caller
+    rewinds it afterwards
+    """
+
+    fileobj.seek(0, os.SEEK_END)
+    size = fileobj.tell()
+
+    def read(start, end):
+        fileobj.seek(start)
+        return fileobj.read(end - start + 1)
+
+    return RangeReader(read, size)
+
+
+class _Parser:
+    """
+    Just enough of the PDF object syntax for catalogs, page dictionaries
+    and cross-reference streams
+    """
+
+    def __init__(self, data: bytes, position: int = 0):
+        self.data = data
+        self.position = position
+
+    def _skip(self):
+        data = self.data
+        while self.position < len(data):
+            byte = data[self.position:self.position + 1]
+            if byte in _WHITESPACE and byte:
+                self.position += 1
+            elif byte == b'%':
+                newline = data.find(b'\n', self.position)
+                self.position = len(data) if newline < 0 else newline + 1
+            else:
+                break
+
+    def _word(self) -> bytes:
+        start = self.position
+        data = self.data
+        while self.position < len(data):
+            byte = data[self.position:self.position + 1]
+            if byte in _WHITESPACE or byte in _DELIMITERS:
+                break
+            self.position += 1
+        return data[start:self.position]
+
+    def parse(self):
+        self._skip()
+        data = self.data
+        if self.position >= len(data):
+            raise PrescanError('Unexpected end of object')
+        head = data[self.position:self.position + 2]
+        if head == b'<<':
+            self.position += 2
+            result = {}
+            while True:
+                self._skip()
+                if data[self.position:self.position + 2] == b'>>':
+                    self.position += 2
+                    return result
+                key = self.parse()
+                if not isinstance(key, Name):
+                    raise PrescanError('Dictionary key is not a name')
+                result[str(key)] = self.parse()
+        if head[:1] == b'[':
+            self.position += 1
+            items = []
+            while True:
+                self._skip()
+                if data[self.position:self.position + 1] == b']':
+                    self.position += 1
+                    return items
+                items.append(self.parse())
+        if head[:1] == b'/':
+            self.position += 1
+            return Name(self._word().decode('latin-1'))
+        if head[:1] == b'(':
+            depth, start = 0, self.position
+            while self.position < len(data):
+                byte = data[self.position:self.position + 1]
+                if byte == b'\\':
+                    self.position += 2
+                    continue
+                if byte == b'(':
+                    depth += 1
+                elif byte == b')':
+                    depth -= 1
+                    if depth == 0:
+                        self.position += 1
+                        return data[start + 1:self.position - 1]
+                self.position += 1
+            raise PrescanError('Unterminated string')
+        if head[:1] == b'<':
+            end = data.index(b'>', self.position)
+            value = data[self.position + 1:end]
+            self.position = end + 1
+            return value
+        word = self._word()
+        if not word:
+            raise PrescanError(f'Unexpected byte {head[:1]!r}')
+        if word == b'true':
+            return True
+        if word == b'false':
+            return False
+        if word == b'null':
+            return None
+        if re.fullmatch(rb'[+-]?\d+', word):
+            # "n g R" is a reference
+            saved = self.position
+            match = re.match(rb'\s+(\d+)\s+R\b', data[self.position:self.position + 24])
+            if match:
+                self.position += match.end()
+                return Ref(int(word), int(match.group(1)))
+            self.position = saved
+            return int(word)
+        try:
+            return float(word)
+        except ValueError:
+            return Name(word.decode('latin-1'))
+
+
+def _unpredict(data: bytes, columns: int) -> bytes:
+    # PNG predictors (/Predictor >= 10), one filter byte per row
+    rows, previous = [], bytearray(columns)
+    for start in range(0, len(data), columns + 1):
+        kind, row = data[start], bytearray(data[start + 1:start + 1 + columns])
+        for i in range(len(row)):
+            left = row[i - 1] if i else 0
+            up = previous[i]
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 2:
+                row[i] = (row[i] + up) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + up) // 2) & 0xFF
+            elif kind == 4:
+                upper_left = previous[i - 1] if i else 0
+                estimate = left + up - upper_left
+                distances = (abs(estimate - left), abs(estimate - up), abs(estimate - upper_left))
+                row[i] = (row[i] + (left, up, upper_left)[distances.index(min(distances))]) & 0xFF
+        rows.append(bytes(row))
+        previous = row
+    return b''.join(rows)
+
+
+class PdfStructure:
+    """
+    Lazily resolved objects of a PDF behind a RangeReader
+    """
+
+    def __init__(self, reader: RangeReader):
+        self.reader = reader
+        self.xref: Dict[int, tuple] = {}
+        self.trailer: Dict = {}
+        self._objects: Dict[int, object] = {}
+        self._object_streams: Dict[int, tuple] = {}
+        self._load_xref()
+
+    def _load_xref(self):
+        tail = self.reader.tail(2048)
+        matches = re.findall(rb'startxref\s+(\d+)', tail)
+        if not matches:
+            raise PrescanError('No startxref')
+        offset, seen = int(matches[-1]), set()
+        while offset is not None and offset not in seen:
+            seen.add(offset)
+            section = self._read_xref_section(offset)
+            # Newer sections (read first) win
+            for key, value in section['trailer'].items():
+                self.trailer.setdefault(key, value)
+            hybrid = section['trailer'].get('XRefStm')
+            if isinstance(hybrid, int) and hybrid not in seen:
+                seen.add(hybrid)
+                self._read_xref_section(hybrid)
+            offset = section['trailer'].get('Prev')
+
+    def _read_xref_section(self, offset: int) -> Dict:
+        head = self.reader.read(offset, 64)
+        if head.lstrip().startswith(b'xref'):
+            return self._read_xref_table(offset)
+        number, dictionary, stream = self._read_indirect(offset)
+        if dictionary.get('Type') != 'XRef':
+            raise PrescanError('startxref does not point to a cross-reference section')
+        widths = dictionary['W']
+        index = dictionary.get('Index', [0, dictionary['Size']])
+        row = sum(widths)
+        position = 0
+        for first, count in zip(index[0::2], index[1::2]):
+            for number in range(first, first + count):
+                fields, cursor = [], position
+                for width in widths:
+                    fields.append(int.from_bytes(stream[cursor:cursor + width], 'big') if width else None)
+                    cursor += width
+                position += row
+                kind = 1 if widths[0] == 0 else fields[0]
+                if number in self.xref or kind == 0:
+                    continue
+                if kind == 1:
+                    self.xref[number] = ('offset', fields[1])
+                elif kind == 2:
+                    self.xref[number] = ('compressed', fields[1], fields[2])
+        return {'trailer': dictionary}
+
+    def _read_xref_table(self, offset: int) -> Dict:
+        length = 4096
+        while True:
+            data = self.reader.read(offset, length)
+            position = data.find(b'trailer')
+            if position >= 0 or offset + length >= self.reader.size:
+                break
+            length *= 4
+        if position < 0:
+            raise PrescanError('Cross-reference table without trailer')
+        lines = data[:position].split(b'\n')
+        number = 0
+        for line in lines[1:]:
+            parts = line.split()
+            if len(parts) == 2:
+                number = int(parts[0])
+            elif len(parts) == 3:
+                if parts[2] == b'n' and number not in self.xref:
+                    self.xref[number] = ('offset', int(parts[0]))
+                number += 1
+        trailer = self.reader.read(offset + position + 7, 4096)
+        return {'trailer': _Parser(trailer).parse()}
+
+    def _read_indirect(self, offset: int, load_stream: bool = True):
+        # Read until the dictionary is complete; a stream body is fetched
+        # separately with its /Length (or only located, for load_stream=False)
+        length = 2048
+        while True:
+            data = self.reader.read(offset, length)
+            if re.search(rb'\bstream|endobj', data) or offset + length >= self.reader.size:
+                break
+            length *= 4
+        lead = len(data) - len(data.lstrip())
+        data = data[lead:]
+        match = _OBJECT_HEADER.match(data)
+        if not match:
+            raise PrescanError(f'No object at offset {offset}')
+        parser = _Parser(data, match.end())
+        value = parser.parse()
+        stream = None
+        parser._skip()
+        if isinstance(value, dict) and data[parser.position:parser.position + 6] == b'stream':
+            start = parser.position + 6
+            start += 2 if data[start:start + 2] == b'\r\n' else 1
+            stream = (offset + lead + start, self.resolve(value.get('Length')))
+            if load_stream:
+                stream = self._load_stream(value, stream)
+        return int(match.group(1)), value, stream
+
+    def _load_stream(self, dictionary: Dict, location: tuple) -> bytes:
+        start, length = location
+        raw = self.reader.read(start, length) if isinstance(length, int) else b''
+        return self._decode(dictionary, raw)
+
+    def _decode(self, dictionary: Dict, raw: bytes) -> bytes:
+        filters = dictionary.get('Filter')
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        data = raw
+        for name in filters:
+            if name != 'FlateDecode':
+                raise PrescanError(f'Unsupported filter {name}')
+            data = zlib.decompressobj().decompress(data)
+        parameters = self.resolve(dictionary.get('DecodeParms')) or {}
+        if isinstance(parameters, dict) and parameters.get('Predictor', 1) >= 10:
+            data = _unpredict(data, parameters.get('Columns', 1) * parameters.get('Colors', 1))
+        return data
+
+    def resolve(self, value):
+        while isinstance(value, Ref):
+            value = self.get(value.number)
+        return value
+
+    def get(self, number: int):
+        if number in self._objects:
+            return self._objects[number]
+        entry = self.xref.get(number)
+        if entry is None:
+            return None
+        if entry[0] == 'offset':
+            # Image data is never needed: stream bodies load on first use
+            _, value, location = self._read_indirect(entry[1], load_stream=False)
+            if location is not None:
+                value = dict(value, _stream_at=location)
+        else:
+            value = self._from_object_stream(entry[1], entry[2])
+        self._objects[number] = value
+        return value
+
+    def _from_object_stream(self, stream_number: int, index: int):
+        if stream_number not in self._object_streams:
+            container = self.get(stream_number)
+            if not isinstance(container, dict) or '_stream_at' not in container:
+                raise PrescanError(f'Object stream {stream_number} not found')
+            data = self.stream(container)
+            header = _Parser(data[:container['First']])
+            offsets = []
+            for _ in range(container['N']):
+                offsets.append((header.parse(), header.parse()))
+            self._object_streams[stream_number] = (data, container['First'], offsets)
+        data, first, offsets = self._object_streams[stream_number]
+        return _Parser(data, first + offsets[index][1]).parse()
+
+    def stream(self, value) -> bytes:
+        value = self.resolve(value)
+        if not isinstance(value, dict) or '_stream_at' not in value:
+            return b''
+        if '_stream' not in value:
+            value['_stream'] = self._load_stream(value, value['_stream_at'])
+        return value['_stream']
+
+
+def _page_at(pdf: PdfStructure, node: Dict, index: int) -> Optional[Dict]:
+    """
+    Leaf page dictionary number index below a page tree node, following
+    /Count to skip subtrees; inherited /Resources are copied down
+    """
+
+    for _ in range(64):
+        kids = pdf.resolve(node.get('Kids')) or []
+        if len(kids) == pdf.resolve(node.get('Count')) and index < len(kids):
+            # Every kid is a leaf: jump without resolving the others
+            kids, index = kids[index:index + 1], 0
+        for kid in kids:
+            child = pdf.resolve(kid)
+            if not isinstance(child, dict):
+                continue
+            if child.get('Type') == 'Pages' or 'Kids' in child:
+                count = pdf.resolve(child.get('Count', 0))
+                if index < count:
+                    if 'Resources' not in child and 'Resources' in node:
+                        child = dict(child, Resources=node['Resources'])
+                    node = child
+                    break
+                index -= count
+            else:
+                if index == 0:
+                    if 'Resources' not in child and 'Resources' in node:
+                        child = dict(child, Resources=node['Resources'])
+                    return child
+                index -= 1
+        else:
+            return None
+    return None
+
+
+def _text_chars(content: bytes) -> int:
+    chars = 0
+    for match in _TEXT_OPERATOR.finditer(content):
+        for operand in _STRING_OPERAND.findall(match.group(1)):
+            if operand.startswith(b'('):
+                chars += len(operand) - 2
+            else:
+                chars += len(re.sub(rb'\s', b'', operand[1:-1])) // 2
+    return chars
+
+
+def _scan_content(pdf: PdfStructure, resources: Dict, content: bytes, depth: int = 0) -> tuple:
+    """
+    Text characters and images drawn by a content stream, following form
+    XObjects (which may nest) up to PRESCAN_FORM_DEPTH levels
+    """
+
+    fonts = pdf.resolve(resources.get('Font')) or {}
+    xobjects = pdf.resolve(resources.get('XObject')) or {}
+    chars = _text_chars(content) if fonts else 0
+    images = 0
+    for value in xobjects.values():
+        xobject = pdf.resolve(value)
+        if not isinstance(xobject, dict):
+            continue
+        if xobject.get('Subtype') == 'Image':
+            images += 1
+        elif xobject.get('Subtype') == 'Form' and depth < PRESCAN_FORM_DEPTH:
+            form_resources = pdf.resolve(xobject.get('Resources')) or resources
+            form_chars, form_images = _scan_content(pdf, form_resources, pdf.stream(xobject), depth + 1)
+            chars += form_chars
+            images += form_images
+    return chars, images
+
+
+def _scan_page(pdf: PdfStructure, page: Dict) -> Dict:
+    resources = pdf.resolve(page.get('Resources')) or {}
+    contents = pdf.resolve(page.get('Contents'))
+    streams = contents if isinstance(contents, list) else [contents] if contents is not None else []
+    content = b''.join(pdf.stream(item) for item in streams)
+    chars, images = _scan_content(pdf, resources, content)
+
+    if chars:
+        kind = 'text'
+    elif images:
+        kind = 'image_only'
+    else:
+        kind = 'blank'
+    return {'kind': kind, 'chars': chars, 'images': images}
+
+
+def prescan_pdf(reader: RangeReader) -> Dict:
+    """
+    Page count, encryption, text-bearing vs image-only estimate (from a
+    sample of first/middle/last pages) and estimated chunk count;
+    text_check says whether that estimate covers every page or a sample
+    """
+
+    head = reader.read(0, 1024)
+    version = re.search(rb'%PDF-(\d\.\d)', head)
+    result = {
+        'is_pdf': bool(version),
+        'version': version.group(1).decode() if version else None,
+        'size_bytes': reader.size,
+        'pages': 0,
+        'encrypted': False,
+        'content': 'unknown',
+        'text_page_ratio': None,
+        'sampled_pages': [],
+        'text_check': 'none',
+        'estimated_chunks': 0,
+        'method': 'structure'
+    }
+    if not version:
+        return _finish(result, reader)
+
+    try:
+        pdf = PdfStructure(reader)
+        result['encrypted'] = 'Encrypt' in pdf.trailer
+        catalog = pdf.resolve(pdf.trailer.get('Root'))
+        root = pdf.resolve(catalog.get('Pages'))
+        result['pages'] = int(pdf.resolve(root.get('Count', 0)))
+    except Exception as e:
+        print(f"PDF pre-scan fell back to heuristics: {str(e)}")
+        return _heuristic(result, reader)
+
+    # Content streams of encrypted files cannot be read without the key
+    if result['pages'] and not result['encrypted']:
+        targets = sorted({0, result['pages'] // 2, result['pages'] - 1})[:PRESCAN_SAMPLE_PAGES]
+        for index in targets:
+            try:
+                page = _page_at(pdf, root, index)
+                if page is not None:
+                    result['sampled_pages'].append(dict(_scan_page(pdf, page), page=index + 1))
+            except Exception as e:
+                print(f"PDF pre-scan could not sample page {index + 1}: {str(e)}")
+                break
+
+    return _finish(result, reader)
+
+
+def _heuristic(result: Dict, reader: RangeReader) -> Dict:
+    result['method'] = 'heuristic'
+    try:
+        blocks = reader.read(0, PRESCAN_BLOCK_BYTES * 2) + reader.tail(PRESCAN_BLOCK_BYTES * 2)
+    except PrescanError:
+        blocks = b''.join(reader.blocks.values())
+    counts = [int(count) for count in re.findall(rb'/Count\s+(\d+)', blocks)]
+    result['pages'] = max(counts) if counts else 0
+    result['encrypted'] = b'/Encrypt' in blocks
+    return _finish(result, reader)
+
+
+def _finish(result: Dict, reader: RangeReader) -> Dict:
+    samples = result['sampled_pages']
+    if samples:
+        text = [sample for sample in samples if sample['kind'] == 'text']
+        result['text_page_ratio'] = len(text) / len(samples)
+        if not text:
+            result['content'] = 'image_only' if any(s['kind'] == 'image_only' for s in samples) else 'blank'
+        else:
+            result['content'] = 'text' if len(text) == len(samples) else 'mixed'
+        scanned = {sample['page'] for sample in samples}
+        result['text_check'] = 'all_pages' if len(scanned) >= result['pages'] else 'sampled'
+        chunks_per_page = (
+            sum(max(1, -(-sample['chars'] // CHUNK_STRIDE)) for sample in text) / len(text) if text else 0
+        )
+        result['estimated_chunks'] = round(result['pages'] * result['text_page_ratio'] * chunks_per_page)
+    if not samples or (result['text_check'] == 'sampled' and not result['estimated_chunks']):
+        result['estimated_chunks'] = -(-result['pages'] * DEFAULT_CHARS_PER_PAGE // CHUNK_STRIDE)
+
+    result['range_reads'] = reader.reads
+    result['bytes_read'] = reader.bytes_read
+    return result
+
+
+def route_for(scan: Dict, fast_path_max_pages: int) -> Dict:
+    """
+    Where an upload should go: reject (nothing the pipeline can extract),
+    fast_path (few pages) or state_machine, with the reason
+    """
+
+    if not scan['is_pdf']:
+        return {'route': 'reject', 'reason': 'not_a_pdf'}
+    if scan['pages'] == 0 and scan['method'] == 'structure':
+        return {'route': 'reject', 'reason': 'no_pages'}
+    if scan['content'] in ('image_only', 'blank'):
+        if scan.get('text_check') == 'all_pages':
+            # Extraction is text-only (no OCR): these would fail with no chunks
+            return {'route': 'reject', 'reason': scan['content']}
+        # Only a sample of pages was checked: text may be on the others, so
+        # the full pipeline decides (extraction fails if there is none)
+        return {'route': 'state_machine', 'reason': f"{scan['pages']} pages, no text in sampled pages"}
+    if scan['pages'] and scan['pages'] <= fast_path_max_pages:
+        return {'route': 'fast_path', 'reason': f"{scan['pages']} pages"}
+    return {'route': 'state_machine', 'reason': f"{scan['pages'] or 'unknown'} pages"}
+
+
+def estimate_processing_seconds(scan: Dict, route: str) -> float:
+    """
+    Rough time to searchable: fixed overhead of the route plus one
+    Bedrock embedding call per estimated chunk
+    """
+
+    if route == 'reject':
+        return 0.0
+    return ROUTE_OVERHEAD_SECONDS.get(route, 8.0) + scan['estimated_chunks'] * PRESCAN_SECONDS_PER_CHUNK
+
+
+def prescan_s3_object(s3_client, bucket: str, key: str, size: Optional[int] = None) -> Dict:
+    return prescan_pdf(s3_range_reader(s3_client, bucket, key, size))
+
+
+def prescan_bytes(data: bytes) -> Dict:
+    return prescan_pdf(bytes_range_reader(data))
@@ -0,0 +1,443 @@
+import os
+import json
+import time
+import zlib
+import fcntl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Every stage publishes compact progress events (stage, status, counts,
+# timings) for its document. The store keeps one record per document with
+# the latest event of each stage and the time of its last update, so a
+# reader asks for "what changed since my last call" in a single request
+# instead of probing S3 artifacts document by document.
+STATUS_FEED = 'status'
+# The DynamoDB feed is spread over this many partition keys (status#0..N-1)
+# so the index is not written through one hot partition; writers and the
+# app must use the same value
+STATUS_FEED_SHARDS = int(os.environ.get('STATUS_FEED_SHARDS', '8'))
+# On start the app only loads records updated this recently; older ones
+# are fetched one by one when a client asks for them by id
+STATUS_INITIAL_WINDOW_SECONDS = float(os.environ.get('STATUS_INITIAL_WINDOW_SECONDS', '86400'))
+# Readers look back this far before their last seen update so events from
+# writers with a slightly late clock are not missed
+STATUS_SKEW_SECONDS = 5.0
+# A new upload event starts a fresh record: stages of a previous run of
+# the same key are dropped
+UPLOAD_STAGE = 'upload'
+# Every stage that publishes events; the DynamoDB store clears the others
+# on an upload event without reading the record first
+STAGES = (UPLOAD_STAGE, 'extract', 'embed', 'index', 'summary', 'execution')
+
+
+def merge_event(record: Optional[Dict], event: Dict) -> Dict:
+    """
+    Fold one event into a document's status record
+    """
+
+    stage = event['stage']
+    entry = {name: value for name, value in event.items() if name not in ('document_id', 'stage')}
+    stages = {} if stage == UPLOAD_STAGE or not record else dict(record.get('stages', {}))
+    stages[stage] = entry
+    return {
+        'document_id': event['document_id'],
+        'stage': stage,
+        'status': event['status'],
+        'updated': event['at'],
+        'seq': (record or {}).get('seq', 0) + 1,
+        'stages': stages
+    }
+
+
+class StatusStore:
+    """
+    Storage for status records: publish() merges an event into the
+    document's record, changed_since() returns every record updated after
+    a time (all of them for 0)
+    """
+
+    def publish(self, event: Dict):
+        raise NotImplementedError
+
+    def get(self, document_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def get_many(self, document_ids: List[str]) -> List[Dict]:
+        return [record for record in map(self.get, document_ids) if record]
+
+    def changed_since(self, since: float) -> List[Dict]:
+        raise NotImplementedError
+
+
+class InMemoryStatusStore(StatusStore):
+    """
+    Process-local store for tests and the local pipeline executor
+    """
+
+    def __init__(self):
+        self._records: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def publish(self, event):
+        with self._lock:
+            document_id = event['document_id']
+            self._records[document_id] = merge_event(self._records.get(document_id), event)
+
+    def get(self, document_id):
+        with self._lock:
+            record = self._records.get(document_id)
+            return json.loads(json.dumps(record)) if record else None
+
+    def changed_since(self, since):
+        with self._lock:
+            return [json.loads(json.dumps(record)) for record in self._records.values() if record['updated'] > since]
+
+
+class FileStatusStore(StatusStore):
+    """
+    Host-wide store on a JSON file guarded by flock, shared by local
+    processes and a locally running app.py
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _load(self, f) -> Dict[str, Dict]:
+        f.seek(0)
+        raw = f.read()
+        return json.loads(raw) if raw.strip() else {}
+
+    def publish(self, event):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            records = self._load(f)
+            document_id = event['document_id']
+            records[document_id] = merge_event(records.get(document_id), event)
+            f.seek(0)
+            f.truncate()
+            json.dump(records, f)
+            f.flush()
+
+    def _read(self) -> Dict[str, Dict]:
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path) as f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            return self._load(f)
+
+    def get(self, document_id):
+        return self._read().get(document_id)
+
+    def changed_since(self, since):
+        return [record for record in self._read().values() if record['updated'] > since]
+
+
+def feed_shard(document_id: str, shards: int = STATUS_FEED_SHARDS) -> str:
+    """
+    Feed partition key of a document's record
+    """
+
+    return f"{STATUS_FEED}#{zlib.crc32(document_id.encode('utf-8')) % shards}"
+
+
+class DynamoDBStatusStore(StatusStore):
+    """
+    Cluster-wide store: one item per document, each stage's latest event in
+    its own attribute so concurrent stages never overwrite each other. A
+    global secondary index on (feed, updated) answers changed_since() with
+    one Query per feed shard (status#0..shards-1, queried in parallel) and
+    per 1 MB of changed records.
+    """
+
+    def __init__(self, dynamodb_client, table_name: str, index_name: str = 'updated-index',
+                 shards: int = STATUS_FEED_SHARDS):
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.index_name = index_name
+        self.shards = shards
+        # Records written before the feed was sharded keep the plain key
+        # until their next event
+        self.feeds = [STATUS_FEED] + [f"{STATUS_FEED}#{shard}" for shard in range(shards)]
+        self._pool = ThreadPoolExecutor(max_workers=len(self.feeds), thread_name_prefix='status-feed')
+
+    def publish(self, event):
+        stage = event['stage']
+        entry = {name: value for name, value in event.items() if name not in ('document_id', 'stage')}
+        update = ('SET #stage = :entry, #latest_stage = :stage, #latest_status = :status, '
+                  '#updated = :at, #feed = :feed ADD #seq :one')
+        names = {
+            '#stage': f"stage_{stage}",
+            '#latest_stage': 'latest_stage',
+            '#latest_status': 'latest_status',
+            '#updated': 'updated',
+            '#feed': 'feed',
+            '#seq': 'seq'
+        }
+        request = {}
+        if stage == UPLOAD_STAGE:
+            # A new run: drop the stages of the previous one in the same
+            # write, unless the record already has a newer event (a late
+            # upload event must not wipe the run it started)
+            stale = [name for name in STAGES if name != UPLOAD_STAGE]
+            for index, name in enumerate(stale):
+                names[f"#old{index}"] = f"stage_{name}"
+            update += ' REMOVE ' + ', '.join(f"#old{index}" for index in range(len(stale)))
+            request['ConditionExpression'] = 'attribute_not_exists(#updated) OR #updated <= :at'
+
+        try:
+            self.client.update_item(
+                TableName=self.table_name,
+                Key={'document_id': {'S': event['document_id']}},
+                UpdateExpression=update,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={
+                    ':entry': {'S': json.dumps(entry)},
+                    ':stage': {'S': stage},
+                    ':status': {'S': event['status']},
+                    ':at': {'N': repr(event['at'])},
+                    ':feed': {'S': feed_shard(event['document_id'], self.shards)},
+                    ':one': {'N': '1'}
+                },
+                **request
+            )
+        except self.client.exceptions.ConditionalCheckFailedException:
+            print(f"Skipping stale {stage}/{event['status']} status for {event['document_id']}")
+
+    def _record(self, item: Dict) -> Dict:
+        return {
+            'document_id': item['document_id']['S'],
+            'stage': item['latest_stage']['S'],
+            'status': item['latest_status']['S'],
+            'updated': float(item['updated']['N']),
+            'seq': int(item['seq']['N']),
+            'stages': {
+                name[len('stage_'):]: json.loads(value['S'])
+                for name, value in item.items() if name.startswith('stage_')
+            }
+        }
+
+    def get(self, document_id):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'document_id': {'S': document_id}},
+            ConsistentRead=True
+        )
+        item = response.get('Item')
+        return self._record(item) if item else None
+
+    def get_many(self, document_ids):
+        records = []
+        for start in range(0, len(document_ids), 100):
+            keys = [{'document_id': {'S': document_id}} for document_id in document_ids[start:start + 100]]
+            while keys:
+                response = self.client.batch_get_item(RequestItems={self.table_name: {'Keys': keys}})
+                records.extend(self._record(item) for item in response.get('Responses', {}).get(self.table_name, []))
+                keys = response.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+        return records
+
+    def _changed_in_feed(self, feed: str, since: float) -> List[Dict]:
+        records = []
+        request = {
+            'TableName': self.table_name,
+            'IndexName': self.index_name,
+            'KeyConditionExpression': '#feed = :feed AND #updated > :since',
+            'ExpressionAttributeNames': {'#feed': 'feed', '#updated': 'updated'},
+            'ExpressionAttributeValues': {':feed': {'S': feed}, ':since': {'N': repr(since)}}
+        }
+        while True:
+            response = self.client.query(**request)
+            records.extend(self._record(item) for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                return records
+            request['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def changed_since(self, since):
+        records = []
+        for shard_records in self._pool.map(lambda feed: self._changed_in_feed(feed, since), self.feeds):
+            records.extend(shard_records)
+        return records
+
+
+def create_status_store() -> Optional[StatusStore]:
+    """
+    Build the store configured through environment variables, or None when
+    STATUS_BACKEND is 'none' (events are dropped)
+    """
+
+    backend_name = os.environ.get('STATUS_BACKEND', 'none')
+    if backend_name == 'none':
+        return None
+    if backend_name == 'memory':
+        return InMemoryStatusStore()
+    if backend_name == 'file':
+        return FileStatusStore(os.environ.get('STATUS_FILE', '/tmp/pipeline_status.json'))
+    if backend_name == 'dynamodb':
+        import boto3
+        return DynamoDBStatusStore(
+            boto3.client('dynamodb', region_name=os.environ.get('AWS_REGION', 'sa-east-1')),
+            os.environ.get('STATUS_TABLE')
+        )
+    raise ValueError(f'Unknown status backend: {backend_name}')
+
+
+status_store = create_status_store()
+
+
+def publish(document_id: str, stage: str, status: str, counts: Optional[Dict] = None,
+            timings: Optional[Dict] = None, **details):
+    """
+    Publish a progress event for document_id. Store errors are logged,
+    never raised, so status reporting cannot fail processing.
+    """
+
+    if status_store is None:
+        return
+    event = {'document_id': document_id, 'stage': stage, 'status': status, 'at': time.time()}
+    if counts:
+        event['counts'] = counts
+    if timings:
+        event['timings'] = {name: round(value, 1) for name, value in timings.items()}
+    event.update({name: value for name, value in details.items() if value is not None})
+    try:
+        status_store.publish(event)
+    except Exception as e:
+        print(f"Error publishing {stage}/{status} status for {document_id}: {str(e)}")
+
+
+class StatusCache:
+    """
+    In-process view of a status store for the web app. One background
+    thread polls changed_since() every poll_seconds, whatever the number of
+    clients or documents; requests are answered from memory. Every change
+    bumps a version number, so clients ask for changes after the version
+    they last saw and can block (long-poll, SSE) until there is one.
+
+    The first load only covers the last initial_window_seconds (None for
+    everything); older records are fetched on demand by backfill().
+    """
+
+    def __init__(self, store: StatusStore, poll_seconds: float = 1.0,
+                 initial_window_seconds: Optional[float] = STATUS_INITIAL_WINDOW_SECONDS):
+        self.store = store
+        self.poll_seconds = poll_seconds
+        self.initial_window_seconds = initial_window_seconds
+        self.version = 0
+        self._records: Dict[str, Dict] = {}
+        self._versions: Dict[str, int] = {}
+        self._backfilled = set()
+        self._since = 0.0
+        self._changed = threading.Condition()
+        self._listeners: List = []
+        self._thread = None
+
+    def refresh(self) -> int:
+        """
+        Fetch what changed in the store; returns the number of records
+        that changed
+        """
+
+        return self._apply(self.store.changed_since(max(0.0, self._since - STATUS_SKEW_SECONDS)))
+
+    def _apply(self, records: List[Dict]) -> int:
+        changed = 0
+        with self._changed:
+            for record in records:
+                current = self._records.get(record['document_id'])
+                if current and (current['updated'], current['seq']) >= (record['updated'], record['seq']):
+                    continue
+                self.version += 1
+                self._records[record['document_id']] = record
+                self._versions[record['document_id']] = self.version
+                self._since = max(self._since, record['updated'])
+                changed += 1
+            if changed:
+                self._changed.notify_all()
+            listeners = list(self._listeners) if changed else []
+        for listener in listeners:
+            listener(self.version)
+        return changed
+
+    def backfill(self, document_ids: Iterable[str]) -> int:
+        """
+        Fetch the records of document_ids the cache does not hold (older
+        than the initial window), each id at most once
+        """
+
+        with self._changed:
+            missing = [
+                document_id for document_id in document_ids
+                if document_id not in self._records and document_id not in self._backfilled
+            ]
+            self._backfilled.update(missing)
+        if not missing:
+            return 0
+        try:
+            records = self.store.get_many(missing)
+        except Exception as e:
+            print(f"Status lookup failed: {str(e)}")
+            with self._changed:
+                self._backfilled.difference_update(missing)
+            return 0
+        return self._apply(records)
+
+    def _poll(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Status refresh failed: {str(e)}")
+            time.sleep(self.poll_seconds)
+
+    def start(self):
+        """
+        Load the current records and keep polling in the background
+        """
+
+        with self._changed:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._poll, name='status-cache', daemon=True)
+            if self.initial_window_seconds is not None:
+                # Skew is added back by refresh(); the window is what gets loaded
+                self._since = max(self._since, time.time() - self.initial_window_seconds + STATUS_SKEW_SECONDS)
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Status refresh failed: {str(e)}")
+        self._thread.start()
+
+    def query(self, since_version: int = 0, document_ids: Optional[Iterable[str]] = None,
+              prefix: Optional[str] = None) -> Tuple[int, List[Dict]]:
+        """
+        Current version and the matching records changed after since_version
+        """
+
+        with self._changed:
+            if document_ids is not None:
+                candidates = [document_id for document_id in document_ids if document_id in self._records]
+            else:
+                candidates = list(self._records)
+            matching = [
+                self._records[document_id] for document_id in candidates
+                if self._versions[document_id] > since_version
+                and (prefix is None or document_id.startswith(prefix))
+            ]
+            return self.version, matching
+
+    def wait(self, since_version: int, timeout: float) -> bool:
+        """
+        Block until the version moves past since_version or timeout expires
+        """
+
+        with self._changed:
+            return self._changed.wait_for(lambda: self.version > since_version, timeout)
+
+    def subscribe(self, listener):
+        """
+        Call listener(version) from the polling thread after every change,
+        for callers that cannot block a thread in wait() (the asyncio app)
+        """
+
+        with self._changed:
+            self._listeners.append(listener)
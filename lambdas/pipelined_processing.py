@@ -0,0 +1,229 @@
+import os
+import json
+import time
+import queue
+import threading
+import boto3
+from typing import List, Dict, Optional
+
+from extract_text import chunk_page, chunking_config
+from parsed_pages import open_parsed_pages
+from generate_embeddings import create_deduplicator, finish_dedup, embed_chunk
+from index_opensearch import index_documents_to_opensearch
+
+# Extraction, embedding and indexing run as concurrent stages connected by
+# bounded queues: pages are parsed into chunks while earlier chunks are
+# being embedded, and finished vectors are flushed to the index in batches
+# while later ones are still in flight. A full queue blocks the stage that
+# feeds it, so a fast parser cannot run ahead of Bedrock and buffer the
+# whole document's chunks and vectors in memory.
+PIPELINE_QUEUE_SIZE = int(os.environ.get('PIPELINE_QUEUE_SIZE', '16'))
+PIPELINE_EMBED_WORKERS = int(os.environ.get('PIPELINE_EMBED_WORKERS', '4'))
+PIPELINE_INDEX_BATCH = int(os.environ.get('PIPELINE_INDEX_BATCH', '32'))
+
+s3_client = boto3.client('s3', region_name='sa-east-1')
+
+_DONE = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+def process_pipelined(pdf_content: bytes, document_id: str, bucket: str, context=None) -> Dict:
+    """
+    Extract, deduplicate, embed and index a PDF with overlapping stages.
+
+    Returns the same pieces the sequential stages produce: extracted_data
+    (as extract_text_from_pdf), embeddings_data in document order, the
+    dedup results, the combined indexing_result, plus per-stage timings.
+    Any chunk that cannot be embedded or any failed index batch aborts the
+    whole pipeline with an exception.
+    """
+
+    chunk_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    vector_queue = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    stop = threading.Event()
+    errors: List[str] = []
+    started = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    extracted_data = {
+        'document_id': document_id,
+        'total_pages': 0,
+        'chunks': [],
+        'metadata': {},
+        'chunking': chunking_config()
+    }
+    deduplicator, corpus_index = create_deduplicator(document_id, bucket)
+    metadata_ready = threading.Event()
+    results: List[Dict] = []
+    indexed = {'indexed_documents': 0, 'batches': 0, 'index_name': 'documents'}
+    flushed_duplicates: Dict[str, int] = {}
+
+    def fail(message: str):
+        errors.append(message)
+        stop.set()
+
+    def put(target: queue.Queue, item):
+        while not stop.is_set():
+            try:
+                target.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+        raise PipelineAborted()
+
+    def get(source: queue.Queue):
+        while not stop.is_set():
+            try:
+                return source.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        raise PipelineAborted()
+
+    def extract():
+        try:
+            # Pages come from the parsed pages cache or are parsed one by one
+            header, pages = open_parsed_pages(pdf_content, s3_client, bucket)
+            extracted_data['total_pages'] = header['total_pages']
+            extracted_data['metadata'] = header['metadata']
+            extracted_data['content_hash'] = header['content_hash']
+            extracted_data['parser_version'] = header['parser_version']
+            extracted_data['parsed_cached'] = header['cached']
+            metadata_ready.set()
+
+            position = 0
+            for page in pages:
+                for chunk in chunk_page(page):
+                    extracted_data['chunks'].append(chunk)
+                    canonical = deduplicator.add(chunk) if deduplicator else chunk
+                    if canonical is not None:
+                        put(chunk_queue, (position, canonical))
+                        position += 1
+            timings['extract_ms'] = (time.perf_counter() - started) * 1000.0
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            fail(f"Extraction failed: {str(e)}")
+        finally:
+            metadata_ready.set()
+            for _ in range(PIPELINE_EMBED_WORKERS):
+                try:
+                    put(chunk_queue, _DONE)
+                except PipelineAborted:
+                    break
+
+    def embed():
+        try:
+            while True:
+                item = get(chunk_queue)
+                if item is _DONE:
+                    break
+                position, chunk = item
+                result = embed_chunk(chunk, document_id, context)
+                if result['entry'] is None:
+                    reason = 'stopped before the time limit' if result['stopped_early'] else result['error']
+                    fail(f"Chunk {chunk['chunk_id']} could not be embedded: {reason}")
+                    return
+                if 'first_embedding_ms' not in timings:
+                    timings['first_embedding_ms'] = (time.perf_counter() - started) * 1000.0
+                put(vector_queue, (position, result['entry']))
+        except PipelineAborted:
+            return
+        except Exception as e:
+            fail(f"Embedding failed: {str(e)}")
+            return
+        try:
+            put(vector_queue, _DONE)
+        except PipelineAborted:
+            pass
+
+    def flush(batch: List[Dict]):
+        if not batch:
+            return
+        metadata_ready.wait()
+        result = index_documents_to_opensearch(
+            document_id, batch, extracted_data['metadata'], extracted_data['total_pages']
+        )
+        if not result['success']:
+            raise RuntimeError(result.get('error', 'OpenSearch indexing failed'))
+        indexed['indexed_documents'] += result['indexed_documents']
+        indexed['index_name'] = result.get('index_name', indexed['index_name'])
+        indexed['batches'] += 1
+        for entry in batch:
+            flushed_duplicates[entry['chunk_id']] = len(entry['duplicates'])
+
+    def index():
+        batch: List[Dict] = []
+        finished_workers = 0
+        try:
+            while finished_workers < PIPELINE_EMBED_WORKERS:
+                item = get(vector_queue)
+                if item is _DONE:
+                    finished_workers += 1
+                    continue
+                results.append(item)
+                batch.append(item[1])
+                if len(batch) >= PIPELINE_INDEX_BATCH:
+                    flush(batch)
+                    batch = []
+            flush(batch)
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            fail(f"Indexing failed: {str(e)}")
+
+    threads = [threading.Thread(target=extract, name='pipeline-extract')]
+    threads += [
+        threading.Thread(target=embed, name=f"pipeline-embed-{i}")
+        for i in range(PIPELINE_EMBED_WORKERS)
+    ]
+    threads.append(threading.Thread(target=index, name='pipeline-index'))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise RuntimeError(errors[0])
+    if not extracted_data['chunks']:
+        raise ValueError('No chunks to process')
+
+    embeddings_data = [entry for _, entry in sorted(results, key=lambda item: item[0])]
+
+    # Within-document duplicates found after their canonical chunk was
+    # flushed: re-send those chunks so the index has every back-reference
+    stale = [
+        entry for entry in embeddings_data
+        if len(entry['duplicates']) != flushed_duplicates.get(entry['chunk_id'])
+    ]
+    if stale:
+        result = index_documents_to_opensearch(
+            document_id, stale, extracted_data['metadata'], extracted_data['total_pages']
+        )
+        if not result['success']:
+            raise RuntimeError(result.get('error', 'OpenSearch indexing failed'))
+
+    dedup_stats = deduplicator.stats() if deduplicator else None
+    if dedup_stats:
+        print(f"Near-duplicate suppression: {json.dumps(dedup_stats)}")
+    finish_dedup(bucket, embeddings_data, dedup_stats, corpus_index)
+
+    timings['total_ms'] = (time.perf_counter() - started) * 1000.0
+    print(f"Pipelined processing of {document_id}: {len(embeddings_data)} embeddings in "
+          f"{indexed['batches']} index batches, timings {json.dumps(timings)}")
+
+    return {
+        'extracted_data': extracted_data,
+        'embeddings_data': embeddings_data,
+        'duplicate_chunks': deduplicator.duplicate_chunks if deduplicator else [],
+        'dedup_stats': dedup_stats,
+        'indexing_result': {
+            'success': True,
+            'indexed_documents': indexed['indexed_documents'],
+            'index_name': indexed['index_name'],
+            'index_batches': indexed['batches']
+        },
+        'timings': timings
+    }
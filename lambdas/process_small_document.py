@@ -0,0 +1,223 @@
+import json
+import os
+import time
+import boto3
+import fitz  # PyMuPDF
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Optional, Tuple
+from datetime import datetime, timezone
+
+from profiling import profiled_handler
+from extract_text import extract_text_from_pdf, build_extracted_json
+from generate_embeddings import suppress_duplicates, finish_dedup, embed_chunk, build_embeddings_json
+from index_opensearch import index_documents_to_opensearch, build_indexed_json
+from update_metadata import create_processing_summary
+from pipelined_processing import process_pipelined
+from scheduler import complete as release_scheduler_slot, handed_off
+from pipeline_status import publish
+from artifacts import put_artifact
+from chunk_text import put_chunk_texts
+
+s3_client = boto3.client('s3', region_name='sa-east-1')
+stepfunctions = boto3.client('stepfunctions', region_name='sa-east-1')
+
+# Uploads routed here by the trigger (FAST_PATH_MAX_BYTES) that turn out to
+# have more pages than this are handed to the state machine instead
+FAST_PATH_MAX_PAGES = int(os.environ.get('FAST_PATH_MAX_PAGES', '5'))
+FAST_PATH_EMBED_CONCURRENCY = int(os.environ.get('FAST_PATH_EMBED_CONCURRENCY', '4'))
+# Overlap extraction, embedding and indexing (see pipelined_processing)
+FAST_PATH_PIPELINED = os.environ.get('FAST_PATH_PIPELINED', 'true').lower() == 'true'
+
+@profiled_handler('process_small_document')
+def lambda_handler(event, context):
+    """
+    Fast path: extract, embed, index and summarize a small PDF in a single
+    invocation, keeping intermediate data in memory and writing the same
+    extracted/, embeddings/, indexed/ and summaries/ artifacts at the end
+    """
+
+    print(f"Process Small Document Lambda - Received event: {json.dumps(event)}")
+
+    bucket = event.get('bucket')
+    key = event.get('key')
+    started = time.perf_counter()
+
+    try:
+        if not bucket or not key:
+            raise ValueError('Missing bucket or key in event')
+
+        publish(key, 'extract', 'running', path='fast_path')
+
+        response = s3_client.get_object(Bucket=bucket, Key=key)
+        pdf_content = response['Body'].read()
+
+        with fitz.open(stream=pdf_content, filetype="pdf") as pdf_document:
+            page_count = len(pdf_document)
+        if page_count > FAST_PATH_MAX_PAGES:
+            return hand_off(event, context, f'{page_count} pages exceeds FAST_PATH_MAX_PAGES={FAST_PATH_MAX_PAGES}')
+
+        if FAST_PATH_PIPELINED:
+            processed = process_pipelined(pdf_content, key, bucket, context)
+            extracted_data = processed['extracted_data']
+            embeddings_data = processed['embeddings_data']
+            duplicate_chunks = processed['duplicate_chunks']
+            dedup_stats = processed['dedup_stats']
+            indexing_result = processed['indexing_result']
+        else:
+            extracted_data, embeddings_data, duplicate_chunks, dedup_stats, indexing_result = process_sequential(
+                pdf_content, key, bucket, context
+            )
+        document_id = extracted_data['document_id']
+        metadata = extracted_data['metadata']
+        total_pages = extracted_data['total_pages']
+
+        # Summarize
+        extracted_file_key = f"extracted/{document_id}.json"
+        embeddings_file_key = f"embeddings/{document_id}.json"
+        indexed_file_key = f"indexed/{document_id}.json"
+        summary_file_key = f"summaries/{document_id}.json"
+        summary = create_processing_summary(
+            document_id=document_id,
+            bucket=bucket,
+            key=key,
+            indexed_documents=indexing_result['indexed_documents'],
+            opensearch_index=indexing_result.get('index_name', 'documents'),
+            processing_timestamp=datetime.now(timezone.utc).isoformat(),
+            dedup_stats=dedup_stats
+        )
+        summary['processing']['path'] = 'fused-pipelined' if FAST_PATH_PIPELINED else 'fused'
+
+        # Chunk texts go first: indexed/ must not announce the document before them
+        chunk_text_key = put_chunk_texts(s3_client, bucket, document_id, embeddings_data)
+
+        # artifact key -> (document, field written one record per line)
+        artifacts = {
+            extracted_file_key: (build_extracted_json(extracted_data, bucket, key), 'chunks'),
+            embeddings_file_key: (build_embeddings_json(
+                document_id, bucket, key, extracted_file_key, total_pages,
+                metadata, embeddings_data, duplicate_chunks, dedup_stats
+            ), 'embeddings_data'),
+            indexed_file_key: (build_indexed_json(
+                document_id, bucket, key, embeddings_file_key, indexing_result, dedup_stats, chunk_text_key
+            ), None),
+            summary_file_key: (summary, None)
+        }
+        write_artifacts(bucket, artifacts)
+
+        # One invocation ran every stage: report them together
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        timings = processed['timings'] if FAST_PATH_PIPELINED else {}
+        publish(key, 'extract', 'completed', counts={'pages': total_pages, 'chunks': len(extracted_data['chunks'])},
+                timings={'ms': timings['extract_ms']} if 'extract_ms' in timings else None)
+        publish(key, 'embed', 'completed', counts={'embeddings': len(embeddings_data), 'duplicates': len(duplicate_chunks)})
+        publish(key, 'index', 'completed', counts={'indexed': indexing_result['indexed_documents']})
+        publish(key, 'summary', 'completed', counts={'indexed': indexing_result['indexed_documents']},
+                timings={'ms': elapsed_ms}, path='fast_path')
+
+        print(f"Fast path processed {document_id}: {page_count} pages, {len(embeddings_data)} embeddings")
+
+        # Free the scheduler slot; a hand-off keeps it until the execution ends
+        release_scheduler_slot(key)
+
+        return {
+            'statusCode': 200,
+            'route': 'fast_path',
+            'bucket': bucket,
+            'key': key,
+            'document_id': document_id,
+            'processing_status': 'completed',
+            'total_pages': total_pages,
+            'indexed_documents': indexing_result['indexed_documents'],
+            'summary_file_key': summary_file_key,
+            'completion_timestamp': datetime.now(timezone.utc).isoformat()
+        }
+
+    except Exception as e:
+        print(f"Error in fast path, falling back to the state machine: {str(e)}")
+        return hand_off(event, context, str(e))
+
+def process_sequential(pdf_content: bytes, key: str, bucket: str, context=None):
+    """
+    Extract, embed and index one stage after the other
+    """
+
+    # Extract
+    extracted_data = extract_text_from_pdf(pdf_content, key, bucket)
+    document_id = extracted_data['document_id']
+    if not extracted_data['chunks']:
+        raise ValueError('No chunks to process')
+
+    # Embed
+    chunks, duplicate_chunks, dedup_stats, corpus_index = suppress_duplicates(
+        extracted_data['chunks'], document_id, bucket
+    )
+    embeddings_data = embed_all(chunks, document_id, context)
+    finish_dedup(bucket, embeddings_data, dedup_stats, corpus_index)
+
+    # Index
+    if not embeddings_data:
+        raise ValueError('No embeddings data to index')
+    indexing_result = index_documents_to_opensearch(
+        document_id, embeddings_data, extracted_data['metadata'], extracted_data['total_pages']
+    )
+    if not indexing_result['success']:
+        raise RuntimeError(indexing_result.get('error', 'OpenSearch indexing failed'))
+
+    return extracted_data, embeddings_data, duplicate_chunks, dedup_stats, indexing_result
+
+def embed_all(chunks: List[Dict], document_id: str, context=None) -> List[Dict]:
+    """
+    Embed all chunks concurrently; any chunk that still fails after its
+    retries fails the fast path
+    """
+
+    with ThreadPoolExecutor(max_workers=FAST_PATH_EMBED_CONCURRENCY) as pool:
+        results = list(pool.map(lambda chunk: embed_chunk(chunk, document_id, context), chunks))
+
+    failed = [chunk['chunk_id'] for chunk, result in zip(chunks, results) if result['entry'] is None]
+    if failed:
+        raise RuntimeError(f"{len(failed)} chunks could not be embedded: {', '.join(failed[:10])}")
+    return [result['entry'] for result in results]
+
+def write_artifacts(bucket: str, artifacts: Dict[str, Tuple[Dict, Optional[str]]]):
+    def put(item):
+        artifact_key, (document, records_field) = item
+        put_artifact(s3_client, bucket, artifact_key, document, records_field)
+
+    with ThreadPoolExecutor(max_workers=len(artifacts)) as pool:
+        list(pool.map(put, artifacts.items()))
+
+def hand_off(event: Dict, context, reason: str) -> Dict:
+    """
+    Start the full state machine for this upload; it has per-stage
+    Retry/Catch and checkpointing the fast path does not
+    """
+
+    step_function_arn = os.environ.get('STEP_FUNCTION_ARN')
+    if not step_function_arn:
+        raise Exception(f'Fast path failed and no STEP_FUNCTION_ARN to fall back to: {reason}')
+
+    key = event.get('key', '')
+    request_id = getattr(context, 'aws_request_id', 'local')
+    execution_name = f"pdf-processing-{key.replace('/', '-').replace('.', '-')}-{request_id[:8]}"
+    execution_input = {'bucket': event.get('bucket'), 'key': key}
+    if event.get('profile'):
+        execution_input['profile'] = True
+
+    publish(key, 'upload', 'started', route='state_machine', reason=reason[:500])
+    response = stepfunctions.start_execution(
+        stateMachineArn=step_function_arn,
+        name=execution_name,
+        input=json.dumps(execution_input)
+    )
+    print(f"Handed {key} to the state machine ({reason}): {response['executionArn']}")
+    handed_off(key)
+
+    return {
+        'statusCode': 202,
+        'route': 'state_machine',
+        'bucket': event.get('bucket'),
+        'key': key,
+        'reason': reason,
+        'executionArn': response['executionArn']
+    }
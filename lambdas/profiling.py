@@ -0,0 +1,338 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import resource
+import functools
+import tempfile
+import threading
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional
+from datetime import datetime, timezone
+
+# PROFILING=off (default) leaves handlers untouched, so there is no cost at
+# all. 'event' profiles invocations whose event carries "profile": true;
+# 'sampled' additionally profiles a PROFILE_SAMPLE_RATE fraction of them.
+PROFILING = os.environ.get('PROFILING', 'off')
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', '0.01'))
+PROFILE_TOP_N = 30
+TRACEMALLOC_FRAMES = 10
+# cProfile only sees the thread that enabled it; every other thread (pool
+# workers fanning out Bedrock and S3 calls) is stack-sampled this often
+THREAD_SAMPLE_INTERVAL_MS = float(os.environ.get('PROFILE_THREAD_SAMPLE_INTERVAL_MS', '5'))
+
+# tracemalloc and the profiler hook are process-wide; one session at a time
+_session_lock = threading.Lock()
+_s3_client = None
+
+
+def should_profile(flagged: bool = False) -> bool:
+    if PROFILING == 'off':
+        return False
+    if flagged:
+        return True
+    return PROFILING == 'sampled' and random.random() < PROFILE_SAMPLE_RATE
+
+
+def _function_name(code) -> str:
+    return f"{code.co_filename}:{code.co_firstlineno}({code.co_name})"
+
+
+def _idle_pool_worker(frame) -> bool:
+    # A ThreadPoolExecutor worker blocked on its (C) work queue has _worker
+    # as its innermost Python frame
+    return frame.f_code.co_name == '_worker' and frame.f_code.co_filename.endswith(os.path.join('futures', 'thread.py'))
+
+
+class ThreadSampler:
+    """
+    Sample the stacks of every thread except the profiled one (and idle
+    pool workers) every interval_ms, counting per function the samples it
+    was on the stack (cumulative) and at the top (self). Each sample weighs
+    the time since the previous one, since under GIL contention the sampler
+    wakes up later than asked.
+    """
+
+    def __init__(self, profiled_thread_id: int, interval_ms: float = THREAD_SAMPLE_INTERVAL_MS):
+        self.profiled_thread_id = profiled_thread_id
+        self.interval_ms = interval_ms
+        self.samples = 0
+        self.threads = set()
+        self.cumulative = Counter()
+        self.self_samples = Counter()
+        self.cumulative_ms = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval_ms / 1000.0):
+            now = time.perf_counter()
+            weight_ms, last = (now - last) * 1000.0, now
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id in (self.profiled_thread_id, self._thread.ident) or _idle_pool_worker(frame):
+                    continue
+                self.samples += 1
+                self.threads.add(thread_id)
+                self.self_samples[_function_name(frame.f_code)] += 1
+                seen = set()
+                while frame is not None:
+                    name = _function_name(frame.f_code)
+                    if name not in seen:
+                        seen.add(name)
+                        self.cumulative[name] += 1
+                        self.cumulative_ms[name] += weight_ms
+                    frame = frame.f_back
+
+    def report(self) -> Dict:
+        return {
+            'interval_ms': self.interval_ms,
+            'threads': len(self.threads),
+            'samples': self.samples,
+            'top_functions': [
+                {
+                    'function': name,
+                    'samples': samples,
+                    'self_samples': self.self_samples[name],
+                    # Thread time, summed over the threads that ran it
+                    'estimated_ms': round(self.cumulative_ms[name], 1)
+                }
+                for name, samples in self.cumulative.most_common(PROFILE_TOP_N)
+            ]
+        }
+
+
+class ProfileSession:
+    """
+    Capture cProfile stats (of the calling thread), stack samples of the
+    other threads, tracemalloc top allocations and peak RSS for the code
+    run inside the with block
+    """
+
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.sampler = ThreadSampler(threading.get_ident())
+        self.snapshot = None
+        self.traced_peak = 0
+        self.wall_ms = 0.0
+        self.rss_before_kb = 0
+        self.rss_peak_kb = 0
+
+    def __enter__(self):
+        self.rss_before_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        self._started = time.perf_counter()
+        self.sampler.start()
+        self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.disable()
+        self.sampler.stop()
+        self.wall_ms = (time.perf_counter() - self._started) * 1000.0
+        self.snapshot = tracemalloc.take_snapshot()
+        _, self.traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        self.rss_peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return False
+
+    def pstats_bytes(self) -> bytes:
+        # pstats can only serialize to a path
+        with tempfile.NamedTemporaryFile(suffix='.pstats') as f:
+            self.profiler.dump_stats(f.name)
+            return open(f.name, 'rb').read()
+
+    def report(self) -> Dict:
+        stream = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=stream)
+        functions = []
+        for (filename, line, name), (cc, ncalls, tottime, cumtime, _) in stats.stats.items():
+            functions.append({
+                'function': f"{filename}:{line}({name})",
+                'ncalls': ncalls,
+                'tottime_ms': round(tottime * 1000.0, 3),
+                'cumtime_ms': round(cumtime * 1000.0, 3)
+            })
+        functions.sort(key=lambda f: f['cumtime_ms'], reverse=True)
+
+        allocations = [
+            {
+                'location': str(stat.traceback[0]) if stat.traceback else '?',
+                'size_bytes': stat.size,
+                'count': stat.count
+            }
+            for stat in self.snapshot.statistics('lineno')[:PROFILE_TOP_N]
+        ]
+
+        return {
+            'wall_ms': round(self.wall_ms, 3),
+            # ru_maxrss is the process high-water mark; the delta shows growth
+            # caused by this invocation on a warm container
+            'peak_rss_kb': self.rss_peak_kb,
+            'peak_rss_growth_kb': self.rss_peak_kb - self.rss_before_kb,
+            'tracemalloc_peak_bytes': self.traced_peak,
+            # What each section covers: work handed to other threads is
+            # missing from top_functions and the .pstats file
+            'profile_scope': {
+                'top_functions': 'calling thread only (cProfile, also in the .pstats file)',
+                'thread_samples': 'every other thread, sampled (pool workers waiting for work are skipped)',
+                'top_allocations': 'all threads (tracemalloc)'
+            },
+            'top_functions': functions[:PROFILE_TOP_N],
+            'thread_samples': self.sampler.report(),
+            'top_allocations': allocations
+        }
+
+
+def profile_key_prefix(document_id: str) -> str:
+    """
+    Profiles live next to the document's summaries/ entry
+    """
+
+    return f"summaries/{document_id}/profiles"
+
+
+def write_profile_artifacts(stage: str, event: Dict, result, session: ProfileSession, context=None):
+    global _s3_client
+
+    source = result if isinstance(result, dict) else {}
+    document_id = source.get('document_id') or event.get('document_id') or event.get('key')
+    bucket = source.get('bucket') or event.get('bucket') or os.environ.get('BUCKET_NAME')
+    if not document_id or not bucket:
+        for record in event.get('Records', [])[:1]:
+            document_id = document_id or record['s3']['object']['key']
+            bucket = bucket or record['s3']['bucket']['name']
+    if not document_id or not bucket:
+        print(f"Profile for {stage} not saved: no document_id/bucket in event")
+        return
+
+    if _s3_client is None:
+        import boto3
+        _s3_client = boto3.client('s3', region_name=os.environ.get('AWS_REGION', 'sa-east-1'))
+
+    request_id = getattr(context, 'aws_request_id', 'local')[:8]
+    timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    base_key = f"{profile_key_prefix(document_id)}/{stage}-{timestamp}-{request_id}"
+
+    report = session.report()
+    report.update({
+        'stage': stage,
+        'document_id': document_id,
+        'request_id': getattr(context, 'aws_request_id', None),
+        'memory_limit_mb': getattr(context, 'memory_limit_in_mb', None),
+        'profiled_at': datetime.now(timezone.utc).isoformat(),
+        'pstats_key': f"{base_key}.pstats"
+    })
+
+    _s3_client.put_object(Bucket=bucket, Key=f"{base_key}.pstats", Body=session.pstats_bytes())
+    _s3_client.put_object(
+        Bucket=bucket,
+        Key=f"{base_key}.json",
+        Body=json.dumps(report, indent=2),
+        ContentType='application/json'
+    )
+    print(f"Saved {stage} profile to: s3://{bucket}/{base_key}.json "
+          f"(wall {report['wall_ms']} ms, peak RSS {report['peak_rss_kb']} KB)")
+
+
+def profiled_handler(stage: str):
+    """
+    Decorate a lambda_handler with opt-in profiling. With PROFILING=off the
+    handler is returned as is.
+    """
+
+    def decorator(handler):
+        if PROFILING == 'off':
+            return handler
+
+        @functools.wraps(handler)
+        def wrapper(event, context):
+            flagged = isinstance(event, dict) and bool(event.get('profile'))
+            if not should_profile(flagged) or not _session_lock.acquire(blocking=False):
+                return handler(event, context)
+
+            try:
+                result, error = None, None
+                with ProfileSession() as session:
+                    try:
+                        result = handler(event, context)
+                    except Exception as e:
+                        error = e
+            finally:
+                _session_lock.release()
+
+            try:
+                write_profile_artifacts(stage, event, result, session, context)
+            except Exception as e:
+                print(f"Could not save {stage} profile: {str(e)}")
+
+            if error is not None:
+                raise error
+            # Stage outputs replace the state machine input, so carry the flag
+            # forward to profile every stage of a flagged execution
+            if flagged and isinstance(result, dict):
+                result.setdefault('profile', True)
+            return result
+
+        return wrapper
+
+    return decorator
+
+
+def profile_flask_app(app, output_dir: Optional[str] = None):
+    """
+    Register request hooks that profile Flask routes. Requests are profiled
+    when sampled or when they carry ?profile=1 / X-Profile: 1; reports are
+    written to output_dir. With PROFILING=off nothing is registered.
+    """
+
+    if PROFILING == 'off':
+        return
+
+    from flask import g, request
+
+    output_dir = output_dir or os.environ.get('PROFILE_DIR', '/tmp/qa-profiles')
+    os.makedirs(output_dir, exist_ok=True)
+
+    @app.before_request
+    def start_profile():
+        flagged = request.args.get('profile') == '1' or request.headers.get('X-Profile') == '1'
+        if should_profile(flagged) and _session_lock.acquire(blocking=False):
+            g.profile_session = ProfileSession().__enter__()
+
+    @app.teardown_request
+    def stop_profile(exc):
+        session = g.pop('profile_session', None)
+        if session is None:
+            return
+        try:
+            session.__exit__(None, None, None)
+        finally:
+            _session_lock.release()
+
+        endpoint = request.endpoint or 'unknown'
+        timestamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+        base_path = os.path.join(output_dir, f"app-{endpoint}-{timestamp}")
+        report = session.report()
+        report.update({
+            'stage': f"app:{endpoint}",
+            'path': request.path,
+            'profiled_at': datetime.now(timezone.utc).isoformat(),
+            'pstats_key': f"{base_path}.pstats"
+        })
+        with open(f"{base_path}.pstats", 'wb') as f:
+            f.write(session.pstats_bytes())
+        with open(f"{base_path}.json", 'w') as f:
+            json.dump(report, f, indent=2)
@@ -0,0 +1,340 @@
+import os
+import json
+import time
+import fcntl
+import random
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+# Heartbeats older than this stop counting a document as active
+ACTIVE_TTL_SECONDS = 15.0
+# A document refreshes its heartbeat (and rereads the active count) at
+# most this often, so the active set is not written on every request
+HEARTBEAT_SECONDS = ACTIVE_TTL_SECONDS / 3
+MAX_SLEEP_SECONDS = 1.0
+# Idle per-document items are removed by the table's TTL on expires_at
+STATE_EXPIRE_SECONDS = 86400
+
+
+class RateLimitContention(Exception):
+    """
+    A state record kept changing under every update attempt; the caller
+    should back off and retry, as for a throttle
+    """
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Cheap input token estimate (~4 characters per token for Titan)
+    """
+
+    return max(1, len(text) // 4)
+
+
+class RateLimitBackend:
+    """
+    Storage for limiter state. update() must apply fn to the current state
+    atomically: fn receives the state dict (empty when missing) and returns
+    (new_state, result). This is the only primitive the limiter needs, so a
+    shared store only has to provide compare-and-swap on one record.
+    """
+
+    def update(self, key: str, fn: Callable[[Dict], Tuple[Dict, object]]):
+        raise NotImplementedError
+
+
+class InMemoryBackend(RateLimitBackend):
+    """
+    Process-local backend for tests and single-process use
+    """
+
+    def __init__(self):
+        self._states: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def update(self, key, fn):
+        with self._lock:
+            state, result = fn(self._states.get(key, {}))
+            self._states[key] = state
+            return result
+
+
+class FileBackend(RateLimitBackend):
+    """
+    Host-wide backend on a JSON file guarded by flock, so several local
+    processes (e.g. the local pipeline executor) share one budget
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def update(self, key, fn):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            f.seek(0)
+            raw = f.read()
+            states = json.loads(raw) if raw.strip() else {}
+            state, result = fn(states.get(key, {}))
+            states[key] = state
+            f.seek(0)
+            f.truncate()
+            json.dump(states, f)
+            f.flush()
+            return result
+
+
+class DynamoDBBackend(RateLimitBackend):
+    """
+    Cluster-wide backend: one DynamoDB item per key, updated with
+    optimistic concurrency on a version attribute. With expire_after_seconds
+    every write also sets expires_at for the table's TTL.
+    """
+
+    def __init__(self, dynamodb_client, table_name: str, max_conflicts: int = 20,
+                 expire_after_seconds: Optional[int] = None):
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.max_conflicts = max_conflicts
+        self.expire_after_seconds = expire_after_seconds
+
+    def update(self, key, fn):
+        for conflict in range(self.max_conflicts):
+            if conflict:
+                # Jittered pause so the writers that collided spread out
+                time.sleep(random.uniform(0, min(0.2, 0.005 * (2 ** conflict))))
+            response = self.client.get_item(
+                TableName=self.table_name,
+                Key={'limiter_key': {'S': key}},
+                ConsistentRead=True
+            )
+            item = response.get('Item')
+            version = int(item['version']['N']) if item else 0
+            state = json.loads(item['state']['S']) if item else {}
+
+            new_state, result = fn(state)
+
+            put = {
+                'TableName': self.table_name,
+                'Item': {
+                    'limiter_key': {'S': key},
+                    'version': {'N': str(version + 1)},
+                    'state': {'S': json.dumps(new_state)}
+                }
+            }
+            if self.expire_after_seconds:
+                put['Item']['expires_at'] = {'N': str(int(time.time()) + self.expire_after_seconds)}
+            if item:
+                put['ConditionExpression'] = 'version = :version'
+                put['ExpressionAttributeValues'] = {':version': {'N': str(version)}}
+            else:
+                put['ConditionExpression'] = 'attribute_not_exists(limiter_key)'
+
+            try:
+                self.client.put_item(**put)
+                return result
+            except self.client.exceptions.ConditionalCheckFailedException:
+                continue
+
+        raise RateLimitContention(f'Rate limiter state {key} is too contended')
+
+
+class RateLimiter:
+    """
+    Token-bucket limiter enforcing requests-per-second and tokens-per-second
+    budgets shared by every execution that uses the same backend.
+
+    Besides the global buckets each document gets its own pair of buckets
+    refilled at 1/N of the global rates, where N is the number of documents
+    that acquired recently. A large document therefore cannot drain the
+    budget while small ones wait, and a lone document still gets all of it.
+
+    The state is spread over several records so no single one is written on
+    every request: the global budget is split into `shards` records (each
+    with 1/shards of the rates, one picked at random per take), every
+    document has its own record, and the active set is only touched on a
+    heartbeat. Contention on a record is treated like a throttle.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        requests_per_second: float,
+        tokens_per_second: float,
+        burst_seconds: float = 1.0,
+        name: str = 'bedrock',
+        shards: int = 1
+    ):
+        self.backend = backend
+        self.requests_per_second = requests_per_second
+        self.tokens_per_second = tokens_per_second
+        self.burst_seconds = burst_seconds
+        self.name = name
+        self.shards = max(1, shards)
+        self._heartbeats: Dict[str, Tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def _active_documents(self, document_id: str, now: float) -> int:
+        """
+        Documents that acquired within ACTIVE_TTL_SECONDS, refreshing this
+        one's heartbeat when it is due
+        """
+
+        with self._lock:
+            beat = self._heartbeats.get(document_id)
+        if beat is not None and now - beat[0] < HEARTBEAT_SECONDS:
+            return beat[1]
+
+        def apply(state):
+            active = state.setdefault('active', {})
+            active[document_id] = now
+            for doc, seen in list(active.items()):
+                if now - seen > ACTIVE_TTL_SECONDS:
+                    del active[doc]
+            return state, len(active)
+
+        count = self.backend.update(f"{self.name}:active", apply)
+        with self._lock:
+            for doc, (seen, _) in list(self._heartbeats.items()):
+                if now - seen > ACTIVE_TTL_SECONDS:
+                    del self._heartbeats[doc]
+            self._heartbeats[document_id] = (now, count)
+        return count
+
+    def _take(self, key: str, wanted, now: float, refund: bool = False) -> float:
+        """
+        Take every (bucket, cost, rate) from one record if all of them
+        have the tokens, else nothing; returns the wait until they would.
+        refund puts the costs back instead.
+        """
+
+        def apply(state):
+            buckets = state.setdefault('buckets', {})
+            wait = 0.0
+            levels = {}
+            for bucket, cost, rate in wanted:
+                # A single request larger than the burst must still pass eventually
+                capacity = max(rate * self.burst_seconds, cost)
+                level, updated = buckets.get(bucket, [capacity, now])
+                level = min(capacity, level + max(0.0, now - updated) * rate)
+                if refund:
+                    level = min(capacity, level + cost)
+                levels[bucket] = level
+                if not refund and level < cost:
+                    wait = max(wait, (cost - level) / rate)
+
+            for bucket, cost, _ in wanted:
+                taken = cost if wait == 0.0 and not refund else 0
+                buckets[bucket] = [levels[bucket] - taken, now]
+            return state, wait
+
+        return self.backend.update(key, apply)
+
+    def _take_global(self, tokens: int, now: float) -> float:
+        shard = random.randrange(self.shards)
+        return self._take(f"{self.name}:global:{shard}", [
+            ('requests', 1, self.requests_per_second / self.shards),
+            ('tokens', tokens, self.tokens_per_second / self.shards),
+        ], now)
+
+    def _try_take(self, document_id: str, tokens: int, now: float) -> float:
+        share = 1.0 / max(1, self._active_documents(document_id, now))
+        document_key = f"{self.name}:doc:{document_id}"
+        document_buckets = [
+            ('requests', 1, self.requests_per_second * share),
+            ('tokens', tokens, self.tokens_per_second * share),
+        ]
+        wait = self._take(document_key, document_buckets, now)
+        if wait > 0:
+            return wait
+
+        wait = self._take_global(tokens, now)
+        if wait > 0:
+            # The document's share was taken but the global budget is short
+            self._take(document_key, document_buckets, now, refund=True)
+        return wait
+
+    def acquire(self, document_id: str, tokens: int, timeout: Optional[float] = None) -> bool:
+        """
+        Block until one request of the given token cost fits the budgets.
+        Returns False if that would take longer than timeout seconds.
+        """
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        contended = 0
+        while True:
+            try:
+                wait = self._try_take(document_id, tokens, time.time())
+                contended = 0
+            except RateLimitContention as e:
+                # Too many writers on one record: back off like a throttle
+                contended += 1
+                wait = random.uniform(0.05, 0.1) * (2 ** min(contended, 4))
+                print(f"{str(e)}; retrying in {wait:.2f}s")
+            if wait <= 0:
+                return True
+            if deadline is not None and time.monotonic() + min(wait, MAX_SLEEP_SECONDS) > deadline:
+                return False
+            time.sleep(min(wait, MAX_SLEEP_SECONDS))
+
+    def try_acquire_global(self, tokens: int) -> bool:
+        """
+        Take one request of the given token cost from the global budget only
+        if it fits right now, without waiting or touching any document's
+        share: for extra copies of a request that was already admitted
+        (hedges), which must count against the quota but not delay anyone
+        """
+
+        try:
+            return self._take_global(tokens, time.time()) <= 0
+        except RateLimitContention:
+            return False
+
+
+def create_backend(
+    backend_name: str,
+    file_path: str,
+    table_name: Optional[str] = None,
+    expire_after_seconds: Optional[int] = None
+) -> RateLimitBackend:
+    """
+    Backend by name: memory, file (file_path) or dynamodb (table_name,
+    items expiring expire_after_seconds after their last write)
+    """
+
+    if backend_name == 'memory':
+        return InMemoryBackend()
+    if backend_name == 'file':
+        return FileBackend(file_path)
+    if backend_name == 'dynamodb':
+        import boto3
+        return DynamoDBBackend(
+            boto3.client('dynamodb', region_name=os.environ.get('AWS_REGION', 'sa-east-1')),
+            table_name,
+            expire_after_seconds=expire_after_seconds
+        )
+    raise ValueError(f'Unknown backend: {backend_name}')
+
+
+def create_rate_limiter() -> Optional[RateLimiter]:
+    """
+    Build the limiter configured through environment variables, or None
+    when RATE_LIMIT_BACKEND is 'none'
+    """
+
+    backend_name = os.environ.get('RATE_LIMIT_BACKEND', 'none')
+    if backend_name == 'none':
+        return None
+
+    backend = create_backend(
+        backend_name,
+        os.environ.get('RATE_LIMIT_FILE', '/tmp/bedrock_rate_limit.json'),
+        os.environ.get('RATE_LIMIT_TABLE'),
+        expire_after_seconds=STATE_EXPIRE_SECONDS
+    )
+
+    return RateLimiter(
+        backend,
+        requests_per_second=float(os.environ.get('BEDROCK_REQUESTS_PER_SECOND', '20')),
+        tokens_per_second=float(os.environ.get('BEDROCK_TOKENS_PER_SECOND', '5000')),
+        shards=int(os.environ.get('RATE_LIMIT_SHARDS', '1'))
+    )
@@ -0,0 +1,625 @@
+import os
+import json
+import time
+import uuid
+import boto3
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from pdf_prescan import prescan_s3_object, route_for, estimate_processing_seconds
+from pipeline_status import publish
+from artifacts import put_artifact
+from rate_limiter import RateLimitBackend, create_backend
+
+s3_client = boto3.client('s3', region_name='sa-east-1')
+stepfunctions = boto3.client('stepfunctions', region_name='sa-east-1')
+lambda_client = boto3.client('lambda', region_name='sa-east-1')
+
+# Small uploads go to the fused single-invocation function instead of the
+# four-stage state machine (unset disables it): up to FAST_PATH_MAX_PAGES
+# pages (when the upload was pre-scanned) and FAST_PATH_MAX_BYTES bytes
+FAST_PATH_FUNCTION = os.environ.get('FAST_PATH_FUNCTION')
+FAST_PATH_MAX_BYTES = int(os.environ.get('FAST_PATH_MAX_BYTES', '1048576'))
+FAST_PATH_MAX_PAGES = int(os.environ.get('FAST_PATH_MAX_PAGES', '5'))
+# Uploads are pre-scanned (pdf_prescan) for routing and cost estimates;
+# those it finds nothing to extract from (not a PDF, no pages, image-only
+# or blank) are rejected before any processing starts
+PRESCAN_ENABLED = os.environ.get('PRESCAN_ENABLED', 'true').lower() == 'true'
+PRESCAN_REJECT = os.environ.get('PRESCAN_REJECT', 'true').lower() == 'true'
+
+# Jobs are classed by estimated page count; each class has its own
+# concurrency quota so large documents cannot take every slot
+SCHEDULER_SMALL_MAX_PAGES = int(os.environ.get('SCHEDULER_SMALL_MAX_PAGES', '10'))
+SCHEDULER_MEDIUM_MAX_PAGES = int(os.environ.get('SCHEDULER_MEDIUM_MAX_PAGES', '100'))
+SCHEDULER_QUOTAS = os.environ.get('SCHEDULER_QUOTAS', 'small:8,medium:4,large:2')
+# Within a class the cheapest job goes first; waiting lowers a job's cost
+# by this many pages per second so the largest ones are not starved
+SCHEDULER_AGING_PAGES_PER_SECOND = float(os.environ.get('SCHEDULER_AGING_PAGES_PER_SECOND', '1.0'))
+# Added per job the same tenant already has running
+SCHEDULER_TENANT_PENALTY_PAGES = float(os.environ.get('SCHEDULER_TENANT_PENALTY_PAGES', '50'))
+# Optionally lend the unused quota of classes with an empty queue to jobs
+# that have waited at least SCHEDULER_LEND_AFTER_SECONDS. Jobs cannot be
+# preempted, so a lent slot stays taken when uploads of its class arrive
+# later; off by default
+SCHEDULER_LEND_IDLE = os.environ.get('SCHEDULER_LEND_IDLE', 'false').lower() == 'true'
+SCHEDULER_LEND_AFTER_SECONDS = float(os.environ.get('SCHEDULER_LEND_AFTER_SECONDS', '30'))
+# Slots whose completion event was lost are reclaimed after this long
+# (state machine executions) or, for fast path invocations, after
+# SCHEDULER_FAST_PATH_LEASE_SECONDS: a failed invocation normally frees its
+# slot through its on-failure destination, this only covers a lost event.
+# It covers the function timeout times the three async attempts plus the
+# retry delays.
+SCHEDULER_LEASE_SECONDS = float(os.environ.get('SCHEDULER_LEASE_SECONDS', '7200'))
+SCHEDULER_FAST_PATH_LEASE_SECONDS = float(os.environ.get('SCHEDULER_FAST_PATH_LEASE_SECONDS', '900'))
+# Queued jobs are separate records ordered by priority; each transition
+# only reads the first SCHEDULER_CANDIDATES of every class
+SCHEDULER_CANDIDATES = int(os.environ.get('SCHEDULER_CANDIDATES', '50'))
+
+# Page count when the pre-scan cannot read the page tree
+BYTES_PER_PAGE = int(os.environ.get('SCHEDULER_BYTES_PER_PAGE', '50000'))
+
+
+def parse_quotas(spec: str) -> Dict[str, int]:
+    quotas = {}
+    for item in spec.split(','):
+        name, _, value = item.strip().partition(':')
+        quotas[name] = int(value)
+    return quotas
+
+
+def classify(pages: int) -> str:
+    if pages <= SCHEDULER_SMALL_MAX_PAGES:
+        return 'small'
+    if pages <= SCHEDULER_MEDIUM_MAX_PAGES:
+        return 'medium'
+    return 'large'
+
+
+def tenant_of(key: str) -> str:
+    """
+    uploads/<tenant>/<file>.pdf; uploads without a tenant prefix share one
+    """
+
+    parts = key.split('/')
+    return parts[1] if len(parts) > 2 else 'default'
+
+
+def prescan_job(job: Dict) -> Dict:
+    """
+    Pre-scan the upload with ranged reads (pdf_prescan) and add the page
+    count, estimated chunks, route and estimated processing time. A failed
+    pre-scan never blocks the upload: it falls back to a size estimate and
+    the size-based route, as does PRESCAN_ENABLED=false.
+    """
+
+    if not PRESCAN_ENABLED:
+        return dict(job, pages=max(1, (job.get('size') or 0) // BYTES_PER_PAGE))
+    try:
+        scan = prescan_s3_object(s3_client, job['bucket'], job['key'], job.get('size'))
+    except Exception as e:
+        print(f"Could not pre-scan {job['key']}: {str(e)}")
+        return dict(job, pages=max(1, (job.get('size') or 0) // BYTES_PER_PAGE))
+
+    decision = route_for(scan, FAST_PATH_MAX_PAGES)
+    if decision['route'] == 'reject' and not PRESCAN_REJECT:
+        decision = {'route': 'state_machine', 'reason': decision['reason']}
+    if decision['route'] == 'fast_path' and scan['size_bytes'] > FAST_PATH_MAX_BYTES:
+        # Few pages but large (images): keep it off the single invocation
+        decision = {'route': 'state_machine', 'reason': f"{decision['reason']}, {scan['size_bytes']} bytes"}
+    pages = scan['pages'] or max(1, scan['size_bytes'] // BYTES_PER_PAGE)
+
+    print(f"Pre-scan of {job['key']}: {scan['pages']} pages, {scan['content']}, "
+          f"{scan['estimated_chunks']} chunks -> {decision['route']} ({decision['reason']}) "
+          f"in {scan['range_reads']} range reads")
+
+    return dict(
+        job,
+        size=scan['size_bytes'],
+        pages=pages,
+        estimated_chunks=scan['estimated_chunks'],
+        route=decision['route'],
+        route_reason=decision['reason'],
+        estimated_seconds=round(estimate_processing_seconds(scan, decision['route']), 1),
+        prescan={name: value for name, value in scan.items() if name != 'sampled_pages'}
+    )
+
+
+def new_job(bucket: str, key: str, size: Optional[int], job_id: Optional[str] = None, profile: bool = False) -> Dict:
+    job = {
+        'job_id': job_id or uuid.uuid4().hex,
+        'bucket': bucket,
+        'key': key,
+        'size': size
+    }
+    if profile:
+        job['profile'] = True
+    return job
+
+
+def estimate_job(job: Dict) -> Dict:
+    """
+    Add the cost estimate the scheduler orders by: pages, class and tenant
+    """
+
+    if 'pages' not in job:
+        job = prescan_job(job)
+    return dict(job, tenant=tenant_of(job['key']), **{'class': classify(job['pages'])})
+
+
+def start_job(job: Dict) -> Dict:
+    """
+    Start processing of one upload: the fast path function for small
+    objects, otherwise a state machine execution
+    """
+
+    bucket, key, size = job['bucket'], job['key'], job.get('size')
+    execution_input = {
+        'bucket': bucket,
+        'key': key
+    }
+    if job.get('profile'):
+        execution_input['profile'] = True
+
+    if 'route' in job:
+        fast_path = job['route'] == 'fast_path'
+    else:
+        fast_path = size is not None and size <= FAST_PATH_MAX_BYTES
+
+    # Published before starting: an upload event resets the document's
+    # record and the first stage may report before the start call returns
+    if FAST_PATH_FUNCTION and fast_path:
+        publish(key, 'upload', 'started', route='fast_path', pages=job.get('pages'),
+                estimated_seconds=job.get('estimated_seconds'))
+        lambda_client.invoke(
+            FunctionName=FAST_PATH_FUNCTION,
+            InvocationType='Event',
+            Payload=json.dumps(execution_input)
+        )
+
+        print(f"Routed {key} ({job.get('pages', size)} {'pages' if 'pages' in job else 'bytes'}) "
+              f"to fast path: {FAST_PATH_FUNCTION}")
+
+        return {
+            'message': 'Fast path invocation started successfully',
+            'route': 'fast_path',
+            'bucket': bucket,
+            'key': key
+        }
+
+    step_function_arn = os.environ.get('STEP_FUNCTION_ARN')
+    if not step_function_arn:
+        raise ValueError('Missing STEP_FUNCTION_ARN environment variable')
+
+    execution_name = f"pdf-processing-{key.replace('/', '-').replace('.', '-')}-{job['job_id'][:8]}"
+    publish(key, 'upload', 'started', route='state_machine', pages=job.get('pages'),
+            estimated_seconds=job.get('estimated_seconds'))
+    response = stepfunctions.start_execution(
+        stateMachineArn=step_function_arn,
+        name=execution_name,
+        input=json.dumps(execution_input)
+    )
+
+    print(f"Started Step Function execution: {response['executionArn']}")
+
+    return {
+        'message': 'Step Function execution started successfully',
+        'executionArn': response['executionArn'],
+        'bucket': bucket,
+        'key': key
+    }
+
+
+def reject_job(job: Dict) -> Dict:
+    """
+    Record why an upload will not be processed in its summaries/ entry
+    instead of starting an execution that could only fail
+    """
+
+    bucket, key = job['bucket'], job['key']
+    summary = {
+        'document_id': key,
+        'source': {
+            'bucket': bucket,
+            'key': key,
+            's3_location': f"s3://{bucket}/{key}"
+        },
+        'processing': {
+            'status': 'rejected',
+            'reason': job['route_reason'],
+            'prescan': job.get('prescan'),
+            'completion_timestamp': datetime.now(timezone.utc).isoformat()
+        },
+        'pipeline_version': '1.0'
+    }
+    summary_file_key = f"summaries/{key}.json"
+    put_artifact(s3_client, bucket, summary_file_key, summary)
+
+    print(f"Rejected {key} ({job['route_reason']}), summary saved to: s3://{bucket}/{summary_file_key}")
+    publish(key, 'upload', 'rejected', reason=job['route_reason'], pages=job.get('pages'))
+
+    return {
+        'message': 'Upload rejected by pre-scan',
+        'route': 'reject',
+        'reason': job['route_reason'],
+        'summary_file_key': summary_file_key,
+        'bucket': bucket,
+        'key': key
+    }
+
+
+class JobQueue:
+    """
+    Queued jobs, one record each, read per class in priority order. remove()
+    is the claim: it succeeds for exactly one caller.
+    """
+
+    def put(self, job_class: str, priority: str, job: Dict):
+        raise NotImplementedError
+
+    def head(self, job_class: str, limit: int) -> List[Dict]:
+        raise NotImplementedError
+
+    def remove(self, job_class: str, priority: str) -> bool:
+        raise NotImplementedError
+
+
+class BackendJobQueue(JobQueue):
+    """
+    Queue on a limiter backend (memory or file): one record per class,
+    which is fine for a single host
+    """
+
+    def __init__(self, backend: RateLimitBackend, name: str = 'scheduler'):
+        self.backend = backend
+        self.name = name
+
+    def _key(self, job_class: str) -> str:
+        return f"{self.name}:queue:{job_class}"
+
+    def put(self, job_class, priority, job):
+        def apply(state):
+            state.setdefault('jobs', {})[priority] = job
+            return state, None
+
+        self.backend.update(self._key(job_class), apply)
+
+    def head(self, job_class, limit):
+        def apply(state):
+            jobs = state.get('jobs', {})
+            return state, [jobs[priority] for priority in sorted(jobs)[:limit]]
+
+        return self.backend.update(self._key(job_class), apply)
+
+    def remove(self, job_class, priority):
+        def apply(state):
+            return state, state.setdefault('jobs', {}).pop(priority, None) is not None
+
+        return self.backend.update(self._key(job_class), apply)
+
+
+class DynamoDBJobQueue(JobQueue):
+    """
+    Queue table with the class as partition key and the priority as sort
+    key, so the head of a class is one Query however long the queue is
+    """
+
+    def __init__(self, dynamodb_client, table_name: str):
+        self.client = dynamodb_client
+        self.table_name = table_name
+
+    def put(self, job_class, priority, job):
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                'job_class': {'S': job_class},
+                'priority': {'S': priority},
+                'job': {'S': json.dumps(job)}
+            }
+        )
+
+    def head(self, job_class, limit):
+        response = self.client.query(
+            TableName=self.table_name,
+            KeyConditionExpression='job_class = :job_class',
+            ExpressionAttributeValues={':job_class': {'S': job_class}},
+            ConsistentRead=True,
+            Limit=limit
+        )
+        return [json.loads(item['job']['S']) for item in response.get('Items', [])]
+
+    def remove(self, job_class, priority):
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={'job_class': {'S': job_class}, 'priority': {'S': priority}},
+                ConditionExpression='attribute_exists(priority)'
+            )
+            return True
+        except self.client.exceptions.ConditionalCheckFailedException:
+            return False
+
+
+class Scheduler:
+    """
+    Admission control between uploads and execution start.
+
+    Jobs wait in a queue shared by every trigger and are started when their
+    class has a free slot. Within a class the job with the lowest effective
+    cost goes first: estimated pages, plus a penalty per job its tenant
+    already has running, minus an aging credit for the time it has waited.
+    Aging is linear, so pages + enqueued time x aging rate orders a class
+    for good; queued jobs are stored under that priority (JobQueue) and a
+    transition only reads the head of each class, applying the tenant
+    penalty among those candidates. Quotas are guarantees: idle quota is
+    lent to jobs that have waited long enough, and a class's own quota
+    stays available to it while lent out.
+
+    The running slots, at most the sum of the quotas, live in one record
+    of the backend updated atomically. A slot is held until release() is
+    called for the job's key, normally from the execution's completion
+    event, or until its lease expires.
+    """
+
+    def __init__(
+        self,
+        backend: RateLimitBackend,
+        quotas: Dict[str, int],
+        queue: Optional[JobQueue] = None,
+        aging_pages_per_second: float = SCHEDULER_AGING_PAGES_PER_SECOND,
+        tenant_penalty_pages: float = SCHEDULER_TENANT_PENALTY_PAGES,
+        lease_seconds: float = SCHEDULER_LEASE_SECONDS,
+        fast_path_lease_seconds: float = SCHEDULER_FAST_PATH_LEASE_SECONDS,
+        lend_idle: bool = SCHEDULER_LEND_IDLE,
+        lend_after_seconds: float = SCHEDULER_LEND_AFTER_SECONDS,
+        candidates: int = SCHEDULER_CANDIDATES,
+        name: str = 'scheduler'
+    ):
+        self.backend = backend
+        self.quotas = quotas
+        self.queue = queue if queue is not None else BackendJobQueue(backend, name)
+        self.aging_pages_per_second = aging_pages_per_second
+        self.tenant_penalty_pages = tenant_penalty_pages
+        self.lease_seconds = lease_seconds
+        self.fast_path_lease_seconds = fast_path_lease_seconds
+        self.lend_idle = lend_idle
+        self.lend_after_seconds = lend_after_seconds
+        self.candidates = candidates
+        self.name = name
+
+    def effective_cost(self, job: Dict, running_by_tenant: Dict[str, int], now: float) -> float:
+        waited = now - job['enqueued']
+        return (
+            job['pages']
+            + running_by_tenant.get(job['tenant'], 0) * self.tenant_penalty_pages
+            - waited * self.aging_pages_per_second
+        )
+
+    def priority(self, job: Dict) -> str:
+        """
+        Sort key of a queued job: its effective cost without the tenant
+        penalty, shifted by a constant so it does not change while waiting
+        """
+
+        value = job['pages'] + job['enqueued'] * self.aging_pages_per_second
+        return f"{value:020.3f}#{job['job_id']}"
+
+    def _lease(self, job: Dict) -> float:
+        if FAST_PATH_FUNCTION and job.get('route') == 'fast_path':
+            return self.fast_path_lease_seconds
+        return self.lease_seconds
+
+    def _transition(self, now: float, release_key: Optional[str] = None):
+        queued = [job for job_class in self.quotas for job in self.queue.head(job_class, self.candidates)]
+
+        def apply(state):
+            running = state.setdefault('running', {})
+            released = False
+
+            for job_id, slot in list(running.items()):
+                if slot['expires'] < now:
+                    print(f"Scheduler lease expired for {slot['key']}")
+                    del running[job_id]
+
+            if release_key is not None:
+                holders = sorted(
+                    (slot['started'], job_id) for job_id, slot in running.items() if slot['key'] == release_key
+                )
+                if holders:
+                    del running[holders[0][1]]
+                    released = True
+
+            running_by_class: Dict[str, int] = {}
+            running_by_tenant: Dict[str, int] = {}
+            for slot in running.values():
+                running_by_class[slot['class']] = running_by_class.get(slot['class'], 0) + 1
+                running_by_tenant[slot['tenant']] = running_by_tenant.get(slot['tenant'], 0) + 1
+
+            claimed = []
+
+            def claim(job, borrowed):
+                job_class = job['class']
+                running_by_class[job_class] = running_by_class.get(job_class, 0) + 1
+                running_by_tenant[job['tenant']] = running_by_tenant.get(job['tenant'], 0) + 1
+                running[job['job_id']] = {
+                    'key': job['key'],
+                    'class': job_class,
+                    'tenant': job['tenant'],
+                    'started': now,
+                    'expires': now + self._lease(job),
+                    'borrowed': borrowed
+                }
+                claimed.append(job)
+
+            # A job another transition claimed since the queue was read
+            # already has a slot
+            candidates = [job for job in queued if job['job_id'] not in running]
+            waiting = []
+            for job in sorted(candidates, key=lambda job: self.effective_cost(job, running_by_tenant, now)):
+                if running_by_class.get(job['class'], 0) < self.quotas.get(job['class'], 0):
+                    claim(job, False)
+                else:
+                    waiting.append(job)
+
+            if self.lend_idle and waiting:
+                # Quota of classes with nothing queued is lent to the others,
+                # keeping the total within the sum of the quotas
+                waiting_classes = {job['class'] for job in waiting}
+                idle = sum(
+                    max(0, quota - running_by_class.get(name, 0))
+                    for name, quota in self.quotas.items() if name not in waiting_classes
+                )
+                lendable = min(idle, sum(self.quotas.values()) - len(running))
+                eligible = [job for job in waiting if now - job['enqueued'] >= self.lend_after_seconds]
+                for job in eligible[:max(0, lendable)]:
+                    claim(job, True)
+
+            return state, (claimed, released)
+
+        claimed, released = self.backend.update(self.name, apply)
+
+        # Taking the job off the queue is the claim; one a concurrent
+        # transition took first (and may have finished since) gives its slot back
+        lost = [job for job in claimed if not self.queue.remove(job['class'], job['priority'])]
+        if lost:
+            lost_ids = {job['job_id'] for job in lost}
+
+            def forget(state):
+                for job_id in lost_ids:
+                    state.setdefault('running', {}).pop(job_id, None)
+                return state, None
+
+            self.backend.update(self.name, forget)
+        return [job for job in claimed if job not in lost], released
+
+    def _start(self, claimed: List[Dict], start: Callable[[Dict], Dict], now: float) -> List[Dict]:
+        started = []
+        for job in claimed:
+            waited = now - job['enqueued']
+            try:
+                started.append(start(job))
+                print(f"Scheduler started {job['key']} ({job['class']}, {job['pages']} pages) after {waited:.1f}s")
+            except Exception as e:
+                print(f"Scheduler could not start {job['key']}, dropping it: {str(e)}")
+                publish(job['key'], 'upload', 'failed', error=str(e)[:500])
+                retry_at = time.time()
+                claimed_next, _ = self._transition(retry_at, release_key=job['key'])
+                started.extend(self._start(claimed_next, start, retry_at))
+        return started
+
+    def submit(self, job: Dict, start: Callable[[Dict], Dict]) -> List[Dict]:
+        """
+        Queue a job and start whatever now fits the quotas (possibly the
+        job itself). Returns the results of start() for the started jobs.
+        Raises only when the job could not be queued: once it is, a failed
+        dispatch is left to the next transition (or the periodic sweep).
+        """
+
+        now = time.time()
+        job = dict(job, enqueued=now)
+        job['priority'] = self.priority(job)
+        self.queue.put(job['class'], job['priority'], job)
+        try:
+            claimed, _ = self._transition(now)
+        except Exception as e:
+            print(f"Scheduler queued {job['key']} but could not dispatch: {str(e)}")
+            return []
+        return self._start(claimed, start, now)
+
+    def release(self, key: str, start: Callable[[Dict], Dict]) -> List[Dict]:
+        """
+        Free the slot held for key and start the jobs that now fit
+        """
+
+        now = time.time()
+        claimed, released = self._transition(now, release_key=key)
+        if not released:
+            print(f"Scheduler had no running slot for {key}")
+        return self._start(claimed, start, now)
+
+    def renew(self, key: str, lease_seconds: float) -> bool:
+        """
+        Extend the lease of the slot held for key (a fast path invocation
+        that handed its upload to the state machine keeps the slot)
+        """
+
+        now = time.time()
+
+        def apply(state):
+            holders = sorted(
+                (slot['started'], job_id) for job_id, slot in state.setdefault('running', {}).items()
+                if slot['key'] == key
+            )
+            if not holders:
+                return state, False
+            state['running'][holders[0][1]]['expires'] = now + lease_seconds
+            return state, True
+
+        return self.backend.update(self.name, apply)
+
+    def dispatch(self, start: Callable[[Dict], Dict]) -> List[Dict]:
+        """
+        Reclaim expired leases and start the jobs that fit
+        """
+
+        now = time.time()
+        claimed, _ = self._transition(now)
+        return self._start(claimed, start, now)
+
+    def snapshot(self) -> Dict:
+        state = self.backend.update(self.name, lambda state: (state, json.loads(json.dumps(state))))
+        state['queue'] = [job for job_class in self.quotas for job in self.queue.head(job_class, self.candidates)]
+        return state
+
+
+def create_scheduler() -> Optional[Scheduler]:
+    """
+    Build the scheduler configured through environment variables, or None
+    when SCHEDULER_BACKEND is 'none' (uploads start immediately)
+    """
+
+    backend_name = os.environ.get('SCHEDULER_BACKEND', 'none')
+    if backend_name == 'none':
+        return None
+
+    backend = create_backend(
+        backend_name,
+        os.environ.get('SCHEDULER_FILE', '/tmp/pipeline_scheduler.json'),
+        os.environ.get('SCHEDULER_TABLE')
+    )
+    queue = None
+    if backend_name == 'dynamodb':
+        queue = DynamoDBJobQueue(backend.client, os.environ.get('SCHEDULER_QUEUE_TABLE'))
+    return Scheduler(backend, parse_quotas(SCHEDULER_QUOTAS), queue=queue)
+
+
+scheduler = create_scheduler()
+
+
+def complete(key: str):
+    """
+    Called when processing of key has finished: free its slot and start the
+    next jobs. Scheduler errors are logged, never raised, so they cannot
+    fail a document that was processed.
+    """
+
+    if scheduler is None:
+        return
+    try:
+        scheduler.release(key, start_job)
+    except Exception as e:
+        print(f"Error releasing scheduler slot for {key}: {str(e)}")
+
+
+def handed_off(key: str):
+    """
+    Called when a fast path invocation started a state machine execution
+    for key: its slot now lasts as long as an execution's. Errors are
+    logged, never raised.
+    """
+
+    if scheduler is None:
+        return
+    try:
+        scheduler.renew(key, scheduler.lease_seconds)
+    except Exception as e:
+        print(f"Error renewing scheduler slot for {key}: {str(e)}")
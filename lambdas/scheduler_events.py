@@ -0,0 +1,97 @@
+import json
+from typing import Dict
+
+from profiling import profiled_handler
+from scheduler import scheduler, start_job
+from pipeline_status import publish
+
+TERMINAL_STATUSES = {'SUCCEEDED', 'FAILED', 'TIMED_OUT', 'ABORTED'}
+
+@profiled_handler('scheduler_events')
+def lambda_handler(event, context):
+    """
+    Scheduler Lambda: free the slot of a finished state machine execution
+    (EventBridge "Step Functions Execution Status Change") or of a fast path
+    invocation that failed every async attempt (its on-failure destination)
+    and start queued jobs; the periodic schedule event reclaims expired
+    leases. Executions that did not process their document are reported to
+    the status store.
+    """
+
+    print(f"Scheduler Events Lambda - Received event: {json.dumps(event)}")
+
+    key = failed_invocation_key(event)
+    if key:
+        failure = invocation_failure(event)
+    else:
+        key = finished_execution_key(event)
+        failure = execution_failure(event) if key else None
+    if failure:
+        publish(key, 'execution', 'failed', error=failure)
+
+    if scheduler is None:
+        return {'statusCode': 200, 'message': 'Scheduler disabled (SCHEDULER_BACKEND=none)'}
+
+    try:
+        if key:
+            started = scheduler.release(key, start_job)
+        else:
+            started = scheduler.dispatch(start_job)
+
+        print(f"Scheduler started {len(started)} job(s)")
+
+        return {
+            'statusCode': 200,
+            'released_key': key,
+            'started': len(started)
+        }
+
+    except Exception as e:
+        print(f"Error in scheduler events: {str(e)}")
+        raise Exception(f'Scheduler events failed: {str(e)}')
+
+def finished_execution_key(event: Dict):
+    """
+    Upload key of a terminal execution status change, None for other events
+    """
+
+    if event.get('detail-type') != 'Step Functions Execution Status Change':
+        return None
+    detail = event.get('detail', {})
+    if detail.get('status') not in TERMINAL_STATUSES:
+        return None
+    return json.loads(detail.get('input') or '{}').get('key')
+
+def execution_failure(event: Dict):
+    """
+    Why a finished execution did not process its document, None if it did:
+    its terminal status, or the error caught by the ProcessingFailed state
+    (which ends the execution as SUCCEEDED)
+    """
+
+    detail = event.get('detail', {})
+    if detail.get('status') != 'SUCCEEDED':
+        return detail.get('status')
+    try:
+        output = json.loads(detail.get('output') or '{}')
+    except ValueError:
+        return None
+    if isinstance(output, dict) and output.get('status') == 'FAILED':
+        return json.dumps(output.get('error'))[:500]
+    return None
+
+def failed_invocation_key(event: Dict):
+    """
+    Upload key of an asynchronous invocation delivered to its on-failure
+    destination, None for other events
+    """
+
+    if 'requestContext' not in event or 'requestPayload' not in event:
+        return None
+    return (event.get('requestPayload') or {}).get('key')
+
+def invocation_failure(event: Dict) -> str:
+    response = event.get('responsePayload') or {}
+    condition = event.get('requestContext', {}).get('condition', 'failed')
+    message = response.get('errorMessage') if isinstance(response, dict) else None
+    return f"{condition}: {message}"[:500] if message else condition
@@ -1,9 +1,10 @@
 import json
-import boto3
-import os
 
-stepfunctions = boto3.client('stepfunctions', region_name='sa-east-1')
+from profiling import profiled_handler, should_profile
+from scheduler import scheduler, new_job, prescan_job, estimate_job, start_job, reject_job
+from pipeline_status import publish
 
+@profiled_handler('trigger_step_function')
 def lambda_handler(event, context):
     """
     Trigger Lambda: Start Step Function execution when PDF is uploaded
@@ -17,36 +18,50 @@ def lambda_handler(event, context):
             s3_record = event['Records'][0]['s3']
             bucket = s3_record['bucket']['name']
             key = s3_record['object']['key']
+            size = s3_record['object'].get('size')
             
-            # Start Step Function execution
-            step_function_arn = os.environ.get('STEP_FUNCTION_ARN')
+            # Sampled executions are profiled in every stage (PROFILING=sampled)
+            job = new_job(bucket, key, size, job_id=context.aws_request_id, profile=should_profile())
             
-            if not step_function_arn:
-                raise ValueError('Missing STEP_FUNCTION_ARN environment variable')
-            
-            execution_name = f"pdf-processing-{key.replace('/', '-').replace('.', '-')}-{context.aws_request_id[:8]}"
-            
-            execution_input = {
-                'bucket': bucket,
-                'key': key
-            }
-            
-            response = stepfunctions.start_execution(
-                stateMachineArn=step_function_arn,
-                name=execution_name,
-                input=json.dumps(execution_input)
-            )
+            # Ranged-read pre-scan: page count, text vs image-only, route
+            job = prescan_job(job)
+            if job.get('route') == 'reject':
+                return {
+                    'statusCode': 200,
+                    'body': reject_job(job)
+                }
             
-            print(f"Started Step Function execution: {response['executionArn']}")
+            if scheduler is not None:
+                job = estimate_job(job)
+                publish(key, 'upload', 'queued', pages=job['pages'], estimated_seconds=job.get('estimated_seconds'),
+                        **{'class': job['class']})
+                try:
+                    started = scheduler.submit(job, start_job)
+                except Exception as e:
+                    # Fail open: an upload that could not even be queued must not
+                    # be lost to a scheduler outage (once queued, it waits its turn)
+                    print(f"Scheduler unavailable, starting {key} immediately: {str(e)}")
+                    started = [start_job(job)]
+                
+                print(f"Queued {key} as {job['class']} ({job['pages']} pages), started {len(started)} job(s)")
+                
+                return {
+                    'statusCode': 200,
+                    'body': {
+                        'message': 'Upload queued for processing',
+                        'route': 'scheduler',
+                        'class': job['class'],
+                        'estimated_pages': job['pages'],
+                        'estimated_seconds': job.get('estimated_seconds'),
+                        'started': started,
+                        'bucket': bucket,
+                        'key': key
+                    }
+                }
             
             return {
                 'statusCode': 200,
-                'body': {
-                    'message': 'Step Function execution started successfully',
-                    'executionArn': response['executionArn'],
-                    'bucket': bucket,
-                    'key': key
-                }
+                'body': start_job(job)
             }
             
         else:
@@ -54,6 +69,8 @@ def lambda_handler(event, context):
             
     except Exception as e:
         print(f"Error starting Step Function: {str(e)}")
+        if 'Records' in event and event['Records']:
+            publish(event['Records'][0]['s3']['object']['key'], 'upload', 'failed', error=str(e)[:500])
         return {
             'statusCode': 500,
             'body': {'error': f'Failed to start Step Function: {str(e)}'}
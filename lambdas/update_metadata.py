@@ -1,10 +1,15 @@
 import json
 import boto3
-from typing import Dict
+from typing import Dict, Optional
 from datetime import datetime, timezone
 
+from profiling import profiled_handler
+from pipeline_status import publish
+from artifacts import put_artifact
+
 s3_client = boto3.client('s3', region_name='sa-east-1')
 
+@profiled_handler('update_metadata')
 def lambda_handler(event, context):
     """
     Lambda 4: Save processing summary to S3
@@ -20,6 +25,7 @@ def lambda_handler(event, context):
         indexed_documents = event.get('indexed_documents', 0)
         opensearch_index = event.get('opensearch_index')
         processing_timestamp = event.get('processing_timestamp')
+        dedup_stats = event.get('dedup_stats')
         
         if not document_id:
             raise ValueError('Missing document_id')
@@ -31,19 +37,16 @@ def lambda_handler(event, context):
             key=key,
             indexed_documents=indexed_documents,
             opensearch_index=opensearch_index,
-            processing_timestamp=processing_timestamp
+            processing_timestamp=processing_timestamp,
+            dedup_stats=dedup_stats
         )
         
         # Save summary to S3
         summary_file_key = f"summaries/{document_id}.json"
-        s3_client.put_object(
-            Bucket=bucket,
-            Key=summary_file_key,
-            Body=json.dumps(summary, indent=2),
-            ContentType='application/json'
-        )
+        put_artifact(s3_client, bucket, summary_file_key, summary)
         
         print(f"Processing summary created for document: {document_id}")
+        publish(document_id, 'summary', 'completed', counts={'indexed': indexed_documents})
         print(f"Summary saved to: s3://{bucket}/{summary_file_key}")
         
         return {
@@ -58,6 +61,8 @@ def lambda_handler(event, context):
         
     except Exception as e:
         print(f"Error creating processing summary: {str(e)}")
+        if event.get('document_id'):
+            publish(event['document_id'], 'summary', 'failed', error=str(e)[:500])
         raise Exception(f'Metadata update failed: {str(e)}')
 
 def create_processing_summary(
@@ -66,7 +71,8 @@ def create_processing_summary(
     key: str,
     indexed_documents: int,
     opensearch_index: str,
-    processing_timestamp: str
+    processing_timestamp: str,
+    dedup_stats: Optional[Dict] = None
 ) -> Dict:
     """
     Create processing summary (placeholder for S3 JSON approach)
@@ -89,6 +95,9 @@ def create_processing_summary(
         'pipeline_version': '1.0'
     }
     
+    if dedup_stats:
+        summary['processing']['dedup'] = dedup_stats
+    
     print("Processing summary created (ready for S3 JSON approach):")
     print(json.dumps(summary, indent=2))
     
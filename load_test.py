@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+"""
+Script de teste de carga HTTP do app web (app.py ou asgi_app.py)
+Sobe o app com S3, Bedrock e modelo de respostas locais (WEB_BACKEND=local),
+gera carga em malha aberta (chegadas Poisson numa taxa fixa, sem esperar as
+respostas) em /upload (PDFs sintéticos), /files, /search e /ask e mede
+throughput, latência p50/p95/p99, taxa de erros e CPU/RSS do servidor
+Executa: python load_test.py [--app flask|asgi] [--scenario search:50] [--report base.json]
+         python load_test.py --baseline base.json [--threshold 0.2]  (falha se regredir)
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import aiohttp  # instalado com o aiobotocore (requirements.txt)
+import numpy as np
+
+from retrieval import SegmentedIndex
+from run_local_pipeline import generate_pdf, WORDS, BUCKET_NAME
+
+# Cenários padrão: requisições por segundo oferecidas a cada rota
+DEFAULT_SCENARIOS = ['files:20', 'search:40', 'ask:10', 'upload:4']
+SERVER_COMMANDS = {
+    'flask': [sys.executable, '-m', 'flask', '--app', 'app', 'run', '--with-threads', '--no-reload'],
+    'asgi': [sys.executable, 'asgi_app.py']
+}
+SAMPLE_SECONDS = 0.25
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK')
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def build_index(directory, documents=40, chunks=100, seed=0):
+    """
+    Índice vetorial sintético para /search e /ask
+    """
+
+    index = SegmentedIndex(directory)
+    generator = np.random.default_rng(seed)
+    batch = []
+    for number in range(documents):
+        document_id = f"uploads/load-{number:04d}.pdf"
+        ids = [f"{document_id}#{chunk}" for chunk in range(chunks)]
+        vectors = generator.standard_normal((chunks, 1536)).astype('float32')
+        metadata = [{'document_id': document_id, 'chunk_id': ids[chunk], 'page': chunk // 4 + 1,
+                     'text': f"Trecho {chunk} do documento sintético {number}"} for chunk in range(chunks)]
+        batch.append((document_id, ids, vectors, metadata))
+    index.add_documents(batch)
+    while index.compact():
+        pass
+
+def start_server(app_name, port, environment, log_path):
+    """
+    Sobe o app num processo separado com o ambiente dos stand-ins
+    """
+
+    command = SERVER_COMMANDS[app_name] + ['--port', str(port)]
+    env = dict(os.environ, **environment)
+    log = open(log_path, 'w')
+    process = subprocess.Popen(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                               stdout=log, stderr=subprocess.STDOUT)
+    return process
+
+async def wait_ready(session, base_url, process, timeout=60.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise Exception(f'servidor terminou com código {process.returncode}')
+        try:
+            async with session.get(f"{base_url}/health") as response:
+                if response.status == 200:
+                    return
+        except aiohttp.ClientError:
+            pass
+        await asyncio.sleep(0.2)
+    raise Exception(f'servidor não respondeu em {timeout:.0f}s')
+
+class ServerSampler:
+    """
+    CPU e RSS do processo do servidor (e filhos) lidos de /proc
+    """
+
+    def __init__(self, pid):
+        self.pid = pid
+        self.samples = []
+
+    def _processes(self):
+        pids, children = [self.pid], {}
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f"/proc/{entry}/stat") as f:
+                        parent = int(f.read().rsplit(')', 1)[1].split()[1])
+                    children.setdefault(parent, []).append(int(entry))
+                except (OSError, IndexError, ValueError):
+                    continue
+        for pid in pids:
+            pids.extend(children.get(pid, []))
+        return pids
+
+    def read(self):
+        ticks, rss_kb = 0, 0
+        for pid in self._processes():
+            try:
+                with open(f"/proc/{pid}/stat") as f:
+                    fields = f.read().rsplit(')', 1)[1].split()
+                ticks += int(fields[11]) + int(fields[12])
+                with open(f"/proc/{pid}/status") as f:
+                    for line in f:
+                        if line.startswith('VmRSS:'):
+                            rss_kb += int(line.split()[1])
+            except OSError:
+                continue
+        return time.monotonic(), ticks, rss_kb
+
+    async def run(self, stop):
+        previous = self.read()
+        while not stop.is_set():
+            await asyncio.sleep(SAMPLE_SECONDS)
+            current = self.read()
+            elapsed = current[0] - previous[0]
+            cpu_percent = (current[1] - previous[1]) / CLOCK_TICKS / elapsed * 100.0 if elapsed else 0.0
+            self.samples.append((cpu_percent, current[2] / 1024.0))
+            previous = current
+
+    def summary(self):
+        if not self.samples:
+            return {'cpu_percent_avg': None, 'cpu_percent_max': None, 'rss_mb_max': None}
+        cpu = [sample[0] for sample in self.samples]
+        return {
+            'cpu_percent_avg': round(sum(cpu) / len(cpu), 1),
+            'cpu_percent_max': round(max(cpu), 1),
+            'rss_mb_max': round(max(sample[1] for sample in self.samples), 1)
+        }
+
+def query_text(generator):
+    return ' '.join(generator.choice(WORDS) for _ in range(generator.randint(3, 8)))
+
+def multipart_body(filename, content):
+    boundary = uuid.uuid4().hex
+    body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n').encode() + content + f'\r\n--{boundary}--\r\n'.encode()
+    return boundary, body
+
+async def request_upload(session, base_url, generator, pdfs):
+    """
+    POST /upload seguido do GET do redirect, como o navegador; o resultado
+    vem na mensagem flash
+    """
+
+    pages, content = generator.choice(pdfs)
+    boundary, body = multipart_body(f"load-{pages}p.pdf", content)
+    async with session.post(f"{base_url}/upload", data=body, allow_redirects=False,
+                            headers={'Content-Type': f'multipart/form-data; boundary={boundary}'}) as response:
+        await response.read()
+        if response.status != 302:
+            return response.status, f'http_{response.status}'
+        cookies = {name: morsel.value for name, morsel in response.cookies.items()}
+        location = response.headers.get('Location', '/upload')
+    if location.startswith('/'):
+        location = f"{base_url}{location}"
+    async with session.get(location, cookies=cookies) as response:
+        page = await response.text()
+        if '✅ Arquivo' in page:
+            return response.status, None
+        return response.status, 'upload_refused'
+
+async def request_files(session, base_url, generator, pdfs):
+    async with session.get(f"{base_url}/files") as response:
+        page = await response.text()
+        return response.status, None if response.status == 200 and 'Erro ao listar' not in page else 'files_error'
+
+async def request_search(session, base_url, generator, pdfs):
+    async with session.get(f"{base_url}/search", params={'q': query_text(generator), 'k': '5'}) as response:
+        await response.read()
+        return response.status, None if response.status == 200 else f'http_{response.status}'
+
+async def request_ask(session, base_url, generator, pdfs):
+    async with session.get(f"{base_url}/ask", params={'q': query_text(generator), 'k': '3'}) as response:
+        await response.read()
+        return response.status, None if response.status == 200 else f'http_{response.status}'
+
+REQUESTS = {
+    'upload': request_upload,
+    'files': request_files,
+    'search': request_search,
+    'ask': request_ask
+}
+
+async def run_scenario(session, base_url, name, rate, duration, pdfs, sampler, timeout, max_in_flight, seed):
+    """
+    Malha aberta: as chegadas seguem um processo de Poisson na taxa pedida,
+    independente das respostas. A latência conta a partir do instante
+    previsto de envio, então atrasos do gerador não escondem a fila.
+    Os intervalos entre chegadas têm gerador próprio: o conteúdo das
+    requisições não desloca a sequência de chegadas para a mesma semente
+    """
+
+    generator = random.Random(seed)
+    arrivals = random.Random(f"arrivals-{seed}")
+    records, tasks = [], []
+    in_flight = 0
+
+    async def one(scheduled):
+        nonlocal in_flight
+        in_flight += 1
+        status, error = None, None
+        try:
+            status, error = await asyncio.wait_for(
+                REQUESTS[name](session, base_url, generator, pdfs), timeout
+            )
+        except asyncio.TimeoutError:
+            error = 'timeout'
+        except aiohttp.ClientError as e:
+            error = type(e).__name__
+        finally:
+            in_flight -= 1
+        records.append({'latency_ms': (time.monotonic() - scheduled) * 1000.0, 'status': status, 'error': error})
+
+    stop = asyncio.Event()
+    sampling = asyncio.create_task(sampler.run(stop)) if sampler else None
+    started = time.monotonic()
+    offset = arrivals.expovariate(rate)
+    while offset < duration:
+        scheduled = started + offset
+        delay = scheduled - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        if in_flight >= max_in_flight:
+            records.append({'latency_ms': None, 'status': None, 'error': 'client_overflow'})
+        else:
+            tasks.append(asyncio.create_task(one(scheduled)))
+        offset += arrivals.expovariate(rate)
+    await asyncio.gather(*tasks)
+    elapsed = time.monotonic() - started
+    stop.set()
+    if sampling:
+        await sampling
+
+    return summarize_scenario(records, rate, duration, elapsed, sampler)
+
+def summarize_scenario(records, rate, duration, elapsed, sampler):
+    """
+    Throughput sobre a janela de chegadas ou o tempo real, o que for maior;
+    sem nenhuma resposta bem-sucedida as latências ficam None (falha no
+    gate) em vez de 0
+    """
+
+    latencies = [record['latency_ms'] for record in records if record['error'] is None]
+    errors = {}
+    for record in records:
+        if record['error'] is not None:
+            errors[record['error']] = errors.get(record['error'], 0) + 1
+    total = len(records)
+    summary = {
+        'offered_rps': rate,
+        'duration_seconds': duration,
+        'requests': total,
+        'succeeded': len(latencies),
+        'errors': errors,
+        'error_rate': round((total - len(latencies)) / total, 4) if total else 0.0,
+        'throughput_rps': round(len(latencies) / max(duration, elapsed), 2),
+        'latency_ms': {
+            'p50': round(percentile(latencies, 0.50), 1) if latencies else None,
+            'p95': round(percentile(latencies, 0.95), 1) if latencies else None,
+            'p99': round(percentile(latencies, 0.99), 1) if latencies else None,
+            'max': round(max(latencies), 1) if latencies else None
+        }
+    }
+    summary['server'] = sampler.summary() if sampler else {}
+    return summary
+
+def find_regressions(report, baseline, threshold, error_threshold, slack_ms):
+    """
+    Cenários que pioraram além do limite: p95/p99 (relativo, com folga
+    absoluta em ms), throughput (relativo) e taxa de erros (absoluto)
+    """
+
+    regressions = []
+    for name, current in report['scenarios'].items():
+        before = baseline.get('scenarios', {}).get(name)
+        if not before:
+            continue
+        for metric in ('p95', 'p99'):
+            old, new = before['latency_ms'][metric], current['latency_ms'][metric]
+            if old is not None and new is not None and new > old * (1 + threshold) + slack_ms:
+                regressions.append(f"{name}: {metric} {old:.0f} → {new:.0f} ms")
+        old, new = before['throughput_rps'], current['throughput_rps']
+        if old and new < old * (1 - threshold):
+            regressions.append(f"{name}: throughput {old:.1f} → {new:.1f} req/s")
+        old, new = before['error_rate'], current['error_rate']
+        if new - old > error_threshold:
+            regressions.append(f"{name}: erros {old:.1%} → {new:.1%}")
+    return regressions
+
+def failed_scenarios(report):
+    """
+    Cenários sem nenhuma resposta bem-sucedida: não há latência a comparar
+    """
+
+    return [f"{name}: nenhuma requisição bem-sucedida em {summary['requests']}"
+            for name, summary in report['scenarios'].items() if not summary['succeeded']]
+
+def milliseconds(value):
+    return '-' if value is None else f"{value:.0f}"
+
+def print_scenario(name, summary):
+    latency, server = summary['latency_ms'], summary['server']
+    percentiles = ' | '.join(f"{metric} {milliseconds(latency[metric]):>7s} ms" for metric in ('p50', 'p95', 'p99'))
+    print(f"   • {name:7s} {summary['throughput_rps']:7.1f}/{summary['offered_rps']:g} req/s | "
+          f"{percentiles} | erros {summary['error_rate']:.1%}", end='')
+    if server.get('rss_mb_max') is not None:
+        print(f" | CPU {server['cpu_percent_avg']:.0f}% (máx {server['cpu_percent_max']:.0f}%) | "
+              f"RSS {server['rss_mb_max']:.0f} MB")
+    else:
+        print()
+    for error, count in summary['errors'].items():
+        print(f"        ❌ {error}: {count}")
+
+async def run_load_test(args, scenarios, pdfs, environment, storage_dir):
+    base_url = args.url or f"http://127.0.0.1:{args.port}"
+    process = None
+    if not args.url:
+        process = start_server(args.app, args.port, environment, os.path.join(storage_dir, 'server.log'))
+
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=None)
+    try:
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout,
+                                         cookie_jar=aiohttp.DummyCookieJar()) as session:
+            await wait_ready(session, base_url, process)
+            pid = process.pid if process else args.server_pid
+            results = {}
+            for index, (name, rate, duration) in enumerate(scenarios):
+                # Aquecimento fora da medição (conexões, índice mapeado, caches)
+                warmup = random.Random(args.seed)
+                for _ in range(3):
+                    await REQUESTS[name](session, base_url, warmup, pdfs)
+                sampler = ServerSampler(pid) if pid else None
+                print(f"🔄 {name}: {rate:g} req/s por {duration:g}s...")
+                results[name] = await run_scenario(
+                    session, base_url, name, rate, duration, pdfs, sampler,
+                    args.timeout, args.max_in_flight, args.seed + index
+                )
+            return results
+    finally:
+        if process is not None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+def parse_scenarios(items, default_duration):
+    scenarios = []
+    for item in items or DEFAULT_SCENARIOS:
+        parts = item.split(':')
+        if parts[0] not in REQUESTS or len(parts) < 2:
+            raise ValueError(f"cenário inválido: {item} (use rota:taxa[:segundos], rotas: {', '.join(REQUESTS)})")
+        duration = float(parts[2]) if len(parts) > 2 else default_duration
+        scenarios.append((parts[0], float(parts[1]), duration))
+    return scenarios
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Teste de carga HTTP do app web com stand-ins locais')
+    parser.add_argument('--app', choices=sorted(SERVER_COMMANDS), default='flask')
+    parser.add_argument('--url', help='App já em execução (não sobe servidor nem usa stand-ins)')
+    parser.add_argument('--server-pid', type=int, help='PID do servidor em --url para medir CPU/RSS')
+    parser.add_argument('--port', type=int, default=5057)
+    parser.add_argument('--scenario', action='append',
+                        help=f"rota:taxa[:segundos], repetível (padrão: {' '.join(DEFAULT_SCENARIOS)})")
+    parser.add_argument('--duration', type=float, default=20.0, help='Duração padrão de cada cenário')
+    parser.add_argument('--pdf-pages', default='1,5,20', help='Tamanhos (páginas) dos PDFs enviados')
+    parser.add_argument('--timeout', type=float, default=30.0, help='Timeout por requisição')
+    parser.add_argument('--max-in-flight', type=int, default=2000,
+                        help='Acima disso as chegadas contam como erro (client_overflow)')
+    parser.add_argument('--storage', default=None, help='Diretório do S3 local e do índice (padrão: temporário)')
+    parser.add_argument('--s3-latency-ms', type=float, default=20.0)
+    parser.add_argument('--bedrock-latency-ms', type=float, default=50.0)
+    parser.add_argument('--env', action='append', default=[], help='Variável de ambiente CHAVE=VALOR para o servidor')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', help='Salva o resultado em JSON (use como baseline)')
+    parser.add_argument('--baseline', help='Resultado JSON anterior; falha se algum cenário regredir')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Piora relativa tolerada em p95/p99 e throughput (0.2 = 20%%)')
+    parser.add_argument('--error-threshold', type=float, default=0.01,
+                        help='Aumento absoluto tolerado na taxa de erros')
+    parser.add_argument('--slack-ms', type=float, default=10.0, help='Folga absoluta de latência na comparação')
+    args = parser.parse_args()
+
+    try:
+        scenarios = parse_scenarios(args.scenario, args.duration)
+        storage_dir = args.storage or tempfile.mkdtemp(prefix='load-test-')
+        index_dir = os.path.join(storage_dir, 'vector-index')
+        environment = {
+            'WEB_BACKEND': 'local',
+            'WEB_LOCAL_STORAGE': os.path.join(storage_dir, 's3'),
+            'WEB_LOCAL_S3_LATENCY_MS': str(args.s3_latency_ms),
+            'WEB_LOCAL_BEDROCK_LATENCY_MS': str(args.bedrock_latency_ms),
+            'VECTOR_INDEX_DIR': index_dir,
+            'STATUS_BACKEND': 'none',
+            'PROFILING': 'off'
+        }
+        environment.update(dict(item.split('=', 1) for item in args.env))
+
+        page_counts = [int(pages) for pages in args.pdf_pages.split(',')]
+        print(f"📄 Preparando {len(page_counts)} PDFs sintéticos e o índice em {storage_dir}...")
+        pdfs = [(pages, generate_pdf(pages, args.seed + pages)) for pages in page_counts]
+        if not args.url:
+            if not os.path.exists(os.path.join(index_dir, 'MANIFEST')):
+                build_index(index_dir, seed=args.seed)
+            # /files lista uploads já existentes desde o início
+            from local_pipeline import LocalS3
+            local_s3 = LocalS3(environment['WEB_LOCAL_STORAGE'])
+            for number in range(20):
+                pages, content = pdfs[number % len(pdfs)]
+                local_s3.put_object(Bucket=BUCKET_NAME, Key=f"uploads/seed-{number:04d}.pdf", Body=content)
+
+        target = args.url or f"{args.app} em :{args.port}"
+        print(f"🚀 Carga em malha aberta contra {target}")
+        started = time.time()
+        results = asyncio.run(run_load_test(args, scenarios, pdfs, environment, storage_dir))
+
+        print(f"\n📊 Resultado ({args.url or args.app}):")
+        for name, summary in results.items():
+            print_scenario(name, summary)
+
+        report = {
+            'app': args.url or args.app,
+            'started_at': started,
+            'configuration': {
+                'scenarios': [list(scenario) for scenario in scenarios],
+                'pdf_pages': page_counts,
+                's3_latency_ms': args.s3_latency_ms,
+                'bedrock_latency_ms': args.bedrock_latency_ms,
+                'environment': environment,
+                'seed': args.seed
+            },
+            'scenarios': results
+        }
+        if args.report:
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Resultado salvo em {args.report}")
+
+        failures = failed_scenarios(report)
+        for failure in failures:
+            print(f"   ❌ Falha: {failure}")
+
+        regressions = []
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+            regressions = find_regressions(report, baseline, args.threshold, args.error_threshold, args.slack_ms)
+            print(f"\n📈 Comparação com {args.baseline} (limite {args.threshold:.0%}, erros +{args.error_threshold:.1%}):")
+            for name, summary in results.items():
+                before = baseline.get('scenarios', {}).get(name)
+                if before:
+                    print(f"   • {name:7s} p95 {milliseconds(before['latency_ms']['p95'])} → {milliseconds(summary['latency_ms']['p95'])} ms | "
+                          f"p99 {milliseconds(before['latency_ms']['p99'])} → {milliseconds(summary['latency_ms']['p99'])} ms | "
+                          f"{before['throughput_rps']:.1f} → {summary['throughput_rps']:.1f} req/s")
+            for regression in regressions:
+                print(f"   ❌ Regressão: {regression}")
+            if not regressions:
+                print("   ✅ Nenhum cenário regrediu")
+
+        sys.exit(1 if failures or regressions else 0)
+
+    except Exception as e:
+        print(f"❌ Erro no teste de carga: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,28 @@
+"""
+In-process executor for the processing state machine, with local
+stand-ins for S3, Bedrock and Step Functions
+"""
+
+from .asl import StateMachine, StatesError
+from .stubs import (
+    LocalS3, LocalBedrockRuntime, LocalStepFunctions, LocalLambdaContext, AsyncLocalS3, AsyncLocalBedrockRuntime,
+    LocalBedrockBatch
+)
+from .runtime import LocalPipeline, load_function_specs, run_executions, run_uploads, summarize
+
+__all__ = [
+    'StateMachine',
+    'StatesError',
+    'LocalS3',
+    'LocalBedrockRuntime',
+    'LocalStepFunctions',
+    'LocalLambdaContext',
+    'AsyncLocalS3',
+    'AsyncLocalBedrockRuntime',
+    'LocalBedrockBatch',
+    'LocalPipeline',
+    'load_function_specs',
+    'run_executions',
+    'run_uploads',
+    'summarize',
+]
@@ -0,0 +1,322 @@
+import re
+import json
+import copy
+import time
+import fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+# Interpreter for the subset of the Amazon States Language the pipeline
+# uses: Task, Pass, Choice, Map, Wait, Succeed and Fail states, the
+# InputPath/Parameters/ResultSelector/ResultPath/OutputPath chain, and
+# Retry/Catch with the same matching and backoff rules as Step Functions.
+# Task resources are opaque strings handed to an invoke callable, so the
+# interpreter knows nothing about Lambda or AWS.
+SUPPORTED_STATES = {'Task', 'Pass', 'Choice', 'Map', 'Wait', 'Succeed', 'Fail'}
+MAX_TRANSITIONS = 25000
+DEFAULT_MAP_CONCURRENCY = 40
+
+_PATH_TOKEN = re.compile(r"\.([A-Za-z0-9_\-]+)|\[(\d+)\]|\['([^']+)'\]")
+
+
+class StatesError(Exception):
+    """
+    A named Step Functions error (e.g. States.TaskFailed or the exception
+    type raised by a task) with its cause
+    """
+
+    def __init__(self, error: str, cause: str = ''):
+        super().__init__(f"{error}: {cause}")
+        self.error = error
+        self.cause = cause
+
+
+def _tokens(path: str) -> List:
+    if path == '$':
+        return []
+    if not path.startswith('$.') and not path.startswith('$['):
+        raise StatesError('States.Runtime', f'Unsupported path: {path}')
+    tokens, position = [], 1
+    for match in _PATH_TOKEN.finditer(path, 1):
+        if match.start() != position:
+            raise StatesError('States.Runtime', f'Unsupported path: {path}')
+        name, index, quoted = match.groups()
+        tokens.append(int(index) if index is not None else (name or quoted))
+        position = match.end()
+    if position != len(path):
+        raise StatesError('States.Runtime', f'Unsupported path: {path}')
+    return tokens
+
+
+def get_path(data, path: str, context: Optional[Dict] = None):
+    if path.startswith('$$'):
+        data, path = context or {}, path[1:]
+    for token in _tokens(path):
+        try:
+            data = data[token]
+        except (KeyError, IndexError, TypeError):
+            raise StatesError('States.Runtime', f'Path {path} not found in input')
+    return data
+
+
+def has_path(data, path: str) -> bool:
+    try:
+        get_path(data, path)
+        return True
+    except StatesError:
+        return False
+
+
+def set_path(data, path: Optional[str], value):
+    """
+    Apply ResultPath: '$' replaces the input, None discards the result
+    """
+
+    if path is None:
+        return data
+    tokens = _tokens(path)
+    if not tokens:
+        return value
+    data = copy.copy(data) if isinstance(data, dict) else {}
+    target = data
+    for token in tokens[:-1]:
+        child = target.get(token)
+        child = copy.copy(child) if isinstance(child, dict) else {}
+        target[token] = child
+        target = child
+    target[tokens[-1]] = value
+    return data
+
+
+def apply_parameters(template, data, context: Optional[Dict] = None):
+    """
+    Resolve a Parameters/ResultSelector/ItemSelector template; keys ending
+    in '.$' are paths into the input (or the context object with '$$')
+    """
+
+    if isinstance(template, dict):
+        resolved = {}
+        for key, value in template.items():
+            if key.endswith('.$'):
+                resolved[key[:-2]] = get_path(data, value, context)
+            else:
+                resolved[key] = apply_parameters(value, data, context)
+        return resolved
+    if isinstance(template, list):
+        return [apply_parameters(value, data, context) for value in template]
+    return template
+
+
+def error_matches(error_equals: List[str], error: str) -> bool:
+    if 'States.ALL' in error_equals:
+        # States.ALL does not match States.Runtime in Step Functions
+        return error != 'States.Runtime'
+    if error in error_equals:
+        return True
+    return 'States.TaskFailed' in error_equals and not error.startswith('States.')
+
+
+_COMPARATORS = {
+    'StringEquals': lambda a, b: isinstance(a, str) and a == b,
+    'StringLessThan': lambda a, b: isinstance(a, str) and a < b,
+    'StringGreaterThan': lambda a, b: isinstance(a, str) and a > b,
+    'StringLessThanEquals': lambda a, b: isinstance(a, str) and a <= b,
+    'StringGreaterThanEquals': lambda a, b: isinstance(a, str) and a >= b,
+    'StringMatches': lambda a, b: isinstance(a, str) and fnmatch.fnmatchcase(a, b),
+    'NumericEquals': lambda a, b: _is_number(a) and a == b,
+    'NumericLessThan': lambda a, b: _is_number(a) and a < b,
+    'NumericGreaterThan': lambda a, b: _is_number(a) and a > b,
+    'NumericLessThanEquals': lambda a, b: _is_number(a) and a <= b,
+    'NumericGreaterThanEquals': lambda a, b: _is_number(a) and a >= b,
+    'BooleanEquals': lambda a, b: isinstance(a, bool) and a == b,
+}
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def evaluate_rule(rule: Dict, data) -> bool:
+    if 'And' in rule:
+        return all(evaluate_rule(r, data) for r in rule['And'])
+    if 'Or' in rule:
+        return any(evaluate_rule(r, data) for r in rule['Or'])
+    if 'Not' in rule:
+        return not evaluate_rule(rule['Not'], data)
+
+    variable = rule['Variable']
+    if 'IsPresent' in rule:
+        return has_path(data, variable) == rule['IsPresent']
+    if not has_path(data, variable):
+        return False
+    value = get_path(data, variable)
+    if 'IsNull' in rule:
+        return (value is None) == rule['IsNull']
+
+    for name, compare in _COMPARATORS.items():
+        if name in rule:
+            return compare(value, rule[name])
+        if f"{name}Path" in rule:
+            return compare(value, get_path(data, rule[f"{name}Path"]))
+    raise StatesError('States.Runtime', f'Unsupported Choice rule: {json.dumps(rule)}')
+
+
+def validate_definition(definition: Dict):
+    for name, state in definition['States'].items():
+        if state['Type'] not in SUPPORTED_STATES:
+            raise ValueError(f"State {name}: unsupported type {state['Type']}")
+        if state['Type'] == 'Map':
+            validate_definition(state.get('ItemProcessor') or state['Iterator'])
+
+
+class StateMachine:
+    """
+    Run executions of one ASL definition. invoke(resource, payload, state)
+    performs a Task; sleeps for Retry intervals and Wait states are scaled
+    by time_scale so load tests do not spend their time in backoff.
+    """
+
+    def __init__(self, definition: Dict, invoke: Callable, time_scale: float = 1.0):
+        validate_definition(definition)
+        self.definition = definition
+        self.invoke = invoke
+        self.time_scale = time_scale
+
+    def execute(self, execution_input: Dict, name: str = 'local') -> Dict:
+        """
+        Run one execution to completion and return its record: status,
+        output or error/cause, duration and the per-state history
+        """
+
+        history: List[Dict] = []
+        context = {'Execution': {'Name': name, 'Input': execution_input}}
+        started = time.perf_counter()
+        record = {'name': name, 'history': history}
+        try:
+            output = self._run(self.definition, execution_input, context, history)
+            record.update({'status': 'SUCCEEDED', 'output': output})
+        except StatesError as e:
+            record.update({'status': 'FAILED', 'error': e.error, 'cause': e.cause})
+        record['duration_ms'] = (time.perf_counter() - started) * 1000.0
+        return record
+
+    def _sleep(self, seconds: float):
+        if seconds > 0 and self.time_scale > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def _run(self, machine: Dict, data, context: Dict, history: List[Dict]):
+        current = machine['StartAt']
+        for _ in range(MAX_TRANSITIONS):
+            state = machine['States'][current]
+            started = time.perf_counter()
+            entry = {'state': current, 'type': state['Type'], 'attempts': 0}
+            history.append(entry)
+            try:
+                data, next_state = self._run_state(state, data, context, history, entry)
+            finally:
+                entry['duration_ms'] = (time.perf_counter() - started) * 1000.0
+            if next_state is None:
+                return data
+            current = next_state
+        raise StatesError('States.Runtime', f'Execution exceeded {MAX_TRANSITIONS} state transitions')
+
+    def _run_state(self, state: Dict, data, context: Dict, history: List[Dict], entry: Dict):
+        kind = state['Type']
+        if kind == 'Fail':
+            raise StatesError(state.get('Error', 'States.Fail'), state.get('Cause', ''))
+
+        if kind == 'Choice':
+            effective = get_path(data, state.get('InputPath', '$'))
+            for rule in state['Choices']:
+                if evaluate_rule(rule, effective):
+                    return data, rule['Next']
+            if 'Default' not in state:
+                raise StatesError('States.NoChoiceMatched', 'No Choice rule matched and no Default')
+            return data, state['Default']
+
+        input_path = state.get('InputPath', '$')
+        effective = {} if input_path is None else get_path(data, input_path)
+        if 'Parameters' in state and kind != 'Map':
+            effective = apply_parameters(state['Parameters'], effective, context)
+
+        try:
+            if kind == 'Task':
+                result = self._with_retry(state, entry, lambda: self.invoke(state['Resource'], effective, state))
+            elif kind == 'Map':
+                result = self._with_retry(state, entry, lambda: self._run_map(state, effective, context, history))
+            elif kind == 'Pass':
+                result = state.get('Result', effective)
+            elif kind == 'Wait':
+                seconds = state.get('Seconds')
+                if 'SecondsPath' in state:
+                    seconds = get_path(effective, state['SecondsPath'])
+                self._sleep(seconds or 0)
+                result = effective
+            else:
+                result = effective
+        except StatesError as e:
+            for catcher in state.get('Catch', []):
+                if error_matches(catcher['ErrorEquals'], e.error):
+                    entry['error'] = e.error
+                    caught = set_path(data, catcher.get('ResultPath', '$'), {'Error': e.error, 'Cause': e.cause})
+                    return caught, catcher['Next']
+            raise
+
+        if 'ResultSelector' in state and kind in ('Task', 'Map'):
+            result = apply_parameters(state['ResultSelector'], result, context)
+        output = set_path(data, state.get('ResultPath', '$'), result)
+        if state.get('OutputPath', '$') is not None:
+            output = get_path(output, state.get('OutputPath', '$'))
+        else:
+            output = {}
+
+        if kind == 'Succeed' or state.get('End'):
+            return output, None
+        return output, state['Next']
+
+    def _with_retry(self, state: Dict, entry: Dict, call: Callable):
+        retriers = state.get('Retry', [])
+        counts = [0] * len(retriers)
+        while True:
+            entry['attempts'] += 1
+            try:
+                return call()
+            except StatesError as e:
+                error = e
+            except Exception as e:
+                error = StatesError(type(e).__name__, json.dumps({
+                    'errorMessage': str(e),
+                    'errorType': type(e).__name__
+                }))
+
+            # The first retrier whose ErrorEquals matches decides
+            index = next(
+                (i for i, retrier in enumerate(retriers) if error_matches(retrier['ErrorEquals'], error.error)),
+                None
+            )
+            if index is None or counts[index] >= retriers[index].get('MaxAttempts', 3):
+                raise error
+
+            retrier = retriers[index]
+            interval = retrier.get('IntervalSeconds', 1) * retrier.get('BackoffRate', 2.0) ** counts[index]
+            if 'MaxDelaySeconds' in retrier:
+                interval = min(interval, retrier['MaxDelaySeconds'])
+            counts[index] += 1
+            self._sleep(interval)
+
+    def _run_map(self, state: Dict, data, context: Dict, history: List[Dict]):
+        items = get_path(data, state.get('ItemsPath', '$'))
+        if not isinstance(items, list):
+            raise StatesError('States.Runtime', 'Map ItemsPath must select an array')
+        processor = state.get('ItemProcessor') or state['Iterator']
+        selector = state.get('ItemSelector', state.get('Parameters'))
+
+        def run_item(index, item):
+            item_context = dict(context, Map={'Item': {'Index': index, 'Value': item}})
+            item_input = apply_parameters(selector, data, item_context) if selector is not None else item
+            return self._run(processor, item_input, item_context, [])
+
+        workers = state.get('MaxConcurrency') or min(max(len(items), 1), DEFAULT_MAP_CONCURRENCY)
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='map-iteration') as pool:
+            futures = [pool.submit(run_item, index, item) for index, item in enumerate(items)]
+            return [future.result() for future in futures]
@@ -0,0 +1,577 @@
+import os
+import re
+import sys
+import json
+import time
+import itertools
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .asl import StateMachine, StatesError
+from .stubs import LocalS3, LocalBedrockRuntime, LocalStepFunctions, LocalLambda, LocalLambdaContext
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAMBDAS_DIR = os.path.join(REPO_ROOT, 'lambdas')
+DEFINITION_PATH = os.path.join(REPO_ROOT, 'state_machines', 'processing.json')
+TEMPLATE_PATH = os.path.join(REPO_ROOT, 'template.yaml')
+
+# Step Functions rejects state payloads above 256 KB
+MAX_PAYLOAD_BYTES = 262144
+LOCAL_STATE_MACHINE_ARN = 'arn:aws:states:local:000000000000:stateMachine:local-rag-pipeline'
+# Modules whose executions/invocations are new work (the scheduler starting
+# queued jobs) rather than a hand-off of the running document
+DISPATCH_MODULES = ('scheduler',)
+
+_RESOURCE_BLOCK = re.compile(r'^  (\w+):\n((?:^(?:    .*|\s*)\n)+)', re.MULTILINE)
+
+
+def load_function_specs(template_path: str = TEMPLATE_PATH) -> Dict[str, Dict]:
+    """
+    Handler, timeout and memory of every AWS::Serverless::Function in the
+    SAM template, keyed by logical resource name. Only these scalar fields
+    are read, so the CloudFormation tags do not need a YAML loader.
+    """
+
+    with open(template_path) as f:
+        text = f.read()
+
+    specs = {}
+    for name, body in _RESOURCE_BLOCK.findall(text):
+        if 'Type: AWS::Serverless::Function' not in body:
+            continue
+        handler = re.search(r'^\s+Handler:\s*(\S+)', body, re.MULTILINE)
+        timeout = re.search(r'^\s+Timeout:\s*(\d+)', body, re.MULTILINE)
+        memory = re.search(r'^\s+MemorySize:\s*(\d+)', body, re.MULTILINE)
+        on_failure = re.search(r'OnFailure:\n(?:^\s+.*\n)*?^\s+Destination:.*function:([\w${}-]+)', body, re.MULTILINE)
+        specs[name] = {
+            'handler': handler.group(1),
+            'timeout': int(timeout.group(1)) if timeout else 3,
+            'memory_mb': int(memory.group(1)) if memory else 128,
+            # EventBridge subscriptions the local runner emulates
+            'execution_events': 'Step Functions Execution Status Change' in body,
+            'schedule': bool(re.search(r'^\s+Type:\s*Schedule\s*$', body, re.MULTILINE)),
+            # Async invocation on-failure destination (function name)
+            'on_failure': on_failure.group(1) if on_failure else None
+        }
+    return specs
+
+
+class LocalPipeline:
+    """
+    Run the processing state machine in-process. ${XFunctionArn} task
+    resources resolve to the handler of the XFunction resource in the SAM
+    template (the DefinitionSubstitutions convention); the handler modules
+    are imported from lambdas/ and their AWS clients are replaced by the
+    local stand-ins, so executions only touch storage_dir.
+    """
+
+    def __init__(
+        self,
+        storage_dir: str,
+        definition_path: str = DEFINITION_PATH,
+        template_path: str = TEMPLATE_PATH,
+        bedrock_latency_ms: float = 0.0,
+        bedrock_failure_rate: float = 0.0,
+        time_scale: float = 1.0,
+        enforce_limits: bool = True,
+        invoke_overhead_ms: float = 0.0,
+        bedrock_endpoints: Optional[List[Dict]] = None
+    ):
+        self.s3 = LocalS3(storage_dir)
+        if bedrock_endpoints:
+            # Several simulated regions ({'name', 'latency_ms', 'failure_rate',
+            # 'tail_latency_ms', 'tail_rate'}) behind the embedding router
+            if LAMBDAS_DIR not in sys.path:
+                sys.path.insert(0, LAMBDAS_DIR)
+            from embedding_router import EmbeddingRouter, Endpoint
+            self.bedrock = EmbeddingRouter([
+                Endpoint(spec['name'], LocalBedrockRuntime(
+                    latency_ms=spec.get('latency_ms', 0.0), failure_rate=spec.get('failure_rate', 0.0),
+                    tail_latency_ms=spec.get('tail_latency_ms', 0.0), tail_rate=spec.get('tail_rate', 0.0)
+                ))
+                for spec in bedrock_endpoints
+            ])
+        else:
+            self.bedrock = LocalBedrockRuntime(latency_ms=bedrock_latency_ms, failure_rate=bedrock_failure_rate)
+        self.specs = load_function_specs(template_path)
+        self.enforce_limits = enforce_limits
+        # Simulated cost of each Lambda invocation and state transition
+        # (scheduling, payload serialization, warm start) that local calls skip
+        self.invoke_overhead_ms = invoke_overhead_ms
+        self._handlers = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._dispatched = itertools.count()
+        # Set by run_uploads: receives (input, name, target) for work started
+        # while executions run, and execution status events are delivered
+        self.live_submit: Optional[Callable] = None
+
+        with open(definition_path) as f:
+            self.state_machine = StateMachine(json.load(f), self.invoke, time_scale=time_scale)
+
+    def _handler(self, function_name: str):
+        with self._lock:
+            if function_name in self._handlers:
+                return self._handlers[function_name]
+
+            module_name, attribute = self.specs[function_name]['handler'].rsplit('.', 1)
+            self._handlers[function_name] = getattr(self._import(module_name), attribute)
+            return self._handlers[function_name]
+
+    def module(self, module_name: str):
+        """
+        A lambdas/ module with its AWS clients replaced by the local ones
+        """
+
+        with self._lock:
+            return self._import(module_name)
+
+    def _import(self, module_name: str):
+        if LAMBDAS_DIR not in sys.path:
+            sys.path.insert(0, LAMBDAS_DIR)
+        # Clients are created at import; give boto3 a region to build them with
+        os.environ.setdefault('AWS_DEFAULT_REGION', 'sa-east-1')
+        os.environ.setdefault('STEP_FUNCTION_ARN', LOCAL_STATE_MACHINE_ARN)
+        os.environ.setdefault('FAST_PATH_FUNCTION', 'ProcessSmallDocumentFunction')
+
+        module = importlib.import_module(module_name)
+
+        # Patch every lambdas/ module loaded so far: handlers share helpers
+        # (and their module-level clients) across modules
+        for loaded in list(sys.modules.values()):
+            if not (getattr(loaded, '__file__', None) or '').startswith(LAMBDAS_DIR):
+                continue
+            dispatcher = loaded.__name__ in DISPATCH_MODULES
+            if hasattr(loaded, 's3_client'):
+                loaded.s3_client = self.s3
+            if hasattr(loaded, '_s3_client'):
+                loaded._s3_client = self.s3
+            if hasattr(loaded, 'bedrock_runtime'):
+                loaded.bedrock_runtime = self.bedrock
+            if hasattr(loaded, 'admit_hedge') and hasattr(self.bedrock, 'hedge_admission'):
+                self.bedrock.hedge_admission = loaded.admit_hedge
+            if hasattr(loaded, 'stepfunctions'):
+                loaded.stepfunctions = LocalStepFunctions(
+                    self._dispatch_execution if dispatcher else self._start_execution
+                )
+            if hasattr(loaded, 'lambda_client'):
+                loaded.lambda_client = LocalLambda(
+                    self._dispatch_function if dispatcher else self._start_function
+                )
+        return module
+
+    def _start_execution(self, execution_input: Dict, name: str):
+        collected = getattr(self._local, 'collected', None)
+        if collected is not None:
+            # Started by the trigger: queue it for run_executions
+            collected.append((execution_input, name, None))
+            return
+        # Hand-off from a running function (fast path fallback): run it now
+        record = self.state_machine.execute(execution_input, name)
+        self._local.handoffs.append(record)
+        self._execution_finished(execution_input, record)
+
+    def _start_function(self, function_name: str, payload: Dict):
+        collected = getattr(self._local, 'collected', None)
+        if collected is None:
+            raise RuntimeError(f'Nested invocation of {function_name} is not supported locally')
+        name = f"{function_name}-{len(collected)}-{payload.get('key', '')}"
+        collected.append((payload, name, self.resolve_function(function_name)))
+
+    def _dispatch_execution(self, execution_input: Dict, name: str):
+        if self.live_submit is not None:
+            self.live_submit((execution_input, name, None))
+        elif getattr(self._local, 'collected', None) is not None:
+            self._local.collected.append((execution_input, name, None))
+        else:
+            raise RuntimeError(f'Execution {name} started by the scheduler outside run_uploads')
+
+    def _dispatch_function(self, function_name: str, payload: Dict):
+        name = f"{function_name}-{next(self._dispatched)}-{payload.get('key', '')}"
+        item = (payload, name, self.resolve_function(function_name))
+        if self.live_submit is not None:
+            self.live_submit(item)
+        elif getattr(self._local, 'collected', None) is not None:
+            self._local.collected.append(item)
+        else:
+            raise RuntimeError(f'Invocation of {function_name} by the scheduler outside run_uploads')
+
+    def _execution_finished(self, execution_input: Dict, record: Dict):
+        """
+        Deliver the EventBridge execution status change to subscribed
+        functions (only while run_uploads is driving the pipeline)
+        """
+
+        if self.live_submit is None:
+            return
+        event = {
+            'source': 'aws.states',
+            'detail-type': 'Step Functions Execution Status Change',
+            'detail': {
+                'name': record['name'],
+                'status': record['status'],
+                'stateMachineArn': LOCAL_STATE_MACHINE_ARN,
+                'input': json.dumps(execution_input),
+                'output': json.dumps(record['output']) if 'output' in record else None
+            }
+        }
+        for function_name, spec in self.specs.items():
+            if spec['execution_events']:
+                try:
+                    self.invoke(f"${{{function_name}Arn}}", event)
+                except Exception as e:
+                    print(f"Execution event handler {function_name} failed: {str(e)}")
+
+    def _invocation_failed(self, function_name: str, name: str, payload: Dict, record: Dict):
+        """
+        Deliver a failed asynchronous invocation to the function's
+        on-failure destination (only while run_uploads is driving the
+        pipeline; retries are not emulated)
+        """
+
+        destination = self.specs[function_name].get('on_failure')
+        if self.live_submit is None or not destination:
+            return
+        event = {
+            'version': '1.0',
+            'requestContext': {
+                'requestId': name,
+                'functionArn': function_name,
+                'condition': 'RetriesExhausted',
+                'approximateInvokeCount': 1
+            },
+            'requestPayload': payload,
+            'responseContext': {'statusCode': 200, 'functionError': 'Unhandled'},
+            'responsePayload': {'errorType': record['error'], 'errorMessage': record['cause']}
+        }
+        try:
+            self.invoke(f"${{{self.resolve_function(destination)}Arn}}", event)
+        except Exception as e:
+            print(f"On-failure destination {destination} failed: {str(e)}")
+
+    def tick(self):
+        """
+        Deliver one scheduled EventBridge event to functions with a Schedule
+        """
+
+        for function_name, spec in self.specs.items():
+            if spec['schedule']:
+                self.invoke(f"${{{function_name}Arn}}", {'source': 'aws.events', 'detail-type': 'Scheduled Event'})
+
+    def resolve_function(self, function_name: str) -> str:
+        # Logical resource name locally; deployed names end with the same words
+        if function_name in self.specs:
+            return function_name
+        for logical_name in self.specs:
+            words = re.findall('[A-Z][a-z]*', logical_name)
+            if function_name.endswith('-'.join(word.lower() for word in words[:-1])):
+                return logical_name
+        raise ValueError(f'Unknown function {function_name}')
+
+    def resolve(self, resource: str) -> str:
+        match = re.fullmatch(r'\$\{(\w+)Arn\}', resource)
+        if not match or match.group(1) not in self.specs:
+            raise ValueError(f'Cannot resolve task resource {resource} to a function in the SAM template')
+        return match.group(1)
+
+    def invoke(self, resource: str, payload: Dict, state: Optional[Dict] = None):
+        """
+        Invoke a function the way Lambda does: JSON in, JSON out, with the
+        configured timeout reported through the context
+        """
+
+        function_name = self.resolve(resource)
+        spec = self.specs[function_name]
+        handler = self._handler(function_name)
+        context = LocalLambdaContext(function_name, spec['timeout'], spec['memory_mb'])
+
+        if self.invoke_overhead_ms:
+            time.sleep(self.invoke_overhead_ms / 1000.0)
+
+        started = time.monotonic()
+        result = handler(json.loads(json.dumps(payload)), context)
+        elapsed = time.monotonic() - started
+
+        if self.enforce_limits and elapsed > spec['timeout']:
+            raise StatesError('Sandbox.Timedout', f'{function_name} ran {elapsed:.1f}s (timeout {spec["timeout"]}s)')
+        serialized = json.dumps(result)
+        if self.enforce_limits and len(serialized.encode('utf-8')) > MAX_PAYLOAD_BYTES:
+            raise StatesError(
+                'States.DataLimitExceeded',
+                f'{function_name} returned {len(serialized)} bytes (limit {MAX_PAYLOAD_BYTES})'
+            )
+        return json.loads(serialized)
+
+    def trigger(self, bucket: str, key: str) -> List[Tuple[Dict, str, Optional[str]]]:
+        """
+        Run the S3 trigger function for an upload and return what it started
+        as (input, name, target): target is None for a state machine
+        execution or the function the upload was routed to
+        """
+
+        size = self.s3.head_object(Bucket=bucket, Key=key)['ContentLength']
+        event = {'Records': [{'s3': {'bucket': {'name': bucket}, 'object': {'key': key, 'size': size}}}]}
+        self._local.collected = []
+        try:
+            self.invoke('${TriggerStepFunctionLambdaArn}', event)
+            return self._local.collected
+        finally:
+            self._local.collected = None
+
+    def execute(self, execution_input: Dict, name: str = 'local', target: Optional[str] = None) -> Dict:
+        """
+        Run one state machine execution, or a single function invocation
+        when target names one (e.g. the fast path) together with any
+        execution it hands off to
+        """
+
+        if target is None:
+            record = self.state_machine.execute(execution_input, name)
+            self._execution_finished(execution_input, record)
+            return record
+
+        self._local.handoffs = []
+        started = time.perf_counter()
+        entry = {'state': target, 'type': 'Task', 'attempts': 1}
+        record = {'name': name, 'history': [entry]}
+        try:
+            record.update({'status': 'SUCCEEDED', 'output': self.invoke(f"${{{target}Arn}}", execution_input)})
+        except StatesError as e:
+            record.update({'status': 'FAILED', 'error': e.error, 'cause': e.cause})
+        except Exception as e:
+            record.update({'status': 'FAILED', 'error': type(e).__name__, 'cause': str(e)})
+        entry['duration_ms'] = (time.perf_counter() - started) * 1000.0
+        if record['status'] == 'FAILED':
+            self._invocation_failed(target, name, execution_input, record)
+
+        for handoff in self._local.handoffs:
+            entry['duration_ms'] -= handoff['duration_ms']
+            record['history'].extend(handoff['history'])
+            record.update({key: value for key, value in handoff.items() if key in ('status', 'output', 'error', 'cause')})
+        record['duration_ms'] = (time.perf_counter() - started) * 1000.0
+        return record
+
+
+_worker_pipeline: Optional[LocalPipeline] = None
+
+
+def _init_worker(options: Dict, environment: Dict, quiet: bool):
+    global _worker_pipeline
+    os.environ.update(environment)
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+    _worker_pipeline = LocalPipeline(**options)
+
+
+def _execute_in_worker(execution_input: Dict, name: str, target: Optional[str] = None) -> Dict:
+    return _worker_pipeline.execute(execution_input, name, target)
+
+
+def run_executions(
+    executions: List[Tuple[Dict, str, Optional[str]]],
+    options: Dict,
+    workers: int = 8,
+    mode: str = 'thread',
+    environment: Optional[Dict] = None,
+    quiet: bool = True
+) -> Dict:
+    """
+    Run many executions concurrently and summarize them. mode='thread'
+    shares one LocalPipeline; mode='process' builds one per worker process
+    (storage is shared through the directory) to sidestep the GIL.
+    """
+
+    environment = environment or {}
+    started = time.perf_counter()
+    if mode == 'process':
+        with ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(options, environment, quiet)
+        ) as pool:
+            records = list(pool.map(_execute_in_worker, *zip(*executions)))
+    else:
+        os.environ.update(environment)
+        console = sys.stdout
+        if quiet:
+            sys.stdout = open(os.devnull, 'w')
+        try:
+            pipeline = LocalPipeline(**options)
+            with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='execution') as pool:
+                records = list(pool.map(lambda args: pipeline.execute(*args), executions))
+        finally:
+            if quiet:
+                sys.stdout.close()
+                sys.stdout = console
+    return summarize(records, time.perf_counter() - started)
+
+
+def run_uploads(
+    uploads: List[Tuple[str, str]],
+    options: Dict,
+    workers: int = 8,
+    environment: Optional[Dict] = None,
+    quiet: bool = True,
+    tick_seconds: float = 1.0
+) -> Dict:
+    """
+    Trigger every (bucket, key) upload and run whatever the trigger
+    and the scheduler start, as it is started, on a pool of workers; the
+    scheduler's EventBridge events (execution status changes, periodic
+    schedule) are delivered as they would be deployed. Latency is measured
+    from upload to completion, so time spent queued counts, and is also
+    reported per scheduler size class.
+    """
+
+    os.environ.update(environment or {})
+    console = sys.stdout
+    if quiet:
+        sys.stdout = open(os.devnull, 'w')
+
+    futures = []
+    lock = threading.Lock()
+    uploaded_at: Dict[str, float] = {}
+    classes: Dict[str, str] = {}
+    rejected = set()
+    finished = threading.Event()
+
+    try:
+        pipeline = LocalPipeline(**options)
+        scheduler = pipeline.module('scheduler')
+        pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='execution')
+
+        def run(item):
+            execution_input, name, target = item
+            started = time.perf_counter()
+            record = pipeline.execute(execution_input, name, target)
+            key = execution_input.get('key')
+            record['key'] = key
+            record['class'] = classes.get(key)
+            record['queued_ms'] = (started - uploaded_at[key]) * 1000.0
+            record['latency_ms'] = (time.perf_counter() - uploaded_at[key]) * 1000.0
+            return record
+
+        def submit(item):
+            with lock:
+                futures.append(pool.submit(run, item))
+
+        def ticker():
+            while not finished.wait(tick_seconds):
+                try:
+                    pipeline.tick()
+                except Exception as e:
+                    print(f"Scheduled tick failed: {str(e)}")
+
+        pipeline.live_submit = submit
+        threading.Thread(target=ticker, name='scheduler-tick', daemon=True).start()
+
+        started = time.perf_counter()
+        for bucket, key in uploads:
+            job = scheduler.prescan_job(scheduler.new_job(bucket, key, None))
+            classes[key] = scheduler.classify(job['pages'])
+            if job.get('route') == 'reject':
+                rejected.add(key)
+            uploaded_at[key] = time.perf_counter()
+            for item in pipeline.trigger(bucket, key):
+                submit(item)
+
+        # Work keeps being started while executions finish; stop once every
+        # started execution is done and nothing new was started meanwhile
+        done = 0
+        while True:
+            with lock:
+                pending = futures[done:]
+            if not pending:
+                break
+            for future in pending:
+                future.exception()
+            done += len(pending)
+
+        records = [future.result() for future in futures]
+        wall_seconds = time.perf_counter() - started
+        finished.set()
+        pool.shutdown()
+    finally:
+        finished.set()
+        if quiet:
+            sys.stdout.close()
+            sys.stdout = console
+
+    missing = set(uploaded_at) - {record['key'] for record in records} - rejected
+    summary = summarize(records, wall_seconds)
+    summary['not_started'] = sorted(missing)
+    summary['rejected'] = sorted(rejected)
+    return summary
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def summarize(records: List[Dict], wall_seconds: float) -> Dict:
+    # Upload-to-completion latency when measured (run_uploads)
+    durations = [record.get('latency_ms', record['duration_ms']) for record in records]
+    states: Dict[str, Dict] = {}
+    errors: Dict[str, int] = {}
+    succeeded = 0
+    for record in records:
+        # An execution routed to a Catch handler (ProcessingFailed) ends
+        # SUCCEEDED for Step Functions but did not process its document
+        caught = [entry['error'] for entry in record['history'] if 'error' in entry]
+        for error in caught + ([record['error']] if record['status'] == 'FAILED' else []):
+            errors[error] = errors.get(error, 0) + 1
+        if record['status'] == 'SUCCEEDED' and not caught:
+            succeeded += 1
+        for entry in record['history']:
+            stats = states.setdefault(entry['state'], {'durations': [], 'attempts': 0, 'entries': 0})
+            stats['durations'].append(entry['duration_ms'])
+            stats['attempts'] += entry['attempts']
+            stats['entries'] += 1
+
+    return {
+        'executions': len(records),
+        'succeeded': succeeded,
+        'failed': len(records) - succeeded,
+        'errors': errors,
+        'wall_seconds': wall_seconds,
+        'documents_per_hour': succeeded / wall_seconds * 3600.0 if wall_seconds else 0.0,
+        'latency_ms': {
+            'p50': percentile(durations, 0.5),
+            'p95': percentile(durations, 0.95),
+            'p99': percentile(durations, 0.99),
+            'max': max(durations) if durations else 0.0
+        },
+        'classes': {
+            name: {
+                'executions': len(values),
+                'p50_ms': percentile(values, 0.5),
+                'p95_ms': percentile(values, 0.95),
+                'p99_ms': percentile(values, 0.99),
+                'queued_p95_ms': percentile(
+                    [record['queued_ms'] for record in records if record.get('class') == name], 0.95
+                )
+            }
+            for name, values in _by_class(records).items()
+        },
+        'states': {
+            name: {
+                'entries': stats['entries'],
+                'attempts': stats['attempts'],
+                'p50_ms': percentile(stats['durations'], 0.5),
+                'p95_ms': percentile(stats['durations'], 0.95)
+            }
+            for name, stats in states.items()
+        },
+        'records': records
+    }
+
+
+def _by_class(records: List[Dict]) -> Dict[str, List[float]]:
+    classes: Dict[str, List[float]] = {}
+    for record in records:
+        if record.get('class'):
+            classes.setdefault(record['class'], []).append(record['latency_ms'])
+    return classes
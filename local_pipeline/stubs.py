@@ -0,0 +1,488 @@
+import io
+import os
+import json
+import fcntl
+import time
+import uuid
+import random
+import shutil
+import asyncio
+import hashlib
+import threading
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+# Local stand-ins for the AWS clients the Lambdas use. They implement only
+# the calls the handlers make, with the same request/response shapes and
+# error attributes, so the handler code runs unmodified. LocalS3 keeps
+# objects as files, which lets executions in several worker processes
+# share one bucket. The Async* variants mirror the aiobotocore call shapes
+# for the asyncio web app (asgi_app.py).
+TITAN_DIMENSIONS = 1536
+
+
+class NoSuchKey(Exception):
+    pass
+
+
+class PreconditionFailed(Exception):
+    """
+    A conditional put lost, with botocore's ClientError error shape
+    """
+
+    def __init__(self, message: str):
+        super().__init__(message)
+        self.response = {'Error': {'Code': 'PreconditionFailed', 'Message': message}}
+
+
+class _S3Exceptions:
+    NoSuchKey = NoSuchKey
+
+
+class LocalS3:
+    """
+    Minimal S3 client backed by a directory: root/<bucket>/<key>.
+    latency_ms simulates the round trip of every object call. Conditional
+    puts (IfMatch / IfNoneMatch='*') are checked under a lock file shared
+    by every process using the same root.
+    """
+
+    exceptions = _S3Exceptions
+
+    def __init__(self, root: str, latency_ms: float = 0.0):
+        self.root = root
+        self.latency_ms = latency_ms
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, bucket: str, key: str) -> str:
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _round_trip(self):
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000.0)
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', IfMatch: Optional[str] = None,
+                   IfNoneMatch: Optional[str] = None, **kwargs):
+        self._round_trip()
+        if isinstance(Body, str):
+            Body = Body.encode('utf-8')
+        elif hasattr(Body, 'read'):
+            Body = Body.read()
+        path = self._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(Body)
+        if IfMatch is None and IfNoneMatch is None:
+            os.replace(tmp_path, path)
+            return {'ETag': hashlib.md5(Body).hexdigest()}
+
+        with open(os.path.join(self.root, '.conditional.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                with open(path, 'rb') as f:
+                    current = hashlib.md5(f.read()).hexdigest()
+            except FileNotFoundError:
+                current = None
+            if (IfNoneMatch == '*' and current is not None) or (IfMatch is not None and IfMatch != current):
+                os.remove(tmp_path)
+                raise PreconditionFailed(f"s3://{Bucket}/{Key} changed")
+            os.replace(tmp_path, path)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    def get_object(self, Bucket: str, Key: str, Range: Optional[str] = None, **kwargs):
+        self._round_trip()
+        path = self._path(Bucket, Key)
+        try:
+            with open(path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                if Range:
+                    start, end = _parse_range(Range, size)
+                    f.seek(start)
+                    body = f.read(end - start + 1)
+                else:
+                    body = f.read()
+        except (FileNotFoundError, IsADirectoryError):
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+        return {
+            'Body': io.BytesIO(body),
+            'ContentLength': len(body),
+            'ContentRange': f"bytes {start}-{end}/{size}" if Range else None,
+            'ETag': None if Range else hashlib.md5(body).hexdigest(),
+            'LastModified': datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        }
+
+    def head_object(self, Bucket: str, Key: str, **kwargs):
+        self._round_trip()
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+        return {
+            'ContentLength': os.path.getsize(path),
+            'LastModified': datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+        }
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        self._round_trip()
+        try:
+            os.remove(self._path(Bucket, Key))
+        except FileNotFoundError:
+            pass
+        return {}
+
+    def delete_objects(self, Bucket: str, Delete: Dict, **kwargs):
+        for item in Delete['Objects']:
+            self.delete_object(Bucket, item['Key'])
+        return {}
+
+    def list_objects_v2(self, Bucket: str, Prefix: str = '', MaxKeys: int = 1000, **kwargs):
+        self._round_trip()
+        base = os.path.join(self.root, Bucket)
+        contents = []
+        for directory, _, files in os.walk(base):
+            for name in files:
+                if name.endswith('.tmp'):
+                    continue
+                path = os.path.join(directory, name)
+                key = os.path.relpath(path, base).replace(os.sep, '/')
+                if key.startswith(Prefix):
+                    contents.append({
+                        'Key': key,
+                        'Size': os.path.getsize(path),
+                        'LastModified': datetime.fromtimestamp(os.path.getmtime(path), timezone.utc)
+                    })
+        contents.sort(key=lambda item: item['Key'])
+        truncated = len(contents) > MaxKeys
+        contents = contents[:MaxKeys]
+        return {'Contents': contents, 'KeyCount': len(contents), 'IsTruncated': truncated}
+
+    def get_paginator(self, operation: str):
+        client = self
+
+        class Paginator:
+            def paginate(self, **kwargs):
+                # Everything in one page
+                kwargs.setdefault('MaxKeys', 2 ** 31)
+                yield getattr(client, operation)(**kwargs)
+
+        return Paginator()
+
+    def upload_file(self, Filename: str, Bucket: str, Key: str, **kwargs):
+        with open(Filename, 'rb') as f:
+            self.put_object(Bucket=Bucket, Key=Key, Body=f.read())
+
+    def upload_fileobj(self, Fileobj, Bucket: str, Key: str, **kwargs):
+        self.put_object(Bucket=Bucket, Key=Key, Body=Fileobj)
+
+    def download_file(self, Bucket: str, Key: str, Filename: str, **kwargs):
+        path = self._path(Bucket, Key)
+        if not os.path.isfile(path):
+            raise NoSuchKey(f"s3://{Bucket}/{Key}")
+        shutil.copyfile(path, Filename)
+
+
+def _parse_range(header: str, size: int):
+    # bytes=start-end | bytes=start- | bytes=-suffix
+    spec = header.split('=', 1)[1]
+    start, _, end = spec.partition('-')
+    if not start:
+        return max(0, size - int(end)), size - 1
+    return int(start), min(size - 1, int(end)) if end else size - 1
+
+
+class LocalBedrockRuntime:
+    """
+    Deterministic stand-in for Titan embeddings: the vector is derived from
+    a hash of the input text. latency_ms simulates the network round trip,
+    tail_rate of the calls taking tail_latency_ms instead (a region with a
+    slow tail), and failure_rate injects throttling errors to exercise
+    Retry and failover paths.
+    """
+
+    def __init__(self, latency_ms: float = 0.0, failure_rate: float = 0.0, dimensions: int = TITAN_DIMENSIONS,
+                 tail_latency_ms: float = 0.0, tail_rate: float = 0.0):
+        self.latency_ms = latency_ms
+        self.failure_rate = failure_rate
+        self.dimensions = dimensions
+        self.tail_latency_ms = tail_latency_ms
+        self.tail_rate = tail_rate
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _latency_seconds(self) -> float:
+        if self.tail_rate and random.random() < self.tail_rate:
+            return self.tail_latency_ms / 1000.0
+        return self.latency_ms / 1000.0
+
+    def invoke_model(self, body, modelId: str = '', **kwargs):
+        with self._lock:
+            self.calls += 1
+        latency = self._latency_seconds()
+        if latency:
+            time.sleep(latency)
+        return {'body': io.BytesIO(self._respond(body))}
+
+    def _respond(self, body) -> bytes:
+        if self.failure_rate and random.random() < self.failure_rate:
+            raise RuntimeError('ThrottlingException: Rate exceeded (simulated)')
+
+        text = json.loads(body)['inputText']
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        generator = random.Random(seed)
+        embedding = [generator.gauss(0.0, 1.0) for _ in range(self.dimensions)]
+        return json.dumps({
+            'embedding': embedding,
+            'inputTextTokenCount': max(1, len(text) // 4)
+        }).encode('utf-8')
+
+
+class AsyncStreamingBody:
+    """
+    Response body with aiobotocore's awaitable read()
+    """
+
+    def __init__(self, data: bytes):
+        self._body = io.BytesIO(data)
+
+    async def read(self, amt: Optional[int] = None) -> bytes:
+        return self._body.read(amt)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._body.close()
+
+
+class AsyncLocalS3:
+    """
+    LocalS3 behind coroutines, plus multipart uploads (parts are files under
+    root/.multipart until completed). latency_ms delays every call with
+    asyncio.sleep, like a network round trip that does not hold a thread.
+    """
+
+    exceptions = _S3Exceptions
+
+    def __init__(self, root: str, latency_ms: float = 0.0):
+        self.s3 = LocalS3(root)
+        self.latency_ms = latency_ms
+        self.calls = 0
+        self._uploads = os.path.join(root, '.multipart')
+
+    async def _round_trip(self):
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+
+    async def put_object(self, **kwargs):
+        await self._round_trip()
+        return self.s3.put_object(**kwargs)
+
+    async def get_object(self, **kwargs):
+        await self._round_trip()
+        response = self.s3.get_object(**kwargs)
+        response['Body'] = AsyncStreamingBody(response['Body'].read())
+        return response
+
+    async def head_object(self, **kwargs):
+        await self._round_trip()
+        return self.s3.head_object(**kwargs)
+
+    async def delete_object(self, **kwargs):
+        await self._round_trip()
+        return self.s3.delete_object(**kwargs)
+
+    async def list_objects_v2(self, **kwargs):
+        await self._round_trip()
+        return self.s3.list_objects_v2(**kwargs)
+
+    async def create_multipart_upload(self, Bucket: str, Key: str, **kwargs):
+        await self._round_trip()
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self._uploads, upload_id))
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    async def upload_part(self, Bucket: str, Key: str, UploadId: str, PartNumber: int, Body=b'', **kwargs):
+        await self._round_trip()
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        directory = os.path.join(self._uploads, UploadId)
+        if not os.path.isdir(directory):
+            raise RuntimeError(f"NoSuchUpload: {UploadId}")
+        with open(os.path.join(directory, f"{PartNumber:05d}"), 'wb') as f:
+            f.write(Body)
+        return {'ETag': hashlib.md5(Body).hexdigest()}
+
+    async def complete_multipart_upload(self, Bucket: str, Key: str, UploadId: str, MultipartUpload: Dict, **kwargs):
+        await self._round_trip()
+        directory = os.path.join(self._uploads, UploadId)
+        path = self.s3._path(Bucket, Key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{UploadId}.tmp"
+        with open(tmp_path, 'wb') as out:
+            for part in MultipartUpload['Parts']:
+                with open(os.path.join(directory, f"{part['PartNumber']:05d}"), 'rb') as f:
+                    shutil.copyfileobj(f, out)
+        os.replace(tmp_path, path)
+        shutil.rmtree(directory, ignore_errors=True)
+        return {'Bucket': Bucket, 'Key': Key}
+
+    async def abort_multipart_upload(self, Bucket: str, Key: str, UploadId: str, **kwargs):
+        await self._round_trip()
+        shutil.rmtree(os.path.join(self._uploads, UploadId), ignore_errors=True)
+        return {}
+
+
+class AsyncLocalBedrockRuntime(LocalBedrockRuntime):
+    """
+    LocalBedrockRuntime with a coroutine invoke_model
+    """
+
+    async def invoke_model(self, body, modelId: str = '', **kwargs):
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.sleep(self.latency_ms / 1000.0)
+        return {'body': AsyncStreamingBody(self._respond(body))}
+
+
+class LocalBedrockBatch:
+    """
+    Bedrock batch inference (the 'bedrock' client's model invocation jobs)
+    over a LocalS3 bucket. A job reads its JSONL input in a background
+    thread and writes {output}{job id}/{input name}.out plus
+    manifest.json.out, embedding with LocalBedrockRuntime; failure_rate
+    turns records into error lines. Jobs below min_records fail validation.
+    """
+
+    def __init__(self, s3: LocalS3, failure_rate: float = 0.0, seconds_per_record: float = 0.0,
+                 min_records: int = 100, dimensions: int = TITAN_DIMENSIONS):
+        self.s3 = s3
+        self.runtime = LocalBedrockRuntime(failure_rate=failure_rate, dimensions=dimensions)
+        self.seconds_per_record = seconds_per_record
+        self.min_records = min_records
+        self.jobs: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _split_uri(uri: str):
+        bucket, _, key = uri[len('s3://'):].partition('/')
+        return bucket, key
+
+    def create_model_invocation_job(self, jobName: str, roleArn: str, modelId: str,
+                                    inputDataConfig: Dict, outputDataConfig: Dict, **kwargs):
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'jobArn': f"arn:aws:bedrock:local:000000000000:model-invocation-job/{job_id}",
+            'jobName': jobName,
+            'modelId': modelId,
+            'roleArn': roleArn,
+            'status': 'Submitted',
+            'message': None,
+            'inputDataConfig': inputDataConfig,
+            'outputDataConfig': outputDataConfig,
+            'submitTime': datetime.now(timezone.utc)
+        }
+        with self._lock:
+            self.jobs[job['jobArn']] = job
+        threading.Thread(target=self._run, args=(job, job_id), daemon=True).start()
+        return {'jobArn': job['jobArn']}
+
+    def get_model_invocation_job(self, jobIdentifier: str, **kwargs):
+        with self._lock:
+            return dict(self.jobs[jobIdentifier])
+
+    def stop_model_invocation_job(self, jobIdentifier: str, **kwargs):
+        with self._lock:
+            if self.jobs[jobIdentifier]['status'] in ('Submitted', 'Validating', 'InProgress'):
+                self.jobs[jobIdentifier]['status'] = 'Stopping'
+        return {}
+
+    def _set(self, job: Dict, **fields):
+        with self._lock:
+            job.update(fields, lastModifiedTime=datetime.now(timezone.utc))
+
+    def _run(self, job: Dict, job_id: str):
+        bucket, input_key = self._split_uri(job['inputDataConfig']['s3InputDataConfig']['s3Uri'])
+        _, output_prefix = self._split_uri(job['outputDataConfig']['s3OutputDataConfig']['s3Uri'])
+        self._set(job, status='Validating')
+        try:
+            records = [json.loads(line) for line in self.s3.get_object(Bucket=bucket, Key=input_key)['Body'] if line.strip()]
+        except Exception as e:
+            self._set(job, status='Failed', message=f"Unable to read input: {str(e)}")
+            return
+        if len(records) < self.min_records:
+            self._set(job, status='Failed',
+                      message=f"Input has {len(records)} records, fewer than the minimum of {self.min_records}")
+            return
+
+        self._set(job, status='InProgress')
+        lines, errors, tokens = [], 0, 0
+        for record in records:
+            if job['status'] == 'Stopping':
+                self._set(job, status='Stopped')
+                return
+            if self.seconds_per_record:
+                time.sleep(self.seconds_per_record)
+            try:
+                output = json.loads(self.runtime._respond(json.dumps(record['modelInput'])))
+                tokens += output['inputTextTokenCount']
+                lines.append(dict(record, modelOutput=output))
+            except Exception as e:
+                errors += 1
+                lines.append(dict(record, error={'errorCode': 429, 'errorMessage': str(e)}))
+
+        prefix = f"{output_prefix.rstrip('/')}/{job_id}/{input_key.rsplit('/', 1)[-1]}"
+        self.s3.put_object(Bucket=bucket, Key=f"{prefix}.out",
+                           Body=''.join(json.dumps(line) + '\n' for line in lines))
+        self.s3.put_object(Bucket=bucket, Key=f"{output_prefix.rstrip('/')}/{job_id}/manifest.json.out", Body=json.dumps({
+            'totalRecordCount': len(records), 'processedRecordCount': len(records),
+            'successRecordCount': len(records) - errors, 'errorRecordCount': errors, 'inputTokenCount': tokens
+        }))
+        self._set(job, status='PartiallyCompleted' if errors else 'Completed')
+
+
+class LocalStepFunctions:
+    """
+    start_execution hands the input to a local pipeline instead of AWS
+    """
+
+    def __init__(self, start: callable):
+        self.start = start
+
+    def start_execution(self, stateMachineArn: str, name: str, input: str):
+        self.start(json.loads(input), name)
+        return {
+            'executionArn': f"arn:aws:states:local:000000000000:execution:local:{name}",
+            'startDate': datetime.now(timezone.utc)
+        }
+
+
+class LocalLambda:
+    """
+    invoke hands the payload to a local pipeline instead of AWS Lambda
+    """
+
+    def __init__(self, start: callable):
+        self.start = start
+
+    def invoke(self, FunctionName: str, Payload='{}', InvocationType: str = 'RequestResponse', **kwargs):
+        if isinstance(Payload, (bytes, bytearray)):
+            Payload = Payload.decode('utf-8')
+        self.start(FunctionName, json.loads(Payload))
+        return {'StatusCode': 202 if InvocationType == 'Event' else 200}
+
+
+class LocalLambdaContext:
+    """
+    Lambda context with the configured timeout and memory size
+    """
+
+    def __init__(self, function_name: str, timeout_seconds: float, memory_mb: int):
+        self.function_name = function_name
+        self.memory_limit_in_mb = memory_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.invoked_function_arn = f"arn:aws:lambda:local:000000000000:function:{function_name}"
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Script para agregar e comparar perfis gerados com PROFILING=event|sampled
+Aceita diretórios locais (PROFILE_DIR do Flask) ou prefixos S3
+(s3://bucket/summaries/<document_id>/profiles)
+Executa: python profile_report.py aggregate ORIGEM [--stage S]
+         python profile_report.py diff BASELINE CANDIDATO [--stage S]
+"""
+
+import argparse
+import boto3
+import glob
+import json
+import os
+import pstats
+import sys
+import tempfile
+
+def fetch_profiles(source, stage=None):
+    """
+    Carrega os relatórios JSON (e o caminho local do .pstats de cada um)
+    """
+
+    if source.startswith('s3://'):
+        bucket, _, prefix = source[len('s3://'):].partition('/')
+        s3_client = boto3.client('s3', region_name='sa-east-1')
+        local_dir = tempfile.mkdtemp(prefix='profiles-')
+        paginator = s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+            for obj in page.get('Contents', []):
+                if obj['Key'].endswith(('.json', '.pstats')):
+                    target = os.path.join(local_dir, obj['Key'].replace('/', '__'))
+                    s3_client.download_file(bucket, obj['Key'], target)
+        source = local_dir
+
+    profiles = []
+    for path in sorted(glob.glob(os.path.join(source, '**', '*.json'), recursive=True)):
+        with open(path) as f:
+            report = json.load(f)
+        if 'wall_ms' not in report:
+            continue
+        if stage and report.get('stage') != stage:
+            continue
+        pstats_path = path[:-len('.json')] + '.pstats'
+        report['pstats_path'] = pstats_path if os.path.exists(pstats_path) else None
+        profiles.append(report)
+    return profiles
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def aggregate(profiles):
+    """
+    Resumo por etapa: latência, memória e funções mais caras (média por execução)
+    """
+
+    by_stage = {}
+    for report in profiles:
+        by_stage.setdefault(report['stage'], []).append(report)
+
+    summary = {}
+    for stage, reports in by_stage.items():
+        functions = {}
+        paths = [r['pstats_path'] for r in reports if r['pstats_path']]
+        if paths:
+            stats = pstats.Stats(*paths)
+            for (filename, line, name), (_, ncalls, tottime, cumtime, _) in stats.stats.items():
+                functions[f"{os.path.basename(filename)}:{line}({name})"] = {
+                    'ncalls': ncalls / len(paths),
+                    'tottime_ms': tottime * 1000.0 / len(paths),
+                    'cumtime_ms': cumtime * 1000.0 / len(paths)
+                }
+
+        # O cProfile só vê a thread do handler; as demais vêm das amostras
+        thread_functions = {}
+        for report in reports:
+            for function in report.get('thread_samples', {}).get('top_functions', []):
+                name = os.path.basename(function['function'])
+                thread_functions[name] = thread_functions.get(name, 0.0) + function['estimated_ms'] / len(reports)
+
+        walls = [r['wall_ms'] for r in reports]
+        summary[stage] = {
+            'runs': len(reports),
+            'wall_ms_p50': percentile(walls, 0.5),
+            'wall_ms_max': max(walls),
+            'peak_rss_kb_max': max(r['peak_rss_kb'] for r in reports),
+            'tracemalloc_peak_bytes_max': max(r['tracemalloc_peak_bytes'] for r in reports),
+            'functions': functions,
+            'thread_functions': thread_functions
+        }
+    return summary
+
+def print_aggregate(summary, top):
+    for stage, data in sorted(summary.items()):
+        print(f"\n📊 {stage}: {data['runs']} execuções")
+        print(f"   ⏱️  wall p50 {data['wall_ms_p50']:.1f} ms | max {data['wall_ms_max']:.1f} ms")
+        print(f"   💾 pico RSS {data['peak_rss_kb_max'] / 1024:.1f} MB | "
+              f"pico tracemalloc {data['tracemalloc_peak_bytes_max'] / 1048576:.1f} MB")
+        ranked = sorted(data['functions'].items(), key=lambda item: item[1]['cumtime_ms'], reverse=True)
+        for function, stats in ranked[:top]:
+            print(f"   {stats['cumtime_ms']:10.1f} ms cum {stats['tottime_ms']:10.1f} ms self  {function}")
+        if data['thread_functions']:
+            print("   🧵 outras threads (amostragem de pilhas, tempo somado entre threads):")
+            ranked = sorted(data['thread_functions'].items(), key=lambda item: item[1], reverse=True)
+            for function, estimated_ms in ranked[:top]:
+                print(f"   {estimated_ms:10.1f} ms cum  {function}")
+
+def print_diff(baseline, candidate, top):
+    for stage in sorted(set(baseline) | set(candidate)):
+        if stage not in baseline or stage not in candidate:
+            print(f"\n⚠️  {stage}: presente só em {'baseline' if stage in baseline else 'candidato'}")
+            continue
+        base, cand = baseline[stage], candidate[stage]
+        print(f"\n📊 {stage}: {base['runs']} → {cand['runs']} execuções")
+        for field, label, scale in [
+            ('wall_ms_p50', 'wall p50 (ms)', 1.0),
+            ('peak_rss_kb_max', 'pico RSS (MB)', 1 / 1024),
+            ('tracemalloc_peak_bytes_max', 'pico tracemalloc (MB)', 1 / 1048576)
+        ]:
+            before, after = base[field] * scale, cand[field] * scale
+            change = f"{(after - before) / before * 100:+.1f}%" if before else 'n/a'
+            print(f"   {label:24s} {before:10.1f} → {after:10.1f}  ({change})")
+
+        functions = set(base['functions']) | set(cand['functions'])
+        deltas = []
+        for function in functions:
+            before = base['functions'].get(function, {}).get('tottime_ms', 0.0)
+            after = cand['functions'].get(function, {}).get('tottime_ms', 0.0)
+            deltas.append((after - before, before, after, function))
+        deltas.sort(key=lambda delta: abs(delta[0]), reverse=True)
+        for delta, before, after, function in deltas[:top]:
+            print(f"   {delta:+10.1f} ms self ({before:.1f} → {after:.1f})  {function}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Agrega e compara perfis do pipeline e do Flask')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    aggregate_parser = subparsers.add_parser('aggregate')
+    aggregate_parser.add_argument('source')
+
+    diff_parser = subparsers.add_parser('diff')
+    diff_parser.add_argument('baseline')
+    diff_parser.add_argument('candidate')
+
+    for sub in (aggregate_parser, diff_parser):
+        sub.add_argument('--stage', help='Filtra uma etapa (ex: extract_text, app:search)')
+        sub.add_argument('--top', type=int, default=15)
+        sub.add_argument('--json', action='store_true', help='Imprime o resumo em JSON')
+
+    args = parser.parse_args()
+
+    try:
+        if args.command == 'aggregate':
+            profiles = fetch_profiles(args.source, args.stage)
+            if not profiles:
+                print(f"❌ Nenhum perfil encontrado em {args.source}")
+                sys.exit(1)
+            summary = aggregate(profiles)
+            if args.json:
+                print(json.dumps(summary, indent=2))
+            else:
+                print_aggregate(summary, args.top)
+        else:
+            baseline = aggregate(fetch_profiles(args.baseline, args.stage))
+            candidate = aggregate(fetch_profiles(args.candidate, args.stage))
+            if args.json:
+                print(json.dumps({'baseline': baseline, 'candidate': candidate}, indent=2))
+            else:
+                print_diff(baseline, candidate, args.top)
+        sys.exit(0)
+
+    except Exception as e:
+        print(f"❌ Erro ao gerar relatório de perfis: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Script para re-segmentar (re-chunk) os documentos já extraídos
+Lê as páginas parseadas do cache parsed/ (hash do PDF + versão do parser)
+e grava novos artefatos extracted/ com os novos parâmetros de chunking,
+sem baixar nem parsear os PDFs de novo; só documentos sem cache são parseados
+Executa: python rechunk_documents.py --chunk-size 800 --overlap 80 [--dry-run]
+"""
+
+import argparse
+import boto3
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+
+from artifacts import open_artifact, put_artifact
+from parsed_pages import ParsedPageCache, open_parsed_pages, PARSER_VERSION
+from extract_text import chunk_document, chunking_config, build_extracted_json
+
+def rechunk_document(s3_client, bucket_name, extracted_key, config, dry_run=False, force=False):
+    """
+    Re-segmenta um documento de extracted/ a partir das páginas parseadas
+    """
+
+    # Só o cabeçalho do artefato é decodificado; os chunks antigos não são lidos
+    header, _ = open_artifact(s3_client, bucket_name, extracted_key, records_field='chunks')
+    if header.get('chunking') == config and not force:
+        return {'key': extracted_key, 'status': 'unchanged'}
+
+    parsed, source = None, 'cache'
+    if header.get('content_hash') and header.get('parser_version') == PARSER_VERSION:
+        parsed = ParsedPageCache(s3_client, bucket_name).open(header['content_hash'])
+    if parsed is None:
+        # Artefato antigo ou parser novo: parseia o PDF uma vez (e grava no cache)
+        response = s3_client.get_object(Bucket=header['source_bucket'], Key=header['source_key'])
+        parsed, source = open_parsed_pages(response['Body'].read(), s3_client, bucket_name), 'parsed'
+
+    page_header, pages = parsed
+    extracted_data = chunk_document(
+        page_header, pages, header['document_id'], config['chunk_size'], config['overlap']
+    )
+    if not dry_run:
+        put_artifact(
+            s3_client, bucket_name, extracted_key,
+            build_extracted_json(extracted_data, header['source_bucket'], header['source_key']),
+            records_field='chunks'
+        )
+    return {'key': extracted_key, 'status': 'rechunked', 'source': source, 'chunks': len(extracted_data['chunks'])}
+
+def rechunk_documents(s3_client, bucket_name, config, prefix='extracted/', workers=8, dry_run=False, force=False):
+    keys = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj['Key'] for obj in page.get('Contents', []) if obj['Key'].endswith('.json'))
+
+    def run(key):
+        try:
+            return rechunk_document(s3_client, bucket_name, key, config, dry_run, force)
+        except Exception as e:
+            return {'key': key, 'status': 'failed', 'error': str(e)}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(run, keys))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Re-segmenta os documentos extraídos sem parsear os PDFs')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Padrão: CHUNK_SIZE (1000)')
+    parser.add_argument('--overlap', type=int, default=None, help='Padrão: CHUNK_OVERLAP (100)')
+    parser.add_argument('--prefix', default='extracted/')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--force', action='store_true', help='Re-segmenta mesmo com os parâmetros atuais')
+    parser.add_argument('--dry-run', action='store_true', help='Só conta os chunks, sem gravar')
+    args = parser.parse_args()
+
+    # Configurações
+    bucket_name = 'source-pdf-qa-aws'
+    region = 'sa-east-1'
+
+    try:
+        config = chunking_config(args.chunk_size, args.overlap)
+        s3_client = boto3.client('s3', region_name=region)
+
+        print(f"✂️  Re-segmentando {args.prefix} com chunks de {config['chunk_size']} "
+              f"e sobreposição de {config['overlap']}...")
+        started = time.perf_counter()
+        results = rechunk_documents(s3_client, bucket_name, config, args.prefix, args.workers, args.dry_run, args.force)
+        elapsed = time.perf_counter() - started
+
+        for result in results:
+            if result['status'] == 'rechunked':
+                print(f"   ✅ {result['key']} ({result['chunks']} chunks, {result['source']})")
+            elif result['status'] == 'failed':
+                print(f"   ❌ {result['key']}: {result['error']}")
+
+        rechunked = [result for result in results if result['status'] == 'rechunked']
+        cached = sum(1 for result in rechunked if result['source'] == 'cache')
+        unchanged = sum(1 for result in results if result['status'] == 'unchanged')
+        failed = sum(1 for result in results if result['status'] == 'failed')
+        print(f"\n🎯 {len(rechunked)} documentos re-segmentados em {elapsed:.1f}s "
+              f"({cached} do cache, {len(rechunked) - cached} parseados, {unchanged} sem mudança, {failed} falhas)")
+        if rechunked and not args.dry_run:
+            print("⚠️  Os embeddings desses documentos precisam ser gerados de novo (reprocesse pela Step Function)")
+
+        sys.exit(0 if failed == 0 else 1)
+
+    except Exception as e:
+        print(f"❌ Erro ao re-segmentar documentos: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,26 @@
+"""
+Retrieval layer used by the Flask app to search embedded chunks
+"""
+
+from .records import record_id, embedding_records
+from .vector_store import MappedVectorStore, SharedVectorStore, write_vector_store
+from .segments import SegmentedIndex, BackgroundCompactor
+from .batcher import QueryBatcher
+from .shards import ShardedIndex, ShardedSearchClient, ShardedResults, serve_shard, shard_for, is_sharded
+
+__all__ = [
+    'record_id',
+    'embedding_records',
+    'MappedVectorStore',
+    'SharedVectorStore',
+    'write_vector_store',
+    'SegmentedIndex',
+    'BackgroundCompactor',
+    'QueryBatcher',
+    'ShardedIndex',
+    'ShardedSearchClient',
+    'ShardedResults',
+    'serve_shard',
+    'shard_for',
+    'is_sharded',
+]
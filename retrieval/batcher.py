@@ -0,0 +1,134 @@
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, Dict, Sequence
+
+import numpy as np
+
+from .filters import filters_key
+
+DEFAULT_WINDOW_MS = 2.0
+DEFAULT_MAX_BATCH = 32
+DEFAULT_WORKERS = 4
+
+
+class QueryBatcher:
+    """
+    Collect concurrent search requests into micro-batches.
+
+    A collector thread waits for the first request, then keeps gathering
+    until window_ms has elapsed or max_batch requests are queued. Each batch
+    embeds its distinct query texts with one embed_batch call and scores all
+    of them against the index with search_batch (one matrix-matrix multiply
+    per segment and distinct filter); results are split back to the
+    waiting callers. Batches run on a small pool so the next window fills
+    while one executes.
+    """
+
+    def __init__(
+        self,
+        index,
+        embed_batch: Callable[[Sequence[str]], List[List[float]]],
+        window_ms: float = DEFAULT_WINDOW_MS,
+        max_batch: int = DEFAULT_MAX_BATCH,
+        workers: int = DEFAULT_WORKERS
+    ):
+        self.index = index
+        self.embed_batch = embed_batch
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.workers = workers
+        self.batches = 0
+        self.queries = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pid = None
+        self._executor = None
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so (re)start lazily in each worker process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='query-batch')
+            threading.Thread(target=self._collect, daemon=True, name='query-batcher').start()
+            self._pid = os.getpid()
+
+    def submit(self, text: str, k: int = 5, filters: Dict = None) -> Future:
+        """
+        Queue a search; the future resolves with its results. asyncio
+        callers await it through asyncio.wrap_future without holding a thread.
+        """
+
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((text, k, filters, future))
+        return future
+
+    def search(self, text: str, k: int = 5, filters: Dict = None, timeout: float = None) -> List[Dict]:
+        return self.submit(text, k, filters).result(timeout)
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'average_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'window_ms': self.window * 1000.0,
+            'max_batch': self.max_batch
+        }
+
+    def _collect(self):
+        pending = self._queue
+        while True:
+            batch = [pending.get()]
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._execute, batch)
+
+    def _execute(self, batch):
+        # Drop requests whose caller gave up (an awaiting task was cancelled);
+        # the rest can no longer be cancelled, so their results always land
+        batch = [request for request in batch if request[3].set_running_or_notify_cancel()]
+        if not batch:
+            return
+        futures = [future for _, _, _, future in batch]
+        try:
+            texts = list(dict.fromkeys(text for text, _, _, _ in batch))
+            vectors = dict(zip(texts, np.asarray(self.embed_batch(texts), dtype=np.float32)))
+
+            # Requests with the same filters share one allow-set and one multiply
+            groups: Dict[str, list] = {}
+            for request in batch:
+                groups.setdefault(filters_key(request[2]), []).append(request)
+
+            for requests in groups.values():
+                group_texts = list(dict.fromkeys(text for text, _, _, _ in requests))
+                results = self.index.search_batch(
+                    np.stack([vectors[text] for text in group_texts]),
+                    max(k for _, k, _, _ in requests),
+                    filters=requests[0][2]
+                )
+                by_text = dict(zip(group_texts, results))
+                for text, k, _, future in requests:
+                    future.set_result(by_text[text][:k])
+
+            with self._lock:
+                self.batches += 1
+                self.queries += len(batch)
+
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
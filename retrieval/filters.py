@@ -0,0 +1,208 @@
+import re
+from datetime import date
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+# Metadata fields that get postings. Each field is stored as sorted-array
+# postings: the sorted distinct values, the row ids ordered by value and
+# the offset of every value's run in that order. Equality and range
+# filters are a searchsorted plus a slice, never a scan over the rows.
+FILTER_FIELDS = ('document_id', 'title', 'author', 'creation_date', 'total_pages', 'page')
+NUMERIC_FIELDS = ('total_pages', 'page')
+# Dates are indexed as ISO YYYY-MM-DD so string order is date order;
+# undated documents get '' and never match a date range
+DATE_FIELDS = ('creation_date',)
+EARLIEST_DATE = '0001-01-01'
+
+# PDF dates are D:YYYYMMDDHHmmSS+HH'mm' with everything after the year
+# optional; ISO dates (YYYY-MM-DD, possibly with a time) are accepted too
+_DATE = re.compile(r'^(?:D:)?(\d{4})(?:-?(\d{2})(?:-?(\d{2}))?)?')
+
+
+def normalize_date(value) -> str:
+    """
+    ISO YYYY-MM-DD for a PDF or ISO date, '' when it is not one
+    """
+
+    match = _DATE.match(str(value or '').strip())
+    if not match:
+        return ''
+    year, month, day = (int(part) if part else 1 for part in match.groups())
+    try:
+        return date(year, month, day).isoformat()
+    except ValueError:
+        return ''
+
+
+def _field_value(item: Dict, field: str):
+    value = item.get(field)
+    if field in NUMERIC_FIELDS:
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return -1
+    if field in DATE_FIELDS:
+        return normalize_date(value)
+    return '' if value is None else str(value)
+
+
+def build_postings(metadata: Sequence[Dict]) -> Dict[str, np.ndarray]:
+    """
+    Build postings arrays for every filter field, keyed for the segment sidecar
+    """
+
+    arrays = {}
+    for field in FILTER_FIELDS:
+        column = np.asarray(
+            [_field_value(item, field) for item in metadata],
+            dtype=np.int64 if field in NUMERIC_FIELDS else str
+        )
+        values, codes = np.unique(column, return_inverse=True)
+        order = np.argsort(codes, kind='stable')
+        offsets = np.zeros(len(values) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(codes, minlength=len(values)))
+
+        arrays[f"filter_{field}_values"] = values
+        arrays[f"filter_{field}_order"] = order.astype(np.int64)
+        arrays[f"filter_{field}_offsets"] = offsets
+    return arrays
+
+
+class FieldPostings:
+    def __init__(self, values: np.ndarray, order: np.ndarray, offsets: np.ndarray):
+        self.values = values
+        self.order = order
+        self.offsets = offsets
+
+    def equal(self, wanted: Sequence) -> np.ndarray:
+        rows = []
+        for value in wanted:
+            if self.values.dtype.kind in 'iu':
+                try:
+                    value = int(value)
+                except (TypeError, ValueError):
+                    continue
+            else:
+                value = str(value)
+            position = int(np.searchsorted(self.values, value))
+            if position < len(self.values) and self.values[position] == value:
+                rows.append(self.order[self.offsets[position]:self.offsets[position + 1]])
+        return np.unique(np.concatenate(rows)) if rows else np.empty(0, dtype=np.int64)
+
+    def between(self, low=None, high=None) -> np.ndarray:
+        """
+        Rows whose value lies in [low, high]; either bound may be omitted
+        """
+
+        start = 0 if low is None else int(np.searchsorted(self.values, low, side='left'))
+        end = len(self.values) if high is None else int(np.searchsorted(self.values, high, side='right'))
+        if start >= end:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(self.order[self.offsets[start]:self.offsets[end]])
+
+
+class MetadataFilterIndex:
+    """
+    Per-segment postings used to turn a filter into an allow-set of rows
+    before any vector is scored.
+
+    Filters map a field to a value, a list of values (OR) or a range dict
+    {'gte': ..., 'lte': ...}; different fields are combined with AND.
+    """
+
+    def __init__(self, fields: Dict[str, FieldPostings], row_count: int):
+        self.fields = fields
+        self.row_count = row_count
+
+    @classmethod
+    def from_arrays(cls, arrays, row_count: int) -> Optional['MetadataFilterIndex']:
+        fields = {}
+        for field in FILTER_FIELDS:
+            key = f"filter_{field}_values"
+            if key not in arrays:
+                return None
+            if field in DATE_FIELDS and any(str(value).startswith('D:') for value in arrays[key]):
+                # Written before dates were normalized: rebuild from metadata
+                return None
+            fields[field] = FieldPostings(
+                arrays[key], arrays[f"filter_{field}_order"], arrays[f"filter_{field}_offsets"]
+            )
+        return cls(fields, row_count)
+
+    @classmethod
+    def from_metadata(cls, metadata: Sequence[Dict]) -> 'MetadataFilterIndex':
+        return cls.from_arrays(build_postings(metadata), len(metadata))
+
+    def allowed_rows(self, filters: Optional[Dict]) -> Optional[np.ndarray]:
+        """
+        Sorted row ids matching every filter, or None when nothing is filtered
+        """
+
+        if not filters:
+            return None
+
+        allowed = None
+        for field, condition in filters.items():
+            postings = self.fields.get(field)
+            if postings is None:
+                raise ValueError(f'Unsupported filter field: {field}')
+
+            if isinstance(condition, dict):
+                rows = postings.between(condition.get('gte'), condition.get('lte'))
+            elif isinstance(condition, (list, tuple, set)):
+                rows = postings.equal(list(condition))
+            else:
+                rows = postings.equal([condition])
+
+            allowed = rows if allowed is None else np.intersect1d(allowed, rows, assume_unique=True)
+            if not len(allowed):
+                break
+
+        return allowed
+
+
+def filters_key(filters: Optional[Dict]) -> str:
+    """
+    Stable key for grouping requests that share the same filters
+    """
+
+    if not filters:
+        return ''
+    return repr(sorted((field, repr(condition)) for field, condition in filters.items()))
+
+
+def _parse_date(value: str) -> str:
+    if not re.fullmatch(r'\d{4}-\d{2}-\d{2}', value):
+        raise ValueError(f'Invalid date {value!r}, expected YYYY-MM-DD')
+    return date.fromisoformat(value).isoformat()
+
+
+def parse_filters(values) -> Dict:
+    """
+    Build filters from request arguments: document_id, title and author
+    (repeatable), page_from/page_to and date_from/date_to (YYYY-MM-DD,
+    inclusive, on the PDF creation date) ranges
+    """
+
+    filters: Dict[str, object] = {}
+    for field in ('document_id', 'title', 'author'):
+        wanted: List[str] = [v for v in values.getlist(field) if v]
+        if wanted:
+            filters[field] = wanted
+
+    for field, low_arg, high_arg, cast in (
+        ('page', 'page_from', 'page_to', int),
+        ('creation_date', 'date_from', 'date_to', _parse_date),
+    ):
+        low, high = values.get(low_arg), values.get(high_arg)
+        if low or high:
+            filters[field] = {
+                'gte': cast(low) if low else None,
+                'lte': cast(high) if high else None
+            }
+            if field in DATE_FIELDS and filters[field]['gte'] is None:
+                # Keep undated documents ('') out of an open-ended range
+                filters[field]['gte'] = EARLIEST_DATE
+
+    return filters
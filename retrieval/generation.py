@@ -0,0 +1,172 @@
+import json
+import time
+import asyncio
+from typing import AsyncIterator, Dict, Iterator, List
+
+DEFAULT_ANSWER_MODEL_ID = 'anthropic.claude-3-haiku-20240307-v1:0'
+DEFAULT_MAX_TOKENS = 1024
+
+
+def build_prompt(question: str, sources: List[Dict]) -> str:
+    """
+    Build the RAG prompt from the retrieved chunks
+    """
+
+    context = '\n\n'.join(
+        f"[{i + 1}] ({source['metadata'].get('document_id')}, página {source['metadata'].get('page')})\n"
+        f"{source['metadata'].get('text', '')}"
+        for i, source in enumerate(sources)
+    )
+    return (
+        "Responda à pergunta usando apenas os trechos abaixo. "
+        "Cite os trechos usados no formato [n]. Se a resposta não estiver nos trechos, diga que não sabe.\n\n"
+        f"Trechos:\n{context}\n\nPergunta: {question}"
+    )
+
+
+class BedrockStreamingModel:
+    """
+    Stream text deltas from a Bedrock Anthropic model through
+    invoke_model_with_response_stream. The bedrock-runtime client is
+    injected so the app and tests can swap it out.
+    """
+
+    def __init__(self, client, model_id: str = DEFAULT_ANSWER_MODEL_ID, max_tokens: int = DEFAULT_MAX_TOKENS):
+        self.client = client
+        self.model_id = model_id
+        self.max_tokens = max_tokens
+
+    def _request(self, prompt: str) -> Dict:
+        return {
+            'modelId': self.model_id,
+            'contentType': 'application/json',
+            'accept': 'application/json',
+            'body': json.dumps({
+                'anthropic_version': 'bedrock-2023-05-31',
+                'max_tokens': self.max_tokens,
+                'messages': [{'role': 'user', 'content': prompt}]
+            })
+        }
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        response = self.client.invoke_model_with_response_stream(**self._request(prompt))
+        for event in response['body']:
+            text = delta_text(event)
+            if text:
+                yield text
+
+
+class AsyncBedrockStreamingModel(BedrockStreamingModel):
+    """
+    Same as BedrockStreamingModel over an aiobotocore bedrock-runtime
+    client, for the asyncio app
+    """
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        response = await self.client.invoke_model_with_response_stream(**self._request(prompt))
+        async for event in response['body']:
+            text = delta_text(event)
+            if text:
+                yield text
+
+
+def delta_text(event: Dict):
+    """
+    Text of a content_block_delta event of a Bedrock response stream
+    """
+
+    chunk = event.get('chunk')
+    if not chunk:
+        return None
+    payload = json.loads(chunk['bytes'])
+    if payload.get('type') == 'content_block_delta':
+        return payload.get('delta', {}).get('text')
+    return None
+
+
+class FakeStreamingModel:
+    """
+    Local stand-in that streams a canned answer word by word with a fixed
+    delay per token, for development without Bedrock and for tests
+    """
+
+    def __init__(self, delay: float = 0.02, first_token_delay: float = 0.2):
+        self.delay = delay
+        self.first_token_delay = first_token_delay
+
+    def _words(self, prompt: str) -> List[str]:
+        question = prompt.rsplit('Pergunta:', 1)[-1].strip()
+        answer = f"Resposta simulada para: {question} Consulte os trechos [1] para mais detalhes."
+        return [word if i == 0 else f" {word}" for i, word in enumerate(answer.split(' '))]
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        time.sleep(self.first_token_delay)
+        for i, word in enumerate(self._words(prompt)):
+            if i:
+                time.sleep(self.delay)
+            yield word
+
+    async def astream(self, prompt: str) -> AsyncIterator[str]:
+        await asyncio.sleep(self.first_token_delay)
+        for i, word in enumerate(self._words(prompt)):
+            if i:
+                await asyncio.sleep(self.delay)
+            yield word
+
+
+def stream_answer(question: str, sources: List[Dict], model, started_at: float) -> Iterator[Dict]:
+    """
+    Yield the answer as events: 'sources' right away, then one 'token' per
+    text delta, then 'done' with time to first byte, time to first token
+    and total latency (all measured from started_at, in milliseconds)
+    """
+
+    first_byte_ms = (time.perf_counter() - started_at) * 1000.0
+    yield {'event': 'sources', 'data': {'sources': sources}}
+
+    first_token_ms = None
+    answer = []
+    for text in model.stream(build_prompt(question, sources)):
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started_at) * 1000.0
+        answer.append(text)
+        yield {'event': 'token', 'data': {'text': text}}
+
+    yield done_event(answer, started_at, first_byte_ms, first_token_ms)
+
+
+async def astream_answer(question: str, sources: List[Dict], model, started_at: float) -> AsyncIterator[Dict]:
+    """
+    stream_answer for models with an async astream()
+    """
+
+    first_byte_ms = (time.perf_counter() - started_at) * 1000.0
+    yield {'event': 'sources', 'data': {'sources': sources}}
+
+    first_token_ms = None
+    answer = []
+    async for text in model.astream(build_prompt(question, sources)):
+        if first_token_ms is None:
+            first_token_ms = (time.perf_counter() - started_at) * 1000.0
+        answer.append(text)
+        yield {'event': 'token', 'data': {'text': text}}
+
+    yield done_event(answer, started_at, first_byte_ms, first_token_ms)
+
+
+def done_event(answer: List[str], started_at: float, first_byte_ms: float, first_token_ms) -> Dict:
+    return {
+        'event': 'done',
+        'data': {
+            'answer': ''.join(answer),
+            'timings': {
+                'first_byte_ms': round(first_byte_ms, 1),
+                'first_token_ms': round(first_token_ms, 1) if first_token_ms is not None else None,
+                'total_ms': round((time.perf_counter() - started_at) * 1000.0, 1)
+            }
+        }
+    }
+
+
+def format_sse(event: Dict) -> str:
+    return f"event: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
@@ -0,0 +1,48 @@
+from typing import Iterable, List, Dict, Optional, Tuple
+
+
+def record_id(document_id: str, chunk_id: str) -> str:
+    """
+    Corpus-wide id of a chunk (chunk ids are only unique per document)
+    """
+
+    return f"{document_id}#{chunk_id}"
+
+
+def embedding_records(embeddings_json: Dict, chunks: Optional[Iterable[Dict]] = None,
+                      include_text: bool = True) -> Tuple[List[str], List[List[float]], List[Dict]]:
+    """
+    Turn an embeddings/ artifact into parallel id, vector and metadata lists;
+    chunks, when given, are the streamed embeddings_data records. Without
+    include_text the chunk text is left to the chunk text store.
+    """
+
+    document_id = embeddings_json['document_id']
+    document_metadata = embeddings_json.get('metadata') or {}
+    ids, vectors, metadata = [], [], []
+
+    if chunks is None:
+        chunks = embeddings_json.get('embeddings_data', [])
+
+    for chunk in chunks:
+        if not chunk.get('embedding'):
+            continue
+        ids.append(record_id(document_id, chunk['chunk_id']))
+        vectors.append(chunk['embedding'])
+        record = {
+            'document_id': document_id,
+            'chunk_id': chunk['chunk_id'],
+            'page': chunk['page'],
+            'char_count': chunk['char_count'],
+            'source_key': embeddings_json.get('source_key'),
+            'duplicates': chunk.get('duplicates', []),
+            'title': document_metadata.get('title', ''),
+            'author': document_metadata.get('author', ''),
+            'creation_date': document_metadata.get('creation_date', ''),
+            'total_pages': embeddings_json.get('total_pages') or 0
+        }
+        if include_text:
+            record['text'] = chunk['text']
+        metadata.append(record)
+
+    return ids, vectors, metadata
@@ -0,0 +1,556 @@
+import os
+import json
+import time
+import uuid
+import heapq
+import fcntl
+import threading
+from typing import List, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .vector_store import MappedVectorStore, write_vector_store, normalize_vectors, top_k
+from .filters import MetadataFilterIndex, build_postings
+
+# Log-structured vector index. Every ingested document (or micro-batch of
+# documents) becomes a small immutable segment; a size-tiered compactor
+# merges FANOUT segments of one level into a single segment of the next
+# level. Segments above IVF_MIN_ROWS get an inverted-file (IVF) structure:
+# rows are reordered by k-means cluster so each probed list is one
+# contiguous slice of the memory-mapped vectors.
+#
+# MANIFEST lists the live segments and is replaced atomically on every
+# change. Deletions are tombstones {document_id: seq}: rows of that
+# document written at or before seq are dead, so a re-ingested document
+# (higher seq) is unaffected. Tombstoned rows are dropped by compaction.
+MANIFEST_FILE = 'MANIFEST'
+LOCK_FILE = 'manifest.lock'
+FANOUT = 4
+IVF_MIN_ROWS = 20000
+DEFAULT_NPROBE = 32
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 64
+# Filtered search scans the allow-set directly when it is at most this many
+# rows or this fraction of the segment; otherwise it probes the IVF lists,
+# widening nprobe by 1 / selectivity so the number of allowed candidates
+# (and therefore recall and latency) stays roughly constant
+BRUTE_FORCE_MAX_ROWS = 20000
+BRUTE_FORCE_MAX_FRACTION = 0.05
+
+
+def _empty_manifest() -> Dict:
+    return {'generation': 0, 'next_seq': 1, 'segments': [], 'tombstones': {}, 'documents': {}}
+
+
+def spherical_kmeans(vectors: np.ndarray, nlist: int, seed: int = 0) -> np.ndarray:
+    """
+    Cluster unit vectors by cosine similarity, returning unit centroids
+    """
+
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), nlist * KMEANS_SAMPLE_PER_LIST)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+    for _ in range(KMEANS_ITERATIONS):
+        assignments = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        counts = np.bincount(assignments, minlength=nlist)
+        # Empty clusters keep their previous centroid
+        centroids = np.where(counts[:, None] > 0, sums, centroids)
+        centroids = normalize_vectors(centroids)
+
+    return centroids
+
+
+def assign_clusters(vectors: np.ndarray, centroids: np.ndarray, batch_size: int = 65536) -> np.ndarray:
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), batch_size):
+        block = np.asarray(vectors[start:start + batch_size])
+        assignments[start:start + batch_size] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+class Segment:
+    """
+    One immutable segment: a memory-mapped vector store file plus a small
+    sidecar with the document and sequence number of every row and, for
+    compacted segments, the IVF centroids and list offsets
+    """
+
+    def __init__(self, directory: str, entry: Dict):
+        self.name = entry['name']
+        self.level = entry['level']
+        self.min_seq = entry['min_seq']
+        self.max_seq = entry['max_seq']
+        self.store = MappedVectorStore(os.path.join(directory, f"{self.name}.qvs"))
+
+        with np.load(os.path.join(directory, f"{self.name}.npz"), allow_pickle=False) as sidecar:
+            self.documents = [str(d) for d in sidecar['documents']]
+            self.doc_index = sidecar['doc_index']
+            self.seqs = sidecar['seqs']
+            self.centroids = sidecar['centroids'] if 'centroids' in sidecar.files else None
+            self.list_offsets = sidecar['list_offsets'] if 'list_offsets' in sidecar.files else None
+            self._filter_index = MetadataFilterIndex.from_arrays(
+                {key: sidecar[key] for key in sidecar.files if key.startswith('filter_')}, len(self.store)
+            )
+
+        self._document_positions = {doc: i for i, doc in enumerate(self.documents)}
+        self._mask_key = None
+        self._mask = None
+
+    def __len__(self):
+        return len(self.store)
+
+    def deleted_mask(self, tombstones: Dict[str, int]) -> Optional[np.ndarray]:
+        """
+        Boolean mask of rows hidden by tombstones (None when nothing is hidden)
+        """
+
+        relevant = tuple(sorted(
+            (doc, seq) for doc, seq in tombstones.items()
+            if doc in self._document_positions and seq >= self.min_seq
+        ))
+        if relevant != self._mask_key:
+            mask = None
+            for doc, seq in relevant:
+                hidden = (self.doc_index == self._document_positions[doc]) & (self.seqs <= seq)
+                mask = hidden if mask is None else (mask | hidden)
+            self._mask_key, self._mask = relevant, mask
+        return self._mask
+
+    @property
+    def filter_index(self) -> MetadataFilterIndex:
+        # Segments written before postings existed build them on first use
+        if self._filter_index is None:
+            self._filter_index = MetadataFilterIndex.from_metadata(
+                [self.store.metadata(row) for row in range(len(self.store))]
+            )
+        return self._filter_index
+
+    def filtered_rows(self, queries: np.ndarray, nprobe: int, filters: Dict) -> np.ndarray:
+        """
+        Candidate rows under a metadata filter: the whole allow-set when it
+        is selective (brute force), otherwise the allowed rows of a widened
+        IVF probe
+        """
+
+        allowed = self.filter_index.allowed_rows(filters)
+        if (
+            self.centroids is None
+            or len(allowed) <= BRUTE_FORCE_MAX_ROWS
+            or len(allowed) <= BRUTE_FORCE_MAX_FRACTION * len(self)
+        ):
+            return allowed
+
+        selectivity = len(allowed) / len(self)
+        rows = self.candidate_rows(queries, int(np.ceil(nprobe / selectivity)))
+        if rows is None:
+            return allowed
+
+        allowed_mask = np.zeros(len(self), dtype=bool)
+        allowed_mask[allowed] = True
+        return rows[allowed_mask[rows]]
+
+    def candidate_rows(self, queries: np.ndarray, nprobe: int) -> Optional[np.ndarray]:
+        """
+        Rows of the nprobe closest IVF lists of every query (their union,
+        so a batch is still scored with one matrix multiply), or None for a
+        full scan
+        """
+
+        if self.centroids is None or nprobe >= len(self.centroids):
+            return None
+
+        centroid_scores = queries @ self.centroids.T
+        lists = set()
+        for row in centroid_scores:
+            lists.update(int(i) for i in top_k(row, nprobe))
+        return np.concatenate([
+            np.arange(self.list_offsets[i], self.list_offsets[i + 1]) for i in sorted(lists)
+        ])
+
+    def search_batch(
+        self,
+        queries: np.ndarray,
+        k: int,
+        tombstones: Dict[str, int],
+        nprobe: int,
+        filters: Optional[Dict] = None
+    ) -> List[List[Tuple[float, int]]]:
+        """
+        Top-k (score, row) pairs for every row of queries
+        """
+
+        if not len(self):
+            return [[] for _ in range(len(queries))]
+
+        if filters:
+            rows = self.filtered_rows(queries, nprobe, filters)
+            if not len(rows):
+                return [[] for _ in range(len(queries))]
+        else:
+            rows = self.candidate_rows(queries, nprobe)
+        vectors = self.store.vectors if rows is None else self.store.vectors[rows]
+        scores = queries @ vectors.T
+
+        mask = self.deleted_mask(tombstones)
+        if mask is not None:
+            scores[:, mask if rows is None else mask[rows]] = -np.inf
+
+        results = []
+        for query_scores in scores:
+            best = top_k(query_scores, k)
+            best = best[np.isfinite(query_scores[best])]
+            row_ids = best if rows is None else rows[best]
+            results.append([(float(query_scores[i]), int(r)) for i, r in zip(best, row_ids)])
+        return results
+
+
+def write_segment(
+    directory: str,
+    ids: Sequence[str],
+    vectors,
+    metadata: Sequence[Dict],
+    documents: Sequence[str],
+    seqs: Sequence[int],
+    level: int = 0
+) -> Dict:
+    """
+    Write a segment and return its manifest entry. Segments of at least
+    IVF_MIN_ROWS rows are clustered and stored in IVF list order.
+    """
+
+    name = f"seg-{uuid.uuid4().hex}"
+    matrix = normalize_vectors(vectors) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    documents = list(documents)
+    seqs = np.asarray(seqs, dtype=np.int64)
+
+    unique_documents = sorted(set(documents))
+    positions = {doc: i for i, doc in enumerate(unique_documents)}
+    doc_index = np.asarray([positions[doc] for doc in documents], dtype=np.int32)
+
+    sidecar = {}
+    if len(ids) >= IVF_MIN_ROWS:
+        nlist = int(np.sqrt(len(ids)))
+        centroids = spherical_kmeans(matrix, nlist)
+        assignments = assign_clusters(matrix, centroids)
+        order = np.argsort(assignments, kind='stable')
+        matrix = matrix[order]
+        ids = [ids[i] for i in order]
+        metadata = [metadata[i] for i in order]
+        doc_index = doc_index[order]
+        seqs = seqs[order]
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignments, minlength=nlist))
+        sidecar = {'centroids': centroids, 'list_offsets': list_offsets}
+
+    # Postings refer to final row positions, so build them after reordering
+    sidecar.update(build_postings(metadata))
+
+    # Sidecar first: a segment is only visible once it is in the manifest
+    with open(os.path.join(directory, f"{name}.npz"), 'wb') as f:
+        np.savez(
+            f,
+            documents=np.asarray(unique_documents, dtype=str),
+            doc_index=doc_index,
+            seqs=seqs,
+            **sidecar
+        )
+    write_vector_store(os.path.join(directory, f"{name}.qvs"), ids, matrix, metadata)
+
+    return {
+        'name': name,
+        'level': level,
+        'count': len(ids),
+        'min_seq': int(seqs.min()) if len(seqs) else 0,
+        'max_seq': int(seqs.max()) if len(seqs) else 0,
+        'ivf': bool(sidecar)
+    }
+
+
+class SegmentedIndex:
+    """
+    Incrementally updatable vector index made of immutable segments.
+
+    Writers (ingest, delete, compaction) serialize on a lock file and swap
+    MANIFEST atomically; readers pick up the new manifest at most every
+    refresh_interval seconds, reusing already-mapped segments.
+    """
+
+    def __init__(self, directory: str, refresh_interval: float = 1.0, nprobe: int = DEFAULT_NPROBE):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self.nprobe = nprobe
+        self._manifest = _empty_manifest()
+        self._segments: Dict[str, Segment] = {}
+        self._checked_at = 0.0
+        self._refresh_lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._manifest['generation']
+
+    # Manifest handling
+
+    def _manifest_path(self) -> str:
+        return os.path.join(self.directory, MANIFEST_FILE)
+
+    def read_manifest(self) -> Dict:
+        try:
+            with open(self._manifest_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return _empty_manifest()
+
+    def _write_manifest(self, manifest: Dict):
+        manifest['generation'] += 1
+        tmp_path = f"{self._manifest_path()}.tmp-{os.getpid()}-{threading.get_ident()}"
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self._manifest_path())
+        self._checked_at = 0.0
+
+    def _locked(self):
+        os.makedirs(self.directory, exist_ok=True)
+        lock = open(os.path.join(self.directory, LOCK_FILE), 'w')
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        return lock
+
+    def refresh(self, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < self.refresh_interval:
+            return
+
+        with self._refresh_lock:
+            manifest = self.read_manifest()
+            if manifest['generation'] == self._manifest['generation'] and not force:
+                self._checked_at = now
+                return
+
+            segments = {}
+            for entry in manifest['segments']:
+                segment = self._segments.get(entry['name'])
+                if segment is None:
+                    try:
+                        segment = Segment(self.directory, entry)
+                    except FileNotFoundError:
+                        # Compacted away between reading the manifest and opening it
+                        return
+                segments[entry['name']] = segment
+
+            self._segments = segments
+            self._manifest = manifest
+            # Only now, so concurrent callers wait on the lock for the
+            # first load instead of searching an empty index
+            self._checked_at = now
+
+    def segments(self) -> List[Segment]:
+        self.refresh()
+        return list(self._segments.values())
+
+    # Writes
+
+    def add_documents(self, documents: Sequence[Tuple[str, Sequence[str], Sequence, Sequence[Dict]]]) -> Dict:
+        """
+        Append a micro-batch of (document_id, ids, vectors, metadata) as one
+        new segment. Documents that are already indexed are replaced.
+        """
+
+        with self._locked():
+            manifest = self.read_manifest()
+            seq = manifest['next_seq']
+
+            all_ids, all_vectors, all_metadata, row_documents = [], [], [], []
+            for document_id, ids, vectors, metadata in documents:
+                if document_id in manifest['documents']:
+                    manifest['tombstones'][document_id] = seq
+                all_ids.extend(ids)
+                all_vectors.extend(vectors)
+                all_metadata.extend(metadata)
+                row_documents.extend([document_id] * len(ids))
+                manifest['documents'][document_id] = seq + 1
+
+            entry = None
+            if all_ids:
+                entry = write_segment(
+                    self.directory, all_ids, all_vectors, all_metadata,
+                    row_documents, [seq + 1] * len(all_ids)
+                )
+                manifest['segments'].append(entry)
+
+            manifest['next_seq'] = seq + 2
+            self._write_manifest(manifest)
+
+        return entry
+
+    def add_document(self, document_id: str, ids: Sequence[str], vectors, metadata: Sequence[Dict]) -> Dict:
+        return self.add_documents([(document_id, ids, vectors, metadata)])
+
+    def delete_document(self, document_id: str) -> bool:
+        with self._locked():
+            manifest = self.read_manifest()
+            if document_id not in manifest['documents']:
+                return False
+            manifest['tombstones'][document_id] = manifest['next_seq']
+            manifest['next_seq'] += 1
+            del manifest['documents'][document_id]
+            self._write_manifest(manifest)
+        return True
+
+    def has_document(self, document_id: str) -> bool:
+        return document_id in self.read_manifest()['documents']
+
+    # Compaction
+
+    def _pick_compaction(self, manifest: Dict) -> List[Dict]:
+        by_level: Dict[int, List[Dict]] = {}
+        for entry in manifest['segments']:
+            by_level.setdefault(entry['level'], []).append(entry)
+        for level in sorted(by_level):
+            if len(by_level[level]) >= FANOUT:
+                return sorted(by_level[level], key=lambda e: e['min_seq'])[:FANOUT]
+        return []
+
+    def compact(self) -> Optional[Dict]:
+        """
+        Merge one group of same-level segments into the next level. The
+        merge runs without holding the manifest lock; only the swap does.
+        Returns the new segment entry, or None when nothing was due.
+        """
+
+        manifest = self.read_manifest()
+        chosen = self._pick_compaction(manifest)
+        if not chosen:
+            return None
+
+        tombstones = manifest['tombstones']
+        ids, vectors, metadata, row_documents, seqs = [], [], [], [], []
+        for entry in chosen:
+            segment = Segment(self.directory, entry)
+            mask = segment.deleted_mask(tombstones)
+            live = np.arange(len(segment)) if mask is None else np.flatnonzero(~mask)
+            for row in live:
+                ids.append(segment.store.chunk_id(row))
+                metadata.append(segment.store.metadata(row))
+                row_documents.append(segment.documents[segment.doc_index[row]])
+                seqs.append(int(segment.seqs[row]))
+            if len(live):
+                vectors.append(np.asarray(segment.store.vectors[live]))
+
+        merged = write_segment(
+            self.directory, ids,
+            np.concatenate(vectors) if vectors else np.zeros((0, 0), dtype=np.float32),
+            metadata, row_documents, seqs,
+            level=chosen[0]['level'] + 1
+        )
+        chosen_names = {entry['name'] for entry in chosen}
+
+        with self._locked():
+            manifest = self.read_manifest()
+            live_names = {entry['name'] for entry in manifest['segments']}
+            if not chosen_names <= live_names:
+                # Another compactor got there first; discard our output
+                self._remove_segment_files(merged['name'])
+                return None
+
+            segments = [entry for entry in manifest['segments'] if entry['name'] not in chosen_names]
+            if merged['count']:
+                segments.append(merged)
+            manifest['segments'] = segments
+
+            # A tombstone can go once no remaining segment may hold rows it hides
+            oldest = min((entry['min_seq'] for entry in segments), default=manifest['next_seq'])
+            manifest['tombstones'] = {
+                doc: seq for doc, seq in manifest['tombstones'].items() if seq >= oldest
+            }
+            self._write_manifest(manifest)
+
+        for name in chosen_names:
+            self._remove_segment_files(name)
+        if not merged['count']:
+            self._remove_segment_files(merged['name'])
+
+        return merged
+
+    def _remove_segment_files(self, name: str):
+        # Open mappings keep the data alive for readers still using it
+        for suffix in ('.qvs', '.npz'):
+            try:
+                os.unlink(os.path.join(self.directory, f"{name}{suffix}"))
+            except FileNotFoundError:
+                pass
+
+    # Reads
+
+    def search(
+        self,
+        query_vector,
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict] = None
+    ) -> List[Dict]:
+        """
+        Fan the query out to every segment and merge the per-segment top-k
+        """
+
+        return self.search_batch(normalize_vectors(query_vector), k, nprobe, filters)[0]
+
+    def search_batch(
+        self,
+        query_vectors,
+        k: int = 5,
+        nprobe: Optional[int] = None,
+        filters: Optional[Dict] = None
+    ) -> List[List[Dict]]:
+        """
+        Search many queries at once; each segment scores the whole batch
+        with a single matrix-matrix multiply. Metadata filters are resolved
+        to an allow-set per segment before scoring.
+        """
+
+        queries = normalize_vectors(query_vectors)
+        segments = self.segments()
+        if not segments:
+            return [[] for _ in range(len(queries))]
+
+        tombstones = self._manifest['tombstones']
+        candidates = [[] for _ in range(len(queries))]
+        for segment in segments:
+            per_query = segment.search_batch(queries, k, tombstones, nprobe or self.nprobe, filters)
+            for query_candidates, hits in zip(candidates, per_query):
+                query_candidates.extend((score, segment, row) for score, row in hits)
+
+        return [
+            [
+                segment.store.result(row, score)
+                for score, segment, row in heapq.nlargest(k, query_candidates, key=lambda c: c[0])
+            ]
+            for query_candidates in candidates
+        ]
+
+
+class BackgroundCompactor(threading.Thread):
+    """
+    Daemon thread that compacts the index until no level is over FANOUT
+    """
+
+    def __init__(self, index: SegmentedIndex, interval: float = 30.0):
+        super().__init__(daemon=True, name='segment-compactor')
+        self.index = index
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                while self.index.compact():
+                    pass
+            except Exception as e:
+                print(f"Segment compaction failed: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
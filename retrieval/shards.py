@@ -0,0 +1,344 @@
+import os
+import json
+import heapq
+import queue
+import ipaddress
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from itertools import islice
+from multiprocessing.connection import Client, Listener
+from multiprocessing import AuthenticationError
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .segments import SegmentedIndex
+from .vector_store import normalize_vectors
+
+# Horizontal partitioning of the vector index. Documents are routed to a
+# shard by a stable hash of their document_id, so all chunks of a document
+# live in one shard and re-ingesting or deleting it touches only that shard.
+# Each shard is an ordinary SegmentedIndex in directory/shard-NNN, served
+# by its own process (serve_shards.py) over multiprocessing.connection
+# (length-prefixed pickles, HMAC-authenticated with a shared key). The
+# coordinator scatters every query to all shards, waits at most the
+# per-shard timeout and merges the per-shard top-k lists, which arrive
+# sorted, lazily until k results are taken. Shards that time out or fail
+# are left out and reported, so a slow node degrades recall instead of
+# latency. Unpickling a request runs code, so there is no default key:
+# whoever knows it can execute code on the shard host.
+SHARDS_FILE = 'SHARDS.json'
+DEFAULT_SHARD_TIMEOUT_MS = 200.0
+
+
+def shard_for(document_id: str, num_shards: int) -> int:
+    digest = hashlib.sha1(document_id.encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def shard_directory(directory: str, shard: int) -> str:
+    return os.path.join(directory, f"shard-{shard:03d}")
+
+
+def is_sharded(directory: str) -> bool:
+    return os.path.exists(os.path.join(directory, SHARDS_FILE))
+
+
+def parse_address(address: str):
+    """
+    host:port for TCP, anything else is a Unix socket path
+    """
+
+    host, sep, port = address.rpartition(':')
+    if sep and port.isdigit():
+        return (host or '127.0.0.1', int(port))
+    return address
+
+
+def is_local_address(address: str) -> bool:
+    """
+    Unix socket or loopback interface: reachable only from this host
+    """
+
+    parsed = parse_address(address)
+    if not isinstance(parsed, tuple):
+        return True
+    if parsed[0] == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(parsed[0]).is_loopback
+    except ValueError:
+        return False
+
+
+def require_authkey(authkey: Optional[bytes]) -> bytes:
+    if not authkey:
+        raise ValueError('A shard authkey is required (SHARD_AUTHKEY)')
+    return authkey
+
+
+def merge_top_k(per_shard: Sequence[List[Dict]], k: int) -> List[Dict]:
+    """
+    Merge best-first result lists, stopping after k
+    """
+
+    return list(islice(heapq.merge(*per_shard, key=lambda result: -result['score']), k))
+
+
+class ShardedResults(list):
+    """
+    Merged results of one query; missing_shards names the shards left out
+    (timeout or error). Slicing keeps the attribute.
+    """
+
+    def __init__(self, results, missing_shards: Sequence[str] = ()):
+        super().__init__(results)
+        self.missing_shards = list(missing_shards)
+
+    def __getitem__(self, index):
+        item = super().__getitem__(index)
+        if isinstance(index, slice):
+            return ShardedResults(item, self.missing_shards)
+        return item
+
+
+class ShardedIndex:
+    """
+    A sharded index on one filesystem: the writer side for
+    sync_vector_index.py, and an in-process search over all shards (the
+    shard servers search a single shard each). The shard count is fixed
+    when the layout is created.
+    """
+
+    def __init__(self, directory: str, num_shards: Optional[int] = None):
+        self.directory = directory
+        layout_path = os.path.join(directory, SHARDS_FILE)
+        if os.path.exists(layout_path):
+            with open(layout_path) as f:
+                layout = json.load(f)
+            if num_shards and num_shards != layout['shards']:
+                raise ValueError(
+                    f"{directory} has {layout['shards']} shards, not {num_shards} (resharding is not supported)"
+                )
+        else:
+            if not num_shards:
+                raise ValueError(f"{directory} is not a sharded index and no shard count was given")
+            layout = {'shards': num_shards, 'hash': 'sha1'}
+            os.makedirs(directory, exist_ok=True)
+            with open(f"{layout_path}.tmp", 'w') as f:
+                json.dump(layout, f)
+            os.replace(f"{layout_path}.tmp", layout_path)
+        self.num_shards = layout['shards']
+        self.shards = [SegmentedIndex(shard_directory(directory, shard)) for shard in range(self.num_shards)]
+
+    @property
+    def generation(self) -> int:
+        return sum(shard.generation for shard in self.shards)
+
+    def shard(self, document_id: str) -> SegmentedIndex:
+        return self.shards[shard_for(document_id, self.num_shards)]
+
+    def add_documents(self, documents: Sequence[Tuple[str, Sequence[str], Sequence, Sequence[Dict]]]) -> Dict:
+        """
+        One segment per shard that receives documents of the micro-batch
+        """
+
+        by_shard: Dict[int, List] = {}
+        for document in documents:
+            by_shard.setdefault(shard_for(document[0], self.num_shards), []).append(document)
+        return {shard: self.shards[shard].add_documents(batch) for shard, batch in sorted(by_shard.items())}
+
+    def add_document(self, document_id: str, ids: Sequence[str], vectors, metadata: Sequence[Dict]) -> Dict:
+        return self.add_documents([(document_id, ids, vectors, metadata)])
+
+    def delete_document(self, document_id: str) -> bool:
+        return self.shard(document_id).delete_document(document_id)
+
+    def has_document(self, document_id: str) -> bool:
+        return self.shard(document_id).has_document(document_id)
+
+    def compact(self) -> Optional[Dict]:
+        """
+        One compaction step in every shard that needs one
+        """
+
+        compacted = {shard: index.compact() for shard, index in enumerate(self.shards)}
+        return {shard: entry for shard, entry in compacted.items() if entry} or None
+
+    def search(self, query_vector, k: int = 5, nprobe: Optional[int] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        return self.search_batch(normalize_vectors(query_vector), k, nprobe, filters)[0]
+
+    def search_batch(self, query_vectors, k: int = 5, nprobe: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[List[Dict]]:
+        queries = normalize_vectors(query_vectors)
+        per_shard = [shard.search_batch(queries, k, nprobe, filters) for shard in self.shards]
+        return [merge_top_k([results[i] for results in per_shard], k) for i in range(len(queries))]
+
+
+def _handle_connection(index: SegmentedIndex, name: str, connection):
+    with connection:
+        while True:
+            try:
+                request = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                if request['op'] == 'search':
+                    results = index.search_batch(
+                        request['queries'], request['k'], request.get('nprobe'), request.get('filters')
+                    )
+                    response = {'ok': True, 'generation': index.generation, 'results': results}
+                elif request['op'] == 'info':
+                    segments = index.segments()
+                    response = {'ok': True, 'generation': index.generation, 'shard': name,
+                                'segments': len(segments), 'rows': sum(len(segment) for segment in segments)}
+                else:
+                    response = {'ok': False, 'error': f"Unknown op {request['op']}"}
+            except Exception as e:
+                response = {'ok': False, 'error': str(e)}
+            try:
+                connection.send(response)
+            except (EOFError, OSError):
+                return
+
+
+def serve_shard(directory: str, address: str, authkey: bytes, ready=None):
+    """
+    Serve one shard directory until the process is stopped; one thread per
+    coordinator connection, each handling one request at a time
+    """
+
+    require_authkey(authkey)
+    index = SegmentedIndex(directory)
+    index.segments()
+    # The default backlog of 1 stalls a coordinator opening its connections
+    # in a burst (SYN retries of a second or more)
+    listener = Listener(parse_address(address), backlog=128, authkey=authkey)
+    if ready is not None:
+        ready.set()
+    name = os.path.basename(directory.rstrip('/'))
+    while True:
+        try:
+            connection = listener.accept()
+        except (AuthenticationError, EOFError, OSError) as e:
+            print(f"Rejected shard connection on {address}: {str(e)}")
+            continue
+        threading.Thread(target=_handle_connection, args=(index, name, connection), daemon=True).start()
+
+
+class ShardTimeout(Exception):
+    pass
+
+
+class _ShardConnections:
+    """
+    Idle connections to one shard server. A connection carries one request
+    at a time; one whose answer timed out is closed, since the late answer
+    would otherwise be read by the next request.
+    """
+
+    def __init__(self, address: str, authkey: bytes):
+        self.address = address
+        self.authkey = authkey
+        self._idle: queue.LifoQueue = queue.LifoQueue()
+
+    def call(self, request: Dict, timeout: float) -> Dict:
+        try:
+            connection, reused = self._idle.get_nowait(), True
+        except queue.Empty:
+            connection, reused = Client(parse_address(self.address), authkey=self.authkey), False
+        try:
+            connection.send(request)
+            if not connection.poll(timeout):
+                connection.close()
+                raise ShardTimeout(f"{self.address} did not answer within {timeout * 1000:.0f} ms")
+            response = connection.recv()
+        except (EOFError, OSError) as e:
+            connection.close()
+            if reused:
+                # Idle connection to a shard server that has since restarted
+                return self.call(request, timeout)
+            raise Exception(f"Connection to {self.address} failed: {str(e) or type(e).__name__}")
+        self._idle.put(connection)
+        if not response['ok']:
+            raise Exception(f"Shard {self.address} failed: {response['error']}")
+        return response
+
+
+class ShardedSearchClient:
+    """
+    Coordinator over shard servers, with the search interface of
+    SegmentedIndex (usable by the app and QueryBatcher). Results of a query
+    that missed shards are a ShardedResults with missing_shards set; when
+    no shard answers the search fails.
+    """
+
+    def __init__(self, addresses: Sequence[str], authkey: bytes,
+                 timeout_ms: float = DEFAULT_SHARD_TIMEOUT_MS, max_concurrent: int = 32):
+        require_authkey(authkey)
+        self.addresses = list(addresses)
+        self.timeout = timeout_ms / 1000.0
+        self._shards = [_ShardConnections(address, authkey) for address in self.addresses]
+        self._generations = [0] * len(self._shards)
+        self._pool = ThreadPoolExecutor(
+            max_workers=len(self._shards) * max_concurrent, thread_name_prefix='shard-scatter'
+        )
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.partial_queries = 0
+        self.shard_failures = {address: 0 for address in self.addresses}
+
+    @property
+    def generation(self) -> int:
+        return sum(self._generations)
+
+    def search(self, query_vector, k: int = 5, nprobe: Optional[int] = None, filters: Optional[Dict] = None) -> List[Dict]:
+        return self.search_batch(normalize_vectors(query_vector), k, nprobe, filters)[0]
+
+    def search_batch(self, query_vectors, k: int = 5, nprobe: Optional[int] = None,
+                     filters: Optional[Dict] = None) -> List[List[Dict]]:
+        queries = normalize_vectors(query_vectors)
+        request = {'op': 'search', 'queries': queries, 'k': k, 'nprobe': nprobe, 'filters': filters}
+        futures = [self._pool.submit(shard.call, request, self.timeout) for shard in self._shards]
+        done, _ = wait(futures, timeout=self.timeout)
+
+        per_shard, missing = [], []
+        for position, future in enumerate(futures):
+            if future in done and future.exception() is None:
+                response = future.result()
+                self._generations[position] = response['generation']
+                per_shard.append(response['results'])
+            else:
+                missing.append(self.addresses[position])
+                error = future.exception() if future in done else 'timed out'
+                print(f"Shard {self.addresses[position]} left out of the query: {error}")
+
+        with self._lock:
+            self.queries += len(queries)
+            if missing:
+                self.partial_queries += len(queries)
+                for address in missing:
+                    self.shard_failures[address] += 1
+        if not per_shard:
+            raise Exception(f"No shard answered the query ({len(missing)} failed or timed out)")
+
+        return [
+            ShardedResults(merge_top_k([results[i] for results in per_shard], k), missing)
+            for i in range(len(queries))
+        ]
+
+    def info(self) -> List[Dict]:
+        """
+        Generation, segments and rows of every shard (None when unreachable)
+        """
+
+        futures = [self._pool.submit(shard.call, {'op': 'info'}, self.timeout) for shard in self._shards]
+        return [future.result() if future.exception() is None else None for future in futures]
+
+    def stats(self) -> Dict:
+        return {
+            'shards': len(self._shards),
+            'queries': self.queries,
+            'partial_queries': self.partial_queries,
+            'shard_failures': dict(self.shard_failures),
+            'timeout_ms': self.timeout * 1000.0
+        }
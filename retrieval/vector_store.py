@@ -0,0 +1,276 @@
+import os
+import json
+import mmap
+import fcntl
+import struct
+import time
+from typing import List, Dict, Optional, Sequence
+
+import numpy as np
+
+# On-disk layout of one generation file (all integers little-endian):
+#
+#   header (128 bytes)
+#   vectors          float32[count][dim], L2-normalized, 64-byte aligned
+#   id_offsets       uint64[count + 1] into the id blob
+#   id blob          utf-8 chunk ids
+#   metadata_offsets uint64[count + 1] into the metadata blob
+#   metadata blob    utf-8 JSON objects
+#
+# Every section is read through a read-only mmap, so all worker processes
+# that open the same generation share one copy through the page cache.
+MAGIC = b'QAVS'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<4sIQQIIQQQQQ')
+HEADER_SIZE = 128
+ALIGNMENT = 64
+CURRENT_FILE = 'CURRENT'
+LOCK_FILE = 'publish.lock'
+KEEP_GENERATIONS = 2
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def _pack_strings(values: Sequence[bytes]):
+    offsets = np.zeros(len(values) + 1, dtype='<u8')
+    if values:
+        offsets[1:] = np.cumsum([len(value) for value in values])
+    return offsets, b''.join(values)
+
+
+def normalize_vectors(vectors) -> np.ndarray:
+    """
+    Convert vectors to float32 rows with unit L2 norm (cosine via dot product)
+    """
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k highest scores, best first
+    """
+
+    k = min(k, scores.shape[-1])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def write_vector_store(
+    path: str,
+    ids: Sequence[str],
+    vectors,
+    metadata: Sequence[Dict],
+    generation: int = 0
+) -> str:
+    """
+    Write a vector store file. The file is written under a temporary name,
+    fsynced and renamed, so readers never observe a partial file.
+    """
+
+    if len(ids) != len(metadata):
+        raise ValueError('ids and metadata must have the same length')
+
+    matrix = normalize_vectors(vectors) if len(ids) else np.zeros((0, 0), dtype=np.float32)
+    if matrix.shape[0] != len(ids):
+        raise ValueError('ids and vectors must have the same length')
+
+    count, dim = matrix.shape
+    id_offsets, id_blob = _pack_strings([str(chunk_id).encode('utf-8') for chunk_id in ids])
+    metadata_offsets, metadata_blob = _pack_strings(
+        [json.dumps(item, separators=(',', ':')).encode('utf-8') for item in metadata]
+    )
+
+    vectors_offset = _align(HEADER_SIZE)
+    id_offsets_offset = _align(vectors_offset + matrix.nbytes)
+    id_blob_offset = id_offsets_offset + id_offsets.nbytes
+    metadata_offsets_offset = _align(id_blob_offset + len(id_blob))
+    metadata_blob_offset = metadata_offsets_offset + metadata_offsets.nbytes
+
+    header = HEADER.pack(
+        MAGIC, FORMAT_VERSION, generation, count, dim, 0,
+        vectors_offset, id_offsets_offset, id_blob_offset,
+        metadata_offsets_offset, metadata_blob_offset
+    )
+
+    tmp_path = f"{path}.tmp-{os.getpid()}"
+    with open(tmp_path, 'wb') as f:
+        f.write(header.ljust(HEADER_SIZE, b'\0'))
+        for offset, payload in (
+            (vectors_offset, matrix.tobytes()),
+            (id_offsets_offset, id_offsets.tobytes()),
+            (id_blob_offset, id_blob),
+            (metadata_offsets_offset, metadata_offsets.tobytes()),
+            (metadata_blob_offset, metadata_blob),
+        ):
+            f.seek(offset)
+            f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, path)
+    return path
+
+
+class MappedVectorStore:
+    """
+    Read-only view of one vector store file backed by mmap
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+
+        if self._mmap is None or size < HEADER_SIZE:
+            raise ValueError(f'Invalid vector store file: {path}')
+
+        (magic, version, self.generation, self.count, self.dim, _flags,
+         vectors_offset, id_offsets_offset, self._id_blob_offset,
+         metadata_offsets_offset, self._metadata_blob_offset) = HEADER.unpack_from(self._mmap, 0)
+
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'Unsupported vector store file: {path}')
+
+        self.vectors = np.frombuffer(
+            self._mmap, dtype='<f4', count=self.count * self.dim, offset=vectors_offset
+        ).reshape(self.count, self.dim)
+        self._id_offsets = np.frombuffer(
+            self._mmap, dtype='<u8', count=self.count + 1, offset=id_offsets_offset
+        )
+        self._metadata_offsets = np.frombuffer(
+            self._mmap, dtype='<u8', count=self.count + 1, offset=metadata_offsets_offset
+        )
+
+    def __len__(self):
+        return self.count
+
+    def chunk_id(self, row: int) -> str:
+        start, end = int(self._id_offsets[row]), int(self._id_offsets[row + 1])
+        return self._mmap[self._id_blob_offset + start:self._id_blob_offset + end].decode('utf-8')
+
+    def metadata(self, row: int) -> Dict:
+        start, end = int(self._metadata_offsets[row]), int(self._metadata_offsets[row + 1])
+        raw = self._mmap[self._metadata_blob_offset + start:self._metadata_blob_offset + end]
+        return json.loads(raw.decode('utf-8'))
+
+    def result(self, row: int, score: float) -> Dict:
+        return {'chunk_id': self.chunk_id(row), 'score': float(score), 'metadata': self.metadata(row)}
+
+    def search(self, query_vector, k: int = 5) -> List[Dict]:
+        """
+        Return the k chunks with the highest cosine similarity to the query
+        """
+
+        if not self.count:
+            return []
+
+        scores = self.vectors @ normalize_vectors(query_vector)[0]
+        return [self.result(row, scores[row]) for row in top_k(scores, k)]
+
+    def close(self):
+        # numpy views keep the buffer exported; drop them before closing
+        self.vectors = self._id_offsets = self._metadata_offsets = None
+        try:
+            self._mmap.close()
+        except BufferError:
+            # A caller still holds a view; the mapping is released with it
+            pass
+
+
+class SharedVectorStore:
+    """
+    Directory of generation files plus a CURRENT pointer.
+
+    Publishers write a complete new generation file and then atomically
+    replace CURRENT; readers re-check CURRENT at most every refresh_interval
+    seconds and remap when the generation changes. Files of superseded
+    generations can be unlinked safely because existing mappings keep the
+    inode alive until the last reader drops them.
+    """
+
+    def __init__(self, directory: str, refresh_interval: float = 1.0):
+        self.directory = directory
+        self.refresh_interval = refresh_interval
+        self._store: Optional[MappedVectorStore] = None
+        self._checked_at = 0.0
+
+    def _generation_path(self, generation: int) -> str:
+        return os.path.join(self.directory, f"vectors-{generation:012d}.qvs")
+
+    def current_generation(self) -> Optional[int]:
+        try:
+            with open(os.path.join(self.directory, CURRENT_FILE)) as f:
+                return int(f.read().strip())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def current(self) -> Optional[MappedVectorStore]:
+        now = time.monotonic()
+        if self._store is not None and now - self._checked_at < self.refresh_interval:
+            return self._store
+
+        self._checked_at = now
+        generation = self.current_generation()
+        if generation is None:
+            return self._store
+
+        if self._store is None or self._store.generation != generation:
+            # Keep serving the old generation if the new one vanished meanwhile
+            try:
+                self._store = MappedVectorStore(self._generation_path(generation))
+            except FileNotFoundError:
+                pass
+
+        return self._store
+
+    def search(self, query_vector, k: int = 5) -> List[Dict]:
+        store = self.current()
+        return store.search(query_vector, k) if store else []
+
+    def publish(self, ids: Sequence[str], vectors, metadata: Sequence[Dict]) -> int:
+        """
+        Build and atomically swap in a new generation, returning its number
+        """
+
+        os.makedirs(self.directory, exist_ok=True)
+
+        with open(os.path.join(self.directory, LOCK_FILE), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+
+            generation = (self.current_generation() or 0) + 1
+            write_vector_store(self._generation_path(generation), ids, vectors, metadata, generation)
+
+            current_path = os.path.join(self.directory, CURRENT_FILE)
+            tmp_path = f"{current_path}.tmp-{os.getpid()}"
+            with open(tmp_path, 'w') as f:
+                f.write(str(generation))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, current_path)
+
+            self._remove_old_generations(generation)
+
+        self._checked_at = 0.0
+        return generation
+
+    def _remove_old_generations(self, generation: int):
+        for name in os.listdir(self.directory):
+            if not (name.startswith('vectors-') and name.endswith('.qvs')):
+                continue
+            try:
+                file_generation = int(name[len('vectors-'):-len('.qvs')])
+            except ValueError:
+                continue
+            if file_generation <= generation - KEEP_GENERATIONS:
+                os.unlink(os.path.join(self.directory, name))
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Script para executar o pipeline RAG localmente, sem deploy
+Interpreta state_machines/processing.json em processo, chamando os
+handlers de lambdas/ com S3, Bedrock e Step Functions locais, e roda
+muitas execuções em paralelo para medir throughput por configuração
+Executa: python run_local_pipeline.py --documents 200 --workers 16 [--env CHAVE=VALOR]
+Com --scheduled os uploads passam pelo escalonador e a latência é medida
+do upload até o fim, por classe de tamanho
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+
+from local_pipeline import LocalPipeline, run_executions, run_uploads
+
+BUCKET_NAME = 'source-pdf-qa-aws'
+
+WORDS = (
+    'amazon bedrock embeddings pipeline documento processamento texto busca vetorial '
+    'resposta pergunta lambda função estado máquina índice segmento consulta modelo '
+    'arquitetura serverless armazenamento objeto chave valor metadados página capítulo'
+).split()
+
+def generate_pdf(pages, seed):
+    """
+    Gera um PDF sintético com texto aleatório em cada página
+    """
+
+    import fitz  # PyMuPDF
+
+    generator = random.Random(seed)
+    document = fitz.open()
+    for _ in range(pages):
+        page = document.new_page()
+        paragraphs = []
+        for _ in range(12):
+            sentence = ' '.join(generator.choice(WORDS) for _ in range(generator.randint(8, 20)))
+            paragraphs.append(sentence.capitalize() + '.')
+        page.insert_textbox(fitz.Rect(50, 50, 550, 800), ' '.join(paragraphs), fontsize=9)
+    data = document.tobytes()
+    document.close()
+    return data
+
+def write_uploads(pipeline, documents, min_pages, max_pages, seed, large_documents=0, large_pages=0):
+    """
+    Grava os PDFs no S3 local; os grandes vêm primeiro, como um manual
+    enviado logo antes de um lote de documentos curtos
+    """
+
+    generator = random.Random(seed)
+    sizes = [large_pages] * large_documents + [generator.randint(min_pages, max_pages) for _ in range(documents)]
+    keys = []
+    for index, pages in enumerate(sizes):
+        key = f"uploads/local-{index:06d}.pdf"
+        pipeline.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=generate_pdf(pages, seed + index))
+        keys.append(key)
+    return keys
+
+def prepare_uploads(pipeline, documents, min_pages, max_pages, seed, large_documents=0, large_pages=0):
+    """
+    Grava os PDFs no S3 local e dispara o trigger para obter as execuções
+    """
+
+    executions = []
+    for key in write_uploads(pipeline, documents, min_pages, max_pages, seed, large_documents, large_pages):
+        executions.extend(pipeline.trigger(BUCKET_NAME, key))
+    return executions
+
+def parse_endpoint(item):
+    """
+    'us-east-1:120:0.01:900:0.05' → perfil de uma região simulada
+    """
+
+    name, *values = item.split(':')
+    fields = ['latency_ms', 'failure_rate', 'tail_latency_ms', 'tail_rate']
+    return dict(zip(fields, map(float, values)), name=name)
+
+def print_summary(summary, baseline=None):
+    print(f"\n📊 {summary['executions']} execuções: {summary['succeeded']} ok, {summary['failed']} falhas "
+          f"em {summary['wall_seconds']:.1f}s")
+    print(f"   🚀 {summary['documents_per_hour']:.0f} documentos/hora")
+    latency = summary['latency_ms']
+    print(f"   ⏱️  latência p50 {latency['p50']:.0f} ms | p95 {latency['p95']:.0f} ms | p99 {latency['p99']:.0f} ms")
+    for name, state in summary['states'].items():
+        print(f"   • {name:22s} p50 {state['p50_ms']:8.1f} ms | p95 {state['p95_ms']:8.1f} ms | "
+              f"{state['attempts']} tentativas / {state['entries']} entradas")
+    for name, stats in sorted(summary.get('classes', {}).items()):
+        print(f"   📦 {name:8s} {stats['executions']:4d} docs | p50 {stats['p50_ms']:8.0f} ms | "
+              f"p95 {stats['p95_ms']:8.0f} ms | p99 {stats['p99_ms']:8.0f} ms | fila p95 {stats['queued_p95_ms']:8.0f} ms")
+    for error, count in summary['errors'].items():
+        print(f"   ❌ {error}: {count}")
+    if summary.get('rejected'):
+        print(f"   🚫 {len(summary['rejected'])} uploads rejeitados pelo pré-scan")
+    if summary.get('not_started'):
+        print(f"   ⚠️  {len(summary['not_started'])} uploads não foram iniciados")
+
+    if baseline:
+        before, after = baseline['documents_per_hour'], summary['documents_per_hour']
+        change = (after - before) / before * 100 if before else 0.0
+        print(f"\n📈 Throughput vs baseline: {before:.0f} → {after:.0f} documentos/hora ({change:+.1f}%)")
+        before, after = baseline['latency_ms']['p95'], summary['latency_ms']['p95']
+        print(f"   p95: {before:.0f} → {after:.0f} ms")
+        for name, stats in sorted(summary.get('classes', {}).items()):
+            if name in baseline.get('classes', {}):
+                print(f"   p95 {name}: {baseline['classes'][name]['p95_ms']:.0f} → {stats['p95_ms']:.0f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Executa o pipeline RAG localmente em paralelo')
+    parser.add_argument('--documents', type=int, default=50)
+    parser.add_argument('--min-pages', type=int, default=1)
+    parser.add_argument('--max-pages', type=int, default=8)
+    parser.add_argument('--large-documents', type=int, default=0, help='Documentos grandes enviados antes dos demais')
+    parser.add_argument('--large-pages', type=int, default=200)
+    parser.add_argument('--scheduled', action='store_true',
+                        help='Dispara os uploads durante a execução (escalonador ativo com SCHEDULER_BACKEND)')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--mode', choices=['thread', 'process'], default='thread')
+    parser.add_argument('--storage', default=None, help='Diretório do S3 local (padrão: temporário)')
+    parser.add_argument('--bedrock-latency-ms', type=float, default=20.0)
+    parser.add_argument('--bedrock-failure-rate', type=float, default=0.0)
+    parser.add_argument('--bedrock-endpoint', action='append', default=[],
+                        metavar='NOME:LATÊNCIA_MS[:FALHAS[:CAUDA_MS:FRAÇÃO_CAUDA]]',
+                        help='Região simulada atrás do roteador de embeddings (repita para várias)')
+    parser.add_argument('--invoke-overhead-ms', type=float, default=100.0,
+                        help='Custo simulado de cada invocação/transição de estado')
+    parser.add_argument('--time-scale', type=float, default=0.01, help='Escala das esperas de Retry/Wait')
+    parser.add_argument('--env', action='append', default=[], help='Variável de ambiente CHAVE=VALOR para os handlers')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--report', help='Salva o resumo em JSON')
+    parser.add_argument('--baseline', help='Relatório JSON anterior para comparar')
+    parser.add_argument('--verbose', action='store_true', help='Mostra os logs dos handlers')
+    args = parser.parse_args()
+
+    environment = dict(item.split('=', 1) for item in args.env)
+    options = {
+        'storage_dir': args.storage or tempfile.mkdtemp(prefix='local-pipeline-'),
+        'bedrock_latency_ms': args.bedrock_latency_ms,
+        'bedrock_failure_rate': args.bedrock_failure_rate,
+        'time_scale': args.time_scale,
+        'invoke_overhead_ms': args.invoke_overhead_ms,
+        'bedrock_endpoints': [parse_endpoint(item) for item in args.bedrock_endpoint] or None
+    }
+
+    try:
+        total = args.documents + args.large_documents
+        print(f"📄 Gerando {total} PDFs em {options['storage_dir']}...")
+        os.environ.update(environment)
+        console = sys.stdout
+        if not args.verbose:
+            sys.stdout = open(os.devnull, 'w')
+        try:
+            if args.scheduled:
+                keys = write_uploads(
+                    LocalPipeline(**options), args.documents, args.min_pages, args.max_pages, args.seed,
+                    args.large_documents, args.large_pages
+                )
+            else:
+                executions = prepare_uploads(
+                    LocalPipeline(**options), args.documents, args.min_pages, args.max_pages, args.seed,
+                    args.large_documents, args.large_pages
+                )
+        finally:
+            sys.stdout = console
+
+        if args.scheduled:
+            print(f"🔄 Disparando {len(keys)} uploads ({args.workers} workers)...")
+            summary = run_uploads(
+                [(BUCKET_NAME, key) for key in keys], options, workers=args.workers,
+                environment=environment, quiet=not args.verbose
+            )
+        else:
+            print(f"🔄 Executando {len(executions)} execuções ({args.mode}, {args.workers} workers)...")
+            summary = run_executions(
+                executions, options, workers=args.workers, mode=args.mode,
+                environment=environment, quiet=not args.verbose
+            )
+
+        baseline = None
+        if args.baseline:
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        print_summary(summary, baseline)
+
+        if args.report:
+            report = {key: value for key, value in summary.items() if key != 'records'}
+            report['configuration'] = {'options': options, 'environment': environment,
+                                       'workers': args.workers, 'mode': args.mode, 'scheduled': args.scheduled}
+            with open(args.report, 'w') as f:
+                json.dump(report, f, indent=2)
+            print(f"💾 Relatório salvo em {args.report}")
+
+        sys.exit(0 if summary['failed'] == 0 else 1)
+
+    except Exception as e:
+        print(f"❌ Erro ao executar pipeline local: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+"""
+Script para servir o índice vetorial particionado (shards)
+Cada shard de um índice criado com sync_vector_index.py --shards N é
+servido por um processo próprio; o app consulta todos em paralelo
+(VECTOR_SHARDS=host:porta,...) e junta o top-k
+Executa: python serve_shards.py --directory /tmp/qa-vector-index [--base-port 7100] [--only 0,1]
+         python serve_shards.py --benchmark [--rows 400000] [--shard-counts 1,2,4]
+"""
+
+import argparse
+import multiprocessing
+import os
+import secrets
+import shutil
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from retrieval import ShardedIndex, ShardedSearchClient, serve_shard
+from retrieval.shards import is_local_address, shard_directory
+
+# nprobe acima de qualquer número de listas IVF: varre todos os vetores
+EXACT_NPROBE = 1 << 30
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+def start_shard_servers(directory, shards, host, base_port, authkey):
+    """
+    Um processo por shard, escutando em base_port + número do shard
+    """
+
+    processes, addresses = [], []
+    for shard in shards:
+        address = f"{host}:{base_port + shard}"
+        ready = multiprocessing.Event()
+        process = multiprocessing.Process(
+            target=serve_shard, args=(shard_directory(directory, shard), address, authkey, ready),
+            name=f"shard-{shard:03d}", daemon=True
+        )
+        process.start()
+        if not ready.wait(60):
+            raise Exception(f'shard {shard} não subiu em 60s')
+        processes.append(process)
+        addresses.append(address)
+    return processes, addresses
+
+def build_benchmark_index(directory, num_shards, rows, dimensions, documents, seed):
+    """
+    Índice sintético: os mesmos vetores, particionados em num_shards
+    """
+
+    index = ShardedIndex(directory, num_shards)
+    generator = np.random.default_rng(seed)
+    per_document = rows // documents
+    batch = []
+    for number in range(documents):
+        document_id = f"uploads/bench-{number:05d}.pdf"
+        ids = [f"{document_id}#{chunk}" for chunk in range(per_document)]
+        vectors = generator.standard_normal((per_document, dimensions)).astype('float32')
+        metadata = [{'document_id': document_id, 'chunk_id': chunk_id} for chunk_id in ids]
+        batch.append((document_id, ids, vectors, metadata))
+    # Um segmento por shard: mede a varredura, não a compactação
+    index.add_documents(batch)
+    return index
+
+def run_clients(client, dimensions, clients, seconds, k, seed):
+    """
+    Clientes em malha fechada, cada um com uma consulta por vez
+    """
+
+    latencies, stop = [], time.monotonic() + seconds
+    lock = threading.Lock()
+
+    def worker(number):
+        generator = np.random.default_rng(seed + number)
+        local = []
+        while time.monotonic() < stop:
+            query = generator.standard_normal(dimensions).astype('float32')
+            started = time.perf_counter()
+            client.search(query, k)
+            local.append((time.perf_counter() - started) * 1000.0)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=worker, args=(number,)) for number in range(clients)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, time.monotonic() - started
+
+def benchmark(args):
+    shard_counts = [int(count) for count in args.shard_counts.split(',')]
+    print(f"🖥️  {os.cpu_count()} CPUs | {args.rows} vetores de {args.dimensions} dimensões | "
+          f"{args.clients} clientes por {args.seconds:g}s")
+    root = tempfile.mkdtemp(prefix='shard-bench-')
+    throughputs, reference = [], None
+    try:
+        for num_shards in shard_counts:
+            directory = os.path.join(root, f"{num_shards}-shards")
+            build_benchmark_index(directory, num_shards, args.rows, args.dimensions, args.documents, args.seed)
+            # Chave aleatória por rodada: os servidores e o cliente são deste processo
+            authkey = secrets.token_bytes(32)
+            processes, addresses = start_shard_servers(directory, range(num_shards), '127.0.0.1',
+                                                       args.base_port, authkey)
+            try:
+                client = ShardedSearchClient(addresses, authkey, timeout_ms=args.timeout_ms,
+                                             max_concurrent=args.clients)
+
+                # O particionamento não muda o resultado: mesma consulta, mesmo top-k
+                # (busca exata; com o nprobe padrão o IVF de cada layout aproxima diferente)
+                probe = np.random.default_rng(args.seed).standard_normal(args.dimensions).astype('float32')
+                top = [result['chunk_id'] for result in client.search(probe, args.k, nprobe=EXACT_NPROBE)]
+                if reference is None:
+                    reference = top
+                matches = len(set(top) & set(reference))
+
+                run_clients(client, args.dimensions, args.clients, 1.0, args.k, args.seed)  # aquecimento
+                latencies, elapsed = run_clients(client, args.dimensions, args.clients, args.seconds, args.k, args.seed)
+                qps = len(latencies) / elapsed
+                throughputs.append(qps)
+                speedup = qps / throughputs[0]
+                print(f"   • {num_shards:2d} shards: {qps:8.1f} consultas/s | p50 {percentile(latencies, 0.5):6.1f} ms | "
+                      f"p99 {percentile(latencies, 0.99):6.1f} ms | {speedup:4.2f}x "
+                      f"({speedup / num_shards:.0%} de eficiência) | parciais {client.stats()['partial_queries']} | "
+                      f"top-{args.k} igual em {matches}/{args.k}")
+            finally:
+                for process in processes:
+                    process.terminate()
+            shutil.rmtree(directory, ignore_errors=True)
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Serve os shards do índice vetorial')
+    parser.add_argument('--directory', default=os.environ.get('VECTOR_INDEX_DIR', '/tmp/qa-vector-index'))
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='Interface de escuta (0.0.0.0 para outros nós; exige SHARD_AUTHKEY)')
+    parser.add_argument('--base-port', type=int, default=7100)
+    parser.add_argument('--only', help='Shards servidos por este nó, ex.: 0,1 (padrão: todos)')
+    parser.add_argument('--benchmark', action='store_true', help='Mede o throughput por número de shards')
+    parser.add_argument('--rows', type=int, default=400000)
+    parser.add_argument('--dimensions', type=int, default=256)
+    parser.add_argument('--documents', type=int, default=400)
+    parser.add_argument('--shard-counts', default='1,2,4')
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--seconds', type=float, default=10.0)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--timeout-ms', type=float, default=5000.0)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    try:
+        if args.benchmark:
+            benchmark(args)
+            sys.exit(0)
+
+        # As requisições são pickles: quem tem a chave executa código neste nó
+        authkey = os.environ.get('SHARD_AUTHKEY', '').encode()
+        generated = not authkey
+        if generated:
+            if not is_local_address(f"{args.host}:{args.base_port}"):
+                raise ValueError(f'defina SHARD_AUTHKEY para escutar em {args.host} (só o loopback aceita chave gerada)')
+            authkey = secrets.token_hex(32).encode()
+        index = ShardedIndex(args.directory)
+        shards = [int(shard) for shard in args.only.split(',')] if args.only else range(index.num_shards)
+        processes, addresses = start_shard_servers(args.directory, shards, args.host, args.base_port, authkey)
+        print(f"🧩 {len(addresses)} de {index.num_shards} shards de {args.directory} no ar:")
+        for address in addresses:
+            print(f"   • {address}")
+        print(f"   VECTOR_SHARDS={','.join(addresses)}")
+        if generated:
+            print(f"   SHARD_AUTHKEY={authkey.decode()}  (gerada para esta execução)")
+        for process in processes:
+            process.join()
+
+    except KeyboardInterrupt:
+        print("\n⏹️  Shards encerrados")
+    except Exception as e:
+        print(f"❌ Erro ao servir shards: {str(e)}")
+        sys.exit(1)
@@ -0,0 +1,17 @@
+"""
+Building blocks of the asyncio serving mode (asgi_app.py)
+"""
+
+from .limits import DownstreamLimiter, Overloaded, limits_from_env
+from .multipart import MultipartError, parse_boundary, iter_parts
+from .uploads import StreamingUpload
+
+__all__ = [
+    'DownstreamLimiter',
+    'Overloaded',
+    'limits_from_env',
+    'MultipartError',
+    'parse_boundary',
+    'iter_parts',
+    'StreamingUpload',
+]
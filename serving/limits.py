@@ -0,0 +1,102 @@
+import os
+import time
+import asyncio
+from typing import Dict
+
+DEFAULT_LIMITS = {'s3': 64, 'bedrock': 32, 'answer': 32, 'index': 8, 'cpu': 4}
+DEFAULT_MAX_WAITING = 1000
+DEFAULT_WAIT_SECONDS = 10.0
+
+
+class Overloaded(Exception):
+    """
+    A downstream is saturated and its waiting line is full or too slow;
+    the app answers 503 with Retry-After instead of queueing without bound
+    """
+
+    def __init__(self, downstream: str, reason: str):
+        super().__init__(f"{downstream} overloaded ({reason})")
+        self.downstream = downstream
+        self.reason = reason
+
+
+class DownstreamLimiter:
+    """
+    Bounded concurrency for one downstream (S3, Bedrock, the index threads).
+    At most `limit` calls run at once; up to max_waiting more wait for a
+    slot, each at most wait_seconds. Beyond that callers fail fast with
+    Overloaded, so a slow dependency cannot pile up unbounded work.
+
+        async with limits['s3']:
+            await s3.put_object(...)
+    """
+
+    def __init__(self, name: str, limit: int, max_waiting: int = DEFAULT_MAX_WAITING,
+                 wait_seconds: float = DEFAULT_WAIT_SECONDS):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.wait_seconds = wait_seconds
+        self.in_flight = 0
+        self.waiting = 0
+        self.peak_in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_total = 0.0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self):
+        if self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(self.name, 'queue full')
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.wait_seconds)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Overloaded(self.name, f"no slot within {self.wait_seconds:.0f}s")
+        finally:
+            self.waiting -= 1
+        self.wait_total += time.perf_counter() - started
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+
+    def release(self):
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.release()
+
+    def stats(self) -> Dict:
+        return {
+            'limit': self.limit,
+            'in_flight': self.in_flight,
+            'waiting': self.waiting,
+            'peak_in_flight': self.peak_in_flight,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'avg_wait_ms': round(self.wait_total / self.completed * 1000.0, 2) if self.completed else 0.0
+        }
+
+
+def limits_from_env() -> Dict[str, DownstreamLimiter]:
+    """
+    One limiter per downstream; ASGI_LIMIT_<NAME> overrides the limit,
+    ASGI_MAX_WAITING and ASGI_WAIT_SECONDS the waiting line
+    """
+
+    max_waiting = int(os.environ.get('ASGI_MAX_WAITING', str(DEFAULT_MAX_WAITING)))
+    wait_seconds = float(os.environ.get('ASGI_WAIT_SECONDS', str(DEFAULT_WAIT_SECONDS)))
+    return {
+        name: DownstreamLimiter(
+            name, int(os.environ.get(f"ASGI_LIMIT_{name.upper()}", str(limit))), max_waiting, wait_seconds
+        )
+        for name, limit in DEFAULT_LIMITS.items()
+    }
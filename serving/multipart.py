@@ -0,0 +1,99 @@
+import re
+from typing import AsyncIterator, Dict, Optional, Tuple
+
+# Incremental multipart/form-data parser over the request body stream.
+# Part bodies are handed out as they arrive, so a large upload is never
+# held in memory; only a tail the size of the boundary is kept between
+# chunks to find the delimiter.
+MAX_HEADER_BYTES = 16384
+
+_PARAM = re.compile(r';\s*([\w*-]+)="?((?<=")[^"]*|[^;\s]*)"?')
+
+
+class MultipartError(Exception):
+    pass
+
+
+def parse_boundary(content_type: str) -> bytes:
+    if not content_type.lower().startswith('multipart/form-data'):
+        raise MultipartError('Expected multipart/form-data')
+    params = dict((name.lower(), value) for name, value in _PARAM.findall(content_type))
+    boundary = params.get('boundary')
+    if not boundary or len(boundary) > 200:
+        raise MultipartError('Missing or invalid multipart boundary')
+    return boundary.encode('latin-1')
+
+
+def parse_part_headers(raw: bytes) -> Dict:
+    headers = {}
+    for line in raw.decode('utf-8', 'replace').split('\r\n'):
+        name, sep, value = line.partition(':')
+        if sep:
+            headers[name.strip().lower()] = value.strip()
+    disposition = headers.get('content-disposition', '')
+    params = dict((name.lower(), value) for name, value in _PARAM.findall(disposition))
+    return {
+        'name': params.get('name'),
+        'filename': params.get('filename'),
+        'content_type': headers.get('content-type', 'text/plain')
+    }
+
+
+async def iter_parts(chunks: AsyncIterator[bytes], boundary: bytes
+                     ) -> AsyncIterator[Tuple[str, Optional[Dict], bytes]]:
+    """
+    ('part', headers, b'') when a part starts, then ('data', None, bytes)
+    for its body as it streams in, and ('end', None, b'') after each part
+    """
+
+    delimiter = b'\r\n--' + boundary
+    buffer = b'\r\n'  # the first delimiter has no leading CRLF
+    state = 'preamble'
+
+    async for chunk in chunks:
+        buffer += chunk
+        while True:
+            if state == 'preamble':
+                found = buffer.find(delimiter)
+                if found < 0:
+                    buffer = buffer[-len(delimiter):]
+                    break
+                buffer = buffer[found + len(delimiter):]
+                state = 'after_delimiter'
+
+            if state == 'after_delimiter':
+                if len(buffer) < 2:
+                    break
+                if buffer.startswith(b'--'):
+                    return
+                if not buffer.startswith(b'\r\n'):
+                    raise MultipartError('Malformed multipart delimiter')
+                buffer = buffer[2:]
+                state = 'headers'
+
+            if state == 'headers':
+                end = buffer.find(b'\r\n\r\n')
+                if end < 0:
+                    if len(buffer) > MAX_HEADER_BYTES:
+                        raise MultipartError('Multipart headers too large')
+                    break
+                yield 'part', parse_part_headers(buffer[:end]), b''
+                buffer = buffer[end + 4:]
+                state = 'body'
+
+            if state == 'body':
+                found = buffer.find(delimiter)
+                if found < 0:
+                    # Keep a tail that could be the start of the delimiter
+                    keep = len(delimiter) - 1
+                    if len(buffer) > keep:
+                        yield 'data', None, buffer[:-keep]
+                        buffer = buffer[-keep:]
+                    break
+                if found:
+                    yield 'data', None, buffer[:found]
+                yield 'end', None, b''
+                buffer = buffer[found + len(delimiter):]
+                state = 'after_delimiter'
+
+    raise MultipartError('Request body ended before the closing boundary')
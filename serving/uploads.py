@@ -0,0 +1,108 @@
+import asyncio
+import tempfile
+from typing import Dict, List, Optional
+
+from .limits import DownstreamLimiter
+
+# S3 multipart parts must be at least 5 MiB (except the last one)
+UPLOAD_PART_BYTES = 8 * 1024 * 1024
+
+
+class StreamingUpload:
+    """
+    Receives one file from the request body and sends it to S3 while it
+    streams in. Bytes are spooled to a temporary file, which the pre-scan
+    reads afterwards; whenever a full part is buffered it goes to S3 as a
+    multipart part while the next one is being received (one part in flight
+    per upload). Files smaller than a part are sent with one put_object on
+    finish(). abort() drops whatever reached S3, so a rejected upload never
+    becomes an object (nor triggers the pipeline).
+    """
+
+    def __init__(self, s3_client, bucket: str, key: str, limiter: DownstreamLimiter,
+                 extra_args: Optional[Dict] = None, part_bytes: int = UPLOAD_PART_BYTES,
+                 spool_dir: Optional[str] = None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.limiter = limiter
+        self.extra_args = extra_args or {}
+        self.part_bytes = part_bytes
+        self.file = tempfile.TemporaryFile(dir=spool_dir)
+        self.size = 0
+        self.upload_id = None
+        self.parts: List[Dict] = []
+        self._sent = 0
+        self._pending: Optional[asyncio.Task] = None
+
+    async def write(self, data: bytes):
+        self.file.write(data)
+        self.size += len(data)
+        if self.size - self._sent >= self.part_bytes:
+            await self._send_part(self.part_bytes)
+
+    async def _send_part(self, length: int):
+        if self._pending is not None:
+            await self._pending
+        if self.upload_id is None:
+            async with self.limiter:
+                response = await self.s3_client.create_multipart_upload(
+                    Bucket=self.bucket, Key=self.key, **self.extra_args
+                )
+            self.upload_id = response['UploadId']
+        body = self._read(self._sent, length)
+        self._sent += length
+        self._pending = asyncio.ensure_future(self._upload_part(len(self.parts) + 1, body))
+        self.parts.append(None)
+
+    async def _upload_part(self, number: int, body: bytes):
+        async with self.limiter:
+            response = await self.s3_client.upload_part(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id, PartNumber=number, Body=body
+            )
+        self.parts[number - 1] = {'PartNumber': number, 'ETag': response['ETag']}
+
+    def _read(self, start: int, length: int) -> bytes:
+        self.file.seek(start)
+        body = self.file.read(length)
+        self.file.seek(0, 2)
+        return body
+
+    async def finish(self):
+        """
+        Send what is left and make the object visible
+        """
+
+        if self.upload_id is None:
+            async with self.limiter:
+                await self.s3_client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=self._read(0, self.size), **self.extra_args
+                )
+            return
+        if self.size > self._sent:
+            await self._send_part(self.size - self._sent)
+        await self._pending
+        async with self.limiter:
+            await self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts}
+            )
+
+    async def abort(self):
+        if self._pending is not None:
+            try:
+                await self._pending
+            except Exception:
+                pass
+        if self.upload_id is not None:
+            try:
+                async with self.limiter:
+                    await self.s3_client.abort_multipart_upload(
+                        Bucket=self.bucket, Key=self.key, UploadId=self.upload_id
+                    )
+            except Exception as e:
+                print(f"Could not abort multipart upload {self.upload_id}: {str(e)}")
+            self.upload_id = None
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Script para manter o índice vetorial segmentado sincronizado com o S3
+Cada documento novo em indexed/ vira um segmento pequeno e imutável;
+um compactador em background junta segmentos pequenos em maiores (IVF)
+Com --shards N os documentos são particionados em N shards (serve_shards.py)
+Executa: python sync_vector_index.py [--watch] [--batch-size N] [--shards N] [--no-text]
+"""
+
+import argparse
+import boto3
+import json
+import os
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+
+from artifacts import open_artifact, read_artifact
+from retrieval import SegmentedIndex, ShardedIndex, BackgroundCompactor, embedding_records, is_sharded
+
+SYNC_STATE_FILE = 'sync_state.json'
+
+def load_sync_state(directory):
+    try:
+        with open(os.path.join(directory, SYNC_STATE_FILE)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+def save_sync_state(directory, state):
+    path = os.path.join(directory, SYNC_STATE_FILE)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+def sync_vector_index(s3_client, bucket_name, index, batch_size=8, include_text=True):
+    """
+    Adiciona ao índice os documentos de indexed/ novos ou reprocessados;
+    sem include_text, o texto dos documentos com chunk-text/ fica fora do índice
+    """
+    
+    state = load_sync_state(index.directory)
+    pending = []
+    paginator = s3_client.get_paginator('list_objects_v2')
+    
+    for page in paginator.paginate(Bucket=bucket_name, Prefix='indexed/'):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('.json'):
+                continue
+            last_modified = obj['LastModified'].isoformat()
+            if state.get(obj['Key']) != last_modified:
+                pending.append((obj['Key'], last_modified))
+    
+    synced = 0
+    for start in range(0, len(pending), batch_size):
+        batch = []
+        for indexed_key, last_modified in pending[start:start + batch_size]:
+            indexed_json = read_artifact(s3_client, bucket_name, indexed_key)
+            
+            # Os chunks são decodificados linha a linha, sem montar o documento inteiro
+            embeddings_json, chunks = open_artifact(
+                s3_client, bucket_name, indexed_json['embeddings_file_key'], records_field='embeddings_data'
+            )
+            
+            ids, vectors, metadata = embedding_records(
+                embeddings_json, chunks, include_text=include_text or not indexed_json.get('chunk_text_key')
+            )
+            batch.append((embeddings_json['document_id'], ids, vectors, metadata))
+            print(f"   ✅ {indexed_key} ({len(ids)} chunks)")
+        
+        # Um segmento por micro-lote de documentos
+        index.add_documents(batch)
+        for indexed_key, last_modified in pending[start:start + batch_size]:
+            state[indexed_key] = last_modified
+        save_sync_state(index.directory, state)
+        synced += len(batch)
+    
+    return synced
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Sincroniza o índice vetorial segmentado')
+    parser.add_argument('--directory', default=os.environ.get('VECTOR_INDEX_DIR', '/tmp/qa-vector-index'))
+    parser.add_argument('--batch-size', type=int, default=8)
+    parser.add_argument('--watch', action='store_true', help='Continua sincronizando e compactando')
+    parser.add_argument('--interval', type=float, default=30.0)
+    parser.add_argument('--shards', type=int, help='Cria o índice particionado em N shards')
+    parser.add_argument('--no-text', action='store_true',
+                        help='Não guarda o texto dos chunks no índice (o app lê de chunk-text/)')
+    args = parser.parse_args()
+    
+    # Configurações
+    bucket_name = 'source-pdf-qa-aws'
+    region = 'sa-east-1'
+    
+    s3_client = boto3.client('s3', region_name=region)
+    
+    print(f"🔄 Sincronizando índice vetorial em {args.directory}...")
+    
+    try:
+        if args.shards or is_sharded(args.directory):
+            index = ShardedIndex(args.directory, args.shards)
+            print(f"🧩 {index.num_shards} shards")
+        else:
+            index = SegmentedIndex(args.directory)
+        
+        if not args.watch:
+            synced = sync_vector_index(s3_client, bucket_name, index, args.batch_size, not args.no_text)
+            while index.compact():
+                pass
+            print(f"🎯 {synced} documentos sincronizados")
+            sys.exit(0)
+        
+        compactor = BackgroundCompactor(index, interval=args.interval)
+        compactor.start()
+        while True:
+            synced = sync_vector_index(s3_client, bucket_name, index, args.batch_size, not args.no_text)
+            if synced:
+                print(f"🎯 {synced} documentos sincronizados")
+            time.sleep(args.interval)
+            
+    except KeyboardInterrupt:
+        print("\n⏹️  Sincronização interrompida")
+    except Exception as e:
+        print(f"❌ Erro ao sincronizar índice vetorial: {str(e)}")
+        sys.exit(1)
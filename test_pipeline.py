@@ -6,10 +6,14 @@ Simula o fluxo: Upload PDF → Step Function → Lambdas → S3 JSON files
 
 import boto3
 import json
+import os
 import sys
 import time
 from pathlib import Path
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lambdas'))
+from pipeline_status import DynamoDBStatusStore
+
 def test_pipeline():
     """
     Testa o pipeline RAG completo
@@ -52,6 +56,8 @@ def test_pipeline():
             outputs = {output['OutputKey']: output['OutputValue'] 
                       for output in stack.get('Outputs', [])}
             
+            status_table = outputs.get('PipelineStatusTableName')
+            
             if 'TriggerLambdaArn' in outputs:
                 print(f"✅ Trigger Lambda: {outputs['TriggerLambdaArn']}")
             if 'RAGStateMachineArn' in outputs:
@@ -85,25 +91,39 @@ def test_pipeline():
             test_pdfs = s3_client.list_objects_v2(
                 Bucket=bucket_name,
                 Prefix='uploads/',
-                MaxKeys=10
+                MaxKeys=1000
             )
             
             if 'Contents' in test_pdfs:
                 pdfs = [obj['Key'] for obj in test_pdfs['Contents'] if obj['Key'].endswith('.pdf')]
                 if pdfs:
                     print(f"\n📄 PDFs encontrados: {len(pdfs)}")
-                    for pdf in pdfs[:3]:  # Mostrar só os 3 primeiros
+                    
+                    # Status de todos os PDFs numa única consulta ao status store
+                    # (em vez de um HEAD no S3 por documento)
+                    statuses = {}
+                    if status_table:
+                        store = DynamoDBStatusStore(boto3.client('dynamodb', region_name=region), status_table)
+                        statuses = {record['document_id']: record for record in store.changed_since(0)}
+                    else:
+                        print("⚠️  Tabela de status não encontrada nos outputs do stack")
+                    
+                    counts = {}
+                    for pdf in pdfs:
+                        record = statuses.get(pdf)
+                        label = f"{record['stage']}/{record['status']}" if record else 'sem status'
+                        counts[label] = counts.get(label, 0) + 1
+                    for label, count in sorted(counts.items()):
+                        print(f"   • {label}: {count}")
+                    
+                    for pdf in pdfs[:3]:  # Detalhe só dos 3 primeiros
+                        record = statuses.get(pdf)
                         print(f"   • {pdf}")
-                        
-                        # Verificar se existe arquivo extraído correspondente
-                        doc_id = pdf.replace('uploads/', '').replace('.pdf', '')
-                        extracted_key = f"extracted/{doc_id}.json"
-                        
-                        try:
-                            s3_client.head_object(Bucket=bucket_name, Key=extracted_key)
-                            print(f"     ✅ Extraído: {extracted_key}")
-                        except:
-                            print(f"     ❌ Não extraído ainda: {extracted_key}")
+                        if record:
+                            for stage, entry in record['stages'].items():
+                                print(f"     {stage}: {entry['status']} {json.dumps(entry.get('counts', {}))}")
+                        else:
+                            print(f"     ❌ Sem eventos de status ainda")
                 else:
                     print(f"\n📄 Nenhum PDF encontrado em uploads/")
             else:
@@ -0,0 +1,8 @@
+import os
+import sys
+
+# The app imports the Lambda modules from lambdas/ (see app.py); tests do the same
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'lambdas')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,93 @@
+import io
+import json
+import array
+import random
+
+import pytest
+
+from artifacts import decode_artifact, encode_artifact, put_artifact, read_artifact, open_artifact
+from local_pipeline import LocalS3
+
+BUCKET = 'source-pdf-qa-aws'
+
+
+def float32_vector(rng, dimensions):
+    # Values exactly representable in float32, so the round trip is exact
+    return array.array('f', [rng.uniform(-1, 1) for _ in range(dimensions)]).tolist()
+
+
+def embeddings_document(count=200, dimensions=1536):
+    return {
+        'document_id': 'uploads/a.pdf',
+        'embeddings_count': count,
+        'embeddings_data': [
+            {'chunk_id': f'page_{index}_chunk_1', 'text': f'texto da página {index}',
+             'embedding': float32_vector(random.Random(index), dimensions)}
+            for index in range(count)
+        ]
+    }
+
+
+class CountingBody(io.BytesIO):
+    """
+    Response body that records how many bytes were read from it
+    """
+
+    bytes_read = 0
+
+    def read(self, size=-1):
+        data = super().read(size)
+        self.bytes_read += len(data)
+        return data
+
+
+@pytest.mark.parametrize('compression', ['gzip', 'none'])
+def test_round_trip_packs_vectors_and_keeps_record_order(compression):
+    document = embeddings_document()
+
+    body = encode_artifact(document, 'embeddings_data', compression=compression)
+    header, records = decode_artifact(io.BytesIO(body), 'embeddings_data')
+
+    assert header == {'document_id': 'uploads/a.pdf', 'embeddings_count': 200}
+    assert list(records) == document['embeddings_data']
+    assert (body[:2] == b'\x1f\x8b') == (compression == 'gzip')
+    # Vectors are base64 float32, not decimal text
+    assert len(body) < len(json.dumps(document)) / 2
+
+
+def test_records_are_decoded_as_the_stream_is_read():
+    body = CountingBody(encode_artifact(embeddings_document(), 'embeddings_data'))
+    total = len(body.getvalue())
+
+    header, records = decode_artifact(body)
+    first = next(records)
+
+    assert header['embeddings_count'] == 200 and first['chunk_id'] == 'page_0_chunk_1'
+    assert body.bytes_read < total / 4
+    assert sum(1 for _ in records) == 199
+
+
+def test_gzip_output_is_deterministic_and_unknown_codecs_are_refused():
+    document = embeddings_document(count=3, dimensions=4)
+
+    assert encode_artifact(document, 'embeddings_data') == encode_artifact(document, 'embeddings_data')
+    with pytest.raises(ValueError, match='Unknown artifact compression'):
+        encode_artifact(document, 'embeddings_data', compression='lz4')
+
+
+def test_s3_artifacts_and_legacy_json_documents_read_the_same(tmp_path):
+    s3 = LocalS3(str(tmp_path))
+    document = embeddings_document(count=5, dimensions=8)
+    size = put_artifact(s3, BUCKET, 'embeddings/uploads/a.pdf.json', document, 'embeddings_data')
+    # Written before the line-delimited format: one pretty-printed document
+    s3.put_object(Bucket=BUCKET, Key='embeddings/uploads/old.pdf.json', Body=json.dumps(document, indent=2))
+
+    assert s3.head_object(Bucket=BUCKET, Key='embeddings/uploads/a.pdf.json')['ContentLength'] == size
+    for key in ('embeddings/uploads/a.pdf.json', 'embeddings/uploads/old.pdf.json'):
+        assert read_artifact(s3, BUCKET, key, 'embeddings_data') == document
+        header, records = open_artifact(s3, BUCKET, key, 'embeddings_data')
+        assert header['document_id'] == 'uploads/a.pdf' and len(list(records)) == 5
+
+    summary = {'document_id': 'uploads/a.pdf', 'processing': {'status': 'completed'}}
+    put_artifact(s3, BUCKET, 'summaries/uploads/a.pdf.json', summary)
+    assert read_artifact(s3, BUCKET, 'summaries/uploads/a.pdf.json') == summary
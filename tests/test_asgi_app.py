@@ -0,0 +1,106 @@
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+
+from load_test import build_index
+from local_pipeline.stubs import LocalS3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET_NAME = 'source-pdf-qa-aws'
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def get(url, timeout=5.0):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return response.status, response.read().decode()
+
+
+@contextmanager
+def serve(tmp_path, **environment):
+    """
+    asgi_app.py on a free port backed by the local stand-ins under
+    tmp_path, the same setup load_test.py --app asgi runs against; yields
+    its base URL once /health answers
+    """
+
+    port = free_port()
+    env = dict(os.environ, WEB_BACKEND='local', WEB_LOCAL_STORAGE=str(tmp_path / 's3'),
+               WEB_LOCAL_S3_LATENCY_MS='1', WEB_LOCAL_BEDROCK_LATENCY_MS='1',
+               VECTOR_INDEX_DIR=str(tmp_path / 'index'), STATUS_BACKEND='none', PROFILING='off')
+    env.update(environment)
+    log_path = tmp_path / 'server.log'
+    with open(log_path, 'w') as log:
+        process = subprocess.Popen([sys.executable, 'asgi_app.py', '--host', '127.0.0.1', '--port', str(port)],
+                                   cwd=ROOT, env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        deadline = time.monotonic() + 30
+        while True:
+            assert process.poll() is None, log_path.read_text()
+            try:
+                get(f"{base_url}/health")
+                break
+            except (urllib.error.URLError, ConnectionError):
+                assert time.monotonic() < deadline, log_path.read_text()
+                time.sleep(0.2)
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def test_asgi_app_serves_files_from_local_stubs(tmp_path):
+    LocalS3(str(tmp_path / 's3')).put_object(Bucket=BUCKET_NAME, Key='uploads/smoke.pdf', Body=b'%PDF-1.4')
+
+    with serve(tmp_path) as base_url:
+        # /files renders its errors as a flash message, so check the listing itself
+        status, body = get(f"{base_url}/files")
+
+    assert status == 200
+    assert 'smoke.pdf' in body
+    assert 'Erro ao listar arquivos' not in body
+
+
+def test_asgi_search_returns_hits_from_the_local_index(tmp_path):
+    build_index(str(tmp_path / 'index'), documents=3, chunks=5)
+
+    with serve(tmp_path) as base_url:
+        status, body = get(f"{base_url}/search?q=trecho&k=4")
+        _, missing = get(f"{base_url}/search?q=trecho&document_id=uploads/none.pdf")
+
+    results = json.loads(body)['results']
+    assert status == 200 and len(results) == 4
+    assert all(result['metadata']['text'].startswith('Trecho ') for result in results)
+    assert [result['score'] for result in results] == sorted((result['score'] for result in results), reverse=True)
+    assert json.loads(missing)['results'] == []
+
+
+def test_saturated_downstream_answers_503_with_retry_after(tmp_path):
+    build_index(str(tmp_path / 'index'), documents=1, chunks=5)
+
+    # No waiting line at all: every Bedrock call is turned away
+    with serve(tmp_path, ASGI_MAX_WAITING='0', SEARCH_BATCH_WINDOW_MS='0') as base_url:
+        try:
+            get(f"{base_url}/search?q=trecho")
+            raise AssertionError('search was not rejected')
+        except urllib.error.HTTPError as e:
+            status, retry_after, body = e.code, e.headers['Retry-After'], json.loads(e.read())
+        _, health = get(f"{base_url}/health")
+
+    assert (status, retry_after) == (503, '1')
+    assert body == {'error': 'bedrock overloaded (queue full)'}
+    assert json.loads(health)['downstreams']['bedrock']['rejected'] == 1
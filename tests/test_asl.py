@@ -0,0 +1,138 @@
+import pytest
+
+from local_pipeline import LocalPipeline, StateMachine
+from run_local_pipeline import BUCKET_NAME, generate_pdf
+
+
+def machine(states, start='Start'):
+    return {'StartAt': start, 'States': states}
+
+
+class Flaky:
+    """
+    Task that raises error_type for its first failures calls
+    """
+
+    def __init__(self, failures, error_type=RuntimeError):
+        self.failures = failures
+        self.error_type = error_type
+        self.calls = 0
+
+    def __call__(self, resource, payload, state):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise self.error_type(f'call {self.calls} failed')
+        return {'resource': resource, 'input': payload}
+
+
+def test_retry_until_success_then_parameters_and_result_path():
+    task = Flaky(failures=2)
+    definition = machine({
+        'Start': {
+            'Type': 'Task', 'Resource': 'extract',
+            'Parameters': {'key.$': '$.upload.key', 'fixed': 1},
+            'ResultPath': '$.result', 'End': True,
+            'Retry': [{'ErrorEquals': ['ValueError'], 'MaxAttempts': 5},
+                      {'ErrorEquals': ['States.ALL'], 'MaxAttempts': 2, 'IntervalSeconds': 1}]
+        }
+    })
+
+    record = StateMachine(definition, task, time_scale=0).execute({'upload': {'key': 'uploads/a.pdf'}})
+
+    assert record['status'] == 'SUCCEEDED'
+    assert record['output'] == {
+        'upload': {'key': 'uploads/a.pdf'},
+        'result': {'resource': 'extract', 'input': {'key': 'uploads/a.pdf', 'fixed': 1}}
+    }
+    assert record['history'][0]['attempts'] == 3
+
+
+def test_exhausted_retries_go_to_the_catch_with_the_error_at_its_result_path():
+    task = Flaky(failures=10)
+    definition = machine({
+        'Start': {
+            'Type': 'Task', 'Resource': 'extract', 'Next': 'Done',
+            'Retry': [{'ErrorEquals': ['States.ALL'], 'MaxAttempts': 2}],
+            'Catch': [{'ErrorEquals': ['States.ALL'], 'Next': 'Failed', 'ResultPath': '$.error'}]
+        },
+        'Done': {'Type': 'Succeed'},
+        'Failed': {'Type': 'Pass', 'Parameters': {'status': 'FAILED', 'error.$': '$.error.Error'}, 'End': True}
+    })
+
+    record = StateMachine(definition, task, time_scale=0).execute({'key': 'uploads/a.pdf'})
+
+    assert task.calls == 3
+    assert record['output'] == {'status': 'FAILED', 'error': 'RuntimeError'}
+    assert [entry['state'] for entry in record['history']] == ['Start', 'Failed']
+    assert record['history'][0]['error'] == 'RuntimeError'
+
+
+def test_states_all_does_not_catch_runtime_errors():
+    definition = machine({
+        'Start': {
+            'Type': 'Pass', 'Parameters': {'missing.$': '$.not_there'}, 'End': True,
+            'Catch': [{'ErrorEquals': ['States.ALL'], 'Next': 'Start'}]
+        }
+    })
+
+    record = StateMachine(definition, Flaky(0), time_scale=0).execute({})
+
+    assert (record['status'], record['error']) == ('FAILED', 'States.Runtime')
+
+
+@pytest.mark.parametrize('pages, expected', [(3, 'Small'), (40, 'Large'), (None, 'Unknown')])
+def test_choice_rules(pages, expected):
+    definition = machine({
+        'Start': {
+            'Type': 'Choice',
+            'Choices': [
+                {'Not': {'Variable': '$.pages', 'IsPresent': True}, 'Next': 'Unknown'},
+                {'And': [{'Variable': '$.pages', 'NumericGreaterThanEquals': 1},
+                         {'Variable': '$.pages', 'NumericLessThanEquals': 5}], 'Next': 'Small'}
+            ],
+            'Default': 'Large'
+        },
+        'Small': {'Type': 'Pass', 'Result': 'Small', 'End': True},
+        'Large': {'Type': 'Pass', 'Result': 'Large', 'End': True},
+        'Unknown': {'Type': 'Fail', 'Error': 'Unknown', 'Cause': 'no page count'}
+    })
+
+    record = StateMachine(definition, Flaky(0), time_scale=0).execute({} if pages is None else {'pages': pages})
+
+    if expected == 'Unknown':
+        assert (record['status'], record['error'], record['cause']) == ('FAILED', 'Unknown', 'no page count')
+    else:
+        assert record['output'] == expected
+
+
+def test_map_runs_every_item_with_its_selector_and_keeps_order():
+    definition = machine({
+        'Start': {
+            'Type': 'Map', 'ItemsPath': '$.pages', 'MaxConcurrency': 3, 'End': True,
+            'ItemSelector': {'bucket.$': '$.bucket', 'page.$': '$$.Map.Item.Value', 'index.$': '$$.Map.Item.Index'},
+            'ItemProcessor': machine({'Start': {'Type': 'Task', 'Resource': 'page', 'End': True,
+                                                'OutputPath': '$.input'}})
+        }
+    })
+
+    record = StateMachine(definition, Flaky(0), time_scale=0).execute({'bucket': 'b', 'pages': [7, 8, 9]})
+
+    assert record['output'] == [{'bucket': 'b', 'page': page, 'index': index} for index, page in enumerate([7, 8, 9])]
+
+
+def test_processing_state_machine_runs_end_to_end_with_local_stand_ins(tmp_path, monkeypatch):
+    monkeypatch.setenv('STEP_FUNCTION_ARN', 'arn:aws:states:local:000000000000:stateMachine:test')
+    pipeline = LocalPipeline(str(tmp_path), time_scale=0)
+    pipeline.s3.put_object(Bucket=BUCKET_NAME, Key='uploads/a.pdf', Body=generate_pdf(2, 1))
+
+    record = pipeline.execute({'bucket': BUCKET_NAME, 'key': 'uploads/a.pdf'}, 'end-to-end')
+
+    assert record['status'] == 'SUCCEEDED', record
+    assert [entry['state'] for entry in record['history']] == [
+        'ExtractText', 'GenerateEmbeddings', 'EmbeddingsComplete', 'IndexToOpenSearch', 'UpdateMetadata',
+        'ProcessingComplete'
+    ]
+    assert record['output']['status'] == 'SUCCESS'
+    keys = {obj['Key'] for obj in pipeline.s3.list_objects_v2(Bucket=BUCKET_NAME)['Contents']}
+    for prefix in ('extracted/', 'embeddings/', 'indexed/', 'summaries/'):
+        assert f"{prefix}uploads/a.pdf.json" in keys
@@ -0,0 +1,90 @@
+import pytest
+
+from local_pipeline import LocalBedrockBatch, LocalPipeline
+from run_local_pipeline import BUCKET_NAME, generate_pdf
+from artifacts import read_artifact
+from batch_embeddings import assign_shards
+
+ROLE_ARN = 'arn:aws:iam::000000000000:role/local-batch'
+# 4, 6 and 8 chunks
+DOCUMENTS = {'uploads/a.pdf': 2, 'uploads/b.pdf': 3, 'uploads/c.pdf': 4}
+
+
+@pytest.fixture
+def pipeline(tmp_path):
+    pipeline = LocalPipeline(str(tmp_path), time_scale=0)
+    for seed, (key, pages) in enumerate(DOCUMENTS.items()):
+        pipeline.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=generate_pdf(pages, seed))
+        assert pipeline.execute({'bucket': BUCKET_NAME, 'key': key}, f"doc-{seed}")['status'] == 'SUCCEEDED'
+    return pipeline
+
+
+def batch_module(pipeline, **batch_options):
+    batch = pipeline.module('batch_embeddings')
+    batch.bedrock_client = LocalBedrockBatch(pipeline.s3, min_records=batch_options.pop('min_records', 1),
+                                             **batch_options)
+    return batch
+
+
+def embeddings(pipeline, key):
+    return read_artifact(pipeline.s3, BUCKET_NAME, f'embeddings/{key}.json', 'embeddings_data')
+
+
+def test_documents_are_packed_whole_into_balanced_shards():
+    records = {'a': 4, 'b': 6, 'c': 8, 'd': 1}
+
+    assert assign_shards(records, 10) == [['a', 'b'], ['c', 'd']]
+    assert assign_shards(records, 8) == [['a'], ['b'], ['c'], ['d']]
+    assert assign_shards({}, 8) == []
+
+
+def test_run_rewrites_embeddings_with_the_online_vectors(pipeline):
+    batch = batch_module(pipeline)
+    online = {key: embeddings(pipeline, key)['embeddings_data'] for key in DOCUMENTS}
+    assert batch.find_pending_documents(BUCKET_NAME) == []
+
+    manifest = batch.create_run(BUCKET_NAME, batch.find_pending_documents(BUCKET_NAME, force=True),
+                                run_id='run-1', max_records=8)
+    assert [shard['documents'] for shard in manifest['shards']] == [[key] for key in DOCUMENTS]
+    assert [shard['records'] for shard in manifest['shards']] == [4, 6, 8]
+
+    # Resumed from the saved manifest, as batch_embed_documents.py --run-id does
+    summary = batch.run_jobs(BUCKET_NAME, batch.load_manifest(BUCKET_NAME, 'run-1'), ROLE_ARN, poll_seconds=0.01)
+
+    assert summary == {'run_id': 'run-1', 'documents': {'embedded': 3}, 'jobs': 3, 'records': 18,
+                       'failed_records': 0, 'online_records': 0}
+    for key in DOCUMENTS:
+        document = embeddings(pipeline, key)
+        assert document['batch_run_id'] == 'run-1'
+        assert ([(entry['chunk_id'], entry['embedding']) for entry in document['embeddings_data']]
+                == [(entry['chunk_id'], entry['embedding']) for entry in online[key]])
+    assert batch.load_manifest(BUCKET_NAME, 'run-1')['documents']['uploads/a.pdf']['status'] == 'embedded'
+
+
+def test_failed_records_leave_embeddings_unchanged_or_go_online(pipeline):
+    batch = batch_module(pipeline, failure_rate=1.0)
+    document_ids = batch.find_pending_documents(BUCKET_NAME, force=True)
+
+    failed = batch.run_jobs(BUCKET_NAME, batch.create_run(BUCKET_NAME, document_ids, run_id='failed'), ROLE_ARN,
+                            poll_seconds=0.01)
+
+    assert failed['documents'] == {'failed': 3} and failed['failed_records'] == 18
+    assert all('batch_run_id' not in embeddings(pipeline, key) for key in DOCUMENTS)
+
+    fallback = batch.run_jobs(BUCKET_NAME, batch.create_run(BUCKET_NAME, document_ids, run_id='fallback'), ROLE_ARN,
+                              poll_seconds=0.01, online_fallback=True)
+
+    assert fallback['documents'] == {'embedded': 3}
+    assert fallback['online_records'] == 18 and fallback['failed_records'] == 0
+    assert embeddings(pipeline, 'uploads/a.pdf')['batch_run_id'] == 'fallback'
+
+
+def test_rejected_job_fails_every_document_of_its_shard(pipeline):
+    batch = batch_module(pipeline, min_records=100)
+
+    manifest = batch.create_run(BUCKET_NAME, ['uploads/a.pdf', 'uploads/b.pdf'], run_id='small')
+    summary = batch.run_jobs(BUCKET_NAME, manifest, ROLE_ARN, poll_seconds=0.01)
+
+    assert summary['documents'] == {'failed': 2} and summary['jobs'] == 1
+    [error, *_] = manifest['documents']['uploads/a.pdf']['failed_records'].values()
+    assert error.startswith('Batch job Failed: Input has 10 records, fewer than the minimum of 100')
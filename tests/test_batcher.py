@@ -0,0 +1,93 @@
+import asyncio
+import threading
+
+import numpy as np
+import pytest
+
+from retrieval import QueryBatcher
+
+
+class FakeIndex:
+    """
+    Scores every query against nothing; each result names its query row
+    """
+
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = []
+
+    def search_batch(self, query_vectors, k=5, filters=None):
+        self.calls.append((len(query_vectors), k, filters))
+        if self.error:
+            raise self.error
+        return [[{'query': float(vector[0]), 'rank': rank} for rank in range(k)] for vector in query_vectors]
+
+
+class FakeEmbedder:
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, texts):
+        self.calls.append(list(texts))
+        return [[float(len(text)), 0.0] for text in texts]
+
+
+def test_concurrent_requests_share_one_embedding_call_and_split_results():
+    index, embed = FakeIndex(), FakeEmbedder()
+    batcher = QueryBatcher(index, embed, window_ms=200, max_batch=3)
+
+    futures = [batcher.submit('abc', 2), batcher.submit('abc', 1), batcher.submit('de', 3)]
+    results = [future.result(5) for future in futures]
+
+    assert embed.calls == [['abc', 'de']]
+    assert index.calls == [(2, 3, None)]
+    assert [len(result) for result in results] == [2, 1, 3]
+    assert results[2][0]['query'] == 2.0
+    assert batcher.stats()['batches'] == 1
+
+
+def test_cancelled_request_does_not_fail_its_batch():
+    index, embed = FakeIndex(), FakeEmbedder()
+    batcher = QueryBatcher(index, embed, window_ms=200, max_batch=2)
+
+    abandoned = batcher.submit('abandoned', 1)
+    assert abandoned.cancel()
+    kept = batcher.submit('kept', 1)
+
+    assert kept.result(5) == [{'query': 4.0, 'rank': 0}]
+    assert embed.calls == [['kept']]
+
+
+def test_cancelled_asyncio_waiter_leaves_the_others_their_results():
+    index = FakeIndex()
+    release = threading.Event()
+
+    def slow_embed(texts):
+        release.wait(5)
+        return [[float(len(text)), 0.0] for text in texts]
+
+    batcher = QueryBatcher(index, slow_embed, window_ms=200, max_batch=2)
+
+    async def scenario():
+        first = asyncio.ensure_future(asyncio.wrap_future(batcher.submit('first', 1)))
+        second = asyncio.ensure_future(asyncio.wrap_future(batcher.submit('second', 1)))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        # The cancellation is passed on to the batcher's future mid-batch
+        release.set()
+        return await asyncio.wait_for(second, 5)
+
+    assert asyncio.run(scenario()) == [{'query': 6.0, 'rank': 0}]
+
+
+def test_search_failure_fails_every_request_of_the_batch():
+    batcher = QueryBatcher(FakeIndex(error=RuntimeError('segment unreadable')), FakeEmbedder(),
+                           window_ms=200, max_batch=2)
+
+    futures = [batcher.submit('a'), batcher.submit('b')]
+
+    for future in futures:
+        with pytest.raises(RuntimeError, match='segment unreadable'):
+            future.result(5)
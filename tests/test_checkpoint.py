@@ -0,0 +1,110 @@
+import json
+import os
+
+import pytest
+
+import generate_embeddings
+from artifacts import put_artifact, read_artifact
+from checkpoint import EmbeddingCheckpoint
+from local_pipeline import LocalBedrockRuntime, LocalS3, StateMachine
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUCKET = 'source-pdf-qa-aws'
+DOCUMENT_ID = 'uploads/report.pdf'
+
+
+def chunks(count):
+    return [{'chunk_id': f"c{n}", 'text': f"trecho número {n} do relatório", 'page': n // 2 + 1,
+             'char_count': 30} for n in range(count)]
+
+
+class ChunkBudgetContext:
+    """
+    Lambda context with time left for a fixed number of chunks
+    """
+
+    def __init__(self, chunks_left):
+        self.chunks_left = chunks_left
+
+    def get_remaining_time_in_millis(self):
+        self.chunks_left -= 1
+        return 10 ** 9 if self.chunks_left >= 0 else 0
+
+
+def test_checkpoint_resumes_only_pending_chunks_of_the_same_chunk_list(tmp_path):
+    s3 = LocalS3(str(tmp_path))
+    ids = [chunk['chunk_id'] for chunk in chunks(5)]
+    checkpoint = EmbeddingCheckpoint(s3, BUCKET, DOCUMENT_ID, ids)
+    checkpoint.save_shard([(0, {'chunk_id': 'c0', 'embedding': [0.0]}), (1, {'chunk_id': 'c1', 'embedding': [1.0]})])
+    checkpoint.save_shard([(3, {'chunk_id': 'c3', 'embedding': [3.0]})])
+    checkpoint.record_failures({'c2': 'ThrottlingException'})
+    checkpoint.record_failures({'c2': 'ThrottlingException'})
+
+    resumed = EmbeddingCheckpoint(s3, BUCKET, DOCUMENT_ID, ids)
+    assert resumed.load()
+    assert resumed.pending_indices() == [2, 4]
+    assert resumed.failed == {'c2': {'attempts': 2, 'error': 'ThrottlingException'}}
+    assert [entry['chunk_id'] for entry in resumed.load_embeddings()] == ['c0', 'c1', 'c3']
+
+    # Re-extracted document: a different chunk list never resumes
+    changed = EmbeddingCheckpoint(s3, BUCKET, DOCUMENT_ID, ids[:4])
+    assert not changed.load()
+    assert changed.pending_indices() == [0, 1, 2, 3]
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix='checkpoints/').get('KeyCount', 0) == 0
+
+
+@pytest.fixture
+def embeddings_lambda(tmp_path, monkeypatch):
+    s3 = LocalS3(str(tmp_path))
+    bedrock = LocalBedrockRuntime(dimensions=8)
+    monkeypatch.setattr(generate_embeddings, 's3_client', s3)
+    monkeypatch.setattr(generate_embeddings, 'bedrock_runtime', bedrock)
+    monkeypatch.setattr(generate_embeddings, 'rate_limiter', None)
+    monkeypatch.setattr(generate_embeddings, 'DEDUP_ENABLED', False)
+    monkeypatch.setattr(generate_embeddings, 'CHECKPOINT_EVERY', 2)
+    put_artifact(s3, BUCKET, 'extracted/report.json', {'document_id': DOCUMENT_ID, 'chunks': chunks(5)},
+                 records_field='chunks')
+    return s3, bedrock
+
+
+def test_handler_hands_off_before_the_timeout_and_resumes_from_the_checkpoint(embeddings_lambda):
+    s3, bedrock = embeddings_lambda
+    event = {'document_id': DOCUMENT_ID, 'bucket': BUCKET, 'key': DOCUMENT_ID,
+             'extracted_file_key': 'extracted/report.json'}
+
+    first = generate_embeddings.lambda_handler(event, ChunkBudgetContext(3))
+    assert first['embeddings_status'] == 'IN_PROGRESS'
+    assert (first['chunks_completed'], first['embeddings_handoffs']) == (3, 1)
+
+    second = generate_embeddings.lambda_handler(first, ChunkBudgetContext(1))
+    assert second['embeddings_status'] == 'IN_PROGRESS'
+    assert (second['chunks_completed'], second['embeddings_handoffs']) == (4, 2)
+
+    done = generate_embeddings.lambda_handler(second, ChunkBudgetContext(10))
+    assert done['embeddings_status'] == 'COMPLETE'
+    # Every chunk was embedded exactly once across the three invocations
+    assert bedrock.calls == 5
+    artifact = read_artifact(s3, BUCKET, done['embeddings_file_key'], records_field='embeddings_data')
+    assert [entry['chunk_id'] for entry in artifact['embeddings_data']] == [f"c{n}" for n in range(5)]
+    assert s3.list_objects_v2(Bucket=BUCKET, Prefix='checkpoints/').get('KeyCount', 0) == 0
+
+
+def test_state_machine_gives_up_after_the_hand_off_limit():
+    with open(os.path.join(ROOT, 'state_machines', 'processing.json')) as f:
+        definition = json.load(f)
+    invocations = []
+
+    def invoke(resource, payload, state):
+        invocations.append(resource)
+        if resource == '${GenerateEmbeddingsFunctionArn}':
+            # A document that never finishes: every run hands off again
+            return dict(payload, embeddings_status='IN_PROGRESS',
+                        embeddings_handoffs=int(payload.get('embeddings_handoffs') or 0) + 1)
+        return dict(payload)
+
+    record = StateMachine(definition, invoke, time_scale=0).execute({'document_id': DOCUMENT_ID})
+
+    assert record['output']['status'] == 'FAILED'
+    assert record['output']['error']['Error'] == 'EmbeddingsHandOffLimitExceeded'
+    assert invocations.count('${GenerateEmbeddingsFunctionArn}') == 20
+    assert '${IndexOpenSearchFunctionArn}' not in invocations
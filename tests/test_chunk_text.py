@@ -0,0 +1,114 @@
+import asyncio
+import os
+
+import pytest
+
+from chunk_text import (
+    AsyncS3ChunkTextSource, ChunkTextStore, LocalChunkTextSource, S3ChunkTextSource, chunk_text_index_key,
+    put_chunk_texts
+)
+from local_pipeline import AsyncLocalS3, LocalS3
+
+BUCKET = 'source-pdf-qa-aws'
+CHUNKS = [
+    {'chunk_id': 'page_1_chunk_1', 'text': 'Introdução à avaliação'},
+    {'chunk_id': 'page_1_chunk_2', 'text': 'Seção com acentuação: é, ç, ã'},
+    {'chunk_id': 'page_2_chunk_1', 'text': ''},
+    # Far past the coalescing distance from the chunks before it
+    {'chunk_id': 'page_2_chunk_2', 'text': 'x' * (100 * 1024)},
+    {'chunk_id': 'page_3_chunk_1', 'text': 'Conclusão'},
+]
+
+
+class CountingS3(LocalS3):
+    """
+    LocalS3 recording the key and range of every get_object
+    """
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.gets = []
+
+    def get_object(self, Bucket, Key, Range=None, **kwargs):
+        self.gets.append((Key, Range))
+        return super().get_object(Bucket=Bucket, Key=Key, Range=Range, **kwargs)
+
+
+@pytest.fixture
+def s3(tmp_path):
+    s3 = CountingS3(str(tmp_path))
+    put_chunk_texts(s3, BUCKET, 'uploads/a.pdf', CHUNKS)
+    s3.gets.clear()
+    return s3
+
+
+def pairs(*chunk_ids, document_id='uploads/a.pdf'):
+    return [(document_id, chunk_id) for chunk_id in chunk_ids]
+
+
+def test_nearby_chunks_share_one_range_read_and_are_cached(s3):
+    store = ChunkTextStore(S3ChunkTextSource(s3, BUCKET))
+
+    texts = store.get_texts(pairs('page_1_chunk_1', 'page_1_chunk_2', 'page_2_chunk_1', 'page_3_chunk_1')
+                            + pairs('page_1_chunk_1', document_id='uploads/missing.pdf'))
+
+    assert texts == {
+        ('uploads/a.pdf', 'page_1_chunk_1'): 'Introdução à avaliação',
+        ('uploads/a.pdf', 'page_1_chunk_2'): 'Seção com acentuação: é, ç, ã',
+        ('uploads/a.pdf', 'page_2_chunk_1'): '',
+        ('uploads/a.pdf', 'page_3_chunk_1'): 'Conclusão',
+    }
+    ranges = [get_range for key, get_range in s3.gets if key.endswith('.txt')]
+    # The two first chunks in one read, the last one past the large chunk in another
+    assert len(ranges) == 2 and all(get_range.startswith('bytes=') for get_range in ranges)
+    assert sorted(key for key, get_range in s3.gets if get_range is None) == [
+        chunk_text_index_key('uploads/a.pdf'), chunk_text_index_key('uploads/missing.pdf')
+    ]
+
+    s3.gets.clear()
+    assert store.get_texts(pairs('page_1_chunk_2', 'page_3_chunk_1')) == {
+        ('uploads/a.pdf', 'page_1_chunk_2'): 'Seção com acentuação: é, ç, ã',
+        ('uploads/a.pdf', 'page_3_chunk_1'): 'Conclusão',
+    }
+    assert s3.gets == []
+    assert store.stats()['hits'] == 2 and store.stats()['bytes_read'] < 1024
+
+
+def test_lru_keeps_the_cache_within_its_budget(s3):
+    store = ChunkTextStore(S3ChunkTextSource(s3, BUCKET), cache_mb=0.05)
+
+    store.get_texts(pairs('page_1_chunk_1', 'page_2_chunk_2'))
+
+    assert store.stats()['cached_bytes'] <= 0.05 * 1024 * 1024
+    assert store.stats()['cached_chunks'] == 0
+
+
+def test_reingested_document_is_read_through_its_new_index(s3):
+    store = ChunkTextStore(S3ChunkTextSource(s3, BUCKET))
+    store.get_texts(pairs('page_1_chunk_1'))
+
+    put_chunk_texts(s3, BUCKET, 'uploads/a.pdf', [{'chunk_id': 'page_3_chunk_1', 'text': 'Nova conclusão'}])
+    keys = {obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix='chunk-text/')['Contents']}
+
+    # The old blob is gone: the cached index fails once, then is re-read
+    assert len(keys) == 2
+    assert store.get_texts(pairs('page_3_chunk_1')) == {('uploads/a.pdf', 'page_3_chunk_1'): 'Nova conclusão'}
+
+
+def test_local_mirror_and_async_source_hydrate_results(s3, tmp_path):
+    results = [{'chunk_id': chunk_id, 'score': 1.0, 'metadata': {'document_id': 'uploads/a.pdf', 'chunk_id': chunk_id}}
+               for chunk_id in ('page_1_chunk_2', 'page_3_chunk_1')]
+    results.append({'chunk_id': 'x', 'score': 0.5, 'metadata': {'document_id': 'uploads/a.pdf', 'chunk_id': 'x',
+                                                                'text': 'indexed with its text'}})
+
+    local = ChunkTextStore(LocalChunkTextSource(os.path.join(str(tmp_path), BUCKET)))
+    hydrated = local.hydrate([dict(result, metadata=dict(result['metadata'])) for result in results])
+
+    async_store = ChunkTextStore(AsyncS3ChunkTextSource(AsyncLocalS3(str(tmp_path)), BUCKET))
+    ahydrated = asyncio.run(async_store.ahydrate([dict(result, metadata=dict(result['metadata']))
+                                                  for result in results]))
+
+    expected = ['Seção com acentuação: é, ç, ã', 'Conclusão', 'indexed with its text']
+    assert [result['metadata']['text'] for result in hydrated] == expected
+    assert [result['metadata']['text'] for result in ahydrated] == expected
+    assert async_store.stats()['range_reads'] == 2
@@ -0,0 +1,121 @@
+import threading
+
+import generate_embeddings
+from dedup import ChunkDeduplicator, S3CorpusIndex, deduplicate_chunks, corpus_key
+from local_pipeline.stubs import LocalS3
+
+BUCKET = 'source-pdf-qa-aws'
+WORDS = ['alfa', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliett',
+         'kilo', 'lima', 'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango']
+
+
+def text(offset, count=60):
+    return ' '.join(WORDS[(offset + i * 7) % len(WORDS)] + WORDS[(offset + i) % len(WORDS)] for i in range(count))
+
+
+def chunk(chunk_id, content, page=1):
+    return {'chunk_id': chunk_id, 'page': page, 'text': content, 'char_count': len(content)}
+
+
+def test_repeated_chunks_collapse_to_the_first_copy():
+    # Page numbers differ but normalize away, as in repeated headers and footers
+    footer = text(0)
+    chunks = [
+        chunk('c0', footer + ' página 1 de 40', page=1),
+        chunk('c1', text(3), page=1),
+        chunk('c2', footer + ' página 2 de 40', page=2),
+        chunk('c3', text(11), page=2)
+    ]
+
+    result = deduplicate_chunks(chunks, 'uploads/a.pdf')
+
+    assert [c['chunk_id'] for c in result['canonical_chunks']] == ['c0', 'c1', 'c3']
+    assert result['canonical_chunks'][0]['duplicates'] == [{'chunk_id': 'c2', 'page': 2}]
+    [duplicate] = result['duplicate_chunks']
+    assert duplicate['duplicate_of'] == {'document_id': 'uploads/a.pdf', 'chunk_id': 'c0'}
+    assert result['stats']['bedrock_calls_saved'] == 1
+    assert result['stats']['bedrock_input_chars_saved'] == chunks[2]['char_count']
+
+
+def test_corpus_match_reuses_the_published_vector(tmp_path):
+    s3 = LocalS3(str(tmp_path))
+    first = S3CorpusIndex(s3, BUCKET, 'dedup/corpus/')
+    deduplicator = ChunkDeduplicator('uploads/a.pdf', corpus_index=first)
+    deduplicator.add(chunk('c0', text(0)))
+    first.flush({'c0': [0.25, 0.5]})
+    assert first.pending == {}
+
+    second = ChunkDeduplicator('uploads/b.pdf', corpus_index=S3CorpusIndex(s3, BUCKET, 'dedup/corpus/'))
+    reused = second.add(chunk('c9', text(0)))
+
+    assert reused['chunk_id'] == 'c9'
+    assert reused['reuse_embedding'] == [0.25, 0.5]
+    assert reused['reused_from']['document_id'] == 'uploads/a.pdf'
+    assert second.stats()['duplicates_across_corpus'] == 1
+
+
+class InterleavingS3(LocalS3):
+    """
+    LocalS3 that lets another document append to a band bucket between the
+    read and the conditional write of the first attempt
+    """
+
+    def __init__(self, root, interleave):
+        super().__init__(root)
+        self.interleave = interleave
+        self.conflicts = 0
+        self._local = threading.local()
+
+    def put_object(self, **kwargs):
+        if 'bands/' in kwargs['Key'] and self.interleave and not getattr(self._local, 'inside', False):
+            interleave, self.interleave = self.interleave, None
+            self._local.inside = True
+            try:
+                interleave()
+            finally:
+                self._local.inside = False
+        try:
+            return super().put_object(**kwargs)
+        except Exception as e:
+            if e.response['Error']['Code'] == 'PreconditionFailed':
+                self.conflicts += 1
+            raise
+
+
+def test_concurrent_appends_to_a_band_bucket_keep_both_documents(tmp_path):
+    signature = ChunkDeduplicator('x').hasher.signature(text(0))
+    storage = str(tmp_path)
+
+    def other_document():
+        index = S3CorpusIndex(LocalS3(storage), BUCKET, 'dedup/corpus/', workers=1)
+        index.add(corpus_key('uploads/b.pdf', 'c0'), signature)
+        index.flush({'c0': [1.0]})
+
+    s3 = InterleavingS3(storage, other_document)
+    index = S3CorpusIndex(s3, BUCKET, 'dedup/corpus/', workers=1)
+    index.add(corpus_key('uploads/a.pdf', 'c0'), signature)
+    index.flush({'c0': [2.0]})
+
+    assert s3.conflicts == 1
+    fresh = S3CorpusIndex(LocalS3(storage), BUCKET, 'dedup/corpus/')
+    for band_key in fresh.bands._band_keys(signature):
+        assert fresh._members(band_key) == {
+            corpus_key('uploads/a.pdf', 'c0'), corpus_key('uploads/b.pdf', 'c0')
+        }
+
+
+class FailingIndex:
+    def flush(self, embeddings):
+        raise Exception('Parameter validation failed: Unknown parameter in input: "IfNoneMatch"')
+
+
+def test_failed_corpus_publish_is_recorded_in_the_stats(monkeypatch):
+    monkeypatch.setattr(generate_embeddings, 'DEDUP_SCOPE', 'corpus')
+    stats = {'index_documents_saved': 1, 'bedrock_input_chars_saved': 10}
+    embeddings = [{'chunk_id': 'c0', 'embedding': [0.0, 1.0]}]
+
+    generate_embeddings.finish_dedup(BUCKET, embeddings, stats, FailingIndex())
+
+    assert stats['corpus_index_published'] is False
+    assert 'IfNoneMatch' in stats['corpus_index_error']
+    assert stats['estimated_index_bytes_saved'] == 1 * 2 * 4 + 10
@@ -0,0 +1,185 @@
+import io
+import json
+import time
+import threading
+
+import pytest
+
+import embedding_router
+from embedding_router import EmbeddingRouter, Endpoint
+from rate_limiter import InMemoryBackend, RateLimiter
+
+REQUEST = {
+    'body': json.dumps({'inputText': 'texto de teste'}),
+    'modelId': 'amazon.titan-embed-text-v1',
+    'accept': 'application/json',
+    'contentType': 'application/json'
+}
+
+
+class ThrottlingException(Exception):
+    def __init__(self):
+        super().__init__('ThrottlingException: Rate exceeded')
+        self.response = {'Error': {'Code': 'ThrottlingException'}}
+
+
+class FakeEndpointClient:
+    """
+    bedrock-runtime stand-in with a settable latency and error, counting
+    started and finished calls
+    """
+
+    def __init__(self, name: str, latency_ms: float):
+        self.name = name
+        self.latency_ms = latency_ms
+        self.error = None
+        self.started = 0
+        self.finished = 0
+        self._lock = threading.Lock()
+
+    def invoke_model(self, **kwargs):
+        with self._lock:
+            self.started += 1
+        try:
+            time.sleep(self.latency_ms / 1000.0)
+            if self.error is not None:
+                raise self.error
+            return {'body': io.BytesIO(json.dumps({'embedding': [1.0], 'endpoint': self.name}).encode('utf-8'))}
+        finally:
+            with self._lock:
+                self.finished += 1
+
+
+def answered_by(response) -> str:
+    return json.loads(response['body'].read())['endpoint']
+
+
+@pytest.fixture(autouse=True)
+def no_exploration(monkeypatch):
+    # Random exploration calls would make the routing counts nondeterministic
+    monkeypatch.setattr(embedding_router, 'EXPLORE_RATE', 0.0)
+
+
+def make_router(latencies, **kwargs):
+    clients = [FakeEndpointClient(name, latency_ms) for name, latency_ms in latencies]
+    router = EmbeddingRouter([Endpoint(client.name, client) for client in clients], **kwargs)
+    return router, {client.name: client for client in clients}
+
+
+def warm_up(router, calls=10):
+    for _ in range(calls):
+        router.invoke_model(**REQUEST)
+
+
+def test_routes_to_the_endpoint_with_the_lowest_latency_estimate():
+    router, clients = make_router([('slow', 40), ('fast', 5)], hedge=False)
+    warm_up(router, 20)
+
+    endpoints = {endpoint['name']: endpoint for endpoint in router.stats()['endpoints']}
+    assert endpoints['fast']['latency_ms'] < endpoints['slow']['latency_ms']
+    # One call measures the cold endpoint, every other call goes to the fast one
+    assert clients['slow'].started == 1
+    assert clients['fast'].started == 19
+
+
+def test_routing_follows_a_lasting_slowdown():
+    router, clients = make_router([('a', 5), ('b', 20)], hedge=False)
+    warm_up(router)
+    clients['a'].latency_ms = 60
+    warm_up(router)
+
+    # The EWMA of a overtakes b's within a few calls and traffic moves to b
+    assert answered_by(router.invoke_model(**REQUEST)) == 'b'
+
+
+def test_hedge_fires_on_a_slow_call_and_the_first_answer_wins():
+    router, clients = make_router([('primary', 5), ('backup', 20)])
+    warm_up(router)
+    clients['primary'].latency_ms = 1000
+
+    started = time.perf_counter()
+    response = router.invoke_model(**REQUEST)
+    elapsed = time.perf_counter() - started
+
+    assert answered_by(response) == 'backup'
+    assert elapsed < 0.5
+    stats = router.stats()
+    assert (stats['hedged'], stats['hedge_wins']) == (1, 1)
+    # The losing call is abandoned, not waited for; its answer is dropped
+    assert clients['primary'].started - clients['primary'].finished == 1
+    time.sleep(1.1)
+    assert clients['primary'].started == clients['primary'].finished
+
+
+def test_no_hedge_when_the_primary_answers_in_time():
+    router, clients = make_router([('primary', 5), ('backup', 20)])
+    warm_up(router)
+    backup_calls = clients['backup'].started
+    warm_up(router)
+
+    assert router.stats()['hedged'] == 0
+    assert clients['backup'].started == backup_calls
+
+
+def test_hedge_budget_caps_duplicates():
+    router, clients = make_router([('primary', 5), ('backup', 20)], hedge_budget=0.0)
+    warm_up(router)
+    clients['primary'].latency_ms = 120
+
+    for _ in range(3):
+        router.invoke_model(**REQUEST)
+
+    # The initial token allows one hedge, the zero budget never refills it
+    assert router.stats()['hedged'] == 1
+
+
+def test_hedges_spend_the_shared_rate_limit():
+    limiter = RateLimiter(InMemoryBackend(), requests_per_second=1.0, tokens_per_second=1000.0)
+    admitted = []
+
+    def admission(request):
+        admitted.append(limiter.try_acquire_global(10))
+        return admitted[-1]
+
+    router, clients = make_router([('primary', 5), ('backup', 20)], hedge_budget=1.0, hedge_admission=admission)
+    warm_up(router)
+    clients['primary'].latency_ms = 150
+
+    answers = [answered_by(router.invoke_model(**REQUEST)) for _ in range(2)]
+
+    # The limiter has one request of burst: the first hedge takes it and
+    # wins, the second is refused and the call waits for the primary
+    assert admitted == [True, False]
+    assert answers == ['backup', 'primary']
+    stats = router.stats()
+    assert (stats['hedged'], stats['hedges_denied']) == (1, 1)
+
+
+def test_fails_over_to_the_next_endpoint_on_error():
+    router, clients = make_router([('primary', 5), ('backup', 20)], hedge=False)
+    warm_up(router)
+    clients['primary'].error = ThrottlingException()
+
+    assert answered_by(router.invoke_model(**REQUEST)) == 'backup'
+    stats = router.stats()
+    assert stats['failovers'] == 1
+    primary = next(endpoint for endpoint in stats['endpoints'] if endpoint['name'] == 'primary')
+    assert primary['ejected'] and primary['throttles'] == 1
+
+    # While ejected, calls go straight to the backup
+    primary_calls = clients['primary'].started
+    assert answered_by(router.invoke_model(**REQUEST)) == 'backup'
+    assert clients['primary'].started == primary_calls
+
+
+def test_request_errors_are_not_failed_over():
+    router, clients = make_router([('primary', 5), ('backup', 20)], hedge=False)
+    warm_up(router)
+    error = Exception('ValidationException: bad input')
+    clients['primary'].error = error
+    backup_calls = clients['backup'].started
+
+    with pytest.raises(Exception, match='ValidationException'):
+        router.invoke_model(**REQUEST)
+    assert clients['backup'].started == backup_calls
+    assert router.stats()['failovers'] == 0
@@ -0,0 +1,69 @@
+import pytest
+
+from local_pipeline import LocalPipeline
+from run_local_pipeline import BUCKET_NAME, generate_pdf
+from artifacts import read_artifact
+
+FAST_PATH = 'ProcessSmallDocumentFunction'
+STATE_MACHINE_STATES = ['ExtractText', 'GenerateEmbeddings', 'EmbeddingsComplete', 'IndexToOpenSearch',
+                        'UpdateMetadata', 'ProcessingComplete']
+
+
+@pytest.fixture
+def pipeline(tmp_path, monkeypatch):
+    monkeypatch.setenv('STEP_FUNCTION_ARN', 'arn:aws:states:local:000000000000:stateMachine:test')
+    pipeline = LocalPipeline(str(tmp_path), time_scale=0)
+    # The routing setting is read at import, which may predate this fixture
+    monkeypatch.setattr(pipeline.module('scheduler'), 'FAST_PATH_FUNCTION', FAST_PATH)
+    for key in ('uploads/fast.pdf', 'uploads/full.pdf'):
+        pipeline.s3.put_object(Bucket=BUCKET_NAME, Key=key, Body=generate_pdf(2, 1))
+    return pipeline
+
+
+def embeddings(pipeline, key):
+    document = read_artifact(pipeline.s3, BUCKET_NAME, f'embeddings/{key}.json', 'embeddings_data')
+    return [(entry['chunk_id'], entry['text'], entry['embedding']) for entry in document['embeddings_data']]
+
+
+def test_small_upload_is_routed_to_one_invocation_with_the_same_artifacts(pipeline):
+    [(execution_input, name, target)] = pipeline.trigger(BUCKET_NAME, 'uploads/fast.pdf')
+    assert target == FAST_PATH
+
+    record = pipeline.execute(execution_input, name, target)
+
+    assert record['status'] == 'SUCCEEDED'
+    assert [entry['state'] for entry in record['history']] == [FAST_PATH]
+    assert record['output']['route'] == 'fast_path'
+    assert record['output']['indexed_documents'] == 4
+
+    assert pipeline.execute({'bucket': BUCKET_NAME, 'key': 'uploads/full.pdf'}, 'full')['status'] == 'SUCCEEDED'
+    assert embeddings(pipeline, 'uploads/fast.pdf') == embeddings(pipeline, 'uploads/full.pdf')
+    indexed = read_artifact(pipeline.s3, BUCKET_NAME, 'indexed/uploads/fast.pdf.json')
+    assert indexed['indexed_documents'] == 4 and indexed['chunk_text_key']
+    summary = read_artifact(pipeline.s3, BUCKET_NAME, 'summaries/uploads/fast.pdf.json')
+    assert summary['processing']['path'] == 'fused-pipelined'
+
+
+def test_document_over_the_page_limit_is_handed_to_the_state_machine(pipeline, monkeypatch):
+    monkeypatch.setattr(pipeline.module('process_small_document'), 'FAST_PATH_MAX_PAGES', 1)
+
+    record = pipeline.execute({'bucket': BUCKET_NAME, 'key': 'uploads/fast.pdf'}, 'handoff', FAST_PATH)
+
+    assert record['status'] == 'SUCCEEDED'
+    assert [entry['state'] for entry in record['history']] == [FAST_PATH] + STATE_MACHINE_STATES
+    assert record['output']['status'] == 'SUCCESS'
+    summary = read_artifact(pipeline.s3, BUCKET_NAME, 'summaries/uploads/fast.pdf.json')
+    assert 'path' not in summary['processing']
+
+
+def test_fast_path_failure_falls_back_to_the_state_machine(pipeline, monkeypatch):
+    def failing(*args, **kwargs):
+        raise RuntimeError('embedding failed')
+
+    monkeypatch.setattr(pipeline.module('process_small_document'), 'process_pipelined', failing)
+
+    record = pipeline.execute({'bucket': BUCKET_NAME, 'key': 'uploads/fast.pdf'}, 'fallback', FAST_PATH)
+
+    assert record['status'] == 'SUCCEEDED'
+    assert [entry['state'] for entry in record['history']] == [FAST_PATH] + STATE_MACHINE_STATES
+    assert embeddings(pipeline, 'uploads/fast.pdf')
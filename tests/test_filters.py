@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from retrieval import SegmentedIndex
+from retrieval import segments
+from retrieval.filters import MetadataFilterIndex, normalize_date, parse_filters
+
+METADATA = [
+    {'document_id': 'uploads/a.pdf', 'author': 'Ana', 'page': 1, 'creation_date': "D:20230105120000-03'00'"},
+    {'document_id': 'uploads/a.pdf', 'author': 'Ana', 'page': 2, 'creation_date': "D:20230105120000-03'00'"},
+    {'document_id': 'uploads/b.pdf', 'author': 'Bruno', 'page': 1, 'creation_date': '2024-02-29'},
+    {'document_id': 'uploads/c.pdf', 'author': 'Ana', 'page': 7, 'creation_date': None},
+]
+
+
+def test_pdf_and_iso_dates_normalize_and_bad_dates_do_not():
+    assert normalize_date("D:20230105120000-03'00'") == '2023-01-05'
+    assert normalize_date('D:2023') == '2023-01-01'
+    assert normalize_date('2024-02-29T10:00:00') == '2024-02-29'
+    assert normalize_date('2023-02-30') == ''
+    assert normalize_date(None) == ''
+
+
+def test_allowed_rows_combine_fields_with_and_and_values_with_or():
+    index = MetadataFilterIndex.from_metadata(METADATA)
+
+    assert index.allowed_rows(None) is None
+    assert index.allowed_rows({'author': 'Ana'}).tolist() == [0, 1, 3]
+    assert index.allowed_rows({'document_id': ['uploads/b.pdf', 'uploads/c.pdf']}).tolist() == [2, 3]
+    assert index.allowed_rows({'author': ['Ana'], 'page': {'gte': 2, 'lte': None}}).tolist() == [1, 3]
+    assert index.allowed_rows({'author': 'Bruno', 'page': {'gte': 2}}).tolist() == []
+    with pytest.raises(ValueError):
+        index.allowed_rows({'color': 'blue'})
+
+
+def test_date_ranges_skip_undated_documents():
+    index = MetadataFilterIndex.from_metadata(METADATA)
+    filters = parse_filters(MultiDict({'date_to': '2023-12-31'}))
+
+    assert filters == {'creation_date': {'gte': '0001-01-01', 'lte': '2023-12-31'}}
+    assert index.allowed_rows(filters).tolist() == [0, 1]
+    assert index.allowed_rows(parse_filters(MultiDict({'date_from': '2024-01-01'}))).tolist() == [2]
+
+
+def test_request_arguments_become_filters():
+    values = MultiDict([('author', 'Ana'), ('author', 'Bruno'), ('page_from', '2'), ('title', '')])
+
+    assert parse_filters(values) == {'author': ['Ana', 'Bruno'], 'page': {'gte': 2, 'lte': None}}
+    with pytest.raises(ValueError):
+        parse_filters(MultiDict({'date_from': '05/01/2023'}))
+
+
+@pytest.mark.parametrize('documents', [2, 40])
+def test_filtered_search_returns_the_best_allowed_rows(tmp_path, monkeypatch, documents):
+    # 2 of 40 documents is a selective filter (allow-set scanned directly),
+    # 40 of 40 goes through the widened IVF probe
+    monkeypatch.setattr(segments, 'IVF_MIN_ROWS', 400)
+    monkeypatch.setattr(segments, 'BRUTE_FORCE_MAX_ROWS', 50)
+    generator = np.random.default_rng(3)
+    index = SegmentedIndex(str(tmp_path), refresh_interval=0, nprobe=2)
+    batch = []
+    for number in range(40):
+        document_id = f"uploads/{number:02d}.pdf"
+        ids = [f"{document_id}#{row}" for row in range(10)]
+        metadata = [{'document_id': document_id, 'chunk_id': chunk_id, 'page': row + 1}
+                    for row, chunk_id in enumerate(ids)]
+        batch.append((document_id, ids, generator.standard_normal((10, 16)).astype('float32'), metadata))
+    assert index.add_documents(batch)['ivf']
+
+    wanted = [f"uploads/{number:02d}.pdf" for number in range(documents)]
+    query = generator.standard_normal(16).astype('float32')
+    results = index.search(query, k=5, filters={'document_id': wanted, 'page': {'gte': 3, 'lte': 8}})
+
+    assert len(results) == 5
+    for result in results:
+        assert result['metadata']['document_id'] in wanted and 3 <= result['metadata']['page'] <= 8
+    if documents == 2:
+        [segment] = index.segments()
+        vectors = np.asarray(segment.store.vectors)
+        scores = vectors @ (query / np.linalg.norm(query))
+        allowed = [row for row in range(len(segment)) if segment.store.metadata(row)['document_id'] in wanted
+                   and 3 <= segment.store.metadata(row)['page'] <= 8]
+        best = sorted(allowed, key=lambda row: -scores[row])[:5]
+        assert [r['chunk_id'] for r in results] == [segment.store.chunk_id(row) for row in best]
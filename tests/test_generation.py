@@ -0,0 +1,120 @@
+import json
+import time
+import asyncio
+
+import pytest
+
+from retrieval.generation import FakeStreamingModel, stream_answer, astream_answer, format_sse
+
+SOURCES = [{
+    'chunk_id': 'uploads/doc.pdf#0',
+    'score': 0.9,
+    'metadata': {'document_id': 'uploads/doc.pdf', 'page': 1, 'text': 'Trecho de teste'}
+}]
+
+
+class FailingModel(FakeStreamingModel):
+    """
+    Streams fail_after tokens of the canned answer, then fails like a
+    dropped Bedrock stream
+    """
+
+    def __init__(self, fail_after: int):
+        super().__init__(delay=0.0, first_token_delay=0.0)
+        self.fail_after = fail_after
+
+    def stream(self, prompt):
+        for i, word in enumerate(super().stream(prompt)):
+            if i == self.fail_after:
+                raise RuntimeError('stream interrupted')
+            yield word
+
+    async def astream(self, prompt):
+        i = 0
+        async for word in super().astream(prompt):
+            if i == self.fail_after:
+                raise RuntimeError('stream interrupted')
+            i += 1
+            yield word
+
+
+async def _collect(events, until_error=False):
+    collected = []
+    try:
+        async for event in events:
+            collected.append(event)
+    except RuntimeError:
+        if not until_error:
+            raise
+    return collected
+
+
+def _parse_sse(body: str):
+    frames = []
+    for frame in body.split('\n\n'):
+        if not frame:
+            continue
+        lines = frame.split('\n')
+        assert len(lines) == 2 and lines[0].startswith('event: ') and lines[1].startswith('data: ')
+        frames.append((lines[0][len('event: '):], json.loads(lines[1][len('data: '):])))
+    return frames
+
+
+def _assert_order(events):
+    names = [event['event'] for event in events]
+    assert names[0] == 'sources'
+    assert names[-1] == 'done'
+    assert set(names[1:-1]) == {'token'}
+
+    assert events[0]['data'] == {'sources': SOURCES}
+    tokens = ''.join(event['data']['text'] for event in events[1:-1])
+    done = events[-1]['data']
+    assert done['answer'] == tokens
+    assert tokens.startswith('Resposta simulada para: O que é?')
+    timings = done['timings']
+    assert timings['first_byte_ms'] <= timings['first_token_ms'] <= timings['total_ms']
+
+
+def test_stream_answer_event_order():
+    model = FakeStreamingModel(delay=0.0, first_token_delay=0.0)
+    _assert_order(list(stream_answer('O que é?', SOURCES, model, time.perf_counter())))
+
+
+def test_astream_answer_event_order():
+    model = FakeStreamingModel(delay=0.0, first_token_delay=0.0)
+    _assert_order(asyncio.run(_collect(astream_answer('O que é?', SOURCES, model, time.perf_counter()))))
+
+
+def test_stream_answer_error_mid_stream():
+    events = stream_answer('O que é?', SOURCES, FailingModel(fail_after=2), time.perf_counter())
+    assert next(events)['event'] == 'sources'
+    assert [next(events)['event'] for _ in range(2)] == ['token', 'token']
+    # The error surfaces to the caller after the tokens already sent, with no 'done'
+    with pytest.raises(RuntimeError, match='stream interrupted'):
+        next(events)
+
+
+def test_astream_answer_error_mid_stream():
+    events = asyncio.run(_collect(
+        astream_answer('O que é?', SOURCES, FailingModel(fail_after=2), time.perf_counter()), until_error=True
+    ))
+    assert [event['event'] for event in events] == ['sources', 'token', 'token']
+
+
+def test_format_sse_framing():
+    frame = format_sse({'event': 'token', 'data': {'text': ' página\ncom quebra'}})
+    assert frame == 'event: token\ndata: {"text": " página\\ncom quebra"}\n\n'
+    assert _parse_sse(frame) == [('token', {'text': ' página\ncom quebra'})]
+
+
+def test_ask_stream_sends_error_event_after_tokens(monkeypatch):
+    import app
+
+    monkeypatch.setattr(app, 'search_index', lambda question, k, filters: SOURCES)
+    monkeypatch.setattr(app, 'answer_model', FailingModel(fail_after=3))
+    response = app.app.test_client().get('/ask', query_string={'q': 'O que é?', 'stream': '1'})
+
+    assert response.mimetype == 'text/event-stream'
+    frames = _parse_sse(response.get_data(as_text=True))
+    assert [name for name, _ in frames] == ['sources', 'token', 'token', 'token', 'error']
+    assert frames[-1][1] == {'error': 'Generation failed: stream interrupted'}
@@ -0,0 +1,27 @@
+import load_test
+
+
+def records(latencies, errors=0):
+    return ([{'latency_ms': latency, 'status': 200, 'error': None} for latency in latencies]
+            + [{'latency_ms': None, 'status': None, 'error': 'timeout'}] * errors)
+
+
+def test_throughput_is_measured_over_at_least_the_scenario_duration():
+    # Responses that all land early must not inflate throughput
+    summary = load_test.summarize_scenario(records([10.0] * 20), 5, 10.0, 4.0, None)
+    assert summary['throughput_rps'] == 2.0
+
+    summary = load_test.summarize_scenario(records([10.0] * 20), 5, 10.0, 20.0, None)
+    assert summary['throughput_rps'] == 1.0
+
+
+def test_scenario_without_successes_fails_instead_of_reporting_zero_latency():
+    summary = load_test.summarize_scenario(records([], errors=3), 5, 10.0, 10.0, None)
+    assert summary['latency_ms']['p95'] is None
+    report = {'scenarios': {'search': summary}}
+
+    assert load_test.failed_scenarios(report) == ['search: nenhuma requisição bem-sucedida em 3']
+    baseline = {'scenarios': {'search': load_test.summarize_scenario(records([10.0] * 5), 5, 10.0, 10.0, None)}}
+    assert load_test.find_regressions(report, baseline, 0.2, 0.01, 10.0) == [
+        'search: throughput 0.5 → 0.0 req/s', 'search: erros 0.0% → 100.0%'
+    ]
@@ -0,0 +1,82 @@
+import fitz
+import pytest
+
+import parsed_pages
+from local_pipeline import LocalS3
+from parsed_pages import content_hash, load_parsed_pages, open_parsed_pages, parsed_key
+from run_local_pipeline import generate_pdf
+
+BUCKET = 'source-pdf-qa-aws'
+
+
+@pytest.fixture
+def s3(tmp_path):
+    return LocalS3(str(tmp_path))
+
+
+def cached_keys(s3):
+    return [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix='parsed/').get('Contents', [])]
+
+
+def test_second_open_reads_the_cache_instead_of_parsing(s3, monkeypatch):
+    pdf = generate_pdf(3, 1)
+
+    parsed = load_parsed_pages(pdf, s3, BUCKET)
+    assert parsed['cached'] is False and parsed['total_pages'] == 3
+    assert cached_keys(s3) == [parsed_key(content_hash(pdf))]
+
+    def no_parsing(*args, **kwargs):
+        raise AssertionError('PDF parsed again')
+
+    monkeypatch.setattr(parsed_pages.fitz, 'open', no_parsing)
+    cached = load_parsed_pages(pdf, s3, BUCKET)
+
+    assert cached['cached'] is True
+    assert cached['pages'] == parsed['pages']
+    assert cached['metadata'] == parsed['metadata']
+
+
+def test_block_ranges_point_into_the_page_text():
+    document = fitz.open()
+    page = document.new_page()
+    page.insert_text((72, 72), 'Primeiro bloco de texto')
+    page.insert_text((72, 400), 'Segundo bloco, mais abaixo')
+    pdf = document.tobytes()
+
+    [parsed] = load_parsed_pages(pdf)['pages']
+
+    texts = [parsed['text'][start:end].strip() for start, end, *_, kind in parsed['blocks'] if kind == 'text']
+    assert texts == ['Primeiro bloco de texto', 'Segundo bloco, mais abaixo']
+    assert parsed['blocks'][0][3] < parsed['blocks'][1][3]
+
+
+def test_partially_read_document_is_not_cached(s3):
+    pdf = generate_pdf(3, 1)
+
+    header, pages = open_parsed_pages(pdf, s3, BUCKET)
+    next(pages)
+    # An aborted extraction closes the iterator before the last page
+    pages.close()
+
+    assert cached_keys(s3) == []
+    assert open_parsed_pages(pdf, s3, BUCKET)[0]['cached'] is False
+
+
+def test_unreadable_cache_entry_falls_back_to_parsing(s3):
+    pdf = generate_pdf(2, 1)
+    s3.put_object(Bucket=BUCKET, Key=parsed_key(content_hash(pdf)), Body=b'\x1f\x8b not gzip')
+
+    parsed = load_parsed_pages(pdf, s3, BUCKET)
+
+    assert parsed['cached'] is False and len(parsed['pages']) == 2
+    # The parse replaced the broken entry
+    assert load_parsed_pages(pdf, s3, BUCKET)['cached'] is True
+
+
+def test_cache_can_be_turned_off(s3, monkeypatch):
+    monkeypatch.setattr(parsed_pages, 'PARSED_PAGES_CACHE', False)
+    pdf = generate_pdf(2, 1)
+
+    load_parsed_pages(pdf, s3, BUCKET)
+
+    assert cached_keys(s3) == []
@@ -0,0 +1,80 @@
+import fitz
+import pytest
+
+import scheduler
+from local_pipeline import LocalS3
+from pdf_prescan import prescan_bytes, route_for
+
+BUCKET = 'source-pdf-qa-aws'
+
+
+def make_pdf(pages, kind='text', **save):
+    document = fitz.open()
+    for number in range(1, pages + 1):
+        page = document.new_page()
+        if kind == 'text':
+            page.insert_text((72, 72), f'page {number} ' + 'lorem ipsum ' * 50)
+        elif kind == 'image':
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 32, 32), False)
+            pixmap.clear_with(128)
+            page.insert_image(fitz.Rect(72, 72, 200, 200), pixmap=pixmap)
+    return document.tobytes(**save)
+
+
+@pytest.mark.parametrize('data, content, text_check, route', [
+    (make_pdf(2), 'text', 'all_pages', {'route': 'fast_path', 'reason': '2 pages'}),
+    (make_pdf(1, 'image'), 'image_only', 'all_pages', {'route': 'reject', 'reason': 'image_only'}),
+    (make_pdf(1, 'blank'), 'blank', 'all_pages', {'route': 'reject', 'reason': 'blank'}),
+    # Only first, middle and last pages were checked: the full pipeline decides
+    (make_pdf(9, 'image'), 'image_only', 'sampled',
+     {'route': 'state_machine', 'reason': '9 pages, no text in sampled pages'}),
+    (make_pdf(40, deflate=True, garbage=3, use_objstms=1), 'text', 'sampled',
+     {'route': 'state_machine', 'reason': '40 pages'}),
+])
+def test_content_and_route(data, content, text_check, route):
+    scan = prescan_bytes(data)
+
+    assert (scan['method'], scan['content'], scan['text_check']) == ('structure', content, text_check)
+    assert route_for(scan, 5) == route
+
+
+def test_large_document_is_sampled_with_a_few_range_reads():
+    data = make_pdf(300)
+
+    scan = prescan_bytes(data)
+
+    assert scan['pages'] == 300
+    assert [sample['page'] for sample in scan['sampled_pages']] == [1, 151, 300]
+    assert scan['estimated_chunks'] == 300
+    assert scan['range_reads'] <= 5 and scan['bytes_read'] < len(data) / 2
+
+
+def test_unreadable_page_tree_falls_back_to_heuristics_and_non_pdfs_are_rejected():
+    scan = prescan_bytes(make_pdf(3).replace(b'startxref', b'startxxxx'))
+
+    assert (scan['method'], scan['pages']) == ('heuristic', 3)
+    assert route_for(prescan_bytes(b'PK\x03\x04 not a pdf'), 5) == {'route': 'reject', 'reason': 'not_a_pdf'}
+
+
+def test_prescan_job_reads_the_upload_with_ranged_gets(tmp_path, monkeypatch):
+    s3 = LocalS3(str(tmp_path))
+    monkeypatch.setattr(scheduler, 's3_client', s3)
+    monkeypatch.setattr(scheduler, 'PRESCAN_ENABLED', True)
+    for key, data in [('uploads/a.pdf', make_pdf(2)), ('uploads/scan.pdf', make_pdf(1, 'image'))]:
+        s3.put_object(Bucket=BUCKET, Key=key, Body=data)
+
+    job = scheduler.prescan_job(scheduler.new_job(BUCKET, 'uploads/a.pdf', None))
+    assert (job['pages'], job['route'], job['estimated_chunks']) == (2, 'fast_path', 2)
+    assert job['estimated_seconds'] > 0 and 'sampled_pages' not in job['prescan']
+
+    # Few pages but over the byte limit stays off the fast path
+    monkeypatch.setattr(scheduler, 'FAST_PATH_MAX_BYTES', 100)
+    assert scheduler.prescan_job(scheduler.new_job(BUCKET, 'uploads/a.pdf', None))['route'] == 'state_machine'
+
+    assert scheduler.prescan_job(scheduler.new_job(BUCKET, 'uploads/scan.pdf', None))['route'] == 'reject'
+    monkeypatch.setattr(scheduler, 'PRESCAN_REJECT', False)
+    assert scheduler.prescan_job(scheduler.new_job(BUCKET, 'uploads/scan.pdf', None))['route'] == 'state_machine'
+
+    # A failed pre-scan falls back to a size estimate
+    missing = scheduler.prescan_job(scheduler.new_job(BUCKET, 'uploads/missing.pdf', 120000))
+    assert missing['pages'] == 2 and 'route' not in missing
@@ -0,0 +1,125 @@
+import json
+import threading
+import time
+
+import pytest
+
+import app
+from pipeline_status import FileStatusStore, InMemoryStatusStore, StatusCache, merge_event
+
+
+def event(document_id, stage, status, at, **details):
+    return dict({'document_id': document_id, 'stage': stage, 'status': status, 'at': at}, **details)
+
+
+def publish_later(store, delay, *events):
+    def run():
+        time.sleep(delay)
+        for item in events:
+            store.publish(item)
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def store(monkeypatch):
+    store = InMemoryStatusStore()
+    monkeypatch.setattr(app, 'status_cache', StatusCache(store, poll_seconds=0.02))
+    return store
+
+
+def test_upload_event_starts_a_fresh_record():
+    record = merge_event(None, event('a.pdf', 'upload', 'started', 1.0))
+    record = merge_event(record, event('a.pdf', 'extract', 'completed', 2.0, counts={'pages': 3}))
+    assert (record['stage'], record['seq'], sorted(record['stages'])) == ('extract', 2, ['extract', 'upload'])
+    assert record['stages']['extract'] == {'status': 'completed', 'at': 2.0, 'counts': {'pages': 3}}
+
+    record = merge_event(record, event('a.pdf', 'upload', 'started', 3.0))
+    assert (record['seq'], list(record['stages'])) == (3, ['upload'])
+
+
+def test_file_store_is_shared_through_its_file(tmp_path):
+    path = str(tmp_path / 'status.json')
+    FileStatusStore(path).publish(event('a.pdf', 'upload', 'started', 1.0))
+    FileStatusStore(path).publish(event('b.pdf', 'upload', 'started', 5.0))
+
+    reader = FileStatusStore(path)
+    assert reader.get('a.pdf')['status'] == 'started'
+    assert [record['document_id'] for record in reader.changed_since(2.0)] == ['b.pdf']
+    assert FileStatusStore(str(tmp_path / 'missing.json')).changed_since(0) == []
+
+
+def test_cache_versions_changes_and_ignores_stale_records():
+    store = InMemoryStatusStore()
+    cache = StatusCache(store, initial_window_seconds=None)
+    store.publish(event('a.pdf', 'upload', 'started', time.time()))
+    store.publish(event('b.pdf', 'upload', 'started', time.time()))
+
+    assert cache.refresh() == 2
+    version, records = cache.query(0)
+    assert version == 2 and len(records) == 2
+
+    store.publish(event('a.pdf', 'extract', 'running', time.time()))
+    stale = store.get('b.pdf')
+    assert cache.refresh() == 1
+    assert cache._apply([stale]) == 0
+    version, [record] = cache.query(2)
+    assert (version, record['document_id'], record['stage']) == (3, 'a.pdf', 'extract')
+    assert cache.query(3) == (3, [])
+    assert cache.query(0, prefix='b')[1][0]['document_id'] == 'b.pdf'
+
+
+def test_records_older_than_the_window_are_backfilled_once():
+    store = InMemoryStatusStore()
+    store.publish(event('old.pdf', 'summary', 'completed', time.time() - 7200))
+    cache = StatusCache(store, poll_seconds=60, initial_window_seconds=3600)
+    cache.start()
+
+    assert cache.query(0) == (0, [])
+    assert cache.backfill(['old.pdf', 'unknown.pdf']) == 1
+    assert cache.backfill(['old.pdf', 'unknown.pdf']) == 0
+    assert cache.query(0, ['old.pdf'])[1][0]['status'] == 'completed'
+
+
+def test_status_long_poll_returns_as_soon_as_a_document_changes(store):
+    client = app.app.test_client()
+    store.publish(event('uploads/a.pdf', 'upload', 'started', time.time()))
+    version = client.get('/status').get_json()['version']
+
+    publisher = publish_later(store, 0.2, event('uploads/a.pdf', 'extract', 'running', time.time() + 0.2))
+    started = time.monotonic()
+    body = client.get('/status', query_string={'since': version, 'wait': 10}).get_json()
+    publisher.join()
+
+    assert time.monotonic() - started < 5
+    assert body['version'] > version
+    assert [(record['document_id'], record['stage']) for record in body['documents']] == [('uploads/a.pdf', 'extract')]
+
+    # Nothing newer: an expired wait returns an empty list
+    assert client.get('/status', query_string={'since': body['version'], 'wait': 0.1}).get_json()['documents'] == []
+    assert client.get('/status/uploads/missing.pdf').status_code == 404
+    assert client.get('/status', query_string={'since': 'x'}).status_code == 400
+
+
+def test_status_stream_sends_every_change_as_an_event(store):
+    store.publish(event('uploads/a.pdf', 'upload', 'started', time.time()))
+    response = app.app.test_client().get('/status', query_string={'stream': '1', 'ids': 'uploads/a.pdf'},
+                                         buffered=False)
+    assert response.mimetype == 'text/event-stream'
+    frames = iter(response.response)
+    try:
+        first = next(frames).decode('utf-8')
+        publisher = publish_later(store, 0.1, event('uploads/b.pdf', 'upload', 'started', time.time()),
+                                  event('uploads/a.pdf', 'summary', 'completed', time.time()))
+        second = next(frames).decode('utf-8')
+        publisher.join()
+    finally:
+        response.close()
+
+    name, data = [line.split(': ', 1)[1] for line in first.strip().split('\n')]
+    assert name == 'status' and json.loads(data)['documents'][0]['stage'] == 'upload'
+    # Only the requested document is streamed
+    documents = json.loads(second.strip().split('\n')[1].split(': ', 1)[1])['documents']
+    assert [(record['document_id'], record['stage']) for record in documents] == [('uploads/a.pdf', 'summary')]
@@ -0,0 +1,141 @@
+import threading
+import time
+
+import pytest
+
+import pipelined_processing
+from pipelined_processing import process_pipelined
+
+PAGES = 30
+
+
+class Document:
+    """
+    Parsed pages of a fake PDF (one chunk each), counting how many the
+    extraction stage pulled; fail_at raises while parsing that page
+    """
+
+    def __init__(self, pages=PAGES, fail_at=None):
+        self.pages = pages
+        self.fail_at = fail_at
+        self.parsed = 0
+
+    def open(self, pdf_content, s3_client, bucket):
+        header = {'total_pages': self.pages, 'metadata': {'title': 'Fake'}, 'content_hash': 'hash',
+                  'parser_version': 'test', 'cached': False}
+        return header, self._pages()
+
+    def _pages(self):
+        for number in range(1, self.pages + 1):
+            if number == self.fail_at:
+                raise ValueError(f'page {number} is corrupt')
+            self.parsed += 1
+            yield {'page': number, 'text': f'text of page {number}'}
+
+
+class Index:
+    """
+    Records the chunk ids of every batch; fail_at returns a failed result
+    for that batch (1-based)
+    """
+
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.batches = []
+
+    def __call__(self, document_id, batch, metadata, total_pages):
+        self.batches.append([entry['chunk_id'] for entry in batch])
+        if len(self.batches) == self.fail_at:
+            return {'success': False, 'error': 'cluster unavailable'}
+        return {'success': True, 'indexed_documents': len(batch), 'index_name': 'documents'}
+
+
+def embed(fail_chunk=None):
+    def embed_chunk(chunk, document_id, context=None):
+        # Later pages finish first so results arrive out of order
+        time.sleep(0.002 * (PAGES - chunk['page']) / PAGES)
+        if chunk['chunk_id'] == fail_chunk:
+            return {'entry': None, 'error': 'ThrottlingException', 'stopped_early': False}
+        entry = {'chunk_id': chunk['chunk_id'], 'text': chunk['text'], 'page': chunk['page'],
+                 'embedding': [float(chunk['page'])], 'duplicates': []}
+        return {'entry': entry, 'error': None, 'stopped_early': False}
+    return embed_chunk
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    monkeypatch.setattr(pipelined_processing, 'PIPELINE_QUEUE_SIZE', 2)
+    monkeypatch.setattr(pipelined_processing, 'PIPELINE_EMBED_WORKERS', 3)
+    monkeypatch.setattr(pipelined_processing, 'PIPELINE_INDEX_BATCH', 4)
+    monkeypatch.setattr(pipelined_processing, 'create_deduplicator', lambda document_id, bucket: (None, None))
+    monkeypatch.setattr(pipelined_processing, 'finish_dedup', lambda *args: None)
+
+    def install(document=None, index=None, embed_chunk=None):
+        document, index = document or Document(), index or Index()
+        monkeypatch.setattr(pipelined_processing, 'open_parsed_pages', document.open)
+        monkeypatch.setattr(pipelined_processing, 'index_documents_to_opensearch', index)
+        monkeypatch.setattr(pipelined_processing, 'embed_chunk', embed_chunk or embed())
+        return document, index
+    return install
+
+
+def pipeline_threads():
+    return [thread for thread in threading.enumerate() if thread.name.startswith('pipeline-')]
+
+
+def test_stages_overlap_and_results_come_back_in_document_order(stages):
+    _, index = stages()
+
+    processed = process_pipelined(b'%PDF', 'uploads/a.pdf', 'bucket')
+
+    expected = [f'page_{number}_chunk_1' for number in range(1, PAGES + 1)]
+    assert [entry['chunk_id'] for entry in processed['embeddings_data']] == expected
+    assert sorted(sum(index.batches, [])) == sorted(expected)
+    assert all(len(batch) <= 4 for batch in index.batches)
+    assert processed['indexing_result'] == {
+        'success': True, 'indexed_documents': PAGES, 'index_name': 'documents', 'index_batches': len(index.batches)
+    }
+    assert processed['extracted_data']['total_pages'] == PAGES
+    assert {'extract_ms', 'first_embedding_ms', 'total_ms'} <= set(processed['timings'])
+
+
+def test_a_chunk_that_cannot_be_embedded_aborts_every_stage(stages):
+    document, _ = stages(embed_chunk=embed(fail_chunk='page_3_chunk_1'))
+
+    with pytest.raises(RuntimeError, match='Chunk page_3_chunk_1 could not be embedded: ThrottlingException'):
+        process_pipelined(b'%PDF', 'uploads/a.pdf', 'bucket')
+
+    # The bounded queues stopped the parser well before the end of the document
+    assert document.parsed < PAGES
+    assert not pipeline_threads()
+
+
+def test_a_failed_index_batch_aborts_the_pipeline(stages):
+    document, index = stages(index=Index(fail_at=2))
+
+    with pytest.raises(RuntimeError, match='Indexing failed: cluster unavailable'):
+        process_pipelined(b'%PDF', 'uploads/a.pdf', 'bucket')
+
+    assert len(index.batches) == 2
+    assert document.parsed < PAGES
+    assert not pipeline_threads()
+
+
+def test_extraction_error_is_reported_and_releases_the_other_stages(stages):
+    stages(document=Document(fail_at=5))
+
+    with pytest.raises(RuntimeError, match='Extraction failed: page 5 is corrupt'):
+        process_pipelined(b'%PDF', 'uploads/a.pdf', 'bucket')
+
+    assert not pipeline_threads()
+
+
+def test_document_without_text_has_no_chunks(stages):
+    class Blank(Document):
+        def _pages(self):
+            yield {'page': 1, 'text': '   '}
+
+    stages(document=Blank(pages=1))
+
+    with pytest.raises(ValueError, match='No chunks to process'):
+        process_pipelined(b'%PDF', 'uploads/a.pdf', 'bucket')
@@ -0,0 +1,82 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import profiling
+from local_pipeline import LocalS3
+
+BUCKET = 'source-pdf-qa-aws'
+
+
+def busy_in_pool(milliseconds):
+    deadline = time.perf_counter() + milliseconds / 1000.0
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+
+
+def handle(event, context):
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        list(pool.map(busy_in_pool, [150, 150]))
+    if event.get('fail'):
+        raise ValueError('extraction failed')
+    return {'document_id': event['document_id'], 'bucket': BUCKET}
+
+
+def saved_reports(s3):
+    keys = [obj['Key'] for obj in s3.list_objects_v2(Bucket=BUCKET, Prefix='summaries/').get('Contents', [])]
+    return keys, [json.loads(s3.get_object(Bucket=BUCKET, Key=key)['Body'].read())
+                  for key in keys if key.endswith('.json')]
+
+
+@pytest.fixture
+def local_s3(tmp_path, monkeypatch):
+    s3 = LocalS3(str(tmp_path))
+    monkeypatch.setattr(profiling, '_s3_client', s3)
+    return s3
+
+
+def test_profiling_off_leaves_the_handler_untouched(monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING', 'off')
+    assert profiling.profiled_handler('extract')(handle) is handle
+
+
+def test_flagged_invocation_saves_a_profile_covering_pool_threads(local_s3, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING', 'event')
+    handler = profiling.profiled_handler('extract')(handle)
+
+    assert handler({'document_id': 'uploads/plain.pdf'}, None) == {
+        'document_id': 'uploads/plain.pdf', 'bucket': BUCKET
+    }
+    assert saved_reports(local_s3) == ([], [])
+
+    result = handler({'document_id': 'uploads/a.pdf', 'profile': True}, None)
+
+    # The flag rides on the output so the next stage is profiled too
+    assert result['profile'] is True
+    keys, [report] = saved_reports(local_s3)
+    assert all(key.startswith('summaries/uploads/a.pdf/profiles/extract-') for key in keys)
+    assert report['pstats_key'] in keys
+    assert report['stage'] == 'extract' and report['wall_ms'] >= 150
+    assert any('(handle)' in entry['function'] for entry in report['top_functions'])
+    # The pool's busy loop only shows up in the stack samples of its threads
+    assert not any('(busy_in_pool)' in entry['function'] for entry in report['top_functions'])
+    sampled = {entry['function']: entry for entry in report['thread_samples']['top_functions']}
+    [busy] = [entry for name, entry in sampled.items() if '(busy_in_pool)' in name]
+    assert report['thread_samples']['threads'] >= 1
+    assert busy['estimated_ms'] > 100
+
+
+def test_failing_handler_still_saves_its_profile_and_raises(local_s3, monkeypatch):
+    monkeypatch.setattr(profiling, 'PROFILING', 'event')
+    handler = profiling.profiled_handler('extract')(handle)
+
+    with pytest.raises(ValueError, match='extraction failed'):
+        handler({'document_id': 'uploads/a.pdf', 'bucket': BUCKET, 'profile': True, 'fail': True}, None)
+
+    _, [report] = saved_reports(local_s3)
+    assert report['document_id'] == 'uploads/a.pdf'
+    # The process-wide session lock was released for the next invocation
+    assert profiling._session_lock.acquire(blocking=False)
+    profiling._session_lock.release()
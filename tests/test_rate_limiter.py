@@ -0,0 +1,153 @@
+import json
+import multiprocessing
+import threading
+
+import pytest
+
+import rate_limiter
+from rate_limiter import (
+    DynamoDBBackend, FileBackend, InMemoryBackend, RateLimitContention, RateLimiter, HEARTBEAT_SECONDS
+)
+
+NOW = 1_700_000_000.0
+
+
+def increment(state):
+    state['count'] = state.get('count', 0) + 1
+    return state, state['count']
+
+
+def _file_worker(path, times):
+    backend = FileBackend(path)
+    for _ in range(times):
+        backend.update('counter', increment)
+
+
+def test_file_backend_updates_are_atomic_across_processes(tmp_path):
+    path = str(tmp_path / 'limiter.json')
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=_file_worker, args=(path, 50)) for _ in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=60)
+        assert process.exitcode == 0
+
+    assert FileBackend(path).update('counter', lambda state: (state, state['count'])) == 150
+
+
+def test_memory_backend_updates_are_atomic_across_threads():
+    backend = InMemoryBackend()
+    threads = [threading.Thread(target=lambda: [backend.update('counter', increment) for _ in range(200)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert backend.update('counter', lambda state: (state, state['count'])) == 800
+
+
+class ConditionalCheckFailedException(Exception):
+    pass
+
+
+class FakeDynamoDB:
+    """
+    get_item/put_item on a dict with the two condition expressions the
+    backend uses; before_put lets a test slip in a competing write
+    """
+
+    class exceptions:
+        ConditionalCheckFailedException = ConditionalCheckFailedException
+
+    def __init__(self):
+        self.items = {}
+        self.before_put = None
+        self.puts = []
+
+    def get_item(self, TableName, Key, ConsistentRead):
+        item = self.items.get(Key['limiter_key']['S'])
+        return {'Item': json.loads(json.dumps(item))} if item else {}
+
+    def put_item(self, TableName, Item, ConditionExpression, ExpressionAttributeValues=None):
+        if self.before_put:
+            self.before_put(self)
+        self.puts.append(Item)
+        current = self.items.get(Item['limiter_key']['S'])
+        if ConditionExpression == 'attribute_not_exists(limiter_key)':
+            ok = current is None
+        else:
+            ok = current is not None and current['version'] == ExpressionAttributeValues[':version']
+        if not ok:
+            raise ConditionalCheckFailedException()
+        self.items[Item['limiter_key']['S']] = Item
+
+
+def test_dynamodb_backend_retries_a_lost_race_on_the_new_version(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda seconds: None)
+    client = FakeDynamoDB()
+    backend = DynamoDBBackend(client, 'limiter', expire_after_seconds=60)
+    assert backend.update('counter', increment) == 1
+
+    def competing_write(client):
+        client.before_put = None
+        DynamoDBBackend(client, 'limiter').update('counter', increment)
+
+    client.before_put = competing_write
+    assert backend.update('counter', increment) == 3
+
+    item = client.items['counter']
+    assert json.loads(item['state']['S']) == {'count': 3}
+    assert item['version'] == {'N': '3'}
+    assert 'expires_at' in client.puts[0]
+
+
+def test_dynamodb_backend_gives_up_on_a_record_that_keeps_changing(monkeypatch):
+    monkeypatch.setattr(rate_limiter.time, 'sleep', lambda seconds: None)
+    client = FakeDynamoDB()
+    backend = DynamoDBBackend(client, 'limiter', max_conflicts=3)
+    backend.update('counter', increment)
+    client.before_put = lambda client: client.items['counter'].update(
+        version={'N': str(int(client.items['counter']['version']['N']) + 1)}
+    )
+
+    with pytest.raises(RateLimitContention):
+        backend.update('counter', increment)
+
+
+def test_lone_document_gets_the_whole_budget_and_then_shares_it():
+    backend = InMemoryBackend()
+    limiter = RateLimiter(backend, requests_per_second=10, tokens_per_second=1e6)
+
+    assert all(limiter._try_take('a.pdf', 1, NOW) == 0 for _ in range(10))
+    assert limiter._try_take('a.pdf', 1, NOW) == pytest.approx(0.1)
+
+    # The global budget is empty: b.pdf waits and gets its own share back
+    assert limiter._try_take('b.pdf', 1, NOW) > 0
+    assert backend._states['bedrock:doc:b.pdf']['buckets']['requests'][0] == pytest.approx(5.0)
+
+    # Once a.pdf's heartbeat sees b.pdf, each gets half of a refilled budget
+    later = NOW + HEARTBEAT_SECONDS
+    assert [limiter._try_take('a.pdf', 1, later) == 0 for _ in range(6)] == [True] * 5 + [False]
+    assert [limiter._try_take('b.pdf', 1, later) == 0 for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_token_budget_admits_a_request_larger_than_the_burst():
+    limiter = RateLimiter(InMemoryBackend(), requests_per_second=100, tokens_per_second=1000)
+
+    # Five seconds of tokens pass at once, emptying the bucket
+    assert limiter._try_take('a.pdf', 5000, NOW) == 0
+    assert limiter._try_take('a.pdf', 1000, NOW) == pytest.approx(1.0)
+    assert limiter._try_take('a.pdf', 1000, NOW + 1.0) == 0
+
+
+def test_hedges_take_the_global_budget_without_waiting_or_touching_shares():
+    backend = InMemoryBackend()
+    limiter = RateLimiter(backend, requests_per_second=2, tokens_per_second=1e6)
+
+    assert limiter.try_acquire_global(10)
+    assert limiter.try_acquire_global(10)
+    assert not limiter.try_acquire_global(10)
+    assert not any(key.startswith('bedrock:doc:') for key in backend._states)
+    assert not limiter.acquire('a.pdf', 10, timeout=0.05)
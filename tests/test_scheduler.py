@@ -0,0 +1,171 @@
+import pytest
+
+import scheduler as scheduler_module
+from rate_limiter import InMemoryBackend
+from scheduler import BackendJobQueue, Scheduler, estimate_job, new_job
+
+QUOTAS = {'small': 2, 'medium': 1, 'large': 1}
+
+
+def job(key, pages):
+    return estimate_job(dict(new_job('bucket', key, None), pages=pages))
+
+
+class Starts:
+    """
+    start() stand-in recording the keys it was called with
+    """
+
+    def __init__(self, fail_keys=()):
+        self.fail_keys = set(fail_keys)
+        self.keys = []
+
+    def __call__(self, job):
+        self.keys.append(job['key'])
+        if job['key'] in self.fail_keys:
+            raise RuntimeError('StartExecution failed')
+        return {'key': job['key']}
+
+
+class RacingQueue(BackendJobQueue):
+    """
+    Runs race() once, right after a transition has read the queue head and
+    before it updates the running slots
+    """
+
+    race = None
+
+    def head(self, job_class, limit):
+        jobs = super().head(job_class, limit)
+        race, self.race = self.race, None
+        if race:
+            race()
+        return jobs
+
+
+@pytest.fixture(autouse=True)
+def quiet_status(monkeypatch):
+    monkeypatch.setattr(scheduler_module, 'publish', lambda *args, **kwargs: None)
+
+
+def running_keys(scheduler):
+    return sorted(slot['key'] for slot in scheduler.snapshot()['running'].values())
+
+
+def test_each_class_gets_its_own_quota_and_the_cheapest_job_goes_first():
+    scheduler = Scheduler(InMemoryBackend(), QUOTAS, aging_pages_per_second=0, tenant_penalty_pages=0)
+    start = Starts()
+
+    for key, pages in [('uploads/big-1.pdf', 500), ('uploads/big-2.pdf', 300), ('uploads/a.pdf', 3),
+                       ('uploads/b.pdf', 5), ('uploads/c.pdf', 1)]:
+        scheduler.submit(job(key, pages), start)
+
+    assert start.keys == ['uploads/big-1.pdf', 'uploads/a.pdf', 'uploads/b.pdf']
+    assert [queued['key'] for queued in scheduler.snapshot()['queue']] == ['uploads/c.pdf', 'uploads/big-2.pdf']
+
+    scheduler.release('uploads/a.pdf', start)
+    scheduler.release('uploads/big-1.pdf', start)
+
+    assert start.keys[3:] == ['uploads/c.pdf', 'uploads/big-2.pdf']
+    assert running_keys(scheduler) == ['uploads/b.pdf', 'uploads/big-2.pdf', 'uploads/c.pdf']
+
+
+def test_tenant_with_running_jobs_is_penalized():
+    scheduler = Scheduler(InMemoryBackend(), {'small': 2}, aging_pages_per_second=0, tenant_penalty_pages=50)
+    start = Starts()
+    scheduler.submit(job('uploads/acme/1.pdf', 1), start)
+    scheduler.queue.put('small', '0', dict(job('uploads/acme/2.pdf', 1), enqueued=0.0, priority='0'))
+    scheduler.queue.put('small', '1', dict(job('uploads/globex/1.pdf', 9), enqueued=0.0, priority='1'))
+
+    # acme/2.pdf is cheaper but its tenant already holds a slot
+    scheduler.dispatch(start)
+
+    assert start.keys == ['uploads/acme/1.pdf', 'uploads/globex/1.pdf']
+
+
+def test_job_claimed_by_a_concurrent_transition_is_not_started_twice():
+    backend = InMemoryBackend()
+    queue = RacingQueue(backend)
+    first, second = Scheduler(backend, QUOTAS, queue=queue), Scheduler(backend, QUOTAS, queue=queue)
+    start = Starts()
+    queue.put('small', '0', dict(job('uploads/a.pdf', 1), enqueued=0.0, priority='0'))
+
+    # The other trigger dispatches between this transition's queue read and its slot update
+    queue.race = lambda: second.dispatch(start)
+    first.dispatch(start)
+
+    assert start.keys == ['uploads/a.pdf']
+    assert running_keys(first) == ['uploads/a.pdf']
+
+
+def test_job_claimed_and_finished_by_a_concurrent_transition_gives_its_slot_back():
+    backend = InMemoryBackend()
+    queue = RacingQueue(backend)
+    first, second = Scheduler(backend, QUOTAS, queue=queue), Scheduler(backend, QUOTAS, queue=queue)
+    start = Starts()
+    queue.put('small', '0', dict(job('uploads/a.pdf', 1), enqueued=0.0, priority='0'))
+
+    def started_and_finished():
+        second.dispatch(start)
+        second.release('uploads/a.pdf', start)
+
+    # The slot is gone again when this transition runs, so it claims the
+    # job a second time; the failed queue removal must undo that claim
+    queue.race = started_and_finished
+    first.dispatch(start)
+
+    assert start.keys == ['uploads/a.pdf']
+    assert running_keys(first) == []
+
+
+def test_release_frees_only_the_oldest_slot_of_a_reuploaded_key():
+    scheduler = Scheduler(InMemoryBackend(), QUOTAS)
+    start = Starts()
+    scheduler.submit(job('uploads/a.pdf', 1), start)
+    scheduler.submit(job('uploads/a.pdf', 1), start)
+
+    assert scheduler.release('uploads/a.pdf', start) == []
+    assert running_keys(scheduler) == ['uploads/a.pdf']
+    _, released = scheduler._transition(0, release_key='uploads/a.pdf')
+    assert released
+    _, released = scheduler._transition(0, release_key='uploads/a.pdf')
+    assert not released
+
+
+def test_expired_lease_is_reclaimed_and_renew_extends_it():
+    scheduler = Scheduler(InMemoryBackend(), {'small': 1}, lease_seconds=-1)
+    start = Starts()
+    scheduler.submit(job('uploads/a.pdf', 1), start)
+    assert scheduler.renew('uploads/a.pdf', 60)
+
+    scheduler.submit(job('uploads/b.pdf', 1), start)
+    assert start.keys == ['uploads/a.pdf']
+
+    # b.pdf's slot was never renewed: its lease has run out when c.pdf arrives
+    scheduler.release('uploads/a.pdf', start)
+    scheduler.submit(job('uploads/c.pdf', 1), start)
+    assert start.keys == ['uploads/a.pdf', 'uploads/b.pdf', 'uploads/c.pdf']
+    assert not scheduler.renew('uploads/a.pdf', 60)
+
+
+def test_idle_quota_is_lent_only_to_jobs_that_waited():
+    scheduler = Scheduler(InMemoryBackend(), {'small': 1, 'large': 1}, lend_idle=True, lend_after_seconds=30)
+    start = Starts()
+    scheduler.submit(job('uploads/a.pdf', 1), start)
+    scheduler.queue.put('small', '1', dict(job('uploads/b.pdf', 1), enqueued=0.0, priority='1'))
+    scheduler.submit(job('uploads/c.pdf', 1), start)
+
+    # b.pdf has waited long enough for large's idle slot, c.pdf has not
+    assert start.keys == ['uploads/a.pdf', 'uploads/b.pdf']
+    assert [slot['borrowed'] for slot in scheduler.snapshot()['running'].values()] == [False, True]
+
+
+def test_failed_start_drops_the_job_and_starts_the_next_one():
+    scheduler = Scheduler(InMemoryBackend(), {'small': 1}, aging_pages_per_second=0)
+    start = Starts(fail_keys={'uploads/a.pdf'})
+    scheduler.queue.put('small', '0', dict(job('uploads/a.pdf', 1), enqueued=0.0, priority='0'))
+    scheduler.queue.put('small', '1', dict(job('uploads/b.pdf', 1), enqueued=0.0, priority='1'))
+
+    assert scheduler.dispatch(start) == [{'key': 'uploads/b.pdf'}]
+    assert running_keys(scheduler) == ['uploads/b.pdf']
+    assert scheduler.snapshot()['queue'] == []
@@ -0,0 +1,92 @@
+import numpy as np
+
+from retrieval import SegmentedIndex
+from retrieval import segments
+
+DIMENSIONS = 32
+
+
+def document(document_id, rows, seed, page=1):
+    vectors = np.random.default_rng(seed).standard_normal((rows, DIMENSIONS)).astype('float32')
+    ids = [f"{document_id}#{row}" for row in range(rows)]
+    metadata = [{'document_id': document_id, 'chunk_id': chunk_id, 'page': page} for chunk_id in ids]
+    return document_id, ids, vectors, metadata
+
+
+def top_chunk(index, vector):
+    return index.search(vector, k=1)[0]['chunk_id']
+
+
+def test_reingest_and_delete_hide_old_rows(tmp_path):
+    index = SegmentedIndex(str(tmp_path), refresh_interval=0)
+    first = document('uploads/a.pdf', 4, seed=1)
+    index.add_document(*first)
+    index.add_document(*document('uploads/b.pdf', 4, seed=2))
+    assert top_chunk(index, first[2][3]) == 'uploads/a.pdf#3'
+
+    # Re-ingesting replaces every earlier row of the document
+    replacement = document('uploads/a.pdf', 2, seed=3)
+    index.add_document(*replacement)
+    results = index.search(first[2][3], k=10)
+    assert {r['chunk_id'] for r in results if r['chunk_id'].startswith('uploads/a.pdf')} == {
+        'uploads/a.pdf#0', 'uploads/a.pdf#1'
+    }
+    assert top_chunk(index, replacement[2][1]) == 'uploads/a.pdf#1'
+
+    assert index.delete_document('uploads/a.pdf')
+    assert not index.delete_document('uploads/a.pdf')
+    assert all(r['metadata']['document_id'] == 'uploads/b.pdf' for r in index.search(replacement[2][1], k=10))
+
+
+def test_compaction_merges_a_level_and_drops_tombstoned_rows(tmp_path):
+    index = SegmentedIndex(str(tmp_path), refresh_interval=0)
+    docs = [document(f"uploads/{n}.pdf", 3, seed=n) for n in range(segments.FANOUT)]
+    for doc in docs:
+        index.add_document(*doc)
+    index.delete_document('uploads/0.pdf')
+    before = [[r['chunk_id'] for r in index.search(doc[2][0], k=3)] for doc in docs[1:]]
+
+    merged = index.compact()
+
+    assert merged['level'] == 1 and merged['count'] == 3 * (segments.FANOUT - 1)
+    manifest = index.read_manifest()
+    assert [entry['name'] for entry in manifest['segments']] == [merged['name']]
+    [segment] = index.segments()
+    assert 'uploads/0.pdf' not in segment.documents
+    assert [path.name for path in tmp_path.glob('*.qvs')] == [f"{merged['name']}.qvs"]
+    assert [[r['chunk_id'] for r in index.search(doc[2][0], k=3)] for doc in docs[1:]] == before
+    assert index.compact() is None
+
+
+def test_ivf_segment_probes_a_subset_and_full_probe_matches_brute_force(tmp_path, monkeypatch):
+    monkeypatch.setattr(segments, 'IVF_MIN_ROWS', 400)
+    index = SegmentedIndex(str(tmp_path), refresh_interval=0, nprobe=4)
+    entry = index.add_document(*document('uploads/big.pdf', 400, seed=7))
+    assert entry['ivf']
+
+    [segment] = index.segments()
+    queries = np.random.default_rng(8).standard_normal((5, DIMENSIONS)).astype('float32')
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    assert len(segment.candidate_rows(queries[:1], 4)) < len(segment)
+
+    exact = queries @ np.asarray(segment.store.vectors).T
+    full = index.search_batch(queries, k=5, nprobe=len(segment.centroids))
+    for scores, results in zip(exact, full):
+        assert [r['chunk_id'] for r in results] == [segment.store.chunk_id(row) for row in np.argsort(-scores)[:5]]
+
+    # Each query's own nearest row lives in the list its centroid probes first
+    for row in (0, 123, 399):
+        vector = np.asarray(segment.store.vectors[row])
+        assert index.search(vector, k=1)[0]['chunk_id'] == segment.store.chunk_id(row)
+
+
+def test_reader_picks_up_segments_written_by_another_instance(tmp_path):
+    writer = SegmentedIndex(str(tmp_path))
+    reader = SegmentedIndex(str(tmp_path), refresh_interval=0)
+    assert reader.search(np.ones(DIMENSIONS), k=1) == []
+
+    doc = document('uploads/a.pdf', 2, seed=1)
+    writer.add_document(*doc)
+
+    assert top_chunk(reader, doc[2][1]) == 'uploads/a.pdf#1'
+    assert reader.generation == writer.read_manifest()['generation']
@@ -0,0 +1,122 @@
+import threading
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+from retrieval import SegmentedIndex, ShardedIndex, ShardedSearchClient, serve_shard
+from retrieval.shards import merge_top_k, parse_address, shard_directory, shard_for
+
+DIMENSIONS = 32
+AUTHKEY = b'test-shard-key'
+DOCUMENTS = [f"uploads/doc-{number:02d}.pdf" for number in range(12)]
+
+
+def document(document_id, rows, seed):
+    vectors = np.random.default_rng(seed).standard_normal((rows, DIMENSIONS)).astype('float32')
+    ids = [f"{document_id}#{row}" for row in range(rows)]
+    metadata = [{'document_id': document_id, 'chunk_id': chunk_id, 'page': 1} for chunk_id in ids]
+    return document_id, ids, vectors, metadata
+
+
+@pytest.fixture
+def indexes(tmp_path):
+    documents = [document(document_id, 6, seed) for seed, document_id in enumerate(DOCUMENTS)]
+    sharded = ShardedIndex(str(tmp_path / 'sharded'), num_shards=3)
+    sharded.add_documents(documents)
+    single = SegmentedIndex(str(tmp_path / 'single'))
+    single.add_documents(documents)
+    return sharded, single
+
+
+def serve(directory, address):
+    ready = threading.Event()
+    threading.Thread(target=serve_shard, args=(directory, address, AUTHKEY, ready), daemon=True).start()
+    assert ready.wait(10)
+    return address
+
+
+class SilentShard:
+    """
+    Accepts connections and reads requests but never answers them
+    """
+
+    def __init__(self, address):
+        self.listener = Listener(parse_address(address), authkey=AUTHKEY)
+        self.connections = []
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def _accept(self):
+        while True:
+            connection = self.listener.accept()
+            self.connections.append(connection)
+            connection.recv()
+
+
+def queries(count=8):
+    return np.random.default_rng(99).standard_normal((count, DIMENSIONS)).astype('float32')
+
+
+def test_merge_keeps_best_first_order_across_shards():
+    per_shard = [
+        [{'chunk_id': 'a', 'score': 0.9}, {'chunk_id': 'b', 'score': 0.5}, {'chunk_id': 'c', 'score': 0.1}],
+        [],
+        [{'chunk_id': 'd', 'score': 0.95}, {'chunk_id': 'e', 'score': 0.5}, {'chunk_id': 'f', 'score': 0.4}],
+    ]
+
+    assert [result['chunk_id'] for result in merge_top_k(per_shard, 4)] == ['d', 'a', 'b', 'e']
+    assert len(merge_top_k(per_shard, 10)) == 6
+
+
+def test_documents_live_in_one_shard_and_searches_match_an_unsharded_index(indexes):
+    sharded, single = indexes
+
+    for document_id in DOCUMENTS:
+        owners = [shard for shard, index in enumerate(sharded.shards) if index.has_document(document_id)]
+        assert owners == [shard_for(document_id, 3)]
+    for vector in queries():
+        assert ([result['chunk_id'] for result in sharded.search(vector, k=7)]
+                == [result['chunk_id'] for result in single.search(vector, k=7)])
+
+    with pytest.raises(ValueError, match='resharding is not supported'):
+        ShardedIndex(sharded.directory, num_shards=4)
+
+
+def test_client_merges_shard_servers_in_score_order(indexes, tmp_path):
+    sharded, single = indexes
+    addresses = [serve(shard_directory(sharded.directory, shard), str(tmp_path / f"shard-{shard}.sock"))
+                 for shard in range(3)]
+    client = ShardedSearchClient(addresses, AUTHKEY, timeout_ms=5000)
+
+    batch = client.search_batch(queries(), k=7)
+
+    for vector, results in zip(queries(), batch):
+        assert results.missing_shards == []
+        assert ([result['chunk_id'] for result in results]
+                == [result['chunk_id'] for result in single.search(vector, k=7)])
+        scores = [result['score'] for result in results]
+        assert scores == sorted(scores, reverse=True)
+    assert sum(info['rows'] for info in client.info()) == len(DOCUMENTS) * 6
+    assert client.stats()['partial_queries'] == 0
+
+
+def test_slow_or_missing_shards_are_left_out_and_reported(indexes, tmp_path):
+    sharded, _ = indexes
+    live = serve(shard_directory(sharded.directory, 0), str(tmp_path / 'live.sock'))
+    silent = str(tmp_path / 'silent.sock')
+    SilentShard(silent)
+    down = str(tmp_path / 'down.sock')
+    client = ShardedSearchClient([live, silent, down], AUTHKEY, timeout_ms=300)
+
+    results = client.search(queries()[0], k=5)
+
+    assert results.missing_shards == [silent, down]
+    assert {result['metadata']['document_id'] for result in results} <= {
+        document_id for document_id in DOCUMENTS if shard_for(document_id, 3) == 0
+    }
+    # Slicing keeps the report
+    assert results[:2].missing_shards == [silent, down]
+    assert client.stats()['shard_failures'] == {live: 0, silent: 1, down: 1}
+
+    with pytest.raises(Exception, match='No shard answered'):
+        ShardedSearchClient([down], AUTHKEY, timeout_ms=300).search(queries()[0])
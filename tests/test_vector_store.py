@@ -0,0 +1,87 @@
+import os
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from retrieval import SharedVectorStore
+
+DIMENSIONS = 384
+WORKERS = 3
+
+
+def _rss_anon_bytes() -> int:
+    """
+    Private resident memory of this process; pages of the mmapped store are
+    file-backed and shared through the page cache, so they are not counted
+    """
+
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('RssAnon:'):
+                return int(line.split()[1]) * 1024
+    raise RuntimeError('RssAnon missing from /proc/self/status')
+
+
+def _worker(directory, queries, results):
+    before = _rss_anon_bytes()
+    store = SharedVectorStore(directory)
+    for query in queries:
+        assert len(store.search(query, k=10)) == 10
+    results.put(_rss_anon_bytes() - before)
+
+
+def _build_store(directory, rows):
+    generator = np.random.default_rng(rows)
+    ids = [f"uploads/doc.pdf#{row}" for row in range(rows)]
+    metadata = [{'document_id': 'uploads/doc.pdf', 'chunk_id': chunk_id} for chunk_id in ids]
+    SharedVectorStore(directory).publish(ids, generator.standard_normal((rows, DIMENSIONS)), metadata)
+    return rows * DIMENSIONS * 4
+
+
+def _worker_growth(directory, workers=WORKERS):
+    """
+    RSS growth of each of workers concurrent fresh processes that open the
+    store and search it (which touches every vector page)
+    """
+
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    queries = np.random.default_rng(0).standard_normal((5, DIMENSIONS)).astype('float32')
+    processes = [context.Process(target=_worker, args=(directory, queries, results)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    growth = [results.get(timeout=120) for _ in processes]
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+    return growth
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs Linux /proc')
+def test_worker_memory_does_not_grow_with_index_size(tmp_path):
+    small_bytes = _build_store(str(tmp_path / 'small'), 2000)
+    large_bytes = _build_store(str(tmp_path / 'large'), 40000)
+
+    small = _worker_growth(str(tmp_path / 'small'))
+    large = _worker_growth(str(tmp_path / 'large'))
+
+    # Every worker maps the same file: its private memory is the per-query
+    # scratch (one score per row), not a copy of the vectors
+    for growth in large:
+        assert growth < large_bytes / 4
+    assert max(large) - min(small) < (large_bytes - small_bytes) / 4
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/status'), reason='needs Linux /proc')
+def test_worker_memory_does_not_grow_with_worker_count(tmp_path):
+    store_bytes = _build_store(str(tmp_path / 'store'), 40000)
+
+    [alone] = _worker_growth(str(tmp_path / 'store'), workers=1)
+    together = _worker_growth(str(tmp_path / 'store'), workers=WORKERS)
+
+    # The vectors live once in the page cache however many workers map them,
+    # so adding workers adds no private copy to any of them
+    assert alone < store_bytes / 4
+    for growth in together:
+        assert growth - alone < store_bytes / 4